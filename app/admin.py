@@ -1,11 +1,13 @@
 # app/admin.py
 from datetime import datetime
 import os
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Request, HTTPException, Form
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 
+from . import broadcasts, user_directory
 from .database import get_db
 from .models import User, Document, MessageThread, Message
 from .notifications_api import push_notification  # In-site notification
@@ -74,25 +76,24 @@ def _refresh_session_user_if_self(request: Request, user: User) -> None:
 # Admin dashboard
 # ---------------------------
 @router.get("/admin")
-def admin_dashboard(request: Request, db: Session = Depends(get_db)):
+def admin_dashboard(
+    request: Request,
+    db: Session = Depends(get_db),
+    section: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
     if not require_admin(request):
         return RedirectResponse(url="/login", status_code=303)
 
-    pending_users = (
-        db.query(User)
-        .filter(User.status == "pending")
-        .order_by(User.created_at.desc())
-        .all()
-    )
-    all_users = db.query(User).order_by(User.created_at.desc()).all()
+    # Paged + filterable sections with cached counts — see app/user_directory.py
+    directory = user_directory.directory(db, request.query_params, section, cursor)
 
     return request.app.templates.TemplateResponse(
         "admin_dashboard.html",
         {
             "request": request,
             "title": "Admin Dashboard",
-            "pending_users": pending_users,
-            "all_users": all_users,
+            **directory,
             "session_user": request.session.get("user"),
         },
     )
@@ -789,7 +790,7 @@ def disable_support(user_id: int, request: Request, db: Session = Depends(get_db
 # Admin Broadcast Email (Send to all users)
 # ---------------------------
 @router.get("/admin/broadcast")
-def broadcast_page(request: Request):
+def broadcast_page(request: Request, db: Session = Depends(get_db)):
     if not require_admin(request):
         return RedirectResponse(url="/login", status_code=303)
 
@@ -798,6 +799,7 @@ def broadcast_page(request: Request):
         {
             "request": request,
             "title": "Broadcast Email",
+            "jobs": broadcasts.recent(db),  # progress polled from /admin/broadcast/jobs
             "session_user": request.session.get("user"),  # ← مهم جداً
         },
     )
@@ -814,29 +816,7 @@ def broadcast_send(
     if not require_admin(request):
         return RedirectResponse(url="/login", status_code=303)
 
-    # 1) اختَر الجمهور
-    query = db.query(User.email).filter(User.email.isnot(None))
-    if audience == "verified":
-        query = query.filter(User.is_verified == True)
-    elif audience == "unverified":
-        query = query.filter((User.is_verified == False) | (User.is_verified.is_(None)))
-
-    emails = [row.email for row in query.all()]
-
-    # لو ما في ولا إيميل
-    if not emails:
-        return request.app.templates.TemplateResponse(
-            "admin_broadcast.html",
-            {
-                "request": request,
-                "title": "Broadcast Email",
-                "session_user": request.session.get("user"),
-                "error": "No recipients found for this audience.",
-            },
-            status_code=400,
-        )
-
-    # 2) حضّر النصوص
+    # 1) حضّر النصوص
     safe_subject = (subject or "").strip() or "📢 Announcement from Sevor"
     plain_text = (message or "").strip()
     msg_html = (message or "").replace("\n", "<br>")
@@ -846,7 +826,7 @@ def broadcast_send(
     logo = LOGO_URL
     brand = BRAND_URL
 
-    # 3) HTML ديزاين بسيط + لوغو من فوق
+    # 2) HTML ديزاين بسيط + لوغو من فوق
     html_body = f"""<!doctype html>
 <html lang="en" dir="ltr">
 <head>
@@ -931,23 +911,31 @@ def broadcast_send(
 </body>
 </html>"""
 
-    # 4) إرسال الإيميل عبر SendGrid
-    from .email_service import send_email
-    ok = send_email(
-        to=emails,
+    # 3) Queue the job: recipients are streamed and sent in the background (app/broadcasts.py)
+    admin_id = (request.session.get("user") or {}).get("id")
+    job = broadcasts.create_job(
+        db,
+        admin_id,
         subject=safe_subject,
-        html_body=html_body,
         text_body=plain_text or safe_subject,
+        html_body=html_body,
+        audience=audience,
     )
-    print("Broadcast send status:", ok, "to", len(emails), "users")
 
-    # 5) صفحة النجاح
-    return request.app.templates.TemplateResponse(
-        "admin_broadcast_success.html",
-        {
-            "request": request,
-            "title": "Broadcast Sent",
-            "sent_to": len(emails),
-            "session_user": request.session.get("user"),
-        },
-    )
+    # لو ما في ولا إيميل
+    if not job:
+        return request.app.templates.TemplateResponse(
+            "admin_broadcast.html",
+            {
+                "request": request,
+                "title": "Broadcast Email",
+                "jobs": broadcasts.recent(db),
+                "session_user": request.session.get("user"),
+                "error": "No recipients found for this audience.",
+            },
+            status_code=400,
+        )
+    print(f"[INFO] broadcast #{job.id} queued for {job.total} users")
+
+    # 4) Progress is shown on the broadcast page
+    return RedirectResponse(url=f"/admin/broadcast#job-{job.id}", status_code=303)
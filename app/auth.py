@@ -10,7 +10,8 @@ import os, secrets, shutil
 from .database import get_db
 from .models import User, Document
 from .utils import hash_password, verify_password, MAX_FORM_PASSWORD_CHARS
-from cloudinary.uploader import upload as cloud_upload
+from . import media_queue
+from .media_queue import PRIVATE_UPLOADS_ROOT, stage_file
 # (Optional) Internal notifications
 try:
     from .notifications_api import push_notification  # noqa: F401
@@ -33,7 +34,8 @@ router = APIRouter()
 # Unify upload folders with main.py (at project root level)
 APP_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 UPLOADS_ROOT = os.environ.get("UPLOADS_DIR", os.path.join(APP_ROOT, "uploads"))
-IDS_DIR = os.path.join(UPLOADS_ROOT, "ids")
+# ID documents stay outside the public /uploads mount (served by profiles.private_document)
+IDS_DIR = os.path.join(PRIVATE_UPLOADS_ROOT, "ids")
 AVATARS_DIR = os.path.join(UPLOADS_ROOT, "avatars")
 os.makedirs(IDS_DIR, exist_ok=True)
 os.makedirs(AVATARS_DIR, exist_ok=True)
@@ -46,31 +48,39 @@ def _normalize_form_password(pwd: str) -> str:
     return pwd[:MAX_FORM_PASSWORD_CHARS]
 
 def _save_any(fileobj: UploadFile | None, folder: str, allow_exts: list[str]) -> str | None:
-    """Upload file to Cloudinary (supports images + PDF correctly)."""
+    """
+    Stage the file locally (images + PDF) and return its /uploads URL
+    (/private URL for folders under PRIVATE_UPLOADS_ROOT, e.g. IDS_DIR).
+    The Cloudinary push happens in the background once the owning row exists
+    (see _queue_cloud).
+    """
     if not fileobj:
         return None
 
-    ext = os.path.splitext(fileobj.filename or "")[1].lower()
-
-    if ext not in allow_exts:
-        return None
-
+    private = os.path.abspath(folder).startswith(os.path.abspath(PRIVATE_UPLOADS_ROOT) + os.sep)
+    subdir = os.path.relpath(folder, PRIVATE_UPLOADS_ROOT if private else UPLOADS_ROOT).replace(os.sep, "/")
     try:
-        # ✅ مهم جدا: PDF لازم يكون raw
-        resource_type = "raw" if ext == ".pdf" else "auto"
-
-        result = cloud_upload(
-            fileobj.file,
-            folder="sevor/uploads",
-            overwrite=True,
-            resource_type=resource_type,
-        )
+        res = stage_file(fileobj, subdir, allow_exts, private=private)
+    except Exception as e:
+        print("Upload staging failed:", e)
+        return None
+    return res[1] if res else None
 
-        return result.get("secure_url")
 
+def _queue_cloud(db: Session, target_table: str, target_id: int, *urls: str | None) -> None:
+    """Queue staged files for Cloudinary; rows keep the local URL until the upload finishes."""
+    try:
+        for url in urls:
+            media_queue.enqueue(
+                db, url,
+                folder="sevor/uploads",
+                target_table=target_table,
+                target_id=target_id,
+            )
+        db.commit()
     except Exception as e:
-        print("Cloudinary upload failed:", e)
-        return None
+        db.rollback()
+        print("Cloudinary enqueue failed:", e)
 
 
 def _signer() -> URLSafeTimedSerializer:
@@ -329,6 +339,8 @@ def register_post(
     )
     db.add(d)
     db.commit()
+    _queue_cloud(db, "users", u.id, avatar_path)
+    _queue_cloud(db, "documents", u.id, front_path, back_path)
 
     # ✅ Save company proof as a separate Document row (doc_type = company_proof)
     if account_type == "company" and company_proof:
@@ -355,6 +367,7 @@ def register_post(
         )
         db.add(cdoc)
         db.commit()
+        _queue_cloud(db, "documents", u.id, company_url)
 
     return RedirectResponse(
         url=f"/verify-email?email={u.email}&sent=1",
@@ -696,6 +709,8 @@ def settings_profile_post(
             u.avatar_path = saved
 
     db.add(u); db.commit(); db.refresh(u)
+    if avatar and saved:
+        _queue_cloud(db, "users", u.id, saved)
 
     # Sync session
     request.session["user"] = {
@@ -0,0 +1,155 @@
+# app/availability.py
+"""
+Item availability index.
+
+`item_reservations` holds one [start_date, end_date) interval per booking that
+currently takes the item (accepted → paid → picked up). Rows are written and
+removed by the after_flush hook below whenever a booking's status or dates
+change, so accept / reject / cancel / return keep the index in sync wherever
+they happen.
+
+Overlap checks are a single range probe on (item_id, start_date, end_date):
+    start_date < :end AND end_date > :start
+used by create_booking / owner accept, and by the "available between" filter
+on /items and /search.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import and_, event, exists, func, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from .database import _backend_name
+from .models import Booking, Item, ItemReservation
+
+# Booking states in which the item is taken for the booked dates
+BLOCKING_STATUSES = ("accepted", "paid", "picked_up")
+
+
+def parse_range(start_raw: Optional[str], end_raw: Optional[str]) -> Optional[tuple[date, date]]:
+    """('2025-07-01', '2025-07-04') → (date, date); None when missing/invalid/empty."""
+    if not start_raw or not end_raw:
+        return None
+    try:
+        start = datetime.strptime(str(start_raw).strip(), "%Y-%m-%d").date()
+        end = datetime.strptime(str(end_raw).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    if end <= start:
+        return None
+    return start, end
+
+
+def _overlap(start: date, end: date):
+    return and_(ItemReservation.start_date < end, ItemReservation.end_date > start)
+
+
+# ================= Checks =================
+def lock_item(db: Session, item_id: int) -> None:
+    """Serialize availability decisions for one item (row lock on Postgres)."""
+    if str(_backend_name()).startswith("postgres"):
+        db.query(Item.id).filter(Item.id == item_id).with_for_update().first()
+
+
+def conflicts(
+    db: Session,
+    item_id: int,
+    start: date,
+    end: date,
+    *,
+    exclude_booking_id: Optional[int] = None,
+) -> list[int]:
+    """Booking ids holding the item for any day in [start, end)."""
+    q = db.query(ItemReservation.booking_id).filter(
+        ItemReservation.item_id == item_id,
+        _overlap(start, end),
+    )
+    if exclude_booking_id:
+        q = q.filter(ItemReservation.booking_id != exclude_booking_id)
+    return [r.booking_id for r in q.all()]
+
+
+def is_available(db: Session, item_id: int, start: date, end: date, **kw) -> bool:
+    return not conflicts(db, item_id, start, end, **kw)
+
+
+def available_between(start: date, end: date):
+    """Filter clause for Item queries: no reservation overlaps [start, end)."""
+    return ~exists().where(
+        ItemReservation.item_id == Item.id,
+        _overlap(start, end),
+    )
+
+
+# ================= Index maintenance =================
+def _sync(conn, bk: Booking) -> None:
+    t = ItemReservation.__table__
+    blocking = (bk.status or "") in BLOCKING_STATUSES and bk.start_date and bk.end_date
+    if not blocking:
+        conn.execute(t.delete().where(t.c.booking_id == bk.id))
+        return
+    res = conn.execute(
+        t.update()
+        .where(t.c.booking_id == bk.id)
+        .values(item_id=bk.item_id, start_date=bk.start_date, end_date=bk.end_date)
+    )
+    if not res.rowcount:
+        conn.execute(t.insert().values(
+            item_id=bk.item_id, booking_id=bk.id,
+            start_date=bk.start_date, end_date=bk.end_date,
+            created_at=datetime.utcnow(),
+        ))
+
+
+def _touched(bk: Booking) -> bool:
+    state = sa_inspect(bk)
+    for col in ("status", "start_date", "end_date", "item_id"):
+        try:
+            if state.attrs[col].history.has_changes():
+                return True
+        except Exception:
+            continue
+    return False
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_reservations(session: Session, _flush_context) -> None:
+    conn = None
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Booking) or not obj.id:
+            continue
+        if obj not in session.new and not _touched(obj):
+            continue
+        conn = conn or session.connection()
+        try:
+            _sync(conn, obj)
+        except Exception as e:
+            print(f"[WARN] item_reservations sync failed for booking #{obj.id}: {e}")
+    for obj in session.deleted:
+        if isinstance(obj, Booking) and obj.id:
+            conn = conn or session.connection()
+            conn.execute(ItemReservation.__table__.delete().where(
+                ItemReservation.__table__.c.booking_id == obj.id
+            ))
+
+
+def backfill_if_empty(db: Session) -> int:
+    """Index bookings that were already accepted/paid/picked up before this table existed."""
+    if db.query(func.count(ItemReservation.id)).scalar():
+        return 0
+    rows = (
+        db.query(Booking.id, Booking.item_id, Booking.start_date, Booking.end_date)
+        .filter(Booking.status.in_(BLOCKING_STATUSES))
+        .all()
+    )
+    now = datetime.utcnow()
+    for r in rows:
+        if r.start_date and r.end_date:
+            db.add(ItemReservation(
+                item_id=r.item_id, booking_id=r.id,
+                start_date=r.start_date, end_date=r.end_date, created_at=now,
+            ))
+    db.commit()
+    return len(rows)
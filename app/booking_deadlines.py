@@ -0,0 +1,306 @@
+# app/booking_deadlines.py
+"""
+Deadline index for booking state transitions.
+
+Whenever a booking's deadline-driving column changes (returned_at,
+renter_response_deadline_at, ...), the matching `booking_deadlines` row is
+written in the same transaction (after_flush hook below). Robots then ask for
+the rows of their kind whose due_at has passed and are not processed yet —
+served by the partial index (kind, due_at) WHERE processed_at IS NULL —
+instead of scanning every booking. scan_due() pages through those rows
+(keyset on due_at, booking_id) until it has enough eligible bookings, and
+retires timers that can never fire, so blocked bookings cannot starve the
+ones behind them.
+
+Kinds and their due time:
+  auto_release     returned_at + 48h                         (cron_auto_release)
+  renter_response  renter_response_deadline_at               (DM decision execution / check-window)
+  owner_silence    first of returned_at / no-problem check + 48h   (deposit_owner_silence_robot)
+  renter_silence   renter_24h_window_opened_at + 48h         (deposit_renter_silence_robot)
+  deposit_refund   first of dm_decision_at / no-problem check      (deposit_refund_robot)
+"""
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, Optional
+
+from sqlalchemy import and_, event, func, inspect as sa_inspect, or_
+from sqlalchemy.orm import Session
+
+from .models import Booking, BookingDeadline
+
+AUTO_RELEASE_WINDOW = timedelta(hours=48)
+OWNER_SILENCE_WINDOW = timedelta(hours=48)
+RENTER_SILENCE_WINDOW = timedelta(hours=48)
+
+# deposit states after which no timer is relevant any more
+SETTLED_DEPOSIT_STATES = ("refunded", "claimed", "partially_withheld", "closed")
+SETTLED_BOOKING_STATES = ("closed", "completed", "canceled", "cancelled", "rejected")
+
+# timers that can only ever act on a deposit / on a deposit hold (see unreachable())
+DEPOSIT_KINDS = ("owner_silence", "renter_silence", "deposit_refund")
+HOLD_KINDS = ("auto_release",)
+
+DUE_PAGE = int(os.getenv("BOOKING_DEADLINES_PAGE", "500"))
+
+
+def _utc_naive(dt: Optional[datetime]) -> Optional[datetime]:
+    if not isinstance(dt, datetime):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _first(*dts: Optional[datetime]) -> Optional[datetime]:
+    vals = [d for d in (_utc_naive(x) for x in dts) if d is not None]
+    return min(vals) if vals else None
+
+
+def _plus(dt: Optional[datetime], delta: timedelta) -> Optional[datetime]:
+    dt = _utc_naive(dt)
+    return dt + delta if dt else None
+
+
+def _no_problem_at(bk: Booking) -> Optional[datetime]:
+    if getattr(bk, "return_check_no_problem", None):
+        return getattr(bk, "return_check_submitted_at", None)
+    return None
+
+
+# kind -> (booking columns it depends on, due time from the booking)
+KINDS: dict[str, tuple[tuple[str, ...], Callable[[Booking], Optional[datetime]]]] = {
+    "auto_release": (
+        ("returned_at",),
+        lambda bk: _plus(getattr(bk, "returned_at", None), AUTO_RELEASE_WINDOW),
+    ),
+    "renter_response": (
+        ("renter_response_deadline_at",),
+        lambda bk: _utc_naive(getattr(bk, "renter_response_deadline_at", None)),
+    ),
+    "owner_silence": (
+        ("returned_at", "return_check_no_problem", "return_check_submitted_at"),
+        lambda bk: _plus(_first(getattr(bk, "returned_at", None), _no_problem_at(bk)), OWNER_SILENCE_WINDOW),
+    ),
+    "renter_silence": (
+        ("renter_24h_window_opened_at",),
+        lambda bk: _plus(getattr(bk, "renter_24h_window_opened_at", None), RENTER_SILENCE_WINDOW),
+    ),
+    "deposit_refund": (
+        ("dm_decision_at", "return_check_no_problem", "return_check_submitted_at"),
+        lambda bk: _first(getattr(bk, "dm_decision_at", None), _no_problem_at(bk)),
+    ),
+}
+
+
+# ================= Writing =================
+def _changed(bk: Booking, cols: Iterable[str]) -> bool:
+    state = sa_inspect(bk)
+    for col in cols:
+        try:
+            if state.attrs[col].history.has_changes():
+                return True
+        except Exception:
+            continue
+    return False
+
+
+def _set_deadline(conn, booking_id: int, kind: str, due_at: Optional[datetime]) -> None:
+    t = BookingDeadline.__table__
+    if due_at is None:
+        conn.execute(t.delete().where(
+            t.c.booking_id == booking_id, t.c.kind == kind, t.c.processed_at.is_(None)
+        ))
+        return
+    res = conn.execute(
+        t.update()
+        .where(t.c.booking_id == booking_id, t.c.kind == kind)
+        .values(due_at=due_at, processed_at=None, outcome=None)
+    )
+    if not res.rowcount:
+        conn.execute(t.insert().values(
+            booking_id=booking_id, kind=kind, due_at=due_at, created_at=datetime.utcnow()
+        ))
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_deadlines(session: Session, _flush_context) -> None:
+    """Mirror changed booking deadline columns into booking_deadlines (same transaction)."""
+    touched = [o for o in list(session.new) + list(session.dirty) if isinstance(o, Booking)]
+    if not touched:
+        return
+    conn = session.connection()
+    for bk in touched:
+        if not bk.id:
+            continue
+        is_new = bk in session.new
+        for kind, (cols, due) in KINDS.items():
+            if not is_new and not _changed(bk, cols):
+                continue
+            try:
+                _set_deadline(conn, bk.id, kind, due(bk))
+            except Exception as e:
+                print(f"[WARN] booking_deadlines sync failed for #{bk.id}/{kind}: {e}")
+
+
+# ================= Reading (robots) =================
+def due_pages(db: Session, kind: str, *, now: Optional[datetime] = None, page: int = DUE_PAGE) -> Iterator[list[int]]:
+    """
+    Booking ids whose `kind` timer has expired and is not processed yet, oldest
+    first, in pages. Keyset on (due_at, booking_id): rows a robot skips do not
+    come back in the next page, so they can never hide the timers behind them.
+    """
+    now = _utc_naive(now) or datetime.utcnow()
+    after: Optional[tuple[datetime, int]] = None
+    while True:
+        q = db.query(BookingDeadline.booking_id, BookingDeadline.due_at).filter(
+            BookingDeadline.kind == kind,
+            BookingDeadline.processed_at.is_(None),
+            BookingDeadline.due_at <= now,
+        )
+        if after is not None:
+            q = q.filter(or_(
+                BookingDeadline.due_at > after[0],
+                and_(BookingDeadline.due_at == after[0], BookingDeadline.booking_id > after[1]),
+            ))
+        rows = q.order_by(BookingDeadline.due_at.asc(), BookingDeadline.booking_id.asc()).limit(page).all()
+        if not rows:
+            return
+        yield [r.booking_id for r in rows]
+        if len(rows) < page:
+            return
+        after = (rows[-1].due_at, rows[-1].booking_id)
+
+
+def scan_due(
+    db: Session,
+    kind: str,
+    *,
+    filters: Iterable = (),
+    eligible: Optional[Callable[[Booking], bool]] = None,
+    now: Optional[datetime] = None,
+    limit: int = DUE_PAGE,
+    retire: bool = True,
+) -> list[Booking]:
+    """
+    Up to `limit` due bookings of `kind` that match `filters` (SQL) and
+    `eligible` (Python), oldest timer first. Walks every due page until
+    `limit` are found, so any number of blocked timers ahead of an eligible
+    one cannot starve it. With retire=True, timers of skipped bookings that
+    can never fire (unreachable) are closed on the way.
+    """
+    filters = tuple(filters)
+    picked: list[Booking] = []
+    retired = 0
+    for ids in due_pages(db, kind, now=now, page=max(1, limit)):
+        by_id = {bk.id: bk for bk in db.query(Booking).filter(Booking.id.in_(ids)).all()}
+        passing = None
+        if filters:
+            passing = {r[0] for r in db.query(Booking.id).filter(Booking.id.in_(ids), *filters).all()}
+        for bid in ids:
+            bk = by_id.get(bid)
+            if bk is None:
+                continue
+            if (passing is None or bid in passing) and (eligible is None or eligible(bk)):
+                picked.append(bk)
+                if len(picked) >= limit:
+                    break
+            elif retire:
+                why = unreachable(kind, bk)
+                if why:
+                    mark_processed(db, bid, kind, f"skipped:{why}", commit=False)
+                    retired += 1
+        if len(picked) >= limit:
+            break
+    if retired:
+        db.commit()
+    return picked
+
+
+def mark_processed(db: Session, booking_id: int, kind: str, outcome: str = "done", *, commit: bool = True) -> None:
+    db.query(BookingDeadline).filter(
+        BookingDeadline.booking_id == booking_id,
+        BookingDeadline.kind == kind,
+        BookingDeadline.processed_at.is_(None),
+    ).update({"processed_at": datetime.utcnow(), "outcome": outcome[:60]}, synchronize_session=False)
+    if commit:
+        db.commit()
+
+
+def is_settled(bk: Booking) -> bool:
+    return (
+        (getattr(bk, "deposit_status", None) or "").lower() in SETTLED_DEPOSIT_STATES
+        or (getattr(bk, "status", None) or "").lower() in SETTLED_BOOKING_STATES
+        or bool(getattr(bk, "deposit_case_closed", None))
+    )
+
+
+def unreachable(kind: str, bk: Booking) -> Optional[str]:
+    """
+    Why the `kind` timer of this booking can never fire (None if it still can):
+    settled / terminal booking, no deposit for the deposit robots, no deposit
+    hold for auto_release. Bookings that are only blocked for now (dispute
+    open, renter still answering) stay pending.
+    """
+    if is_settled(bk):
+        return "settled"
+    if kind in DEPOSIT_KINDS and not (getattr(bk, "deposit_amount", None) or 0) > 0:
+        return "no_deposit"
+    if kind in DEPOSIT_KINDS and getattr(bk, "deposit_refund_sent", None):
+        return "refunded"
+    if kind in HOLD_KINDS and getattr(bk, "deposit_hold_intent_id", None) in (None, ""):
+        return "no_hold"
+    return None
+
+
+# ================= Backfill =================
+def backfill(db: Session, *, batch: int = 1000) -> int:
+    """Create timers for bookings that predate the table (safe to re-run)."""
+    existing = {(b, k) for b, k in db.query(BookingDeadline.booking_id, BookingDeadline.kind).all()}
+    written = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(Booking)
+            .filter(Booking.id > last_id)
+            .order_by(Booking.id.asc())
+            .limit(batch)
+            .all()
+        )
+        if not rows:
+            break
+        conn = db.connection()
+        for bk in rows:
+            last_id = bk.id
+            if is_settled(bk):
+                continue
+            for kind, (_cols, due) in KINDS.items():
+                if (bk.id, kind) in existing:
+                    continue
+                try:
+                    due_at = due(bk)
+                except Exception:
+                    due_at = None
+                if due_at is not None:
+                    _set_deadline(conn, bk.id, kind, due_at)
+                    written += 1
+        db.commit()
+        db.expunge_all()
+    return written
+
+
+def backfill_if_empty(db: Session) -> int:
+    if db.query(func.count(BookingDeadline.id)).scalar():
+        return 0
+    return backfill(db)
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    _db = SessionLocal()
+    try:
+        print(f"booking_deadlines backfilled: {backfill(_db)}")
+    finally:
+        _db.close()
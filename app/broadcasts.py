@@ -0,0 +1,389 @@
+# app/broadcasts.py
+"""
+Background engine for admin email broadcasts (/admin/broadcast).
+
+broadcast_send() only creates a `broadcast_jobs` row (create_job) and
+redirects back to the page; a dispatcher thread claims queued jobs with a
+conditional UPDATE and sends them:
+
+- recipients are streamed from `users` in id order, BROADCAST_CHUNK_SIZE at a
+  time; each chunk becomes `broadcast_recipients` rows (pending) in the same
+  commit that advances the job's `last_user_id`, so nothing holds the whole
+  audience in memory and a restart resumes where it stopped;
+- every recipient gets their own message (their address only in To:) over
+  one reused SMTP login (email_service.SMTPSession), throttled to
+  BROADCAST_RATE_PER_SECOND;
+- each delivery is recorded (sent / failed + error) and the job's sent /
+  failed counters are bumped in the same commit, which is what the admin
+  page polls (GET /admin/broadcast/jobs).
+
+Addresses refused at RCPT fail only that recipient. A refused login, sender
+or message (5xx) would fail every recipient the same way, so the job is
+marked failed at once with the rest still pending; so is a server that stays
+unreachable. Either way it can be resumed from the page.
+"""
+from __future__ import annotations
+
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import insert, or_
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, get_db
+from .email_service import SMTPSession
+from .models import BroadcastJob, BroadcastRecipient, User
+
+# ================= Settings =================
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "200"))
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "5"))  # 0 = unthrottled
+BROADCAST_POLL_SECONDS = float(os.getenv("BROADCAST_POLL_SECONDS", "15"))
+BROADCAST_STALE_MINUTES = int(os.getenv("BROADCAST_STALE_MINUTES", "10"))
+BROADCAST_MAX_SMTP_ERRORS = int(os.getenv("BROADCAST_MAX_SMTP_ERRORS", "5"))
+
+AUDIENCES = ("all", "verified", "unverified")
+
+
+# ================= Audience =================
+def audience_query(db: Session, audience: str):
+    """(User.id, User.email) of everyone a broadcast to `audience` goes to."""
+    q = db.query(User.id, User.email).filter(User.email.isnot(None), User.email != "")
+    if audience == "verified":
+        q = q.filter(User.is_verified.is_(True))
+    elif audience == "unverified":
+        q = q.filter(or_(User.is_verified.is_(False), User.is_verified.is_(None)))
+    return q
+
+
+def create_job(
+    db: Session,
+    created_by_id: Optional[int],
+    subject: str,
+    text_body: str,
+    html_body: str,
+    audience: str = "all",
+) -> Optional[BroadcastJob]:
+    """Queue a broadcast; None when the audience is empty."""
+    audience = audience if audience in AUDIENCES else "all"
+    total = audience_query(db, audience).order_by(None).count()
+    if not total:
+        return None
+    job = BroadcastJob(
+        created_by_id=created_by_id,
+        subject=subject[:300],
+        text_body=text_body,
+        html_body=html_body,
+        audience=audience,
+        status="queued",
+        total=total,
+    )
+    db.add(job)
+    db.commit()
+    kick()
+    return job
+
+
+# ================= Status =================
+def describe(job: BroadcastJob) -> dict:
+    done = (job.sent or 0) + (job.failed or 0)
+    return {
+        "id": job.id,
+        "subject": job.subject,
+        "audience": job.audience,
+        "status": job.status,
+        "total": job.total or 0,
+        "sent": job.sent or 0,
+        "failed": job.failed or 0,
+        "percent": min(100, int(done * 100 / job.total)) if job.total else 100,
+        "last_error": job.last_error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def recent(db: Session, limit: int = 10) -> list[dict]:
+    rows = db.query(BroadcastJob).order_by(BroadcastJob.id.desc()).limit(limit).all()
+    return [describe(j) for j in rows]
+
+
+def failures(db: Session, job_id: int, limit: int = 50) -> list[dict]:
+    rows = (
+        db.query(BroadcastRecipient)
+        .filter(BroadcastRecipient.job_id == job_id, BroadcastRecipient.status == "failed")
+        .order_by(BroadcastRecipient.id.asc())
+        .limit(limit)
+        .all()
+    )
+    return [{"email": r.email, "error": r.error} for r in rows]
+
+
+# ================= Sending (worker thread) =================
+class _RateLimiter:
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(now, self._next) + self.interval
+
+
+def _next_chunk(db: Session, job: BroadcastJob) -> int:
+    """Turn the next BROADCAST_CHUNK_SIZE audience users into pending recipients."""
+    rows = (
+        audience_query(db, job.audience)
+        .filter(User.id > (job.last_user_id or 0))
+        .order_by(User.id.asc())
+        .limit(BROADCAST_CHUNK_SIZE)
+        .all()
+    )
+    if rows:
+        db.execute(insert(BroadcastRecipient), [
+            {"job_id": job.id, "user_id": r.id, "email": r.email.strip(), "status": "pending"} for r in rows
+        ])
+        job.last_user_id = rows[-1].id
+    db.commit()
+    return len(rows)
+
+
+def _recipient_refused(e: Exception) -> bool:
+    # The server refused this address at RCPT: only this recipient fails
+    return isinstance(e, smtplib.SMTPRecipientsRefused)
+
+
+def _fatal(e: Exception) -> bool:
+    # Missing credentials, or a 5xx to connect / LOGIN / MAIL FROM / DATA: every
+    # remaining recipient would fail the same way, retrying won't help
+    if isinstance(e, RuntimeError):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and 500 <= (e.smtp_code or 0) < 600
+
+
+def _record(db: Session, job_id: int, rcpt_id: int, error: Optional[str]) -> None:
+    now = datetime.utcnow()
+    db.query(BroadcastRecipient).filter(BroadcastRecipient.id == rcpt_id).update(
+        {"status": "failed" if error else "sent", "error": error, "sent_at": None if error else now},
+        synchronize_session=False,
+    )
+    counter = BroadcastJob.failed if error else BroadcastJob.sent
+    db.query(BroadcastJob).filter(BroadcastJob.id == job_id).update(
+        {counter.key: counter + 1, "updated_at": now}, synchronize_session=False,
+    )
+    db.commit()
+
+
+def _status(db: Session, job_id: int) -> Optional[str]:
+    status = db.query(BroadcastJob.status).filter(BroadcastJob.id == job_id).scalar()
+    db.commit()
+    return status
+
+
+def _finish(db: Session, job_id: int, status: str, error: Optional[str] = None) -> None:
+    db.query(BroadcastJob).filter(BroadcastJob.id == job_id, BroadcastJob.status == "running").update(
+        {"status": status, "last_error": error, "finished_at": datetime.utcnow()}, synchronize_session=False,
+    )
+    db.commit()
+
+
+def _run_job(job_id: int) -> None:
+    db = SessionLocal()
+    limiter = _RateLimiter(BROADCAST_RATE_PER_SECOND)
+    smtp_errors = 0
+    try:
+        with SMTPSession() as smtp:
+            while not _stop.is_set():
+                job = db.get(BroadcastJob, job_id)
+                db.refresh(job)
+                if job.status != "running":
+                    return  # cancelled from the admin page
+                pending = (
+                    db.query(BroadcastRecipient.id, BroadcastRecipient.email)
+                    .filter(BroadcastRecipient.job_id == job_id, BroadcastRecipient.status == "pending")
+                    .order_by(BroadcastRecipient.id.asc())
+                    .limit(BROADCAST_CHUNK_SIZE)
+                    .all()
+                )
+                if not pending:
+                    if not _next_chunk(db, job):
+                        _finish(db, job_id, "done")
+                        db.refresh(job)
+                        print(f"[INFO] broadcast #{job_id} done: {job.sent} sent, {job.failed} failed")
+                        return
+                    continue
+                subject, html_body, text_body = job.subject, job.html_body, job.text_body
+                db.commit()
+
+                for i, (rcpt_id, email) in enumerate(pending, 1):
+                    if _stop.is_set():
+                        return
+                    if i % 20 == 0 and _status(db, job_id) != "running":
+                        return  # cancelled mid-chunk
+                    limiter.wait()
+                    try:
+                        smtp.send(email, subject, html_body or "", text_body or subject)
+                        smtp_errors = 0
+                        _record(db, job_id, rcpt_id, None)
+                    except Exception as e:
+                        if _recipient_refused(e):
+                            _record(db, job_id, rcpt_id, str(e)[:500])
+                            continue
+                        if _fatal(e):
+                            # recipients stay pending: resume sends them once SMTP is fixed
+                            _finish(db, job_id, "failed", f"SMTP refused: {e}"[:1000])
+                            print(f"[WARN] broadcast #{job_id} stopped: {e}")
+                            return
+                        smtp_errors += 1
+                        if smtp_errors >= BROADCAST_MAX_SMTP_ERRORS:
+                            _finish(db, job_id, "failed", f"SMTP unavailable: {e}"[:1000])
+                            print(f"[WARN] broadcast #{job_id} stopped: {e}")
+                            return
+                        time.sleep(min(60, 2 ** smtp_errors))
+                        break  # re-read the job (cancel?) and retry this recipient
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] broadcast #{job_id} crashed: {e}")
+        try:
+            _finish(db, job_id, "failed", str(e)[:1000])
+        except Exception:
+            db.rollback()
+    finally:
+        db.close()
+
+
+# ================= Worker =================
+_wake = threading.Event()
+_stop = threading.Event()
+_dispatcher: Optional[threading.Thread] = None
+
+
+def kick() -> None:
+    """Wake the dispatcher so a freshly queued broadcast starts immediately."""
+    _wake.set()
+
+
+def _claim_job() -> Optional[int]:
+    """Flip the oldest queued job to 'running' (conditional UPDATE) and return its id."""
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=BROADCAST_STALE_MINUTES)
+    db = SessionLocal()
+    try:
+        # A process that died mid-job leaves it 'running' with no progress
+        db.query(BroadcastJob).filter(
+            BroadcastJob.status == "running", BroadcastJob.updated_at < stale,
+        ).update({"status": "queued"}, synchronize_session=False)
+        db.commit()
+
+        ids = [r.id for r in db.query(BroadcastJob.id).filter(BroadcastJob.status == "queued")
+               .order_by(BroadcastJob.id.asc()).limit(5).all()]
+        for job_id in ids:
+            n = db.query(BroadcastJob).filter(
+                BroadcastJob.id == job_id, BroadcastJob.status == "queued",
+            ).update(
+                {"status": "running", "updated_at": now, "started_at": now, "last_error": None},
+                synchronize_session=False,
+            )
+            db.commit()
+            if n:
+                return job_id
+        return None
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] broadcast claim failed: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def run_pending() -> int:
+    """Claim and send queued broadcasts in the calling thread (CLI / tests)."""
+    n = 0
+    while (job_id := _claim_job()) is not None:
+        _run_job(job_id)
+        n += 1
+    return n
+
+
+def _dispatch_loop() -> None:
+    while not _stop.is_set():
+        _wake.clear()
+        job_id = _claim_job()
+        if job_id is not None:
+            _run_job(job_id)
+            continue
+        _wake.wait(BROADCAST_POLL_SECONDS)
+
+
+def start_worker() -> bool:
+    global _dispatcher
+    if _dispatcher and _dispatcher.is_alive():
+        return True
+    _stop.clear()
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="broadcast-dispatch", daemon=True)
+    _dispatcher.start()
+    return True
+
+
+def stop_worker() -> None:
+    _stop.set()
+    _wake.set()
+
+
+# ================= Routes =================
+router = APIRouter(tags=["admin"])
+
+
+def _require_admin(request: Request) -> None:
+    u = request.session.get("user")
+    if not (u and (u.get("role") or "").lower() == "admin"):
+        raise HTTPException(status_code=403, detail="Admin only")
+
+
+@router.get("/admin/broadcast/jobs")
+def broadcast_jobs(request: Request, db: Session = Depends(get_db)):
+    """Polled by admin_broadcast.html while a job is queued or running."""
+    _require_admin(request)
+    return {"jobs": recent(db)}
+
+
+@router.get("/admin/broadcast/jobs/{job_id}")
+def broadcast_job(job_id: int, request: Request, db: Session = Depends(get_db)):
+    _require_admin(request)
+    job = db.get(BroadcastJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return {**describe(job), "failures": failures(db, job_id)}
+
+
+@router.post("/admin/broadcast/jobs/{job_id}/cancel")
+def cancel_broadcast(job_id: int, request: Request, db: Session = Depends(get_db)):
+    _require_admin(request)
+    n = db.query(BroadcastJob).filter(
+        BroadcastJob.id == job_id, BroadcastJob.status.in_(("queued", "running")),
+    ).update({"status": "cancelled", "finished_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    if not n:
+        raise HTTPException(status_code=409, detail="Broadcast is not in progress")
+    return {"ok": True, "id": job_id}
+
+
+@router.post("/admin/broadcast/jobs/{job_id}/resume")
+def resume_broadcast(job_id: int, request: Request, db: Session = Depends(get_db)):
+    """Requeue a failed / cancelled job; already-sent recipients are not sent again."""
+    _require_admin(request)
+    n = db.query(BroadcastJob).filter(
+        BroadcastJob.id == job_id, BroadcastJob.status.in_(("failed", "cancelled")),
+    ).update({"status": "queued", "finished_at": None}, synchronize_session=False)
+    db.commit()
+    if not n:
+        raise HTTPException(status_code=409, detail="Only failed or cancelled broadcasts can be resumed")
+    kick()
+    return {"ok": True, "id": job_id}
@@ -1,15 +1,18 @@
 # app/cron_auto_release.py
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import os
 
 import stripe
 from fastapi import APIRouter, Depends, Query
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from .database import get_db
-from .models import Booking, User
+from .database import SessionLocal, get_db
+from .models import AutoReleaseOutcome, Booking, User
 from .notifications_api import push_notification, notify_admins
+from . import booking_deadlines
 
 # ===== SMTP Email (fallback) =====
 # Will be replaced later by app/emailer.py; this guarantees no break if it's missing.
@@ -52,25 +55,6 @@ def _currency(num: int) -> str:
         return str(num)
 
 
-def _stripe_capture(pi_id: str, amount: int) -> bool:
-    """
-    Stripe expects amounts in cents, so we multiply by 100.
-    """
-    try:
-        stripe.PaymentIntent.capture(pi_id, amount_to_capture=int(amount) * 100)
-        return True
-    except Exception:
-        return False
-
-
-def _stripe_cancel(pi_id: str) -> bool:
-    try:
-        stripe.PaymentIntent.cancel(pi_id)
-        return True
-    except Exception:
-        return False
-
-
 def _has_dispute_open(bk: Booking) -> bool:
     return (getattr(bk, "deposit_status", None) or "").lower() in (
         "in_dispute", "partially_withheld", "claimed"
@@ -112,43 +96,6 @@ def _can_auto_release(bk: Booking, now: datetime) -> bool:
         return False
 
 
-def _do_release(bk: Booking) -> None:
-    """
-    Cancels the deposit authorization and adjusts local states.
-    """
-    pi_id = getattr(bk, "deposit_hold_intent_id", None)
-    if not pi_id:
-        return
-
-    # Try to cancel the hold on Stripe (safe: do not break job on any error)
-    try:
-        if stripe.api_key:
-            stripe.PaymentIntent.cancel(pi_id)
-    except Exception:
-        # Quietly ignore—may have been cancelled already
-        pass
-
-    # Update deposit state and booking
-    try:
-        bk.deposit_status = "refunded"
-        bk.deposit_charged_amount = 0
-    except Exception:
-        pass
-
-    # If booking is still returned/in_review, consider it completed
-    try:
-        if getattr(bk, "status", None) in ("returned", "in_review"):
-            bk.status = "completed"
-    except Exception:
-        pass
-
-    # Timestamp update
-    try:
-        bk.updated_at = datetime.utcnow()
-    except Exception:
-        pass
-
-
 # ======================================================
 # Execute DM decision automatically after renter timeout (24h)
 # ======================================================
@@ -189,228 +136,165 @@ def _can_execute_dm_decision(bk: Booking, now: datetime) -> bool:
         return False
 
 
-def _execute_dm_decision(db: Session, bk: Booking) -> str:
-    """
-    Executes the DM decision stored on the booking after the renter response window expires:
-      - withhold/partial: capture dm_decision_amount (Stripe will automatically release the remainder)
-      - release: cancel the deposit authorization
-    Updates booking states and sends notifications to both parties.
-    Returns a short text describing what happened.
-    """
+# ======================================================
+# Pipeline: claim → external call (thread pool) → commit
+# ======================================================
+# Stripe calls run in a bounded pool; booking state is only written by the
+# calling thread after the call returned. Every side effect has an
+# auto_release_outcomes row keyed by "booking-{id}-{action}" — the same key is
+# sent to Stripe as Idempotency-Key, so rerunning after a crash or timeout is
+# safe. Stripe caches a 5xx answer under its key too, so once a call got one
+# the next attempt is sent as "<key>:<attempt>" (row.request_key).
+AUTO_RELEASE_WORKERS = int(os.getenv("AUTO_RELEASE_WORKERS", "8"))
+# A claim older than this without an outcome is treated as abandoned (crashed run)
+AUTO_RELEASE_CLAIM_MINUTES = int(os.getenv("AUTO_RELEASE_CLAIM_MINUTES", "15"))
+
+
+def _idempotency_key(booking_id: int, action: str) -> str:
+    return f"booking-{booking_id}-{action}"
+
+
+def _plan_dm_action(bk: Booking) -> tuple[str | None, int, str | None]:
+    """(action, amount, skip_reason) for a due DM decision."""
     pi_id = getattr(bk, "deposit_hold_intent_id", None)
     decision = (getattr(bk, "dm_decision", None) or "").lower()
     amount = int(getattr(bk, "dm_decision_amount", 0) or 0)
-    deposit_total = int(
-        (getattr(bk, "deposit_amount", None)
-         or getattr(bk, "hold_deposit_amount", None)
-         or 0)
-    )
-
     if not pi_id or not decision:
-        return "skipped:no_pi_or_decision"
-
+        return None, 0, "skipped:no_pi_or_decision"
     if decision in ("withhold", "partial"):
         if amount <= 0:
-            return "skipped:zero_amount"
+            return None, 0, "skipped:zero_amount"
+        return "dm_capture", amount, None
+    if decision == "release":
+        return "dm_release", 0, None
+    return None, 0, "skipped:unknown_decision"
 
-        ok = _stripe_capture(pi_id, amount)
-        if not ok:
-            return "error:stripe_capture_failed"
 
-        # Update state
-        try:
-            bk.deposit_charged_amount = amount
-            if deposit_total > 0 and amount >= deposit_total:
-                bk.deposit_status = "claimed"
-            else:
-                bk.deposit_status = "partially_withheld"
-            bk.status = "closed"
-            bk.dm_decision_at = datetime.utcnow()
-            bk.updated_at = datetime.utcnow()
-        except Exception:
-            pass
+def _claim(db: Session, bk: Booking, action: str, amount: int) -> AutoReleaseOutcome | None:
+    """
+    Take ownership of one side effect. Returns None if it is already done or
+    another run claimed it recently.
+    """
+    key = _idempotency_key(bk.id, action)
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=AUTO_RELEASE_CLAIM_MINUTES)
 
+    n = (
+        db.query(AutoReleaseOutcome)
+        .filter(
+            AutoReleaseOutcome.idempotency_key == key,
+            AutoReleaseOutcome.status != "done",
+            (AutoReleaseOutcome.status != "claimed") | (AutoReleaseOutcome.updated_at < stale),
+        )
+        .update(
+            {
+                "status": "claimed",
+                "attempts": AutoReleaseOutcome.attempts + 1,
+                "amount": amount,
+                "updated_at": now,
+            },
+            synchronize_session=False,
+        )
+    )
+    if n:
         db.commit()
-
-        # Notifications
-        try:
-            push_notification(
-                db, bk.owner_id,
-                "Decision executed: deposit captured",
-                f"You were compensated { _currency(amount) } from booking #{bk.id}'s deposit.",
-                f"/bookings/flow/{bk.id}",
-                "deposit",
-            )
-            push_notification(
-                db, bk.renter_id,
-                "Response window ended",
-                f"{ _currency(amount) } was captured from your deposit for booking #{bk.id} due to no evidence submitted in time.",
-                f"/bookings/flow/{bk.id}",
-                "deposit",
-            )
-            notify_admins(db, "Auto-executed DM decision", f"Booking #{bk.id} — captured {amount}.", f"/dm/deposits/{bk.id}")
-        except Exception:
-            pass
-
-        # ===== Emails: Auto-execution — capture =====
-        try:
-            owner_email = _user_email(db, bk.owner_id)
-            renter_email = _user_email(db, bk.renter_id)
-            admins_em   = _admin_emails(db)
-            case_url = f"{BASE_URL}/bookings/flow/{bk.id}"
-            amt_txt = _currency(amount)
-            if owner_email:
-                send_email(
-                    owner_email,
-                    f"Auto-executed capture — #{bk.id}",
-                    f"<p>You were compensated {amt_txt} CAD from booking #{bk.id}'s deposit after the response window expired.</p>"
-                    f'<p><a href="{case_url}">View booking</a></p>'
-                )
-            if renter_email:
-                send_email(
-                    renter_email,
-                    f"Response window ended — {amt_txt} CAD captured — #{bk.id}",
-                    f"<p>{amt_txt} CAD was captured from your deposit for booking #{bk.id} because no evidence was submitted within the deadline.</p>"
-                    f'<p><a href="{case_url}">View booking</a></p>'
-                )
-            for em in admins_em:
-                send_email(
-                    em,
-                    f"[Auto] DM decision executed — #{bk.id}",
-                    f"<p>Auto-capture executed for {amt_txt} CAD.</p>"
-                    f'<p><a href="{case_url}">Open case</a></p>'
-                )
-        except Exception:
-            pass
-
-        return f"captured:{amount}"
-
-    elif decision == "release":
-        ok = _stripe_cancel(pi_id)
-        if not ok:
-            # The hold may be expired or already cancelled — proceed with updates
-            pass
-
-        try:
-            bk.deposit_status = "refunded"
-            bk.deposit_charged_amount = 0
-            bk.status = "closed"
-            bk.dm_decision_at = datetime.utcnow()
-            bk.updated_at = datetime.utcnow()
-        except Exception:
-            pass
-
+        return db.query(AutoReleaseOutcome).filter_by(idempotency_key=key).first()
+    if db.query(AutoReleaseOutcome.id).filter_by(idempotency_key=key).first():
+        db.rollback()
+        return None
+
+    row = AutoReleaseOutcome(
+        booking_id=bk.id, action=action, idempotency_key=key,
+        amount=amount, status="claimed", attempts=1,
+    )
+    db.add(row)
+    try:
         db.commit()
+        return row
+    except IntegrityError:
+        db.rollback()
+        return None
 
-        try:
-            push_notification(
-                db, bk.owner_id,
-                "Deposit released",
-                f"The deposit for booking #{bk.id} has been returned after the response window expired.",
-                f"/bookings/flow/{bk.id}",
-                "deposit",
-            )
-            push_notification(
-                db, bk.renter_id,
-                "Deposit released",
-                f"Your deposit for booking #{bk.id} has been returned after the response window expired.",
-                f"/bookings/flow/{bk.id}",
-                "deposit",
-            )
-            notify_admins(db, "Auto-executed DM decision", f"Booking #{bk.id} — full release.", f"/dm/deposits/{bk.id}")
-        except Exception:
-            pass
-
-        # ===== Emails: Auto-execution — release =====
-        try:
-            owner_email = _user_email(db, bk.owner_id)
-            renter_email = _user_email(db, bk.renter_id)
-            admins_em   = _admin_emails(db)
-            case_url = f"{BASE_URL}/bookings/flow/{bk.id}"
-            if owner_email:
-                send_email(
-                    owner_email,
-                    f"Auto-executed — deposit released — #{bk.id}",
-                    f"<p>The deposit was fully released for this booking after the response window expired.</p>"
-                    f'<p><a href="{case_url}">View booking</a></p>'
-                )
-            if renter_email:
-                send_email(
-                    renter_email,
-                    f"Deadline passed — your deposit was released — #{bk.id}",
-                    f"<p>Your deposit was fully released for this booking after the response window expired.</p>"
-                    f'<p><a href="{case_url}">View booking</a></p>'
-                )
-            for em in admins_em:
-                send_email(
-                    em,
-                    f"[Auto] DM execution: release — #{bk.id}",
-                    f"<p>Deposit release executed automatically (deadline passed).</p>"
-                    f'<p><a href="{case_url}">Open case</a></p>'
-                )
-        except Exception:
-            pass
-
-        return "released"
-
-    return "skipped:unknown_decision"
 
-
-@router.get("/admin/run/auto-release")
-def run_auto_release(
-    dry: bool = Query(True, description="Dry-run mode only; no real Stripe/DB changes"),
-    db: Session = Depends(get_db),
-):
+def _call(action: str, pi_id: str, amount: int, key: str) -> tuple[bool, str | None, int | None]:
     """
-    Manually run auto-release from Admin during testing.
-    - Iterates eligible bookings and cancels the deposit hold if 48 hours passed since return with no dispute.
-    - If dry=true it makes no changes, only returns what it would do.
-
-    [Addition]
-    - Also auto-executes deferred DM decisions after the renter response deadline (24h),
-      provided the status is awaiting_renter and the renter did not reply before the deadline.
+    Stripe side effect only (runs in the pool, no DB access).
+    Returns (ok, error, http_status). A failed cancel is not fatal — the hold
+    may already be cancelled or expired — but a failed capture is.
+    http_status is None when no response came back (network error, timeout).
     """
+    try:
+        if action == "dm_capture":
+            stripe.PaymentIntent.capture(pi_id, amount_to_capture=int(amount) * 100, idempotency_key=key)
+        elif stripe.api_key:
+            stripe.PaymentIntent.cancel(pi_id, idempotency_key=key)
+        return True, None, None
+    except Exception as e:
+        return action != "dm_capture", str(e)[:1000], getattr(e, "http_status", None)
+
+
+def _apply(bk: Booking, action: str, amount: int, ok: bool) -> str:
+    """Local state after the Stripe call; returns the outcome label."""
     now = datetime.utcnow()
+    if action == "release":
+        bk.deposit_status = "refunded"
+        bk.deposit_charged_amount = 0
+        # If booking is still returned/in_review, consider it completed
+        if getattr(bk, "status", None) in ("returned", "in_review"):
+            bk.status = "completed"
+        bk.updated_at = now
+        return "released"
 
-    # -------------------------------
-    # Original part: Auto Release 48h
-    # -------------------------------
-    q = (
-        db.query(Booking)
-        .filter(
-            Booking.returned_at.isnot(None),
-            Booking.deposit_hold_intent_id.isnot(None),
-            Booking.deposit_status.is_(None) | Booking.deposit_status.in_(["held", "refunded", "none", "in_review"]),
-            Booking.status.in_(["returned", "in_review"]),
+    if action == "dm_capture":
+        if not ok:
+            return "error:stripe_capture_failed"
+        deposit_total = int(
+            (getattr(bk, "deposit_amount", None)
+             or getattr(bk, "hold_deposit_amount", None)
+             or 0)
         )
-        .order_by(Booking.returned_at.asc())
-    )
-    candidates = q.all()
-    to_release = [bk for bk in candidates if _can_auto_release(bk, now)]
+        bk.deposit_charged_amount = amount
+        if deposit_total > 0 and amount >= deposit_total:
+            bk.deposit_status = "claimed"
+        else:
+            bk.deposit_status = "partially_withheld"
+        bk.status = "closed"
+        bk.dm_decision_at = now
+        bk.updated_at = now
+        return f"captured:{amount}"
 
-    released_count = 0
-    released_ids = []
+    # dm_release
+    bk.deposit_status = "refunded"
+    bk.deposit_charged_amount = 0
+    bk.status = "closed"
+    bk.dm_decision_at = now
+    bk.updated_at = now
+    return "released"
 
-    if not dry:
-        for bk in to_release:
-            _do_release(bk)
-            db.commit()
-            released_count += 1
-            released_ids.append(bk.id)
 
-            # Notifications to booking parties
+def _notify_outcome(booking_id: int, action: str, amount: int) -> None:
+    """Push + email both parties and admins (own session; runs in the pool)."""
+    db = SessionLocal()
+    try:
+        bk = db.get(Booking, booking_id)
+        if not bk:
+            return
+        case_url = f"{BASE_URL}/bookings/flow/{bk.id}"
+        owner_email = _user_email(db, bk.owner_id)
+        renter_email = _user_email(db, bk.renter_id)
+        admins_em = _admin_emails(db)
+
+        if action == "release":
             try:
                 push_notification(
-                    db,
-                    bk.renter_id,
+                    db, bk.renter_id,
                     "Automatic deposit release",
                     f"Your deposit for booking #{bk.id} was automatically released after the objection window ended.",
                     f"/bookings/flow/{bk.id}",
                     "deposit",
                 )
                 push_notification(
-                    db,
-                    bk.owner_id,
+                    db, bk.owner_id,
                     "Automatic deposit release",
                     f"The deposit for booking #{bk.id} was automatically released after the window ended.",
                     f"/bookings/flow/{bk.id}",
@@ -418,13 +302,8 @@ def run_auto_release(
                 )
             except Exception:
                 pass
-
             # ===== Emails: 48h auto-release =====
             try:
-                renter_email = _user_email(db, bk.renter_id)
-                owner_email  = _user_email(db, bk.owner_id)
-                admins_em    = _admin_emails(db)
-                case_url = f"{BASE_URL}/bookings/flow/{bk.id}"
                 if renter_email:
                     send_email(
                         renter_email,
@@ -449,6 +328,192 @@ def run_auto_release(
             except Exception:
                 pass
 
+        elif action == "dm_capture":
+            try:
+                push_notification(
+                    db, bk.owner_id,
+                    "Decision executed: deposit captured",
+                    f"You were compensated { _currency(amount) } from booking #{bk.id}'s deposit.",
+                    f"/bookings/flow/{bk.id}",
+                    "deposit",
+                )
+                push_notification(
+                    db, bk.renter_id,
+                    "Response window ended",
+                    f"{ _currency(amount) } was captured from your deposit for booking #{bk.id} due to no evidence submitted in time.",
+                    f"/bookings/flow/{bk.id}",
+                    "deposit",
+                )
+                notify_admins(db, "Auto-executed DM decision", f"Booking #{bk.id} — captured {amount}.", f"/dm/deposits/{bk.id}")
+            except Exception:
+                pass
+            # ===== Emails: Auto-execution — capture =====
+            try:
+                amt_txt = _currency(amount)
+                if owner_email:
+                    send_email(
+                        owner_email,
+                        f"Auto-executed capture — #{bk.id}",
+                        f"<p>You were compensated {amt_txt} CAD from booking #{bk.id}'s deposit after the response window expired.</p>"
+                        f'<p><a href="{case_url}">View booking</a></p>'
+                    )
+                if renter_email:
+                    send_email(
+                        renter_email,
+                        f"Response window ended — {amt_txt} CAD captured — #{bk.id}",
+                        f"<p>{amt_txt} CAD was captured from your deposit for booking #{bk.id} because no evidence was submitted within the deadline.</p>"
+                        f'<p><a href="{case_url}">View booking</a></p>'
+                    )
+                for em in admins_em:
+                    send_email(
+                        em,
+                        f"[Auto] DM decision executed — #{bk.id}",
+                        f"<p>Auto-capture executed for {amt_txt} CAD.</p>"
+                        f'<p><a href="{case_url}">Open case</a></p>'
+                    )
+            except Exception:
+                pass
+
+        elif action == "dm_release":
+            try:
+                push_notification(
+                    db, bk.owner_id,
+                    "Deposit released",
+                    f"The deposit for booking #{bk.id} has been returned after the response window expired.",
+                    f"/bookings/flow/{bk.id}",
+                    "deposit",
+                )
+                push_notification(
+                    db, bk.renter_id,
+                    "Deposit released",
+                    f"Your deposit for booking #{bk.id} has been returned after the response window expired.",
+                    f"/bookings/flow/{bk.id}",
+                    "deposit",
+                )
+                notify_admins(db, "Auto-executed DM decision", f"Booking #{bk.id} — full release.", f"/dm/deposits/{bk.id}")
+            except Exception:
+                pass
+            # ===== Emails: Auto-execution — release =====
+            try:
+                if owner_email:
+                    send_email(
+                        owner_email,
+                        f"Auto-executed — deposit released — #{bk.id}",
+                        f"<p>The deposit was fully released for this booking after the response window expired.</p>"
+                        f'<p><a href="{case_url}">View booking</a></p>'
+                    )
+                if renter_email:
+                    send_email(
+                        renter_email,
+                        f"Deadline passed — your deposit was released — #{bk.id}",
+                        f"<p>Your deposit was fully released for this booking after the response window expired.</p>"
+                        f'<p><a href="{case_url}">View booking</a></p>'
+                    )
+                for em in admins_em:
+                    send_email(
+                        em,
+                        f"[Auto] DM execution: release — #{bk.id}",
+                        f"<p>Deposit release executed automatically (deadline passed).</p>"
+                        f'<p><a href="{case_url}">Open case</a></p>'
+                    )
+            except Exception:
+                pass
+    except Exception as e:
+        print(f"[WARN] auto-release notify failed for #{booking_id}: {e}")
+    finally:
+        db.close()
+
+
+def _run_pipeline(db: Session, planned: list[tuple[Booking, str, int, str]]) -> dict[int, str]:
+    """
+    planned: (booking, action, amount, deadline kind).
+    Returns {booking_id: outcome label} for every booking that was claimed.
+    """
+    # 1) claim
+    claimed: list[tuple[Booking, str, int, str, AutoReleaseOutcome]] = []
+    for bk, action, amount, kind in planned:
+        row = _claim(db, bk, action, amount)
+        if row is not None:
+            claimed.append((bk, action, amount, kind, row))
+    if not claimed:
+        return {}
+
+    results: dict[int, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, AUTO_RELEASE_WORKERS), thread_name_prefix="auto-release") as pool:
+        # 2) external calls in parallel
+        futures = {
+            pool.submit(
+                _call, action, getattr(bk, "deposit_hold_intent_id", None), amount,
+                row.request_key or row.idempotency_key,
+            ): (bk, action, amount, kind, row)
+            for bk, action, amount, kind, row in claimed
+        }
+        to_notify: list[tuple[int, str, int]] = []
+
+        # 3) commit each booking as its call finishes
+        for fut in as_completed(futures):
+            bk, action, amount, kind, row = futures[fut]
+            try:
+                ok, err, http_status = fut.result()
+            except Exception as e:
+                ok, err, http_status = False, str(e)[:1000], None
+            try:
+                label = _apply(bk, action, amount, ok)
+                done = not label.startswith("error:")
+                row.status = "done" if done else "error"
+                row.result = label
+                row.error = err
+                if not done and http_status and http_status >= 500:
+                    # Stripe would replay the cached 5xx for this key; no response → keep it
+                    row.request_key = f"{row.idempotency_key}:{(row.attempts or 1) + 1}"
+                if done:
+                    booking_deadlines.mark_processed(db, bk.id, kind, label, commit=False)
+                db.commit()
+                results[bk.id] = label
+                if done:
+                    to_notify.append((bk.id, action, amount))
+            except Exception as e:
+                db.rollback()
+                results[bk.id] = "error:commit_failed"
+                print(f"[WARN] auto-release commit failed for #{bk.id}: {e}")
+
+        # notifications (each push commits + sends SMTP) also fan out over the pool
+        for booking_id, action, amount in to_notify:
+            pool.submit(_notify_outcome, booking_id, action, amount)
+
+    return results
+
+
+def auto_release_tick(db: Session, dry: bool = False) -> dict:
+    """
+    One pass of the auto-release job (run by app/scheduler.py, or manually below).
+    - Iterates eligible bookings and cancels the deposit hold if 48 hours passed since return with no dispute.
+    - If dry=true it makes no changes, only returns what it would do.
+
+    [Addition]
+    - Also auto-executes deferred DM decisions after the renter response deadline (24h),
+      provided the status is awaiting_renter and the renter did not reply before the deadline.
+    """
+    now = datetime.utcnow()
+
+    # -------------------------------
+    # Original part: Auto Release 48h
+    # -------------------------------
+    # Only bookings whose 48h timer has expired (booking_deadlines), not a full scan;
+    # timers that can never fire (settled / no hold) are retired on the way
+    to_release = booking_deadlines.scan_due(
+        db, "auto_release", eligible=lambda bk: _can_auto_release(bk, now), now=now, retire=not dry,
+    )
+
+    released_count = 0
+    released_ids = []
+    release_results: dict[int, str] = {}
+
+    if not dry:
+        release_results = _run_pipeline(db, [(bk, "release", 0, "auto_release") for bk in to_release])
+        released_ids = sorted(bid for bid, label in release_results.items() if label == "released")
+        released_count = len(released_ids)
+
         try:
             if released_count:
                 notify_admins(
@@ -463,35 +528,50 @@ def run_auto_release(
     # -------------------------------------------------------
     # Execute DM decisions after renter deadline (24h)
     # -------------------------------------------------------
-    q2 = (
-        db.query(Booking)
-        .filter(
-            Booking.deposit_hold_intent_id.isnot(None),
-            Booking.renter_response_deadline_at.isnot(None),
-        )
-        .order_by(Booking.renter_response_deadline_at.asc())
+    dm_eligible = booking_deadlines.scan_due(
+        db, "renter_response", eligible=lambda bk: _can_execute_dm_decision(bk, now), now=now, retire=not dry,
     )
-    dm_candidates = q2.all()
-    dm_eligible = [bk for bk in dm_candidates if _can_execute_dm_decision(bk, now)]
 
     dm_results = {}
     if not dry:
+        planned = []
         for bk in dm_eligible:
-            res = _execute_dm_decision(db, bk)
-            dm_results[bk.id] = res
+            action, amount, skip = _plan_dm_action(bk)
+            if action:
+                planned.append((bk, action, amount, "renter_response"))
+            else:
+                dm_results[bk.id] = skip
+        dm_results.update(_run_pipeline(db, planned))
 
     return {
         "now": now.isoformat(),
         "dry": dry,
         # original section
-        "candidates": [bk.id for bk in candidates],
+        "candidates": [bk.id for bk in to_release],
         "eligible": [bk.id for bk in to_release],
         "released_count": (released_count if not dry else 0),
         "released_ids": (released_ids if not dry else []),
         "window_hours": AUTO_RELEASE_WINDOW_HOURS,
         # additions for DM decisions
-        "dm_candidates": [bk.id for bk in dm_candidates],
+        "dm_candidates": [bk.id for bk in dm_eligible],
         "dm_eligible": [bk.id for bk in dm_eligible],
         "dm_window_hours": DM_RESPONSE_WINDOW_HOURS,
         "dm_results": (dm_results if not dry else {}),
+        # failed Stripe calls / commits (the scheduler marks the run as failed)
+        "errors": sum(
+            1 for label in list(release_results.values()) + list(dm_results.values())
+            if str(label).startswith("error:")
+        ),
     }
+
+
+@router.get("/admin/run/auto-release")
+def run_auto_release(
+    dry: bool = Query(True, description="Dry-run mode only; no real Stripe/DB changes"),
+    db: Session = Depends(get_db),
+):
+    """
+    Manually run auto-release from Admin during testing.
+    The same pass runs periodically as the "auto_release" scheduler job.
+    """
+    return auto_release_tick(db, dry=dry)
@@ -1,14 +1,17 @@
 # app/cs.py
 from datetime import datetime
+from typing import Optional
 from fastapi import APIRouter, Request, Depends, Form
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, text
+from sqlalchemy import text
 
+from . import staff_queues, ticket_events
 from .database import get_db
 from .models import SupportTicket, SupportMessage, User
-from .notifications_api import push_notification, notify_mods, notify_dms
+from .notifications_api import push_notification, push_notifications, notify_mods, notify_dms
+from .support import bump_ticket_on_message
 from .utils import display_currency   # ← ★★★ مهم جداً
 
 templates = Jinja2Templates(directory="app/templates")
@@ -41,7 +44,12 @@ def _ensure_cs_session(db: Session, request: Request):
 # CS Inbox
 # ---------------------------
 @router.get("/inbox")
-def cs_inbox(request: Request, db: Session = Depends(get_db)):
+def cs_inbox(
+    request: Request,
+    db: Session = Depends(get_db),
+    tab: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
     u = _require_login(request)
     if not u:
         return RedirectResponse("/login", status_code=303)
@@ -50,36 +58,8 @@ def cs_inbox(request: Request, db: Session = Depends(get_db)):
     if not u_cs:
         return RedirectResponse("/support/my", status_code=303)
 
-    base_q = db.query(SupportTicket).filter(text("COALESCE(queue,'cs') = 'cs'"))
-
-    new_q = (
-        base_q.filter(
-            SupportTicket.status.in_(("new", "open")),
-            SupportTicket.assigned_to_id.is_(None),
-            SupportTicket.unread_for_agent.is_(True),
-            SupportTicket.last_from == "user",
-        )
-        .order_by(desc(SupportTicket.last_msg_at), desc(SupportTicket.created_at))
-    )
-
-    in_review_q = (
-        base_q.filter(
-            SupportTicket.status == "open",
-            SupportTicket.assigned_to_id.isnot(None),
-        )
-        .order_by(desc(SupportTicket.last_msg_at), desc(SupportTicket.updated_at))
-    )
-
-    resolved_q = (
-        base_q.filter(SupportTicket.status == "resolved")
-        .order_by(desc(SupportTicket.resolved_at), desc(SupportTicket.updated_at))
-    )
-
-    data = {
-        "new": new_q.all(),
-        "in_review": in_review_q.all(),
-        "resolved": resolved_q.all(),
-    }
+    # Paged per tab (keyset) with cached counts — see app/staff_queues.py
+    inbox = staff_queues.inbox(db, "cs", tab, cursor)
 
     return templates.TemplateResponse(
         "cs_inbox.html",
@@ -87,7 +67,8 @@ def cs_inbox(request: Request, db: Session = Depends(get_db)):
             "request": request,
             "session_user": u_cs,
             "title": "CS Inbox",
-            "data": data,
+            **inbox,
+            "events_after": ticket_events.last_id(db),  # console polls /api/support/events from here
             "display_currency": display_currency,  # ← ★★ إضافة مهمة
         },
     )
@@ -145,6 +126,7 @@ def cs_assign_self(ticket_id: int, request: Request, db: Session = Depends(get_d
         t.status = "open"
         t.updated_at = datetime.utcnow()
         t.unread_for_agent = False
+        ticket_events.record(db, t.id, "assigned", actor_id=u_cs["id"], queue=t.queue, status="open")
 
         agent_name = (request.session["user"].get("first_name") or "").strip() or "Support Agent"
         try:
@@ -177,45 +159,34 @@ def cs_ticket_reply(tid: int, request: Request, db: Session = Depends(get_db), b
     if not u_cs:
         return RedirectResponse("/support/my", status_code=303)
 
-    t = db.get(SupportTicket, tid)
+    t = bump_ticket_on_message(db, tid, u_cs, is_cs_author=True, commit=False)
     if not t:
         return RedirectResponse("/cs/inbox", status_code=303)
 
-    now = datetime.utcnow()
-
     msg = SupportMessage(
-        ticket_id=t.id,
+        ticket_id=tid,
         sender_id=u_cs["id"],
         sender_role="agent",
         body=(body or "").strip() or "(no text)",
-        created_at=now,
+        created_at=datetime.utcnow(),
     )
     db.add(msg)
-
-    t.last_msg_at = now
-    t.updated_at = now
-    t.last_from = "agent"
-    if not t.assigned_to_id:
-        t.assigned_to_id = u_cs["id"]
-    t.status = "open"
-    t.unread_for_user = True
-    t.unread_for_agent = False
+    db.commit()
 
     try:
         agent_name = (request.session["user"].get("first_name") or "").strip() or "Support Agent"
-        push_notification(
+        push_notifications(
             db,
-            t.user_id,
+            [t["user_id"]],
             "💬 Reply from support",
-            f"{agent_name} replied to your ticket #{t.id}",
-            url=f"/support/ticket/{t.id}",
+            f"{agent_name} replied to your ticket #{tid}",
+            url=f"/support/ticket/{tid}",
             kind="support",
         )
     except:
         pass
 
-    db.commit()
-    return RedirectResponse(f"/cs/ticket/{t.id}", status_code=303)
+    return RedirectResponse(f"/cs/ticket/{tid}", status_code=303)
 
 
 # ---------------------------
@@ -252,6 +223,7 @@ def cs_resolve(ticket_id: int, request: Request, db: Session = Depends(get_db)):
         db.add(close_msg)
 
         t.unread_for_user = True
+        ticket_events.record(db, t.id, "resolved", actor_id=u_cs["id"], queue=t.queue, status="resolved")
 
         try:
             push_notification(
@@ -328,6 +300,9 @@ def cs_transfer_queue(ticket_id: int, request: Request, db: Session = Depends(ge
             t.assigned_to_id = u_cs["id"]
         t.unread_for_agent = False
 
+    ticket_events.record(db, t.id, "transferred", actor_id=u_cs["id"], queue=target, status=t.status,
+                         **{"from": t.queue, "to": target})
+
     try:
         push_notification(
             db,
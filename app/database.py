@@ -1,34 +1,531 @@
 # app/database.py
+import asyncio
+import contextvars
 import os
+import re
+import sqlite3
+import threading
+import time
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, declarative_base
+from typing import Optional
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from starlette.requests import Request
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import await_only
 
 # =========================================================
 # 1) Read the database URL + automatically normalize Postgres driver
 # =========================================================
-DB_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+def _normalize_url(url: str) -> str:
+    # psycopg (v3) is the recommended driver for SQLAlchemy with Postgres
+    # Automatically convert any legacy format to postgresql+psycopg://
+    if url.startswith("postgres://"):
+        return "postgresql+psycopg://" + url[len("postgres://"):]
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+psycopg://", 1)
+    if url.startswith("postgresql://") and "+psycopg" not in url:
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
 
-# psycopg (v3) is the recommended driver for SQLAlchemy with Postgres
-# Automatically convert any legacy format to postgresql+psycopg://
-if DB_URL.startswith("postgres://"):
-    DB_URL = "postgresql+psycopg://" + DB_URL[len("postgres://"):]
-elif DB_URL.startswith("postgresql+psycopg2://"):
-    DB_URL = DB_URL.replace("postgresql+psycopg2://", "postgresql+psycopg://", 1)
-elif DB_URL.startswith("postgresql://") and "+psycopg" not in DB_URL:
-    DB_URL = DB_URL.replace("postgresql://", "postgresql+psycopg://", 1)
+DB_URL = _normalize_url(os.getenv("DATABASE_URL", "sqlite:///./app.db"))
+# Optional read replica for read-only pages (see section 2d)
+DB_REPLICA_URL = _normalize_url(os.getenv("DATABASE_REPLICA_URL", "").strip())
 
 # =========================================================
-# 2) Create Engine and Session
+# 2) Connection pool settings (env) + instrumentation
 # =========================================================
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; -1 = never
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+# A checkout waiting longer than this is logged
+DB_POOL_SLOW_WAIT_MS = float(os.getenv("DB_POOL_SLOW_WAIT_MS", "200"))
+
+_pool_stats_lock = threading.Lock()
+pool_stats = {
+    "checkouts": 0,
+    "waits_over_slow": 0,
+    "timeouts": 0,
+    "total_wait_ms": 0.0,
+    "max_wait_ms": 0.0,
+}
+
+
+def _record_wait(elapsed_ms: float, timed_out: bool = False) -> None:
+    with _pool_stats_lock:
+        pool_stats["checkouts"] += 0 if timed_out else 1
+        pool_stats["total_wait_ms"] += elapsed_ms
+        pool_stats["max_wait_ms"] = max(pool_stats["max_wait_ms"], elapsed_ms)
+        if timed_out:
+            pool_stats["timeouts"] += 1
+        elif elapsed_ms >= DB_POOL_SLOW_WAIT_MS:
+            pool_stats["waits_over_slow"] += 1
+    if timed_out or elapsed_ms >= DB_POOL_SLOW_WAIT_MS:
+        tr = _request_tracker.get()
+        where = f" ({tr['route']})" if tr else ""
+        print(f"[WARN] db pool: {'timeout after' if timed_out else 'waited'} {elapsed_ms:.0f} ms for a connection{where}")
+
+
+class _TimedCheckout:
+    """Pool mixin: measures how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            _record_wait((time.perf_counter() - t0) * 1000, timed_out=True)
+            raise
+        _record_wait((time.perf_counter() - t0) * 1000)
+        return conn
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+# Per-request connection tracker, set by the pool-tracking middleware in main.py:
+#   {"route": "GET /items", "checkouts": n, "in_handler": bool,
+#    "held": {pool: n}, "peak": n}
+# "checkouts" counts every layer (middleware sessions included); "held"/"peak"
+# only count connections the endpoint and its dependencies check out, per pool
+# (get_db + get_read_db, or sync + async, are different pools, not a leak).
+# Pool events of one request can fire on several threads at once → _tracker_lock.
+_request_tracker: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("db_request_tracker", default=None)
+_tracker_lock = threading.Lock()
+
+
+def start_request_tracking(route: str):
+    """Begin counting connections for the current request; returns the token for reset."""
+    return _request_tracker.set({"route": route, "checkouts": 0, "in_handler": False, "held": {}, "peak": 0})
+
+
+def stop_request_tracking(token) -> Optional[dict]:
+    tr = _request_tracker.get()
+    _request_tracker.reset(token)
+    return tr
+
+
+def set_handler_active(active: bool) -> None:
+    """Mark the endpoint part of the current request (db_metrics.handler_scope)."""
+    tr = _request_tracker.get()
+    if tr is not None:
+        with _tracker_lock:
+            tr["in_handler"] = active
+
+
+def _track_pool(eng, name: str) -> None:
+    """Count this engine's checkouts/checkins into the current request's tracker."""
+
+    def _on_checkout(_dbapi_conn, record, _proxy) -> None:
+        tr = _request_tracker.get()
+        if tr is None:
+            return
+        with _tracker_lock:
+            tr["checkouts"] += 1
+            if not tr["in_handler"]:
+                return
+            held = tr["held"][name] = tr["held"].get(name, 0) + 1
+            tr["peak"] = max(tr["peak"], held)
+        # checkin may run in another context (threadpool, GC): remember whose it is
+        record.info["_request_tracker"] = tr
+
+    def _on_checkin(_dbapi_conn, record) -> None:
+        tr = record.info.pop("_request_tracker", None) if record is not None else None
+        if tr is not None:
+            with _tracker_lock:
+                tr["held"][name] = max(0, tr["held"].get(name, 0) - 1)
+
+    event.listen(eng, "checkout", _on_checkout)
+    event.listen(eng, "checkin", _on_checkin)
+
+
+def _pool_kwargs(url: str) -> dict:
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith("sqlite:")):
+        return {}  # in-memory SQLite uses a singleton pool
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+# =========================================================
+# 2a) SQLite profile: pragmas on connect + single writer per process
+#     (no effect on Postgres)
+# =========================================================
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "1").lower() in ("1", "true", "yes")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", str(64 * 1024)))
+# How long a write transaction queues for the writer slot before going ahead
+# anyway (SQLite's busy timeout then applies)
+SQLITE_WRITE_QUEUE_TIMEOUT = float(os.getenv("SQLITE_WRITE_QUEUE_TIMEOUT", "30"))
+
+_WRITE_SQL_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+sqlite_writer_stats = {"write_txns": 0, "queued": 0, "total_queue_ms": 0.0, "max_queue_ms": 0.0, "queue_timeouts": 0}
+
+
+class _SQLiteWriterSlot:
+    """
+    One write transaction at a time per process, in arrival order-ish.
+    Writers wait here (a condition variable) instead of spinning on SQLite's
+    busy handler, which retries on a sleep schedule and produces long tails.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._holder = None          # connection object
+        self._holder_thread = None
+
+    def acquire(self, conn, *, wait: bool = True, thread_bound: bool = True) -> bool:
+        """
+        wait=False: take the slot only if it is free (sync writes on the event
+        loop thread must not block it). thread_bound=False: the holder is an
+        async connection, not tied to the thread that waited for it.
+        """
+        t0 = time.perf_counter()
+        with self._cond:
+            if self._holder is not None and (not wait or self._holder_thread == threading.get_ident()):
+                # A second connection of the same thread (or the event loop):
+                # waiting would deadlock on ourselves; let SQLite arbitrate as before.
+                return False
+            queued = self._holder is not None
+            ok = self._cond.wait_for(lambda: self._holder is None, timeout=SQLITE_WRITE_QUEUE_TIMEOUT)
+            waited = (time.perf_counter() - t0) * 1000
+            sqlite_writer_stats["write_txns"] += 1
+            if queued:
+                sqlite_writer_stats["queued"] += 1
+                sqlite_writer_stats["total_queue_ms"] += waited
+                sqlite_writer_stats["max_queue_ms"] = max(sqlite_writer_stats["max_queue_ms"], waited)
+            if not ok:
+                sqlite_writer_stats["queue_timeouts"] += 1
+                print(f"[WARN] sqlite writer queue: gave up after {waited:.0f} ms, continuing unserialized")
+                return False
+            self._holder = conn
+            self._holder_thread = threading.get_ident() if thread_bound else None
+            return True
+
+    def release(self, conn) -> None:
+        with self._cond:
+            if self._holder is conn:
+                self._holder = None
+                self._holder_thread = None
+                self._cond.notify()
+
+
+_sqlite_writer = _SQLiteWriterSlot()
+
+
+class WriterQueueConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that takes the process writer slot right before the
+    first INSERT/UPDATE/DELETE of a transaction and gives it back once the
+    transaction ends. With the default (implicit) transaction handling sqlite3
+    issues BEGIN just before that first DML statement, so the transaction
+    itself starts after the slot is ours: no upgrade from a stale read.
+    """
+
+    _holds_writer = False
+
+    def acquire_writer(self, statement: str) -> None:
+        if self._holds_writer or self.in_transaction or not _WRITE_SQL_RE.match(statement or ""):
+            return
+        self._holds_writer = _sqlite_writer.acquire(self, wait=not _on_event_loop())
+
+    def _release_writer(self) -> None:
+        if self._holds_writer:
+            self._holds_writer = False
+            _sqlite_writer.release(self)
+
+    def commit(self):
+        try:
+            return super().commit()
+        finally:
+            self._release_writer()
+
+    def rollback(self):
+        try:
+            return super().rollback()
+        finally:
+            self._release_writer()
+
+    def close(self):
+        try:
+            return super().close()
+        finally:
+            self._release_writer()
+
+
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        if SQLITE_JOURNAL_MODE:
+            cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        if SQLITE_SYNCHRONOUS:
+            cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+        cur.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_BYTES)}")
+        cur.execute(f"PRAGMA cache_size={-int(SQLITE_CACHE_KB)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    except Exception as e:
+        print("[WARN] sqlite pragmas failed:", e)
+    finally:
+        cur.close()
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _sqlite_before_execute(conn, _cursor, statement, _params, _context, _executemany) -> None:
+    dbapi_conn = conn.connection.dbapi_connection
+    if isinstance(dbapi_conn, WriterQueueConnection):
+        dbapi_conn.acquire_writer(statement)
+
+
+# Async (aiosqlite) connections take the same writer slot, waited for in a
+# worker thread so the event loop keeps running. The slot is held until the
+# connection goes back to the pool, i.e. after its transaction ended.
+async def _acquire_writer_async(dbapi_conn) -> bool:
+    fut = asyncio.ensure_future(asyncio.to_thread(_sqlite_writer.acquire, dbapi_conn, thread_bound=False))
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        # request cancelled while queued: give the slot back once the wait ends
+        fut.add_done_callback(
+            lambda f: (not f.cancelled() and f.exception() is None and f.result()) and _sqlite_writer.release(dbapi_conn)
+        )
+        raise
+
+
+def _sqlite_async_before_execute(conn, _cursor, statement, _params, _context, _executemany) -> None:
+    if conn.info.get("sqlite_writer") or not _WRITE_SQL_RE.match(statement or ""):
+        return
+    conn.info["sqlite_writer"] = await_only(_acquire_writer_async(conn.connection.dbapi_connection))
+
+
+def _sqlite_async_end(conn) -> None:
+    if conn.info.pop("sqlite_writer", False):
+        _sqlite_writer.release(conn.connection.dbapi_connection)
+
+
+def _sqlite_async_checkin(dbapi_conn, record) -> None:
+    if record is not None and record.info.pop("sqlite_writer", False):
+        _sqlite_writer.release(dbapi_conn)
+
+
+def _sqlite_connect_args() -> dict:
+    args = {"check_same_thread": False}
+    if SQLITE_PROFILE:
+        args["factory"] = WriterQueueConnection
+        args["timeout"] = SQLITE_BUSY_TIMEOUT_MS / 1000
+    return args
+
+
+# =========================================================
+# 2b) Create Engine and Session
+# =========================================================
+_IS_SQLITE = DB_URL.startswith("sqlite")
+_POOL_KWARGS = _pool_kwargs(DB_URL)
 engine = create_engine(
     DB_URL,
-    connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {},
-    pool_pre_ping=True,  # Very useful for remote hosts (Render, etc.)
+    connect_args=_sqlite_connect_args() if _IS_SQLITE else {},
+    pool_pre_ping=DB_POOL_PRE_PING,  # Very useful for remote hosts (Render, etc.)
+    **({"poolclass": TimedQueuePool, **_POOL_KWARGS} if _POOL_KWARGS else {}),
 )
+_track_pool(engine, "primary")
+if _IS_SQLITE and SQLITE_PROFILE:
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(engine, "before_cursor_execute", _sqlite_before_execute)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# =========================================================
+# 2c) Async engine and session (AsyncSession)
+#     Postgres: psycopg v3 speaks asyncio natively (same URL).
+#     SQLite:   aiosqlite (sqlite:/// → sqlite+aiosqlite:///).
+# =========================================================
+if DB_URL.startswith("sqlite:"):
+    ASYNC_DB_URL = DB_URL.replace("sqlite:", "sqlite+aiosqlite:", 1)
+else:
+    ASYNC_DB_URL = DB_URL
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        ASYNC_DB_URL,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        **({"poolclass": TimedAsyncQueuePool, **_POOL_KWARGS} if _POOL_KWARGS else {}),
+    )
+    _track_pool(async_engine.sync_engine, "async")
+    if _IS_SQLITE and SQLITE_PROFILE:
+        # Same pragmas, and the same per-process writer slot as the sync
+        # engine (awaited off the event loop, see _acquire_writer_async)
+        event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", _sqlite_async_before_execute)
+        event.listen(async_engine.sync_engine, "commit", _sqlite_async_end)
+        event.listen(async_engine.sync_engine, "rollback", _sqlite_async_end)
+        event.listen(async_engine.sync_engine, "checkin", _sqlite_async_checkin)
+    # expire_on_commit=False: no implicit reload (= hidden IO) after commit
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+except Exception as _e:  # async driver / greenlet not installed
+    print("[WARN] async database engine unavailable:", _e)
+    async_engine = None
+    AsyncSessionLocal = None
+
+# =========================================================
+# 2d) Read replica routing (catalogue pages)
+#     get_read_db() hands out a RoutingSession: SELECTs go to the replica,
+#     anything that writes (flush, INSERT/UPDATE/DELETE text) goes to the
+#     primary and pins the session there. Falls back to the primary when no
+#     replica is configured or it is unreachable.
+#     Read-your-writes: a request that committed a write on the primary marks
+#     the user's session cookie; their reads stay on the primary for
+#     DB_REPLICA_STICKY_SECONDS (set by the middleware in main.py).
+# =========================================================
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "15"))
+DB_REPLICA_HEALTH_SECONDS = float(os.getenv("DB_REPLICA_HEALTH_SECONDS", "10"))
+PRIMARY_UNTIL_KEY = "_db_primary_until"
+
+replica_engine = None
+if DB_REPLICA_URL:
+    try:
+        replica_engine = create_engine(
+            DB_REPLICA_URL,
+            connect_args=_sqlite_connect_args() if DB_REPLICA_URL.startswith("sqlite") else {"connect_timeout": 3},
+            pool_pre_ping=DB_POOL_PRE_PING,
+            **({"poolclass": TimedQueuePool, **_pool_kwargs(DB_REPLICA_URL)} if _pool_kwargs(DB_REPLICA_URL) else {}),
+        )
+        _track_pool(replica_engine, "replica")
+    except Exception as _e:
+        print("[WARN] read replica disabled:", _e)
+        replica_engine = None
+
+_replica_health = {"ok": replica_engine is not None, "checked_at": 0.0, "error": None}
+_replica_health_lock = threading.Lock()
+
+
+def replica_available() -> bool:
+    """Replica configured and answered a ping within the last health interval."""
+    if replica_engine is None:
+        return False
+    now = time.monotonic()
+    if now - _replica_health["checked_at"] < DB_REPLICA_HEALTH_SECONDS:
+        return _replica_health["ok"]
+    if not _replica_health_lock.acquire(blocking=False):
+        return _replica_health["ok"]  # another thread is probing
+    try:
+        try:
+            with replica_engine.connect() as conn:
+                conn.exec_driver_sql("SELECT 1")
+            if not _replica_health["ok"]:
+                print("[INFO] read replica is back")
+            _replica_health.update(ok=True, error=None)
+        except Exception as e:
+            if _replica_health["ok"]:
+                print(f"[WARN] read replica unavailable, reading from primary: {e}")
+            _replica_health.update(ok=False, error=str(e)[:300])
+        _replica_health["checked_at"] = time.monotonic()
+        return _replica_health["ok"]
+    finally:
+        _replica_health_lock.release()
+
+
+class RoutingSession(Session):
+    """Reads on the replica, writes (and everything after them) on the primary."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("primary") or replica_engine is None:
+            return engine
+        if self._flushing or isinstance(clause, UpdateBase) or (
+            isinstance(clause, TextClause) and _WRITE_SQL_RE.match(clause.text or "")
+        ):
+            self.info["primary"] = True
+            return engine
+        return replica_engine
+
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+
+def primary_pinned(request) -> bool:
+    """True while this user's own recent write must be visible to their reads."""
+    try:
+        until = float((request.session or {}).get(PRIMARY_UNTIL_KEY) or 0)
+    except Exception:
+        return False
+    return until > time.time()
+
+
+def get_read_db(request: Request):
+    """Dependency for read-only pages: replica when healthy and not pinned, else primary."""
+    db = ReadSessionLocal()
+    if primary_pinned(request) or not replica_available():
+        db.info["primary"] = True
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Write detection for read-your-writes: a commit on the primary after a DML
+# statement flags the current request (contextvar set by the middleware)
+_request_writes: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("db_request_writes", default=None)
+
+
+def start_write_tracking():
+    return _request_writes.set({"wrote": False})
+
+
+def stop_write_tracking(token) -> bool:
+    st = _request_writes.get()
+    _request_writes.reset(token)
+    return bool(st and st["wrote"])
+
+
+def _note_write_statement(conn, _cursor, statement, _params, _context, _executemany) -> None:
+    if _request_writes.get() is not None and _WRITE_SQL_RE.match(statement or ""):
+        conn.info["_pending_write"] = True
+
+
+def _note_commit(conn) -> None:
+    if conn.info.pop("_pending_write", False):
+        st = _request_writes.get()
+        if st is not None:
+            st["wrote"] = True
+
+
+def _note_rollback(conn) -> None:
+    conn.info.pop("_pending_write", None)
+
+
+if replica_engine is not None:
+    for _eng in (engine, async_engine.sync_engine if async_engine is not None else None):
+        if _eng is not None:
+            event.listen(_eng, "before_cursor_execute", _note_write_statement)
+            event.listen(_eng, "commit", _note_commit)
+            event.listen(_eng, "rollback", _note_rollback)
+
 # The only Base used throughout the project
 Base = declarative_base()
 
@@ -42,6 +539,52 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency to inject an AsyncSession inside async routes."""
+    if AsyncSessionLocal is None:
+        raise RuntimeError("async database driver missing (pip install 'sqlalchemy[asyncio]' aiosqlite)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def pool_status() -> dict:
+    """Current pool occupancy + cumulative checkout/wait metrics (this process)."""
+    out = {"sync": {}, "async": {}}
+    for key, eng in (("sync", engine), ("async", async_engine.sync_engine if async_engine else None)):
+        pool = getattr(eng, "pool", None)
+        if pool is None:
+            continue
+        info = {"class": type(pool).__name__, "status": pool.status()}
+        for attr in ("size", "checkedout", "checkedin", "overflow"):
+            fn = getattr(pool, attr, None)
+            if callable(fn):
+                try:
+                    info[attr] = fn()
+                except Exception:
+                    pass
+        out[key] = info
+    with _pool_stats_lock:
+        stats = dict(pool_stats)
+    stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["checkouts"], 3) if stats["checkouts"] else 0.0
+    out["metrics"] = stats
+    if _IS_SQLITE:
+        out["sqlite"] = {"profile": SQLITE_PROFILE, "writer_queue": dict(sqlite_writer_stats)}
+    if replica_engine is not None:
+        out["replica"] = {
+            "healthy": _replica_health["ok"],
+            "error": _replica_health["error"],
+            "status": replica_engine.pool.status(),
+        }
+    out["settings"] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pre_ping": DB_POOL_PRE_PING,
+    }
+    return out
+
+
 # =========================================================
 # 3) Helpers for compatibility (engine detection and safe column checking)
 # =========================================================
@@ -73,6 +616,42 @@ def _has_column(table: str, col: str) -> bool:
     except Exception:
         return False
 
+# Cached column sets per table (computed once per process).
+# Call invalidate_table_columns() after any ALTER TABLE / create_all.
+_table_columns_cache: dict[str, frozenset] = {}
+_table_columns_lock = threading.Lock()
+
+
+def table_columns(table: str) -> frozenset:
+    """
+    Column names of `table`, via the SQLAlchemy inspector (works on SQLite and
+    Postgres). Cached per process; empty results (missing table) are not cached.
+    """
+    cols = _table_columns_cache.get(table)
+    if cols is not None:
+        return cols
+    with _table_columns_lock:
+        cols = _table_columns_cache.get(table)
+        if cols is not None:
+            return cols
+        try:
+            cols = frozenset(c["name"] for c in inspect(engine).get_columns(table))
+        except Exception:
+            cols = frozenset()
+        if cols:
+            _table_columns_cache[table] = cols
+        return cols
+
+
+def invalidate_table_columns(table: str | None = None) -> None:
+    """Forget cached columns for one table (or all) after a schema migration."""
+    with _table_columns_lock:
+        if table is None:
+            _table_columns_cache.clear()
+        else:
+            _table_columns_cache.pop(table, None)
+
+
 # =========================================================
 # 4) Hotfix: ensure reports columns (if missing in old Postgres)
 # =========================================================
@@ -89,6 +668,7 @@ def _ensure_reports_columns() -> None:
         with engine.begin() as conn:
             conn.exec_driver_sql("ALTER TABLE public.reports ADD COLUMN IF NOT EXISTS tag VARCHAR(24);")
             conn.exec_driver_sql("ALTER TABLE public.reports ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NULL;")
+        invalidate_table_columns("reports")
     except Exception as e:
         # Do not stop the app because of this — just print a warning
         print("[WARN] ensure reports columns failed:", e)
@@ -0,0 +1,97 @@
+# app/db_metrics.py
+"""
+Per-route database connection metrics.
+
+The pool-tracking middleware in main.py starts a tracker for every request
+(database.start_request_tracking); pool checkout/checkin events count how many
+connections the request checked out and how many it held at the same time.
+"Held" only counts what the endpoint and its dependencies check out (the
+app-wide handler_scope dependency marks that window) and is per pool, so
+middleware sessions and get_db + get_read_db are not mistaken for a leak.
+When the request ends, record_request() folds that into per-route totals and
+logs routes that held more than one connection of a pool at once (a second
+session opened while get_db's is still checked out: pool pressure and a
+deadlock risk once every worker does it).
+
+GET /admin/db/pool shows the pool occupancy, checkout wait times and the
+per-route counters of this process.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from fastapi import APIRouter, HTTPException, Request
+
+from .database import pool_status, set_handler_active
+
+# Same route is logged at most once per interval
+DB_LEAK_LOG_INTERVAL_SECONDS = float(os.getenv("DB_LEAK_LOG_INTERVAL_SECONDS", "300"))
+DB_METRICS_MAX_ROUTES = int(os.getenv("DB_METRICS_MAX_ROUTES", "500"))
+
+_lock = threading.Lock()
+_routes: dict[str, dict] = {}
+_last_logged: dict[str, float] = {}
+
+
+async def handler_scope():
+    """App-wide dependency (main.py): the endpoint's own part of the request."""
+    set_handler_active(True)
+    try:
+        yield
+    finally:
+        set_handler_active(False)
+
+
+def route_key(request: Request) -> str:
+    """'GET /items/{item_id}' (route template when matched, raw path otherwise)."""
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or request.url.path
+    return f"{request.method} {path}"
+
+
+def record_request(route: str, tracker: dict | None) -> None:
+    if not tracker:
+        return
+    checkouts = tracker.get("checkouts", 0)
+    peak = tracker.get("peak", 0)
+    with _lock:
+        st = _routes.get(route)
+        if st is None:
+            if len(_routes) >= DB_METRICS_MAX_ROUTES:
+                return
+            st = _routes[route] = {"requests": 0, "checkouts": 0, "max_checkouts": 0, "max_held": 0, "over_one": 0}
+        st["requests"] += 1
+        st["checkouts"] += checkouts
+        st["max_checkouts"] = max(st["max_checkouts"], checkouts)
+        st["max_held"] = max(st["max_held"], peak)
+        if peak > 1:
+            st["over_one"] += 1
+            now = time.monotonic()
+            if now - _last_logged.get(route, 0.0) < DB_LEAK_LOG_INTERVAL_SECONDS:
+                return
+            _last_logged[route] = now
+    if peak > 1:
+        print(f"[WARN] db pool: {route} held {peak} connections at once ({checkouts} checkouts in the request)")
+
+
+def route_stats() -> list[dict]:
+    with _lock:
+        rows = [{"route": k, **v} for k, v in _routes.items()]
+    for r in rows:
+        r["avg_checkouts"] = round(r["checkouts"] / r["requests"], 2) if r["requests"] else 0
+    rows.sort(key=lambda r: (r["max_held"], r["checkouts"]), reverse=True)
+    return rows
+
+
+# ================= Admin =================
+router = APIRouter(prefix="/admin/db", tags=["admin"])
+
+
+@router.get("/pool")
+def db_pool(request: Request, limit: int = 100):
+    u = request.session.get("user") or {}
+    if u.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {**pool_status(), "routes": route_stats()[: max(1, min(limit, DB_METRICS_MAX_ROUTES))]}
@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends, Request, Form, HTTPException
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 
+from . import staff_queues
 from .database import get_db
 from .models import Booking, User
 from .notifications_api import push_notification
@@ -43,6 +44,7 @@ def dm_index(
     db: Session = Depends(get_db),
     user: Optional[User] = Depends(get_current_user),
     view: Literal["pending", "in_review", "resolved"] = "pending",
+    cursor: Optional[str] = None,
 ):
     """
     Simple tabs:
@@ -52,22 +54,16 @@ def dm_index(
     """
     require_manager(user)
 
-    q = db.query(Booking)
+    titles = {
+        "pending": "Deposit Queue — Pending",
+        "in_review": "Deposit Queue — In Review",
+        "resolved": "Deposit Queue — Resolved",
+    }
+    title = titles[view]
 
-    if view == "pending":
-        q = q.filter(
-            Booking.status.in_(["returned", "in_review"]),
-            Booking.deposit_status.in_(["in_dispute", "held"])
-        )
-        title = "Deposit Queue — Pending"
-    elif view == "in_review":
-        q = q.filter(Booking.status == "in_review")
-        title = "Deposit Queue — In Review"
-    else:
-        q = q.filter(Booking.status.in_(["closed", "completed"]))
-        title = "Deposit Queue — Resolved"
-
-    rows = q.order_by(Booking.updated_at.desc().nullslast(), Booking.created_at.desc().nullslast()).all()
+    # Keyset-paged on (updated_at, id) — see app/staff_queues.py
+    queue = staff_queues.QUEUES["deposit_manager"]
+    rows, next_cursor = queue.page(db, view, cursor)
 
     # Pass everything to the template
     return request.app.templates.TemplateResponse(
@@ -78,6 +74,8 @@ def dm_index(
             "session_user": request.session.get("user"),
             "rows": rows,
             "view": view,
+            "counts": queue.counts(db),
+            "next_cursor": next_cursor,
         }
     )
 
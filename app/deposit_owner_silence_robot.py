@@ -26,12 +26,14 @@ from app.database import SessionLocal
 from app.models import Booking, DepositAuditLog, User
 from app.pay_api import send_deposit_refund
 from app.notifications_api import push_notification
+from app import booking_deadlines
 
 
 # =====================================================
 # Owner dispute window (48 hours after return)
 WINDOW_DELTA = timedelta(hours=48)
 NOW = lambda: datetime.now(timezone.utc)
+DEADLINE_KIND = "owner_silence"
 # =====================================================
 
 
@@ -50,9 +52,11 @@ def get_system_actor_id(db: Session) -> int:
 def find_candidates(db: Session) -> List[Booking]:
     deadline = NOW() - WINDOW_DELTA
 
-    return (
-        db.query(Booking)
-        .filter(
+    # Only bookings whose owner-silence timer has expired
+    return booking_deadlines.scan_due(
+        db,
+        DEADLINE_KIND,
+        filters=(
             Booking.deposit_amount > 0,
             Booking.deposit_refund_sent == False,
 
@@ -73,8 +77,7 @@ def find_candidates(db: Session) -> List[Booking]:
 
             Booking.payment_method == "paypal",
             Booking.payment_provider.isnot(None),
-        )
-        .all()
+        ),
     )
 
 
@@ -85,15 +88,23 @@ def compute_refund_amount(bk: Booking) -> float:
         return 0.0
 
 
-def execute_one(db: Session, bk: Booking) -> Optional[str]:
-    refund_amount = compute_refund_amount(bk)
-    if refund_amount <= 0:
-        return None
-
+def skip_reason(bk: Booking) -> Optional[str]:
+    """Why execute_one would not refund this booking (None: it will)."""
+    if compute_refund_amount(bk) <= 0:
+        return "no_amount"
     capture_id = (bk.payment_provider or "").strip()
     if not capture_id or capture_id.lower() in ("paypal", "sandbox"):
-        print(f"⏭️ Skip booking #{bk.id} (invalid capture_id)")
+        return "invalid_capture_id"
+    return None
+
+
+def execute_one(db: Session, bk: Booking) -> Optional[str]:
+    """Queue the refund; returns its reference, or None when nothing was refunded."""
+    why = skip_reason(bk)
+    if why:
+        print(f"⏭️ Skip booking #{bk.id} ({why})")
         return None
+    refund_amount = compute_refund_amount(bk)
 
     refund_id = send_deposit_refund(
         db=db,
@@ -144,7 +155,10 @@ def run_once():
         items = find_candidates(db)
         print(f"Candidates: {len(items)}")
         for bk in items:
-            execute_one(db, bk)
+            refund_id = execute_one(db, bk)
+            outcome = "refunded" if refund_id else f"skipped:{skip_reason(bk) or 'not_refunded'}"
+            booking_deadlines.mark_processed(db, bk.id, DEADLINE_KIND, outcome)
+        return {"candidates": len(items)}
     finally:
         db.close()
 
@@ -19,6 +19,9 @@ from sqlalchemy import or_, and_
 from app.database import SessionLocal
 from app.models import Booking, DepositAuditLog
 from app.pay_api import send_deposit_refund
+from app import booking_deadlines
+
+DEADLINE_KIND = "deposit_refund"
 
 
 # =========================================================
@@ -34,7 +37,8 @@ def find_candidates(db: Session):
         A) قرار DM موجود
         B) انتهت بدون مشاكل
     """
-    return db.query(Booking).filter(
+    # فقط الحجوزات التي حان موعدها في booking_deadlines
+    return booking_deadlines.scan_due(db, DEADLINE_KIND, filters=(
         Booking.deposit_amount > 0,
         Booking.deposit_refund_sent == False,
         or_(
@@ -47,7 +51,7 @@ def find_candidates(db: Session):
                 Booking.return_check_submitted_at.isnot(None),
             ),
         ),
-    ).all()
+    ))
 
 
 # =========================================================
@@ -74,14 +78,16 @@ def compute_refund_amount(booking: Booking) -> float:
 # تنفيذ Refund حقيقي + تسجيل Log
 # =========================================================
 
-def execute_refund(db: Session, booking: Booking, refund_amount: float):
+def execute_refund(db: Session, booking: Booking, refund_amount: float) -> str:
     """
     - يرسل Refund حقيقي عبر PayPal
     - يتجاهل أي حجز غير صالح
+    Returns the booking_deadlines outcome: "refunded" only when a refund was
+    queued, "skipped:<reason>" otherwise.
     """
 
     if refund_amount <= 0:
-        return
+        return "skipped:no_amount"
 
     # =====================================================
     # 🔒 فلاتر أمان — لا نلمس إلا PayPal مع capture_id حقيقي
@@ -89,12 +95,12 @@ def execute_refund(db: Session, booking: Booking, refund_amount: float):
 
     if booking.payment_method != "paypal":
         print(f"⏭️ Skip booking #{booking.id} (not PayPal)")
-        return
+        return "skipped:not_paypal"
 
     capture_id = booking.payment_provider
     if not capture_id or capture_id.lower() == "paypal":
         print(f"⏭️ Skip booking #{booking.id} (missing PayPal capture_id)")
-        return
+        return "skipped:no_capture_id"
 
     # =====================================================
     # 🔥 إرسال المال فعليًا
@@ -123,6 +129,7 @@ def execute_refund(db: Session, booking: Booking, refund_amount: float):
     )
 
     db.commit()
+    return "refunded"
 
 
 # =========================================================
@@ -147,14 +154,12 @@ def run_once():
                 f"refund={refund}"
             )
 
-            execute_refund(db, b, refund)
+            outcome = execute_refund(db, b, refund)
+            booking_deadlines.mark_processed(db, b.id, DEADLINE_KIND, outcome)
 
         print("Robot finished successfully.")
         print("======================================")
-
-    except Exception as e:
-        print("❌ Robot error:", str(e))
-        raise
+        return {"candidates": len(bookings)}
 
     finally:
         db.close()
@@ -25,12 +25,14 @@ from app.database import SessionLocal
 from app.models import Booking, DepositAuditLog, User, DepositEvidence
 from app.pay_api import send_deposit_refund
 from app.notifications_api import push_notification, notify_admins
+from app import booking_deadlines
 
 
 # =====================================================
 # Owner dispute window (48 hours after return)
 WINDOW_DELTA = timedelta(hours=48)
 NOW = lambda: datetime.now(timezone.utc)
+DEADLINE_KIND = "renter_silence"
 # =====================================================
 
 
@@ -72,43 +74,45 @@ def renter_replied_with_files(db: Session, bk: Booking) -> bool:
 def find_candidates(db: Session) -> List[Booking]:
     deadline = NOW() - WINDOW_DELTA
 
-    rows = db.query(Booking).filter(
-        Booking.deposit_amount > 0,
-
-        Booking.renter_24h_window_opened_at.isnot(None),
-
-        # ❌ no response timestamp
-        Booking.renter_responded_at.is_(None),
-
-        Booking.dm_decision_amount.isnot(None),
-        Booking.dm_decision_final == False,
-
-        Booking.payment_method == "paypal",
-        Booking.deposit_capture_id.isnot(None),
-    ).all()
-
-    valid: List[Booking] = []
-
-    for bk in rows:
+    def expired_and_silent(bk: Booking) -> bool:
         opened_at = bk.renter_24h_window_opened_at
         if not opened_at:
-            continue
+            return False
 
         if opened_at.tzinfo is None:
             opened_at = opened_at.replace(tzinfo=timezone.utc)
 
         # ⏱ window expired
         if opened_at > deadline:
-            continue
+            return False
 
         # ✅ NEW BLOCKER: renter replied with evidence → STOP ROBOT
         if renter_replied_with_files(db, bk):
             print(f"⛔ Skip booking #{bk.id}: renter uploaded evidence")
-            continue
+            return False
 
-        valid.append(bk)
+        return True
 
-    return valid
+    # Only bookings whose renter-silence timer has expired
+    return booking_deadlines.scan_due(
+        db,
+        DEADLINE_KIND,
+        filters=(
+            Booking.deposit_amount > 0,
+
+            Booking.renter_24h_window_opened_at.isnot(None),
+
+            # ❌ no response timestamp
+            Booking.renter_responded_at.is_(None),
+
+            Booking.dm_decision_amount.isnot(None),
+            Booking.dm_decision_final == False,
+
+            Booking.payment_method == "paypal",
+            Booking.deposit_capture_id.isnot(None),
+        ),
+        eligible=expired_and_silent,
+    )
 
 
 def compute_refund_amount(bk: Booking) -> float:
@@ -227,13 +231,21 @@ def run_once():
         print("Window = 1 minute")
         print(f"Candidates found: {len(items)}")
 
+        refund_failures = 0
         for bk in items:
             print(f"- Booking #{bk.id}")
-            execute_one(db, bk)
+            refund_due = compute_refund_amount(bk) > 0
+            refund_id = execute_one(db, bk)
+            outcome = "finalized"
+            if refund_due and not refund_id:
+                refund_failures += 1
+                outcome = "finalized:refund_failed"
+            booking_deadlines.mark_processed(db, bk.id, DEADLINE_KIND, outcome)
             print("  ✅ processed")
 
         print("Robot finished.")
         print("======================================")
+        return {"candidates": len(items), "errors": refund_failures}
 
     finally:
         db.close()
@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends, Request, Form, HTTPException
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 
+from . import payment_ops
 from .database import get_db
 from .models import User, Booking, Item
 from .notifications_api import push_notification
@@ -160,10 +161,7 @@ def dm_decide_compat(
 
     if decision == "release":
         if stripe and getattr(bk, "deposit_hold_intent_id", None):
-            try:
-                stripe.PaymentIntent.cancel(bk.deposit_hold_intent_id)
-            except Exception:
-                pass
+            payment_ops.stripe_cancel(db, bk, bk.deposit_hold_intent_id)
 
         bk.deposit_status = "released"
         bk.updated_at = datetime.utcnow()
@@ -189,30 +187,12 @@ def dm_decide_compat(
     if amount > (bk.hold_deposit_amount or 0):
         amount = bk.hold_deposit_amount or 0
 
-    captured_ok = False
+    # Capturing part of the hold releases the rest; the charge id is stored
+    # on the booking by the payment_ops worker once Stripe confirms.
+    capture_state = "none"
     if stripe and getattr(bk, "deposit_hold_intent_id", None):
-        try:
-            amt_cents = int(amount * 100)
-            pi = stripe.PaymentIntent.capture(
-                bk.deposit_hold_intent_id,
-                amount_to_capture=amt_cents
-            )
-            try:
-                charge_id = (pi.get("latest_charge") or "") if isinstance(pi, dict) else None
-                if charge_id and hasattr(bk, "deposit_capture_id"):
-                    bk.deposit_capture_id = str(charge_id)
-            except Exception:
-                pass
-            captured_ok = True
-
-            try:
-                remaining = (bk.hold_deposit_amount or 0) - (bk.deposit_charged_amount or 0) - amount
-                if remaining > 0:
-                    stripe.PaymentIntent.cancel(bk.deposit_hold_intent_id)
-            except Exception:
-                pass
-        except Exception:
-            captured_ok = False
+        payment_ops.stripe_capture(db, bk, bk.deposit_hold_intent_id, amount)
+        capture_state = "queued"
 
     bk.deposit_charged_amount = (bk.deposit_charged_amount or 0) + amount
     if bk.deposit_charged_amount >= (bk.hold_deposit_amount or 0):
@@ -224,7 +204,7 @@ def dm_decide_compat(
 
     if updated_note:
         updated_note += "\n"
-    updated_note += f"[DM] Withhold {amount}$ . Reason: {reason or '—'} (stripe_ok={captured_ok})"
+    updated_note += f"[DM] Withhold {amount}$ . Reason: {reason or '—'} (stripe={capture_state})"
     bk.owner_return_note = updated_note
 
     db.commit()
@@ -28,6 +28,15 @@ def _normalize_list(value: Optional[Union[str, Iterable[str]]]) -> List[str]:
         value = [value]
     return [v.strip() for v in value if v and v.strip()]
 
+def _build_message(recipients: List[str], subject: str, html_body: str, text_body: Optional[str]) -> MIMEMultipart:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = f"{FROM_NAME} <{FROM_EMAIL}>"
+    msg["To"] = ", ".join(recipients)
+    msg.attach(MIMEText(text_body or "", "plain"))
+    msg.attach(MIMEText(html_body or "", "html"))
+    return msg
+
 def send_email(
     to: Union[str, Iterable[str]],
     subject: str,
@@ -47,10 +56,7 @@ def send_email(
         print("[email_service] ⚠️ No recipient")
         return False
 
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"] = f"{FROM_NAME} <{FROM_EMAIL}>"
-    msg["To"] = ", ".join(recipients)
+    msg = _build_message(recipients, subject, html_body, text_body)
 
     if cc:
         cc_list = _normalize_list(cc)
@@ -61,9 +67,6 @@ def send_email(
     if reply_to:
         msg["Reply-To"] = reply_to
 
-    msg.attach(MIMEText(text_body or "", "plain"))
-    msg.attach(MIMEText(html_body or "", "html"))
-
     try:
         with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20) as server:
             server.starttls()
@@ -81,6 +84,66 @@ def send_email(
         return False
 
 
+# =========================
+# Reusable SMTP session (bulk sends)
+# =========================
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+
+
+class SMTPSession:
+    """
+    One logged-in SMTP connection reused across many send() calls (broadcasts),
+    instead of connect + STARTTLS + LOGIN per message. Reconnects after
+    SMTP_MAX_MESSAGES_PER_CONNECTION messages or when the server drops us, and
+    retries that message once on the fresh connection.
+    Raises smtplib.SMTPRecipientsRefused for a rejected address (permanent).
+    """
+
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+        self._sent_on_conn = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        if not SMTP_USER or not SMTP_PASSWORD:
+            raise RuntimeError("SMTP credentials missing")
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20)
+        server.starttls()
+        server.login(SMTP_USER, SMTP_PASSWORD)
+        self._sent_on_conn = 0
+        return server
+
+    def send(self, to: str, subject: str, html_body: str, text_body: Optional[str] = None) -> None:
+        raw = _build_message([to], subject, html_body, text_body).as_string()
+        for attempt in (1, 2):
+            if self._server is None or self._sent_on_conn >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                self.close()
+                self._server = self._connect()
+            try:
+                self._server.sendmail(FROM_EMAIL, [to], raw)
+                self._sent_on_conn += 1
+                return
+            except smtplib.SMTPRecipientsRefused:
+                raise
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 # Optional test
 if __name__ == "__main__":
     ok = send_email(
@@ -3,19 +3,18 @@ from fastapi import APIRouter, Depends, Request, Form, UploadFile, File
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, or_, and_
-import os, secrets, shutil
+import os
 import unicodedata
 from datetime import date
 from typing import Optional
 
-# Cloudinary (upload images to the cloud)
-import cloudinary
-import cloudinary.uploader
-
-from .database import get_db
+from .database import get_db, get_read_db
 from .models import Item, User, ItemReview, Favorite as _Fav
 from .utils import CATEGORIES, category_label
 from .utils_badges import get_user_badges
+from .utils_images import strip_metadata_inplace
+from . import availability, media_queue
+from .media_queue import queue_derivatives, stage_file
 from .models import Category, Subcategory
 
 router = APIRouter()
@@ -27,6 +26,7 @@ UPLOADS_ROOT = os.environ.get(
 )
 ITEMS_DIR = os.path.join(UPLOADS_ROOT, "items")
 os.makedirs(ITEMS_DIR, exist_ok=True)
+ITEM_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
 
 
 # ================= Currency helpers =================
@@ -273,19 +273,37 @@ def _ext_ok(filename: str) -> bool:
     return ext in [".jpg", ".jpeg", ".png", ".webp"]
 
 
-def _local_public_url(fname: str) -> str:
-    return f"/uploads/items/{fname}"
+def _enqueue_item_uploads(db: Session, it: Item, staged: list, owner_id: int) -> None:
+    """Queue staged item images for Cloudinary; the item keeps local URLs until done."""
+    if not staged:
+        return
+    try:
+        for fpath, local_url in staged:
+            media_queue.enqueue(
+                db, local_url,
+                folder=f"items/{owner_id}",
+                target_table="items",
+                target_id=it.id,
+                local_path=fpath,
+                resource_type="image",
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] item upload enqueue failed: {e}")
 
 @router.get("/items")
 def items_list(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     category: str = None,
     sort: str = None,
     city: str = None,
     lat: float | None = None,
     lng: float | None = None,
     seller: str = None,
+    available_from: str = None,
+    available_to: str = None,
 ):
     # Load DB categories
     categories_db = db.query(Category).order_by(Category.name.asc()).all()
@@ -320,6 +338,11 @@ def items_list(
 
     current_category = category
 
+    # Free for the whole [available_from, available_to) range
+    date_range = availability.parse_range(available_from, available_to)
+    if date_range:
+        q = q.filter(availability.available_between(*date_range))
+
     # Filter by category (by name)
     if category:
         q = q.filter(Item.category == category)
@@ -399,6 +422,8 @@ def items_list(
             "categories": categories_db,
             "current_category": current_category,
             "current_seller": seller,  # ✅ NEW
+            "available_from": date_range[0].isoformat() if date_range else "",
+            "available_to": date_range[1].isoformat() if date_range else "",
             "subcategories": subcategories_db,
             "current_sub": request.query_params.get("sub"),
             "display_currency": disp_cur,
@@ -415,7 +440,7 @@ def items_list(
 # ======================= ITEM DETAIL =========================
 # ============================================================
 @router.get("/items/{item_id}")
-def item_detail(request: Request, item_id: int, db: Session = Depends(get_db)):
+def item_detail(request: Request, item_id: int, db: Session = Depends(get_read_db)):
     # 1) اجلب العنصر من قاعدة البيانات
     item = db.query(Item).get(item_id)
     session_u = request.session.get("user")
@@ -643,16 +668,22 @@ def item_edit_post(
             sub_name = sc.name
     it.subcategory = sub_name
 
-    # Upload new images (optional)
+    # Upload new images (optional) — staged locally, Cloudinary in the background
+    staged = []
     if images:
-        new_list = []
         for img in images:
-            if img and img.filename:
-                up = cloudinary.uploader.upload(img.file, folder=f"items/{u['id']}")
-                url = (up or {}).get("secure_url")
-                if url:
-                    new_list.append(url)
-        if new_list:
+            if not img or not img.filename or not _ext_ok(img.filename):
+                continue
+            try:
+                res = stage_file(img, "items", ITEM_IMAGE_EXTS, prefix=f"{u['id']}_",
+                                 transform=strip_metadata_inplace)
+            except Exception:
+                res = None
+            if res:
+                queue_derivatives(res[0])
+                staged.append(res)
+        if staged:
+            new_list = [url for _, url in staged]
             it.image_urls = new_list
             it.image_path = new_list[0]
 
@@ -663,6 +694,8 @@ def item_edit_post(
 
     db.commit()
 
+    _enqueue_item_uploads(db, it, staged, u["id"])
+
     return RedirectResponse(url="/owner/items", status_code=303)
 
 
@@ -754,48 +787,27 @@ def item_new_post(
     image_urls_list = []
     fallback_image = None  # first image
 
+    staged = []  # (local path, local url) → pushed to Cloudinary in the background
+
     for img in images:
         if not img or not img.filename or not _ext_ok(img.filename):
             continue
 
-        ext = os.path.splitext(img.filename)[1].lower()
-        fname = f"{u['id']}_{secrets.token_hex(8)}{ext}"
-        fpath = os.path.join(ITEMS_DIR, fname)
-
-        uploaded_url = None
-
-        # Upload to Cloudinary
         try:
-            up = cloudinary.uploader.upload(
-                img.file,
-                folder=f"items/{u['id']}",
-                public_id=os.path.splitext(fname)[0],
-                resource_type="image",
-            )
-            uploaded_url = (up or {}).get("secure_url")
+            res = stage_file(img, "items", ITEM_IMAGE_EXTS, prefix=f"{u['id']}_",
+                             transform=strip_metadata_inplace)
         except Exception:
-            uploaded_url = None
-
-        # Local fallback
-        if not uploaded_url:
-            try:
-                img.file.seek(0)
-                with open(fpath, "wb") as f:
-                    shutil.copyfileobj(img.file, f)
-                uploaded_url = _local_public_url(fname)
-            except Exception:
-                uploaded_url = None
+            res = None
+        if not res:
+            continue
 
-        # Store
-        if uploaded_url:
-            image_urls_list.append(uploaded_url)
-            if fallback_image is None:
-                fallback_image = uploaded_url
+        fpath, local_url = res
+        queue_derivatives(fpath)
+        staged.append(res)
 
-        try:
-            img.file.close()
-        except:
-            pass
+        image_urls_list.append(local_url)
+        if fallback_image is None:
+            fallback_image = local_url
 
     # ------------------------------
     # CREATE ITEM
@@ -827,6 +839,8 @@ def item_new_post(
     db.commit()
     db.refresh(it)
 
+    _enqueue_item_uploads(db, it, staged, u["id"])
+
     return RedirectResponse(url=f"/owner/items/{it.id}/submitted",status_code=303)
 
 # ============================================================
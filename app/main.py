@@ -7,6 +7,7 @@ load_dotenv()
 # 2) General settings
 import os
 import random
+import time
 import difflib
 from datetime import date
 from typing import Optional
@@ -36,7 +37,12 @@ from starlette.middleware.sessions import SessionMiddleware
 from sqlalchemy import func, or_, text
 from sqlalchemy.orm import Session
 
-from .database import Base, engine, SessionLocal, get_db
+from .database import Base, engine, SessionLocal, get_db, invalidate_table_columns
+from .database import start_request_tracking, stop_request_tracking
+from .database import (
+    DB_REPLICA_STICKY_SECONDS, PRIMARY_UNTIL_KEY, get_read_db, replica_engine,
+    start_write_tracking, stop_write_tracking,
+)
 from .models import User, Item
 from .utils import CATEGORIES, category_label
 # 5) Routers
@@ -66,6 +72,7 @@ from .routers.me import router as me_router
 from .routes_home import router as home_router
 from .routes_deposits import router as deposits_router          # DM
 from .routes_evidence import router as evidence_router          # Deposit evidences
+from .routes_evidence import MAX_REQUEST_BYTES as EVIDENCE_MAX_REQUEST_BYTES
 from .cron_auto_release import router as cron_router            # Manual trigger (test/admin)
 from .debug_email import router as debug_email_router
 from .routes_metrics import router as metrics_router
@@ -87,15 +94,43 @@ from .routes_md_chatbot import router as md_chatbot_router
 from .routes_mod_chatbot import router as mod_chatbot_router
 from .payout_settings import router as payout_settings_router
 from .routes_admin_payouts import router as admin_payouts_router, front_router as payouts_front_router
+from .routes_media import router as media_router
+from . import media_queue
+from . import scheduler
+from . import db_metrics
+from . import paypal_client
+from . import payment_ops
+from . import staff_queues
+from . import user_directory
+from . import broadcasts
+from . import metrics_buffer
+from . import metrics_rollup
+from . import presence
+from . import ticket_events
+from . import booking_deadlines
+from . import availability
+from . import platform_wallet
+from .utils_images import sized_url, srcset as _media_srcset
+from .utils_uploads import UploadBodyLimit
 
 
 
 # -----------------------------------------------------------------------------
 # Create the app
 # -----------------------------------------------------------------------------
-app = FastAPI()
+app = FastAPI(dependencies=[Depends(db_metrics.handler_scope)])   # see app/db_metrics.py
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+# -----------------------------------------------------------------------------
+# Evidence upload body cap (checked before the multipart form is parsed;
+# 1 MB slack for the boundaries and the comment field)
+# -----------------------------------------------------------------------------
+app.add_middleware(
+    UploadBodyLimit,
+    path_pattern=r"^/deposits/\d+/evidence/upload/?$",
+    max_bytes=EVIDENCE_MAX_REQUEST_BYTES + 1024 * 1024,
+)
+
 @app.get("/whoami")
 def whoami(request: Request, db: Session = Depends(get_db)):
     sess = request.session.get("user")
@@ -110,6 +145,21 @@ def whoami(request: Request, db: Session = Depends(get_db)):
         "status": sess.get("status"),
     }
 
+# -----------------------------------------------------------------------------
+# Read-your-writes for the read replica (registered before SessionMiddleware so
+# it runs inside it and can write request.session; see database.get_read_db)
+# -----------------------------------------------------------------------------
+@app.middleware("http")
+async def replica_stickiness(request: Request, call_next):
+    token = start_write_tracking()
+    try:
+        response = await call_next(request)
+    finally:
+        wrote = stop_write_tracking(token)
+    if wrote and replica_engine is not None and _has_session(request):
+        request.session[PRIMARY_UNTIL_KEY] = time.time() + DB_REPLICA_STICKY_SECONDS
+    return response
+
 # -----------------------------------------------------------------------------
 # Sessions (cookies are secure only in production) + set domain
 # -----------------------------------------------------------------------------
@@ -170,6 +220,8 @@ async def geo_session_middleware(request: Request, call_next):
     EXEMPT_PREFIXES = (
         "/static/",
         "/uploads/",
+        "/private/",
+        "/media/",
         "/webhooks/",
         "/favicon",
         "/manifest",
@@ -310,14 +362,11 @@ def fx_rate(base: str, quote: str) -> float:
     ترجع فقط سعر الصرف (بدون ضرب مبلغ)
     تُستعمل داخل Jinja: fx_rate('CAD','USD')
     """
-    db = SessionLocal()
     try:
-        r = _fetch_rate(db, (base or "CAD").upper(), (quote or "CAD").upper())
+        r = _cached_rate((base or "CAD").upper(), (quote or "CAD").upper())
         return float(r) if r else 1.0
     except Exception:
         return 1.0
-    finally:
-        db.close()
 
 templates.env.globals["fx_rate"] = fx_rate
 
@@ -326,16 +375,23 @@ templates.env.globals["display_currency"] = lambda request: getattr(request.stat
 
 
 
-def media_url(path: str | None) -> str:
-    """Returns the Cloudinary URL as-is, or prefixes a local path with '/'."""
+def media_url(path: str | None, size: str | None = None, fill: bool = False) -> str:
+    """
+    Returns the Cloudinary URL as-is, or prefixes a local path with '/'.
+    With a size ('thumb' / 'card' / 'detail') returns the resized derivative URL
+    (fill=True: square Cloudinary crop for fixed-ratio cards).
+    """
     if not path:
         return ""
+    if size:
+        return sized_url(path, size, fill=fill)
     p = str(path).strip()
     if p.startswith("http://") or p.startswith("https://"):
         return p
     return p if p.startswith("/") else "/" + p
 
 app.templates.env.filters["media_url"] = media_url
+app.templates.env.filters["media_srcset"] = _media_srcset
 
 # -----------------------------------------------------------------------------
 # Currencies (NEW)
@@ -497,11 +553,35 @@ def _fetch_rate(db: Session, base: str, quote: str) -> Optional[float]:
         return float(r2[0])
     return None
 
+# Rates for template helpers (fx_rate / |convert), cached per process so a page
+# rendering many prices doesn't check out a connection per call.
+FX_RATE_CACHE_SECONDS = float(os.getenv("FX_RATE_CACHE_SECONDS", "600"))
+_fx_rate_cache: dict[tuple[str, str], tuple[float, Optional[float]]] = {}
+
+def _cached_rate(base: str, quote: str) -> Optional[float]:
+    if base == quote:
+        return 1.0
+    key = (base, quote)
+    hit = _fx_rate_cache.get(key)
+    now = time.monotonic()
+    if hit and now - hit[0] < FX_RATE_CACHE_SECONDS:
+        return hit[1]
+    db = SessionLocal()
+    try:
+        r = _fetch_rate(db, base, quote)
+    finally:
+        db.close()
+    _fx_rate_cache[key] = (now, r)
+    return r
+
 def fx_convert(db: Session, amount: float | int | None, base: str, quote: str) -> float:
     """
     يحوّل مبلغ من base إلى quote باستخدام fx_rates.
     إن لم يجد سعراً مباشراً، يحاول via CAD كجسر (base→CAD→quote) للتغطية.
     """
+    return _convert_with(lambda b, q: _fetch_rate(db, b, q), amount, base, quote)
+
+def _convert_with(fetch, amount: float | int | None, base: str, quote: str) -> float:
     try:
         amt = float(amount or 0)
     except Exception:
@@ -512,14 +592,14 @@ def fx_convert(db: Session, amount: float | int | None, base: str, quote: str) -
         return amt
 
     # مباشرة
-    r = _fetch_rate(db, base, quote)
+    r = fetch(base, quote)
     if r:
         return amt * r
 
     # جسر عبر CAD
     if base != "CAD" and quote != "CAD":
-        r1 = _fetch_rate(db, base, "CAD")
-        r2 = _fetch_rate(db, "CAD", quote)
+        r1 = fetch(base, "CAD")
+        r2 = fetch("CAD", quote)
         if r1 and r2:
             return amt * r1 * r2
 
@@ -527,11 +607,7 @@ def fx_convert(db: Session, amount: float | int | None, base: str, quote: str) -
     return amt
 
 def _convert_filter(amount, base, quote):
-    db = SessionLocal()
-    try:
-        return fx_convert(db, amount, (base or "CAD"), (quote or "CAD"))
-    finally:
-        db.close()
+    return _convert_with(_cached_rate, amount, (base or "CAD"), (quote or "CAD"))
 
 def _format_money(amount: float | int, cur: str) -> str:
     ...
@@ -562,6 +638,7 @@ app.state.supported_currencies = SUPPORTED_CURRENCIES
 # Database
 # -----------------------------------------------------------------------------
 Base.metadata.create_all(bind=engine)
+invalidate_table_columns()
 
 def ensure_sqlite_columns():
     """
@@ -700,6 +777,7 @@ def ensure_support_ticket_columns():
 ensure_sqlite_columns()
 ensure_users_columns()
 ensure_support_ticket_columns()   # ⬅️ Now defined
+invalidate_table_columns()  # columns may have been added above
 
 def seed_admin():
     db = SessionLocal()
@@ -821,6 +899,13 @@ app.include_router(debug_email_router)
 app.include_router(deposits_router)
 app.include_router(evidence_router)
 app.include_router(cron_router)
+app.include_router(scheduler.router)
+app.include_router(db_metrics.router)
+app.include_router(paypal_client.router)
+app.include_router(payment_ops.router)
+app.include_router(broadcasts.router)
+app.include_router(presence.router)
+app.include_router(ticket_events.router)
 app.include_router(reports_router)
 app.include_router(admin_reports_router)
 app.include_router(support_router)
@@ -839,6 +924,7 @@ app.include_router(mod_chatbot_router)
 app.include_router(payout_settings_router)
 app.include_router(admin_payouts_router)
 app.include_router(payouts_front_router)
+app.include_router(media_router)
 
 # -----------------------------------------------------------------------------
 # Legacy path → redirect to the new reports page
@@ -860,7 +946,7 @@ def _cat_code(cat) -> str:
 @app.get("/")
 def home(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     category: str | None = None,
     q: str | None = None,
     city: str | None = None,
@@ -1029,6 +1115,19 @@ async def sync_user_flags(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# -----------------------------------------------------------------------------
+# DB pool tracking (outermost middleware: counts the connections every layer
+# below checks out for this request; see app/db_metrics.py)
+# -----------------------------------------------------------------------------
+@app.middleware("http")
+async def db_pool_tracking(request: Request, call_next):
+    token = start_request_tracking(request.url.path)
+    try:
+        return await call_next(request)
+    finally:
+        tracker = stop_request_tracking(token)
+        db_metrics.record_request(db_metrics.route_key(request), tracker)
+
 # -----------------------------------------------------------------------------
 # Currency routes (NEW)
 # -----------------------------------------------------------------------------
@@ -1139,6 +1238,152 @@ def _startup_fx_seed():
     _fx_ensure_daily_sync()
 
 
+@app.on_event("startup")
+def _startup_media_queue():
+    media_queue.start_worker()
+
+
+@app.on_event("shutdown")
+def _shutdown_media_queue():
+    media_queue.stop_worker()
+
+
+@app.on_event("startup")
+def _startup_payment_ops():
+    payment_ops.start_worker()
+
+
+@app.on_event("shutdown")
+def _shutdown_payment_ops():
+    payment_ops.stop_worker()
+
+
+@app.on_event("startup")
+def _startup_broadcasts():
+    broadcasts.start_worker()
+
+
+@app.on_event("shutdown")
+def _shutdown_broadcasts():
+    broadcasts.stop_worker()
+
+
+@app.on_event("startup")
+def _startup_metrics_buffer():
+    metrics_buffer.start()
+
+
+@app.on_event("startup")
+def _startup_metrics_rollup():
+    # Raw visit days not rolled up yet (first deploy / scheduler disabled)
+    metrics_rollup.start_backfill()
+
+
+@app.on_event("shutdown")
+def _shutdown_metrics_buffer():
+    # Write beacons still buffered in memory
+    metrics_buffer.stop()
+
+
+@app.on_event("startup")
+def _startup_presence():
+    presence.start()
+
+
+@app.on_event("shutdown")
+def _shutdown_presence():
+    presence.stop()
+
+
+@app.on_event("startup")
+def _startup_booking_deadlines():
+    # One-time fill for bookings created before booking_deadlines existed
+    db = SessionLocal()
+    try:
+        n = booking_deadlines.backfill_if_empty(db)
+        if n:
+            print(f"[INFO] booking_deadlines backfilled: {n}")
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] booking_deadlines backfill failed: {e}")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def _startup_availability():
+    db = SessionLocal()
+    try:
+        n = availability.backfill_if_empty(db)
+        if n:
+            print(f"[INFO] item_reservations backfilled: {n}")
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] item_reservations backfill failed: {e}")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def _startup_staff_queues():
+    # Non-null queue / sort keys and the composite queue indexes
+    db = SessionLocal()
+    try:
+        fixed = staff_queues.normalize(db)
+        if fixed:
+            print(f"[INFO] staff queues normalized: {fixed}")
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] staff queue normalize failed: {e}")
+    finally:
+        db.close()
+    staff_queues.ensure_indexes()
+
+
+@app.on_event("startup")
+def _startup_user_directory():
+    # Non-null created_at (keyset key) and the /admin directory indexes
+    db = SessionLocal()
+    try:
+        fixed = user_directory.normalize(db)
+        if fixed:
+            print(f"[INFO] users.created_at backfilled: {fixed}")
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] user directory normalize failed: {e}")
+    finally:
+        db.close()
+    user_directory.ensure_indexes()
+
+
+@app.on_event("startup")
+def _startup_platform_wallet():
+    # Opening snapshot from the legacy platform_balance row, before any new ledger row
+    db = SessionLocal()
+    try:
+        platform_wallet.ensure_opening_snapshot(db)
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] platform wallet opening snapshot failed: {e}")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def _startup_scheduler():
+    scheduler.start()
+
+
+@app.on_event("shutdown")
+def _shutdown_scheduler():
+    scheduler.stop()
+
+
+@app.on_event("shutdown")
+def _shutdown_paypal_client():
+    paypal_client.close()
+
+
 from fastapi.responses import FileResponse
 
 @app.get("/sitemap.xml")
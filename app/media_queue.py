@@ -0,0 +1,360 @@
+# app/media_queue.py
+"""
+Background Cloudinary upload queue.
+
+Request handlers write the file to local staging under /uploads and record a
+`media_uploads` row pointing at the DB row that references it. A small worker
+pool pushes pending rows to Cloudinary (in parallel, with retries/backoff) and,
+once the remote URL exists, swaps it into the referencing column. Until then
+the local /uploads URL keeps being served.
+
+Identity documents are staged with private=True: they go to PRIVATE_UPLOADS_DIR
+(outside the public /uploads mount, and outside the blob store that lives
+under it) and get a /private/... URL that only profiles.private_document
+serves, to the owner and to admins/moderators.
+
+queue_derivatives() encodes the responsive sizes of a staged image on a small
+pool of its own (no Cloudinary needed), so the upload request doesn't wait for
+them; /media still encodes a missing size on first hit.
+"""
+from __future__ import annotations
+
+import os
+import secrets
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import cloudinary
+import cloudinary.uploader
+from fastapi import UploadFile
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, table_columns
+from .models import Item, MediaUpload
+from .utils_images import generate_derivatives
+from .utils_uploads import save_upload_file
+
+# ================= Settings =================
+APP_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+UPLOADS_ROOT = os.environ.get("UPLOADS_DIR", os.path.join(APP_ROOT, "uploads"))
+PRIVATE_UPLOADS_ROOT = os.environ.get("PRIVATE_UPLOADS_DIR", os.path.join(APP_ROOT, "private_uploads"))
+LOCAL_PREFIXES = ("/uploads/", "/private/")
+
+MEDIA_UPLOAD_WORKERS = int(os.getenv("MEDIA_UPLOAD_WORKERS", "4"))
+MEDIA_UPLOAD_MAX_ATTEMPTS = int(os.getenv("MEDIA_UPLOAD_MAX_ATTEMPTS", "5"))
+MEDIA_UPLOAD_POLL_SECONDS = float(os.getenv("MEDIA_UPLOAD_POLL_SECONDS", "15"))
+# Rows stuck in "uploading" longer than this (worker crash) are retried
+MEDIA_UPLOAD_STALE_MINUTES = int(os.getenv("MEDIA_UPLOAD_STALE_MINUTES", "10"))
+MEDIA_DERIVE_WORKERS = int(os.getenv("MEDIA_DERIVE_WORKERS", "2"))
+
+# table -> (key column, string columns that may hold the staged URL)
+# items.image_urls is an array column and is handled through the ORM.
+TARGETS = {
+    "items": ("id", ("image_path",)),
+    "users": ("id", ("avatar_path",)),
+    "documents": ("user_id", ("file_front_path", "file_back_path")),
+    "deposit_evidences": ("booking_id", ("file_path",)),
+}
+
+
+def cloudinary_configured() -> bool:
+    cfg = cloudinary.config()
+    return bool(cfg.cloud_name and cfg.api_key and cfg.api_secret)
+
+
+# ================= Staging (request thread) =================
+def stage_file(
+    fileobj: UploadFile | None,
+    subdir: str,
+    allow_exts: Iterable[str],
+    *,
+    prefix: str = "",
+    transform: Optional[Callable[[Path], None]] = None,
+    private: bool = False,
+) -> Optional[tuple[str, str]]:
+    """
+    Save an UploadFile under uploads/<subdir>/ (deduplicated through the blob
+    store) and return (absolute path, public URL). `transform` runs on the
+    bytes before they are stored (e.g. EXIF stripping).
+    private=True stores it under PRIVATE_UPLOADS_DIR/<subdir>/ instead (no
+    blob store) and returns a /private/<subdir>/<name> URL.
+    Returns None if there is no file or the extension is not allowed.
+    """
+    if not fileobj or not fileobj.filename:
+        return None
+    ext = os.path.splitext(fileobj.filename)[1].lower()
+    if ext not in set(allow_exts):
+        return None
+
+    root = PRIVATE_UPLOADS_ROOT if private else UPLOADS_ROOT
+    folder = os.path.join(root, subdir)
+    os.makedirs(folder, exist_ok=True)
+    fname = f"{prefix}{secrets.token_hex(10)}{ext}"
+    fpath = os.path.join(folder, fname)
+
+    try:
+        fileobj.file.seek(0)
+    except Exception:
+        pass
+    if private:
+        _save_private(fileobj.file, fpath, transform)
+    else:
+        save_upload_file(fileobj.file, Path(fpath), transform=transform)
+    try:
+        fileobj.file.close()
+    except Exception:
+        pass
+
+    rel = os.path.relpath(fpath, root).replace(os.sep, "/")
+    return fpath, f"/{'private' if private else 'uploads'}/{rel}"
+
+
+def _save_private(src, fpath: str, transform: Optional[Callable[[Path], None]]) -> None:
+    tmp = f"{fpath}.part"
+    try:
+        with open(tmp, "wb") as out:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+        if transform:
+            transform(Path(tmp))
+        os.replace(tmp, fpath)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+        raise
+
+
+def local_path_for(local_url: str) -> str:
+    """/uploads/items/x.jpg → <UPLOADS_ROOT>/items/x.jpg, /private/ids/x.pdf → <PRIVATE_UPLOADS_ROOT>/ids/x.pdf"""
+    rel = (local_url or "").lstrip("/")
+    root = UPLOADS_ROOT
+    if rel.startswith("uploads/"):
+        rel = rel[len("uploads/"):]
+    elif rel.startswith("private/"):
+        rel = rel[len("private/"):]
+        root = PRIVATE_UPLOADS_ROOT
+    return os.path.join(root, *rel.split("/"))
+
+
+def private_path_for(local_url: str) -> Optional[str]:
+    """Disk path of a /private/... URL, None if it is not one or escapes the private root."""
+    if not (local_url or "").startswith("/private/"):
+        return None
+    root = os.path.realpath(PRIVATE_UPLOADS_ROOT)
+    path = os.path.realpath(local_path_for(local_url))
+    return path if path.startswith(root + os.sep) else None
+
+
+def enqueue(
+    db: Session,
+    local_url: Optional[str],
+    *,
+    folder: str,
+    target_table: str,
+    target_id: int,
+    local_path: Optional[str] = None,
+    resource_type: Optional[str] = None,
+) -> Optional[MediaUpload]:
+    """
+    Add a pending upload to the caller's session. It is committed with the
+    caller's transaction, and the worker is woken right after that commit.
+    Non-local URLs (already remote) are ignored.
+    """
+    if target_table not in TARGETS:
+        raise ValueError(f"unknown media target table: {target_table}")
+    if not local_url or not local_url.startswith(LOCAL_PREFIXES):
+        return None
+    local_path = local_path or local_path_for(local_url)
+    if not resource_type:
+        resource_type = "raw" if local_path.lower().endswith(".pdf") else "auto"
+    job = MediaUpload(
+        local_url=local_url,
+        local_path=local_path,
+        folder=folder,
+        public_id=os.path.splitext(os.path.basename(local_path))[0],
+        resource_type=resource_type,
+        target_table=target_table,
+        target_id=int(target_id),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(job)
+    if not db.info.get("media_queue_kick"):
+        db.info["media_queue_kick"] = True
+
+        def _after_commit(_session):
+            _session.info.pop("media_queue_kick", None)
+            kick()
+
+        event.listen(db, "after_commit", _after_commit, once=True)
+    return job
+
+
+# ================= Derivatives =================
+_derive_executor: Optional[ThreadPoolExecutor] = None
+_derive_guard = threading.Lock()
+
+
+def queue_derivatives(path: str | Path) -> None:
+    """Encode every size/format of a staged image in the background."""
+    global _derive_executor
+    with _derive_guard:
+        if _derive_executor is None:
+            _derive_executor = ThreadPoolExecutor(
+                max_workers=max(1, MEDIA_DERIVE_WORKERS), thread_name_prefix="media-derive"
+            )
+        try:
+            _derive_executor.submit(generate_derivatives, path)
+        except RuntimeError as e:  # interpreter / pool shutting down
+            print(f"[WARN] image derivatives not queued for {path}: {e}")
+
+
+# ================= Worker =================
+_executor: Optional[ThreadPoolExecutor] = None
+_wake = threading.Event()
+_stop = threading.Event()
+_dispatcher: Optional[threading.Thread] = None
+
+
+def kick() -> None:
+    """Wake the dispatcher so freshly committed jobs start immediately."""
+    _wake.set()
+
+
+def _claim_due(limit: int) -> list[int]:
+    """Atomically flip due pending rows to 'uploading' and return their ids."""
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=MEDIA_UPLOAD_STALE_MINUTES)
+    db = SessionLocal()
+    try:
+        db.query(MediaUpload).filter(
+            MediaUpload.status == "uploading",
+            MediaUpload.updated_at < stale,
+        ).update({"status": "pending"}, synchronize_session=False)
+        db.commit()
+
+        ids = [
+            r.id for r in db.query(MediaUpload.id)
+            .filter(MediaUpload.status == "pending", MediaUpload.next_attempt_at <= now)
+            .order_by(MediaUpload.id.asc())
+            .limit(limit)
+            .all()
+        ]
+        claimed: list[int] = []
+        for job_id in ids:
+            n = db.query(MediaUpload).filter(
+                MediaUpload.id == job_id, MediaUpload.status == "pending"
+            ).update({"status": "uploading", "updated_at": now}, synchronize_session=False)
+            if n:
+                claimed.append(job_id)
+        db.commit()
+        return claimed
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] media_queue claim failed: {e}")
+        return []
+    finally:
+        db.close()
+
+
+def _swap_references(db: Session, job: MediaUpload, remote: str) -> None:
+    """Replace job.local_url with the remote URL in the row(s) that reference it."""
+    key_col, cols = TARGETS[job.target_table]
+    for col in cols:
+        if col not in table_columns(job.target_table):
+            continue
+        db.execute(
+            text(
+                f"UPDATE {job.target_table} SET {col} = :remote "
+                f"WHERE {key_col} = :kid AND {col} = :local"
+            ),
+            {"remote": remote, "kid": job.target_id, "local": job.local_url},
+        )
+    if job.target_table == "items":
+        it = db.get(Item, job.target_id)
+        urls = getattr(it, "image_urls", None) if it else None
+        if isinstance(urls, list) and job.local_url in urls:
+            it.image_urls = [remote if u == job.local_url else u for u in urls]
+
+
+def _process(job_id: int) -> None:
+    db = SessionLocal()
+    try:
+        job = db.get(MediaUpload, job_id)
+        if not job or job.status != "uploading":
+            return
+        try:
+            up = cloudinary.uploader.upload(
+                job.local_path,
+                folder=job.folder,
+                public_id=job.public_id,
+                resource_type=job.resource_type or "auto",
+                overwrite=True,
+            )
+            remote = (up or {}).get("secure_url") or (up or {}).get("url")
+            if not remote:
+                raise RuntimeError("cloudinary returned no url")
+        except Exception as e:
+            job.attempts = (job.attempts or 0) + 1
+            job.last_error = str(e)[:1000]
+            if job.attempts >= MEDIA_UPLOAD_MAX_ATTEMPTS:
+                job.status = "failed"
+            else:
+                job.status = "pending"
+                job.next_attempt_at = datetime.utcnow() + timedelta(seconds=30 * (2 ** (job.attempts - 1)))
+            db.commit()
+            return
+
+        _swap_references(db, job, remote)
+        job.remote_url = remote
+        job.status = "done"
+        job.attempts = (job.attempts or 0) + 1
+        job.last_error = None
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] media_queue job {job_id} failed: {e}")
+    finally:
+        db.close()
+
+
+def _dispatch_loop() -> None:
+    while not _stop.is_set():
+        _wake.clear()
+        for job_id in _claim_due(MEDIA_UPLOAD_WORKERS * 4):
+            _executor.submit(_process, job_id)
+        _wake.wait(MEDIA_UPLOAD_POLL_SECONDS)
+
+
+def start_worker() -> bool:
+    """Start the dispatcher + upload pool (no-op without Cloudinary credentials)."""
+    global _executor, _dispatcher
+    if _dispatcher and _dispatcher.is_alive():
+        return True
+    if not cloudinary_configured():
+        print("[INFO] media upload queue idle (Cloudinary not configured)")
+        return False
+    _stop.clear()
+    _executor = ThreadPoolExecutor(max_workers=MEDIA_UPLOAD_WORKERS, thread_name_prefix="media-upload")
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="media-upload-dispatch", daemon=True)
+    _dispatcher.start()
+    return True
+
+
+def stop_worker() -> None:
+    global _derive_executor
+    _stop.set()
+    _wake.set()
+    if _executor:
+        _executor.shutdown(wait=False)
+    with _derive_guard:
+        if _derive_executor:
+            _derive_executor.shutdown(wait=False)
+            _derive_executor = None
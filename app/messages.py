@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime
 
+from . import presence
 from .database import get_db
 from .models import MessageThread, Message, User, Item, SupportTicket
 
@@ -140,6 +141,7 @@ def inbox(request: Request, db: Session = Depends(get_db)):
             "other_verified": other_verified,
             "other_avatar": other_avatar,
             "other_created_iso": other_created_iso,
+            "other_online": presence.is_online(other_id),
             "last_message_text": last_text,
         })
 
@@ -300,6 +302,7 @@ def thread_view(thread_id: int, request: Request, db: Session = Depends(get_db))
             "messages": msgs,
             "other": other,
             "other_avatar": other_avatar,
+            "other_online": presence.is_online(other_id),
             "item_title": item_title,
             "item_image": item_image,
             "session_user": u,
@@ -0,0 +1,205 @@
+# app/metrics_buffer.py
+"""
+In-memory ingestion buffer for the traffic beacons (/api/metrics/track and
+/api/metrics/heartbeat, sent by every page of base.html).
+
+The handlers only call record_visit() / record_heartbeat(), which take a lock
+and touch a few dicts — no DB session, no commit. A flusher thread writes
+everything every METRICS_FLUSH_SECONDS (or as soon as METRICS_FLUSH_VISITS
+visits are waiting):
+
+- visits: one multi-row INSERT;
+- sessions: heartbeats are coalesced per session_id (last value wins), then
+  upserted with one INSERT ... ON CONFLICT DO UPDATE per flush.
+
+Every beacon also touches app/presence.py, which answers "online now" from
+memory, so a heartbeat no longer runs COUNT(*) over online_sessions.
+
+If a flush fails the batch is put back (bounded by METRICS_MAX_BUFFERED;
+the oldest visits are dropped beyond that) and retried on the next tick.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import func, insert
+
+from . import presence
+from .database import SessionLocal, engine
+from .models_metrics import OnlineSession, Visit
+
+# ================= Settings =================
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+METRICS_FLUSH_VISITS = int(os.getenv("METRICS_FLUSH_VISITS", "500"))
+METRICS_MAX_BUFFERED = int(os.getenv("METRICS_MAX_BUFFERED", "50000"))
+
+
+# ================= Buffer =================
+_lock = threading.Lock()
+_visits: list[dict] = []
+_sessions: dict[str, dict] = {}               # session_id -> latest state (coalesced)
+_stats = {"visits": 0, "heartbeats": 0, "flushes": 0, "rows_written": 0, "dropped": 0, "errors": 0}
+
+
+def _touch(session_id: str, user_id: Optional[int], ip: str, ua: str, now: datetime) -> None:
+    # caller holds _lock
+    s = _sessions.get(session_id)
+    if s is None:
+        _sessions[session_id] = {
+            "session_id": session_id, "user_id": user_id, "ip": ip, "user_agent": ua,
+            "first_seen": now, "last_seen": now,
+        }
+    else:
+        s["last_seen"] = now
+        s["ip"] = ip
+        s["user_agent"] = ua
+        if user_id:
+            s["user_id"] = user_id
+
+
+def record_visit(session_id: str, user_id: Optional[int], ip: str, ua: str) -> None:
+    now = datetime.utcnow()
+    today = date.today()  # same local day the Visit column defaults use
+    with _lock:
+        _visits.append({
+            "session_id": session_id, "user_id": user_id, "ip": ip, "user_agent": ua,
+            "visited_at": now, "day": today, "year": today.year, "month": today.month,
+        })
+        _touch(session_id, user_id, ip, ua, now)
+        _stats["visits"] += 1
+        full = len(_visits) >= METRICS_FLUSH_VISITS
+    presence.touch(session_id, user_id)
+    if full:
+        _wake.set()
+
+
+def record_heartbeat(session_id: str, user_id: Optional[int], ip: str, ua: str) -> None:
+    with _lock:
+        _touch(session_id, user_id, ip, ua, datetime.utcnow())
+        _stats["heartbeats"] += 1
+    presence.touch(session_id, user_id)
+
+
+def stats() -> dict:
+    with _lock:
+        return {**_stats, "pending_visits": len(_visits), "pending_sessions": len(_sessions)}
+
+
+# ================= Flush =================
+def _upsert_sessions(conn, rows: list[dict]) -> None:
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    if dialect_insert is None:
+        # No ON CONFLICT: update, then insert whatever did not exist yet
+        t = OnlineSession.__table__
+        for r in rows:
+            n = conn.execute(t.update().where(t.c.session_id == r["session_id"]).values(
+                last_seen=r["last_seen"], ip=r["ip"], user_agent=r["user_agent"],
+                user_id=func.coalesce(r["user_id"], t.c.user_id),
+            )).rowcount
+            if not n:
+                conn.execute(insert(t).values(**r))
+        return
+
+    stmt = dialect_insert(OnlineSession.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OnlineSession.session_id],
+        set_={
+            "last_seen": stmt.excluded.last_seen,
+            "ip": stmt.excluded.ip,
+            "user_agent": stmt.excluded.user_agent,
+            "user_id": func.coalesce(stmt.excluded.user_id, OnlineSession.user_id),
+        },
+    )
+    conn.execute(stmt, rows)
+
+
+def flush() -> int:
+    """Write buffered visits and session state; returns rows written."""
+    with _lock:
+        visits, sessions = _visits[:], list(_sessions.values())
+        _visits.clear()
+        _sessions.clear()
+    if not visits and not sessions:
+        return 0
+
+    db = SessionLocal()
+    try:
+        conn = db.connection()
+        if visits:
+            conn.execute(insert(Visit.__table__), visits)
+        if sessions:
+            _upsert_sessions(conn, sessions)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        _requeue(visits, sessions)
+        with _lock:
+            _stats["errors"] += 1
+        print(f"[WARN] metrics flush failed ({len(visits)} visits, {len(sessions)} sessions): {e}")
+        return 0
+    finally:
+        db.close()
+
+    with _lock:
+        _stats["flushes"] += 1
+        _stats["rows_written"] += len(visits) + len(sessions)
+    return len(visits) + len(sessions)
+
+
+def _requeue(visits: list[dict], sessions: list[dict]) -> None:
+    with _lock:
+        _visits[:0] = visits
+        overflow = len(_visits) - METRICS_MAX_BUFFERED
+        if overflow > 0:
+            del _visits[:overflow]
+            _stats["dropped"] += overflow
+        for s in sessions:
+            newer = _sessions.get(s["session_id"])
+            if newer is None:
+                _sessions[s["session_id"]] = s
+            else:
+                newer["first_seen"] = s["first_seen"]
+                if not newer.get("user_id"):
+                    newer["user_id"] = s.get("user_id")
+
+
+# ================= Flusher thread =================
+_wake = threading.Event()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _loop() -> None:
+    while not _stop.is_set():
+        _wake.wait(METRICS_FLUSH_SECONDS)
+        _wake.clear()
+        flush()
+
+
+def start() -> bool:
+    global _thread
+    if _thread and _thread.is_alive():
+        return True
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="metrics-flush", daemon=True)
+    _thread.start()
+    return True
+
+
+def stop() -> None:
+    """Stop the flusher and write what is still buffered."""
+    _stop.set()
+    _wake.set()
+    if _thread:
+        _thread.join(timeout=METRICS_FLUSH_SECONDS + 5)
+    flush()
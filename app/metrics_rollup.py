@@ -0,0 +1,219 @@
+# app/metrics_rollup.py
+"""
+Pre-aggregated visit counts for the admin metrics dashboard.
+
+The scheduler (register_default_jobs) runs:
+  metrics_rollup     rollup_tick()  — recompute visit_daily for today, yesterday
+                                      and any raw day not rolled up yet, then
+                                      the visit_monthly rows of those months;
+  visits_retention   prune_tick()   — delete raw `visits` older than
+                                      VISITS_RETENTION_DAYS (only days already
+                                      rolled up), in batches.
+
+Each daily row stores the exact distinct-session count plus a HyperLogLog
+sketch of the session ids (HLL_PRECISION=12: 4 KB, ~1.6% error). Months are
+the merge of their days' sketches and the year is the merge of at most 12
+monthly sketches, so metrics_summary / daily_chart read a handful of rows no
+matter how much history there is, and still work after raw visits are pruned.
+
+refresh_today() recomputes only today's row when it is older than
+METRICS_ROLLUP_MAX_AGE_SECONDS, so the dashboard stays current when the
+scheduler is disabled (cost bounded by one day of visits); start_backfill()
+rolls up older raw days once at startup.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models_metrics import Visit, VisitDaily, VisitMonthly
+
+# ================= Settings =================
+VISITS_RETENTION_DAYS = int(os.getenv("VISITS_RETENTION_DAYS", "90"))
+VISITS_PRUNE_BATCH = int(os.getenv("VISITS_PRUNE_BATCH", "5000"))
+METRICS_ROLLUP_MAX_AGE_SECONDS = int(os.getenv("METRICS_ROLLUP_MAX_AGE_SECONDS", "300"))
+
+HLL_PRECISION = 12
+_HLL_M = 1 << HLL_PRECISION
+
+
+# ================= HyperLogLog =================
+def hll_new() -> bytearray:
+    return bytearray(_HLL_M)
+
+
+def hll_add(reg: bytearray, value: str) -> None:
+    h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+    idx = h >> (64 - HLL_PRECISION)
+    rest = h & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    if rank > reg[idx]:
+        reg[idx] = rank
+
+
+def hll_merge(sketches: Iterable[Optional[bytes]]) -> bytearray:
+    out = hll_new()
+    for s in sketches:
+        if s and len(s) == _HLL_M:
+            out = bytearray(map(max, out, s))
+    return out
+
+
+def hll_count(reg: bytes) -> int:
+    m = _HLL_M
+    alpha = 0.7213 / (1 + 1.079 / m)
+    est = alpha * m * m / sum(2.0 ** -r for r in reg)
+    zeros = reg.count(0)
+    if est <= 2.5 * m and zeros:
+        est = m * math.log(m / zeros)  # linear counting for small sets
+    return int(round(est))
+
+
+# ================= Rollup =================
+def rollup_day(db: Session, day: date) -> VisitDaily:
+    reg = hll_new()
+    n_sessions = 0
+    for (sid,) in db.execute(select(Visit.session_id).where(Visit.day == day).distinct()).yield_per(5000):
+        hll_add(reg, sid)
+        n_sessions += 1
+    n_visits = db.query(func.count(Visit.id)).filter(Visit.day == day).scalar() or 0
+
+    row = db.get(VisitDaily, day) or VisitDaily(day=day)
+    row.unique_sessions = n_sessions
+    row.visits = n_visits
+    row.hll = bytes(reg)
+    row.updated_at = datetime.utcnow()
+    db.add(row)
+    return row
+
+
+def rollup_month(db: Session, year: int, month: int) -> VisitMonthly:
+    first = date(year, month, 1)
+    nxt = date(year + (month == 12), month % 12 + 1, 1)
+    days = (
+        db.query(VisitDaily.visits, VisitDaily.unique_sessions, VisitDaily.hll)
+        .filter(VisitDaily.day >= first, VisitDaily.day < nxt)
+        .all()
+    )
+
+    reg = hll_merge(d.hll for d in days)
+    row = db.get(VisitMonthly, (year, month)) or VisitMonthly(year=year, month=month)
+    # The estimate can dip below a day's exact count; a month is never smaller than its busiest day
+    row.unique_sessions = max([hll_count(reg)] + [d.unique_sessions or 0 for d in days]) if days else 0
+    row.visits = sum(d.visits or 0 for d in days)
+    row.hll = bytes(reg)
+    row.updated_at = datetime.utcnow()
+    db.add(row)
+    return row
+
+
+def _days_to_roll(db: Session, today: date) -> list[date]:
+    last = db.query(func.max(VisitDaily.day)).scalar()
+    q = db.query(Visit.day).filter(Visit.day.isnot(None)).distinct()
+    if last:
+        q = q.filter(Visit.day >= min(last, today - timedelta(days=1)))
+    days = {d for (d,) in q.all()}
+    days.update({today, today - timedelta(days=1)})
+    return sorted(days)
+
+
+def rollup_tick(db: Session) -> dict:
+    """Scheduler job: daily rows (today, yesterday, backlog) then their months."""
+    today = date.today()
+    days = _days_to_roll(db, today)
+    for d in days:
+        rollup_day(db, d)
+        db.commit()
+    months = sorted({(d.year, d.month) for d in days})
+    for y, mth in months:
+        rollup_month(db, y, mth)
+    db.commit()
+    return {"days": len(days), "months": [f"{y}-{mth:02d}" for y, mth in months]}
+
+
+def refresh_today(db: Session) -> None:
+    """Recompute today's daily + monthly rows if they are stale (request path)."""
+    today = date.today()
+    row = db.get(VisitDaily, today)
+    max_age = timedelta(seconds=METRICS_ROLLUP_MAX_AGE_SECONDS)
+    if row and row.updated_at and datetime.utcnow() - row.updated_at < max_age:
+        return
+    try:
+        rollup_day(db, today)
+        rollup_month(db, today.year, today.month)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] metrics refresh_today failed: {e}")
+
+
+def start_backfill() -> threading.Thread:
+    """Startup: roll up any raw days without a rollup row, off the request path."""
+    def _run():
+        db = SessionLocal()
+        try:
+            out = rollup_tick(db)
+            print(f"[INFO] metrics rollup: {out['days']} day(s) refreshed")
+        except Exception as e:
+            db.rollback()
+            print(f"[WARN] metrics rollup backfill failed: {e}")
+        finally:
+            db.close()
+
+    t = threading.Thread(target=_run, name="metrics-rollup-backfill", daemon=True)
+    t.start()
+    return t
+
+
+# ================= Retention =================
+def prune_tick(db: Session) -> dict:
+    """Scheduler job: delete raw visits past retention (rolled-up days only)."""
+    cutoff = date.today() - timedelta(days=VISITS_RETENTION_DAYS)
+    last_rolled = db.query(func.max(VisitDaily.day)).scalar()
+    if not last_rolled:
+        return {"deleted": 0}
+    cutoff = min(cutoff, last_rolled)
+    deleted = 0
+    while True:
+        ids = select(Visit.id).where(Visit.day < cutoff).limit(VISITS_PRUNE_BATCH).scalar_subquery()
+        n = db.execute(delete(Visit).where(Visit.id.in_(ids))).rowcount or 0
+        db.commit()
+        deleted += n
+        if n < VISITS_PRUNE_BATCH:
+            break
+    return {"deleted": deleted, "before": cutoff.isoformat()}
+
+
+# ================= Dashboard reads =================
+def summary(db: Session) -> dict:
+    """today / month / year distinct sessions from the rollup rows."""
+    refresh_today(db)
+    today = date.today()
+    day = db.get(VisitDaily, today)
+    month = db.get(VisitMonthly, (today.year, today.month))
+    months = db.query(VisitMonthly.unique_sessions, VisitMonthly.hll).filter(VisitMonthly.year == today.year).all()
+    return {
+        "today": day.unique_sessions if day else 0,
+        "month": month.unique_sessions if month else 0,
+        "year": max([hll_count(hll_merge(r.hll for r in months))] + [r.unique_sessions for r in months]) if months else 0,
+    }
+
+
+def daily_chart(db: Session, days: int = 30) -> dict:
+    refresh_today(db)
+    start = date.today() - timedelta(days=days - 1)
+    rows = (
+        db.query(VisitDaily.day, VisitDaily.unique_sessions)
+        .filter(VisitDaily.day >= start, VisitDaily.unique_sessions > 0)
+        .order_by(VisitDaily.day)
+        .all()
+    )
+    return {"labels": [r.day.isoformat() for r in rows], "values": [int(r.unique_sessions) for r in rows]}
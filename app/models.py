@@ -1,9 +1,10 @@
 # app/models.py
 from datetime import datetime, date
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Text, Date, Boolean, Float, event, func, Numeric, UniqueConstraint
+    Column, Integer, String, DateTime, ForeignKey, Text, Date, Boolean, Float, event, func, Numeric, UniqueConstraint,
+    Index, text,
 )
-from sqlalchemy.orm import relationship, column_property
+from sqlalchemy.orm import relationship, column_property, deferred, load_only
 from sqlalchemy.sql import literal
 
 # ✅ Import the correct functions/objects from database (without locally defining _has_column)
@@ -12,12 +13,16 @@ from .database import Base, engine, _has_column
 # -------------------------
 # Helper: real Column if it exists, otherwise literal(None)
 # -------------------------
-def col_or_literal(table: str, name: str, type_, **kwargs):
+def col_or_literal(table: str, name: str, type_, group: str | None = None, **kwargs):
     """
     If the column actually exists in the table → Column(type_, **kwargs)
     If it doesn't exist (in older schemas) → column_property(literal(None)) so models don't break.
+    `group` makes it a deferred column: not loaded with the row, the whole group
+    is fetched on first access (for large/cold columns).
     """
     if _has_column(table, name):
+        if group:
+            return deferred(Column(type_, **kwargs), group=group)
         return Column(type_, **kwargs)
     return column_property(literal(None))
 
@@ -492,12 +497,12 @@ class Booking(Base):
     payout_executed_at  = col_or_literal("bookings", "payout_executed_at", DateTime, nullable=True)
 
     # Pickup/return photos
-    pickup_photos_json = col_or_literal("bookings", "pickup_photos_json", Text, nullable=True)
-    return_photos_json  = col_or_literal("bookings", "return_photos_json",  Text, nullable=True)
+    pickup_photos_json = col_or_literal("bookings", "pickup_photos_json", Text, group="photos", nullable=True)
+    return_photos_json  = col_or_literal("bookings", "return_photos_json",  Text, group="photos", nullable=True)
 
     # DM list
     returned_at        = col_or_literal("bookings", "returned_at", DateTime, nullable=True)
-    owner_return_note  = col_or_literal("bookings", "owner_return_note", Text, nullable=True)
+    owner_return_note  = col_or_literal("bookings", "owner_return_note", Text, group="case_text", nullable=True)
 
     # Timeline fields
     accepted_at                     = col_or_literal("bookings", "accepted_at", DateTime, nullable=True)
@@ -527,12 +532,12 @@ class Booking(Base):
     dm_decision_deadline_at     = col_or_literal("bookings", "dm_decision_deadline_at", DateTime, nullable=True)
 
     owner_report_type   = col_or_literal("bookings", "owner_report_type", String(20), nullable=True)
-    owner_report_reason = col_or_literal("bookings", "owner_report_reason", Text, nullable=True)
-    renter_response_text = col_or_literal("bookings", "renter_response_text", Text, nullable=True)
+    owner_report_reason = col_or_literal("bookings", "owner_report_reason", Text, group="case_text", nullable=True)
+    renter_response_text = col_or_literal("bookings", "renter_response_text", Text, group="case_text", nullable=True)
 
     dm_decision        = col_or_literal("bookings", "dm_decision", String(30), nullable=True)
     dm_decision_amount = col_or_literal("bookings", "dm_decision_amount", Integer, nullable=False, default=0)
-    dm_decision_note   = col_or_literal("bookings", "dm_decision_note", Text, nullable=True)
+    dm_decision_note   = col_or_literal("bookings", "dm_decision_note", Text, group="case_text", nullable=True)
 
     # claims
     if _has_column("bookings", "dm_claimed_by_id"):
@@ -565,7 +570,7 @@ class Booking(Base):
 
     tax_total              = col_or_literal("bookings", "tax_total", Numeric(12,2), nullable=True, default=0)
     tax_currency           = col_or_literal("bookings", "tax_currency", String(3), nullable=True)
-    tax_details_json       = col_or_literal("bookings", "tax_details_json", Text, nullable=True)
+    tax_details_json       = col_or_literal("bookings", "tax_details_json", Text, group="tax", nullable=True)
 
     # Relations
     item   = relationship("Item", backref="bookings")
@@ -584,6 +589,26 @@ class Booking(Base):
     )
 
 
+# Columns the booking list pages actually render (/bookings, DM queue).
+# Cold groups (photos / case_text / tax) are deferred on the model itself;
+# list queries go further and load only these.
+BOOKING_LIST_COLUMNS = (
+    "id", "item_id", "renter_id", "owner_id",
+    "start_date", "end_date", "days",
+    "status", "deposit_status",
+    "created_at", "updated_at", "returned_at", "accepted_at",
+)
+
+
+def booking_list_load():
+    """load_only() option for list views (skips columns missing in older schemas)."""
+    cols = [
+        getattr(Booking, name) for name in BOOKING_LIST_COLUMNS
+        if name in Booking.__table__.c
+    ]
+    return load_only(*cols)
+
+
 # =========================
 # Deposit Audit Log
 # =========================
@@ -879,3 +904,262 @@ class PlatformLedger(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     booking = relationship("Booking", lazy="joined")
+
+
+# =========================
+# Platform balance snapshots (balance = latest snapshot + ledger rows after it)
+# =========================
+class PlatformBalanceSnapshot(Base):
+    __tablename__ = "platform_balance_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    # Ledger rows with id <= last_ledger_id are folded into this snapshot
+    last_ledger_id = Column(Integer, nullable=False, unique=True)
+    available_amount = Column(Numeric(12, 2), nullable=False, default=0)
+    hold_amount = Column(Numeric(12, 2), nullable=False, default=0)
+    kind = Column(String(20), nullable=False, default="periodic")  # opening / periodic
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# =========================
+# Media uploads (local staging → Cloudinary)
+# =========================
+class MediaUpload(Base):
+    __tablename__ = "media_uploads"
+
+    id = Column(Integer, primary_key=True)
+    local_url = Column(String(600), nullable=False, index=True)   # /uploads/items/xxx.jpg (served until done)
+    local_path = Column(String(600), nullable=False)              # absolute path on disk
+    folder = Column(String(200), nullable=True)                   # Cloudinary folder
+    public_id = Column(String(200), nullable=True)
+    resource_type = Column(String(10), nullable=False, default="auto")  # image / raw / auto / video
+
+    # Row whose column(s) hold local_url and must be switched to remote_url
+    target_table = Column(String(40), nullable=True)              # items / users / documents / deposit_evidences
+    target_id = Column(Integer, nullable=True)
+
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending / uploading / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    remote_url = Column(String(600), nullable=True)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# =========================
+# Scheduler (app/scheduler.py)
+# =========================
+class SchedulerLock(Base):
+    """
+    One row per periodic job, shared by every worker process.
+    Whoever flips locked_until/owner first runs the job; next_run_at is the
+    shared schedule so a job runs once per interval across the whole fleet.
+    """
+    __tablename__ = "scheduler_locks"
+
+    job_name = Column(String(80), primary_key=True)
+    owner = Column(String(120), nullable=True)                     # host:pid of the current holder
+    locked_until = Column(DateTime, nullable=True)                 # lease expiry (crashed holder → reclaimable)
+    next_run_at = Column(DateTime, nullable=True)
+    failures = Column(Integer, nullable=False, default=0)          # consecutive failures (drives backoff)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SchedulerRun(Base):
+    __tablename__ = "scheduler_runs"
+
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String(80), nullable=False, index=True)
+    worker = Column(String(120), nullable=True)
+    trigger = Column(String(20), nullable=False, default="schedule")  # schedule / manual
+    status = Column(String(20), nullable=False, default="running")    # running / ok / error
+    started_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+
+
+# =========================
+# Booking deadlines (app/booking_deadlines.py)
+# =========================
+class BookingDeadline(Base):
+    """
+    One pending timer per (booking, kind), kept in sync with the booking's
+    deadline columns. Robots read only the rows that are due.
+    """
+    __tablename__ = "booking_deadlines"
+
+    id = Column(Integer, primary_key=True)
+    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(40), nullable=False)          # auto_release / renter_response / owner_silence / ...
+    due_at = Column(DateTime, nullable=False)          # naive UTC
+    processed_at = Column(DateTime, nullable=True)
+    outcome = Column(String(60), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("booking_id", "kind", name="uq_booking_deadlines_booking_kind"),
+        Index(
+            "ix_booking_deadlines_pending",
+            "kind", "due_at",
+            postgresql_where=text("processed_at IS NULL"),
+            sqlite_where=text("processed_at IS NULL"),
+        ),
+    )
+
+
+# =========================
+# Auto-release outcomes (app/cron_auto_release.py)
+# =========================
+class AutoReleaseOutcome(Base):
+    """
+    One row per (booking, action) side effect of the auto-release job.
+    The idempotency key is also sent to Stripe, so a rerun after a crash
+    replays the same request instead of issuing a second one; after a 5xx
+    answer the next attempt sends request_key ("<key>:<attempt>") instead,
+    since Stripe would replay the cached error for the old key.
+    """
+    __tablename__ = "auto_release_outcomes"
+
+    id = Column(Integer, primary_key=True)
+    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="CASCADE"), nullable=False, index=True)
+    action = Column(String(30), nullable=False)                  # release / dm_capture / dm_release
+    idempotency_key = Column(String(120), nullable=False, unique=True)
+    request_key = Column(String(140), nullable=True)             # key for the next call (NULL = idempotency_key)
+    amount = Column(Integer, nullable=True)
+    status = Column(String(20), nullable=False, default="claimed", index=True)  # claimed / done / error
+    attempts = Column(Integer, nullable=False, default=0)
+    result = Column(String(60), nullable=True)                   # released / captured:N / error:...
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# =========================
+# Item availability (app/availability.py)
+# =========================
+class ItemReservation(Base):
+    """
+    Date interval [start_date, end_date) during which an item is taken by a
+    confirmed booking. Kept in sync with Booking.status by app/availability.py.
+    """
+    __tablename__ = "item_reservations"
+
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id", ondelete="CASCADE"), nullable=False)
+    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="CASCADE"), nullable=False, unique=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)      # exclusive (checkout day)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_item_reservations_item_range", "item_id", "start_date", "end_date"),
+    )
+
+
+# =========================
+# Outbound payment operations (app/payment_ops.py)
+# =========================
+class PaymentOperation(Base):
+    """
+    A Stripe / PayPal side effect queued by a handler or robot and executed
+    by the payment_ops worker. The idempotency key is unique here and is also
+    sent to the provider, so retries never issue a second capture/refund.
+    After a Stripe 5xx the next attempt sends request_key ("<key>:<n>").
+    """
+    __tablename__ = "payment_operations"
+
+    id = Column(Integer, primary_key=True)
+    booking_id = Column(Integer, ForeignKey("bookings.id", ondelete="CASCADE"), nullable=True)
+    provider = Column(String(20), nullable=False)                # stripe / paypal
+    kind = Column(String(40), nullable=False)                    # pi_capture / pi_cancel / transfer / refund_capture
+    idempotency_key = Column(String(160), nullable=False, unique=True)
+    request_key = Column(String(180), nullable=True)             # key for the next call (NULL = idempotency_key)
+    params = Column(Text, nullable=True)                         # JSON
+    status = Column(String(20), nullable=False, default="pending")  # pending / running / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+    result = Column(Text, nullable=True)                         # JSON (provider ids)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_payment_operations_booking", "booking_id", "id"),
+        Index("ix_payment_operations_due", "status", "next_attempt_at"),
+    )
+
+
+class BroadcastJob(Base):
+    """
+    An admin email broadcast (/admin/broadcast), sent in the background by
+    app/broadcasts.py. Recipients are streamed from users in id order;
+    `last_user_id` is how far that scan has got, so a restart resumes.
+    """
+    __tablename__ = "broadcast_jobs"
+
+    id = Column(Integer, primary_key=True)
+    created_by_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    subject = Column(String(300), nullable=False)
+    text_body = Column(Text, nullable=True)
+    html_body = Column(Text, nullable=True)
+    audience = Column(String(20), nullable=False, default="all")      # all / verified / unverified
+    status = Column(String(20), nullable=False, default="queued")     # queued / running / done / failed / cancelled
+    total = Column(Integer, nullable=False, default=0)                # audience size when queued
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    last_user_id = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_broadcast_jobs_status", "status", "id"),
+    )
+
+
+class BroadcastRecipient(Base):
+    """Per-recipient delivery status of a BroadcastJob."""
+    __tablename__ = "broadcast_recipients"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("broadcast_jobs.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    email = Column(String(200), nullable=False)
+    status = Column(String(20), nullable=False, default="pending")    # pending / sent / failed
+    error = Column(Text, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("job_id", "user_id", name="uq_broadcast_recipient"),
+        Index("ix_broadcast_recipients_job_status", "job_id", "status", "id"),
+    )
+
+
+class SupportTicketEvent(Base):
+    """
+    Append-only log of ticket state changes (created / message / assigned /
+    resolved / transferred). Staff consoles tail it by id (app/ticket_events.py).
+    """
+    __tablename__ = "support_ticket_events"
+
+    id = Column(Integer, primary_key=True)
+    ticket_id = Column(Integer, ForeignKey("support_tickets.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(20), nullable=False)
+    actor_id = Column(Integer, nullable=True)        # user / agent who caused it (no FK: log outlives users)
+    queue = Column(String(20), nullable=True)        # queue after the change
+    status = Column(String(20), nullable=True)       # status after the change
+    data = Column(Text, nullable=True)               # small JSON payload
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_support_ticket_events_queue_id", "queue", "id"),
+        Index("ix_support_ticket_events_ticket_id", "ticket_id", "id"),
+        Index("ix_support_ticket_events_created", "created_at"),
+    )
@@ -1,6 +1,6 @@
 # app/models_metrics.py
 from datetime import datetime, date
-from sqlalchemy import Column, Integer, String, DateTime, Date, Index
+from sqlalchemy import Column, Integer, String, DateTime, Date, Index, LargeBinary, PrimaryKeyConstraint
 from .database import Base
 
 class Visit(Base):
@@ -26,3 +26,27 @@ class OnlineSession(Base):
     user_agent = Column(String(255), nullable=True)
     first_seen = Column(DateTime, default=datetime.utcnow, nullable=False)
     last_seen = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+# Rollups maintained by app/metrics_rollup.py (raw visits are pruned after
+# VISITS_RETENTION_DAYS). `hll` is a HyperLogLog sketch of the distinct
+# session ids, so months/years can be merged without the raw rows.
+class VisitDaily(Base):
+    __tablename__ = "visit_daily"
+    day = Column(Date, primary_key=True)
+    unique_sessions = Column(Integer, nullable=False, default=0)  # exact
+    visits = Column(Integer, nullable=False, default=0)
+    hll = Column(LargeBinary, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class VisitMonthly(Base):
+    __tablename__ = "visit_monthly"
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    unique_sessions = Column(Integer, nullable=False, default=0)  # HLL estimate
+    visits = Column(Integer, nullable=False, default=0)
+    hll = Column(LargeBinary, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (PrimaryKeyConstraint("year", "month"),)
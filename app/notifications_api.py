@@ -1,16 +1,17 @@
 # app/notifications_api.py
 from __future__ import annotations
-from typing import Optional
+from typing import Iterable, Optional
 from datetime import datetime
 import os   # ✅ هذا هو الحل
 import smtplib
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from fastapi import APIRouter, Depends, Request, HTTPException, Query
 from fastapi.responses import JSONResponse, RedirectResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import insert, or_
 
 from .database import get_db
 from .models import User, Notification
@@ -27,25 +28,30 @@ SMTP_USER = "no-reply@sevor.net"
 SMTP_PASS = os.getenv("SMTP_PASSWORD")
 
 
+def _build_email(to_email: str, subject: str, message: str) -> MIMEMultipart:
+    msg = MIMEMultipart("alternative")
+    msg["From"] = SMTP_USER
+    msg["To"] = to_email
+    msg["Subject"] = subject
+
+    html = f"""
+    <html>
+    <body style="font-family:Arial;">
+        <h3>{subject}</h3>
+        <p>{message}</p>
+        <br><p>Sevor — Rent Anything Worldwide</p>
+    </body>
+    </html>
+    """
+
+    msg.attach(MIMEText(message, "plain"))
+    msg.attach(MIMEText(html, "html"))
+    return msg
+
+
 def send_email_notification(to_email: str, subject: str, message: str):
     try:
-        msg = MIMEMultipart("alternative")
-        msg["From"] = SMTP_USER
-        msg["To"] = to_email
-        msg["Subject"] = subject
-
-        html = f"""
-        <html>
-        <body style="font-family:Arial;">
-            <h3>{subject}</h3>
-            <p>{message}</p>
-            <br><p>Sevor — Rent Anything Worldwide</p>
-        </body>
-        </html>
-        """
-
-        msg.attach(MIMEText(message, "plain"))
-        msg.attach(MIMEText(html, "html"))
+        msg = _build_email(to_email, subject, message)
 
         with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
             s.starttls()
@@ -58,6 +64,25 @@ def send_email_notification(to_email: str, subject: str, message: str):
         print("EMAIL ERROR:", e)
 
 
+def send_email_notifications(to_emails: list[str], subject: str, message: str) -> int:
+    """Same email to many recipients over one SMTP login; returns how many were sent."""
+    sent = 0
+    try:
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
+            s.starttls()
+            s.login(SMTP_USER, SMTP_PASS)
+            for to_email in to_emails:
+                try:
+                    s.sendmail(SMTP_USER, to_email, _build_email(to_email, subject, message).as_string())
+                    sent += 1
+                except smtplib.SMTPRecipientsRefused as e:
+                    print("EMAIL ERROR:", to_email, e)
+    except Exception as e:
+        print("EMAIL ERROR:", e)
+    print(f"EMAIL SENT → {sent}/{len(to_emails)} recipients")
+    return sent
+
+
 def send_user_email(db: Session, user_id: int, subject: str, message: str):
     u = db.get(User, user_id)
     if not u or not u.email:
@@ -123,26 +148,78 @@ def push_notification(
     return n
 
 
+def push_notifications(
+    db: Session,
+    user_ids: Iterable[int],
+    title: str,
+    body: str = "",
+    url: Optional[str] = None,
+    kind: str = "system",
+) -> int:
+    """
+    Fan-out of one notification to many users (all agents of a queue, all
+    admins…): one multi-row INSERT and one commit instead of a commit +
+    refresh + SMTP connection per user. The email fallback goes out in a
+    background thread over a single SMTP login. Returns rows inserted.
+    """
+    ids = list(dict.fromkeys(int(u) for u in user_ids if u))
+    if not ids:
+        return 0
+
+    now = datetime.utcnow()
+    db.execute(insert(Notification), [
+        {
+            "user_id": uid,
+            "title": (title or "").strip()[:200],
+            "body": (body or "").strip()[:1000],
+            "link_url": url or "",
+            "kind": kind,
+            "is_read": False,
+            "created_at": now,
+            "opened_once": False,
+        }
+        for uid in ids
+    ])
+    db.commit()
+
+    # Email fallback
+    try:
+        emails = [
+            e for (e,) in db.query(User.email).filter(User.id.in_(ids), User.email.isnot(None)).all() if e
+        ]
+        if emails:
+            content = body or title
+            if url:
+                content += f"\n\nOpen: https://sevor.net{url}"
+            threading.Thread(
+                target=send_email_notifications, args=(emails, title, content),
+                name="notify-email", daemon=True,
+            ).start()
+    except Exception as e:
+        print("Email send error:", e)
+
+    return len(ids)
+
+
 # ============================================================
 #               ADMIN + DM BROADCAST
 # ============================================================
 
 def notify_admins(db: Session, title: str, body: str = "", url: str = ""):
-    admins = db.query(User).filter(User.role == "admin").all()
-    for a in admins:
-        push_notification(db, a.id, title, body, url, kind="admin")
+    admin_ids = [r[0] for r in db.query(User.id).filter(User.role == "admin").all()]
+    push_notifications(db, admin_ids, title, body, url, kind="admin")
 
 
 def notify_dms(db: Session, title: str, body: str = "", url: str = ""):
     """
     إرسال إشعار فقط للـ Deposit Managers + Admin
     """
-    dm_users = db.query(User).filter(
-        (User.is_deposit_manager == True) | (User.role == "admin")
-    ).all()
-
-    for u in dm_users:
-        push_notification(db, u.id, title, body, url, kind="deposit")
+    dm_ids = [
+        r[0] for r in db.query(User.id).filter(
+            (User.is_deposit_manager == True) | (User.role == "admin")
+        ).all()
+    ]
+    push_notifications(db, dm_ids, title, body, url, kind="deposit")
 
 
 def notify_mods(db: Session, title: str, body: str = "", url: str = ""):
@@ -152,8 +229,7 @@ def notify_mods(db: Session, title: str, body: str = "", url: str = ""):
         .all()
     )
     ids = [r[0] for r in rows]
-    for uid in ids:
-        push_notification(db, uid, title, body, url, kind="support")
+    push_notifications(db, ids, title, body, url, kind="support")
 
 
 # ============================================================
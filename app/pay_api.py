@@ -1,8 +1,5 @@
 from __future__ import annotations
 
-import os
-import base64
-import requests
 from datetime import datetime
 from typing import Optional, Literal
 
@@ -13,6 +10,7 @@ from sqlalchemy.orm import Session
 from .database import get_db
 from .models import Booking, User
 from .notifications_api import push_notification
+from . import paypal_client, payment_ops
 
 # ✅ نستخدم نفس منطق الضرائب
 from .utili_geo import locate_from_session
@@ -55,33 +53,12 @@ def flow_redirect(bk: Booking, flag: str):
 # PayPal core
 # =====================================================
 
-PAYPAL_MODE = os.getenv("PAYPAL_MODE", "sandbox")
+# Base URL, token cache and the pooled HTTP client live in paypal_client
+PAYPAL_BASE = paypal_client.BASE_URL
 
-if PAYPAL_MODE == "live":
-    PAYPAL_BASE = "https://api-m.paypal.com"
-else:
-    PAYPAL_BASE = "https://api-m.sandbox.paypal.com"
 
 def paypal_get_token() -> str:
-    client_id = os.getenv("PAYPAL_CLIENT_ID")
-    secret = os.getenv("PAYPAL_CLIENT_SECRET")
-
-    if not client_id or not secret:
-        raise RuntimeError("PayPal credentials missing")
-
-    auth = base64.b64encode(f"{client_id}:{secret}".encode()).decode()
-
-    r = requests.post(
-        f"{PAYPAL_BASE}/v1/oauth2/token",
-        headers={
-            "Authorization": f"Basic {auth}",
-            "Content-Type": "application/x-www-form-urlencoded",
-        },
-        data={"grant_type": "client_credentials"},
-        timeout=20,
-    )
-    r.raise_for_status()
-    return r.json()["access_token"]
+    return paypal_client.get_access_token()
 
 
 def paypal_create_order(
@@ -91,61 +68,32 @@ def paypal_create_order(
     currency: str,
     pay_type: Literal["rent", "securityfund"],
 ) -> str:
-    token = paypal_get_token()
-
-    r = requests.post(
-        f"{PAYPAL_BASE}/v2/checkout/orders",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        json={
-            "intent": "CAPTURE",
-            "purchase_units": [
-                {
-                    "reference_id": f"{pay_type.upper()}_{booking.id}",
-                    "amount": {
-                        "currency_code": currency,
-                        "value": f"{amount:.2f}",
-                    },
-                }
-            ],
-            "application_context": {
-                "brand_name": "Sevor",
-                "user_action": "PAY_NOW",
-                "return_url": (
-                    f"https://sevor.net/paypal/return"
-                    f"?booking_id={booking.id}&type={pay_type}"
-                ),
-                "cancel_url": f"https://sevor.net/bookings/flow/{booking.id}",
-            },
+    data = paypal_client.create_order({
+        "intent": "CAPTURE",
+        "purchase_units": [
+            {
+                "reference_id": f"{pay_type.upper()}_{booking.id}",
+                "amount": {
+                    "currency_code": currency,
+                    "value": f"{amount:.2f}",
+                },
+            }
+        ],
+        "application_context": {
+            "brand_name": "Sevor",
+            "user_action": "PAY_NOW",
+            "return_url": (
+                f"https://sevor.net/paypal/return"
+                f"?booking_id={booking.id}&type={pay_type}"
+            ),
+            "cancel_url": f"https://sevor.net/bookings/flow/{booking.id}",
         },
-        timeout=20,
-    )
-
-    r.raise_for_status()
-    data = r.json()
-
-    for link in data.get("links", []):
-        if link.get("rel") == "approve":
-            return link["href"]
-
-    raise RuntimeError("PayPal approval link not found")
+    })
+    return paypal_client.approval_link(data)
 
 
 def paypal_capture(order_id: str):
-    token = paypal_get_token()
-
-    r = requests.post(
-        f"{PAYPAL_BASE}/v2/checkout/orders/{order_id}/capture",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        timeout=20,
-    )
-    r.raise_for_status()
-    return r.json()
+    return paypal_client.capture_order(order_id)
 
 def compute_grand_total_for_paypal(request: Request, bk: Booking) -> dict:
     rent = float(bk.total_amount or 0)
@@ -275,25 +223,15 @@ def paypal_refund_capture(
     Refund a captured PayPal payment (partial or full).
     Returns refund ID.
     """
-    token = paypal_get_token()
-
-    r = requests.post(
-        f"{PAYPAL_BASE}/v2/payments/captures/{capture_id}/refund",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        json={
+    data = paypal_client.refund_capture(
+        capture_id,
+        {
             "amount": {
                 "value": f"{amount:.2f}",
                 "currency_code": currency,
             }
         },
-        timeout=20,
     )
-
-    r.raise_for_status()
-    data = r.json()
     return data["id"]
 
 def send_deposit_refund(
@@ -304,7 +242,10 @@ def send_deposit_refund(
 ) -> str:
     """
     ROBOT ENTRY POINT
-    Sends refund to renter for deposit only.
+    Queues the deposit refund to the renter (app/payment_ops.py runs the
+    PayPal call with retries) and returns the operation reference
+    "payop:<id>". Calling it again for the same capture returns the same
+    operation, so a robot rerun never refunds twice.
     """
 
     if amount <= 0:
@@ -330,16 +271,13 @@ def send_deposit_refund(
     # Optional but very useful for debugging
     print("🔁 REFUND USING CAPTURE_ID:", capture_id)
 
-    refund_id = paypal_refund_capture(
-        capture_id=capture_id,
-        amount=amount,
-        currency=(booking.currency or "CAD"),
-    )
+    op = payment_ops.paypal_refund(db, booking, capture_id, amount, booking.currency or "CAD")
 
-    # Update booking (robot only touches refund fields)
+    # Update booking (robot only touches refund fields);
+    # deposit_refund_sent_at is moved to the PayPal completion time by the worker
     booking.deposit_refund_amount = amount
     booking.deposit_refund_sent = True
     booking.deposit_refund_sent_at = datetime.utcnow()
 
     db.commit()
-    return refund_id
+    return f"payop:{op.id}"
@@ -0,0 +1,529 @@
+# app/payment_ops.py
+"""
+Durable queue for outbound payment side effects.
+
+Handlers and robots no longer call Stripe / PayPal inline: they add a
+`payment_operations` row to their own transaction (enqueue / stripe_capture /
+stripe_cancel / paypal_refund) and return. A dispatcher thread claims due
+rows with a conditional UPDATE, runs the provider call in a small pool and
+records the result:
+
+- the idempotency key is unique in the table (a second enqueue of the same
+  operation returns the first row) and is sent to the provider
+  (Stripe idempotency_key / PayPal-Request-Id), so a retry after a timeout
+  replays the original request instead of charging or refunding twice;
+  Stripe also caches a 5xx answer under its key, so after one the next
+  attempt is sent as "<key>:<n>" (request_key);
+- transient errors (network, 5xx, rate limits) are retried with exponential
+  backoff, permanent ones (4xx, invalid request) fail at once and notify the
+  admins;
+- after success a per-kind hook applies local state (charge id, transfer to
+  the owner, refund timestamp) in the same transaction that marks it done.
+
+The booking flow page reads for_booking() (also at GET
+/bookings/{id}/payment-ops); admins list and retry failed rows at
+/admin/payment-ops.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+import stripe
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import paypal_client
+from .database import SessionLocal, get_db
+from .models import Booking, PaymentOperation, User
+from .notifications_api import notify_admins
+
+# ================= Settings =================
+PAYMENT_OPS_WORKERS = int(os.getenv("PAYMENT_OPS_WORKERS", "4"))
+PAYMENT_OPS_MAX_ATTEMPTS = int(os.getenv("PAYMENT_OPS_MAX_ATTEMPTS", "8"))
+PAYMENT_OPS_POLL_SECONDS = float(os.getenv("PAYMENT_OPS_POLL_SECONDS", "10"))
+PAYMENT_OPS_BACKOFF_SECONDS = float(os.getenv("PAYMENT_OPS_BACKOFF_SECONDS", "30"))
+PAYMENT_OPS_BACKOFF_MAX_SECONDS = float(os.getenv("PAYMENT_OPS_BACKOFF_MAX_SECONDS", "3600"))
+# Rows stuck in "running" longer than this (worker crash) are retried
+PAYMENT_OPS_STALE_MINUTES = int(os.getenv("PAYMENT_OPS_STALE_MINUTES", "10"))
+
+
+def _stripe_key() -> str:
+    if not stripe.api_key:
+        stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
+    return stripe.api_key
+
+
+class PermanentError(Exception):
+    """Provider rejected the request; retrying the same request cannot help."""
+
+
+def _stripe_error(e: Exception) -> Exception:
+    permanent = tuple(
+        c for c in (
+            getattr(stripe, "InvalidRequestError", None),
+            getattr(stripe, "CardError", None),
+            getattr(stripe, "AuthenticationError", None),
+            getattr(stripe, "PermissionError", None),
+            getattr(stripe, "IdempotencyError", None),
+        ) if c
+    )
+    if isinstance(e, permanent):
+        return PermanentError(str(e))
+    return e
+
+
+def _stripe_server_error(e: BaseException) -> bool:
+    """Stripe answered with a 5xx (None status = no response: network error / timeout)."""
+    for err in (e, e.__cause__):
+        status = getattr(err, "http_status", None)
+        if status:
+            return int(status) >= 500
+    return False
+
+
+def _next_request_key(op: PaymentOperation) -> str:
+    """"<key>:<n>" for the next attempt; n keeps growing across admin retries."""
+    n = op.attempts or 0
+    current = op.request_key or ""
+    if current.startswith(op.idempotency_key + ":"):
+        try:
+            n = max(n, int(current.rsplit(":", 1)[1]))
+        except ValueError:
+            pass
+    return f"{op.idempotency_key}:{n + 1}"
+
+
+def _paypal_error(e: paypal_client.PayPalError) -> Exception:
+    code = e.status_code
+    if code is not None and 400 <= code < 500 and code not in (401, 408, 409, 429):
+        return PermanentError(str(e))
+    return e
+
+
+# ================= Provider calls (pool threads, no DB) =================
+def _run_pi_capture(p: dict, key: str) -> dict:
+    if not _stripe_key():
+        raise PermanentError("STRIPE_SECRET_KEY not set")
+    try:
+        pi = stripe.PaymentIntent.capture(p["pi_id"], amount_to_capture=int(p["amount_cents"]), idempotency_key=key)
+    except Exception as e:
+        raise _stripe_error(e) from e
+    charge_id = pi.get("latest_charge")
+    if not charge_id:
+        charges = (pi.get("charges") or {}).get("data") or [{}]
+        charge_id = charges[0].get("id")
+    return {"status": pi.get("status"), "charge_id": charge_id}
+
+
+def _run_pi_cancel(p: dict, key: str) -> dict:
+    if not _stripe_key():
+        raise PermanentError("STRIPE_SECRET_KEY not set")
+    try:
+        pi = stripe.PaymentIntent.cancel(p["pi_id"], idempotency_key=key)
+    except Exception as e:
+        err = _stripe_error(e)
+        if isinstance(err, PermanentError):
+            # Already cancelled / captured / expired hold: nothing left to release
+            return {"status": "skipped", "detail": str(e)[:300]}
+        raise err from e
+    return {"status": pi.get("status")}
+
+
+def _run_transfer(p: dict, key: str) -> dict:
+    if not _stripe_key():
+        raise PermanentError("STRIPE_SECRET_KEY not set")
+    kw = {}
+    if p.get("source_transaction"):
+        kw["source_transaction"] = p["source_transaction"]
+    try:
+        tr = stripe.Transfer.create(
+            amount=int(p["amount_cents"]), currency=p.get("currency") or "cad",
+            destination=p["destination"], idempotency_key=key, **kw,
+        )
+    except Exception as e:
+        raise _stripe_error(e) from e
+    return {"transfer_id": tr.get("id")}
+
+
+def _run_paypal_refund(p: dict, key: str) -> dict:
+    try:
+        data = paypal_client.refund_capture(
+            p["capture_id"],
+            {"amount": {"value": f"{float(p['amount']):.2f}", "currency_code": p.get("currency") or "CAD"}},
+            request_id=key,
+        )
+    except paypal_client.PayPalError as e:
+        raise _paypal_error(e) from e
+    return {"refund_id": data.get("id"), "status": data.get("status")}
+
+
+RUNNERS = {
+    ("stripe", "pi_capture"): _run_pi_capture,
+    ("stripe", "pi_cancel"): _run_pi_cancel,
+    ("stripe", "transfer"): _run_transfer,
+    ("paypal", "refund_capture"): _run_paypal_refund,
+}
+
+
+# ================= Local state after success (worker, own session) =================
+def _after_pi_capture(db: Session, op: PaymentOperation, params: dict, result: dict) -> None:
+    bk = db.get(Booking, op.booking_id) if op.booking_id else None
+    charge_id = result.get("charge_id")
+    if bk and charge_id and hasattr(bk, "deposit_capture_id"):
+        bk.deposit_capture_id = str(charge_id)
+    tr = params.get("transfer")
+    if tr and tr.get("destination"):
+        enqueue(
+            db, provider="stripe", kind="transfer", key=f"{op.idempotency_key}:transfer",
+            booking_id=op.booking_id,
+            params={**tr, "source_transaction": charge_id},
+        )
+
+
+def _after_paypal_refund(db: Session, op: PaymentOperation, params: dict, result: dict) -> None:
+    bk = db.get(Booking, op.booking_id) if op.booking_id else None
+    if bk:
+        bk.deposit_refund_sent = True
+        bk.deposit_refund_sent_at = datetime.utcnow()
+
+
+AFTER_DONE = {
+    ("stripe", "pi_capture"): _after_pi_capture,
+    ("paypal", "refund_capture"): _after_paypal_refund,
+}
+
+LABELS = {
+    ("stripe", "pi_capture"): "Deposit capture",
+    ("stripe", "pi_cancel"): "Deposit hold release",
+    ("stripe", "transfer"): "Owner payout",
+    ("paypal", "refund_capture"): "Deposit refund",
+}
+
+
+# ================= Enqueue (request / robot thread) =================
+def enqueue(
+    db: Session,
+    *,
+    provider: str,
+    kind: str,
+    key: str,
+    params: dict,
+    booking_id: Optional[int] = None,
+) -> PaymentOperation:
+    """
+    Add an operation to the caller's session (committed with the caller's
+    transaction; the worker is woken after that commit). An operation with
+    the same idempotency key is returned as-is instead of being queued twice.
+    """
+    if (provider, kind) not in RUNNERS:
+        raise ValueError(f"unknown payment operation: {provider}/{kind}")
+    existing = db.query(PaymentOperation).filter_by(idempotency_key=key).first()
+    if existing:
+        return existing
+
+    op = PaymentOperation(
+        booking_id=booking_id,
+        provider=provider,
+        kind=kind,
+        idempotency_key=key,
+        params=json.dumps(params),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    try:
+        with db.begin_nested():
+            db.add(op)
+    except IntegrityError:
+        # Same key inserted concurrently by another worker/process
+        return db.query(PaymentOperation).filter_by(idempotency_key=key).one()
+
+    if not db.info.get("payment_ops_kick"):
+        db.info["payment_ops_kick"] = True
+
+        def _after_commit(_session):
+            _session.info.pop("payment_ops_kick", None)
+            kick()
+
+        event.listen(db, "after_commit", _after_commit, once=True)
+    return op
+
+
+def stripe_capture(
+    db: Session,
+    bk: Booking,
+    pi_id: str,
+    amount: float,
+    *,
+    transfer_to: Optional[str] = None,
+    currency: str = "cad",
+) -> PaymentOperation:
+    """Capture `amount` of a deposit hold; optionally pay it out to a connected account."""
+    cents = int(round(float(amount) * 100))
+    params = {"pi_id": pi_id, "amount_cents": cents}
+    if transfer_to:
+        params["transfer"] = {"destination": transfer_to, "amount_cents": cents, "currency": currency}
+    return enqueue(db, provider="stripe", kind="pi_capture", key=f"deposit_capture:{bk.id}:{pi_id}",
+                   booking_id=bk.id, params=params)
+
+
+def stripe_cancel(db: Session, bk: Booking, pi_id: str) -> PaymentOperation:
+    """Release a deposit hold."""
+    return enqueue(db, provider="stripe", kind="pi_cancel", key=f"deposit_cancel:{pi_id}",
+                   booking_id=bk.id, params={"pi_id": pi_id})
+
+
+def paypal_refund(db: Session, bk: Booking, capture_id: str, amount: float, currency: str) -> PaymentOperation:
+    """Refund (part of) a PayPal capture."""
+    return enqueue(db, provider="paypal", kind="refund_capture", key=f"deposit_refund:{bk.id}:{capture_id}",
+                   booking_id=bk.id, params={"capture_id": capture_id, "amount": float(amount), "currency": currency})
+
+
+# ================= Status =================
+def describe(op: PaymentOperation) -> dict:
+    try:
+        result = json.loads(op.result) if op.result else None
+    except Exception:
+        result = None
+    return {
+        "id": op.id,
+        "booking_id": op.booking_id,
+        "provider": op.provider,
+        "kind": op.kind,
+        "label": LABELS.get((op.provider, op.kind), op.kind),
+        "status": op.status,
+        "attempts": op.attempts,
+        "next_attempt_at": op.next_attempt_at.isoformat() if op.next_attempt_at and op.status == "pending" else None,
+        "completed_at": op.completed_at.isoformat() if op.completed_at else None,
+        "error": (op.last_error or "")[:300] or None,
+        "result": result,
+        "created_at": op.created_at.isoformat() if op.created_at else None,
+    }
+
+
+def for_booking(db: Session, booking_id: int) -> list[dict]:
+    rows = (
+        db.query(PaymentOperation)
+        .filter(PaymentOperation.booking_id == booking_id)
+        .order_by(PaymentOperation.id.asc())
+        .all()
+    )
+    return [describe(r) for r in rows]
+
+
+# ================= Worker =================
+_executor: Optional[ThreadPoolExecutor] = None
+_wake = threading.Event()
+_stop = threading.Event()
+_dispatcher: Optional[threading.Thread] = None
+
+
+def kick() -> None:
+    """Wake the dispatcher so freshly committed operations start immediately."""
+    _wake.set()
+
+
+def _claim_due(limit: int) -> list[int]:
+    """Atomically flip due pending rows to 'running' and return their ids."""
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=PAYMENT_OPS_STALE_MINUTES)
+    db = SessionLocal()
+    try:
+        db.query(PaymentOperation).filter(
+            PaymentOperation.status == "running",
+            PaymentOperation.updated_at < stale,
+        ).update({"status": "pending"}, synchronize_session=False)
+        db.commit()
+
+        ids = [
+            r.id for r in db.query(PaymentOperation.id)
+            .filter(PaymentOperation.status == "pending", PaymentOperation.next_attempt_at <= now)
+            .order_by(PaymentOperation.id.asc())
+            .limit(limit)
+            .all()
+        ]
+        claimed: list[int] = []
+        for op_id in ids:
+            n = db.query(PaymentOperation).filter(
+                PaymentOperation.id == op_id, PaymentOperation.status == "pending"
+            ).update(
+                {"status": "running", "attempts": PaymentOperation.attempts + 1, "updated_at": now},
+                synchronize_session=False,
+            )
+            if n:
+                claimed.append(op_id)
+        db.commit()
+        return claimed
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] payment_ops claim failed: {e}")
+        return []
+    finally:
+        db.close()
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(PAYMENT_OPS_BACKOFF_MAX_SECONDS, PAYMENT_OPS_BACKOFF_SECONDS * (2 ** max(0, attempts - 1))))
+
+
+def _fail(db: Session, op: PaymentOperation, error: str) -> None:
+    op.status = "failed"
+    op.last_error = error[:1000]
+    op.completed_at = datetime.utcnow()
+    db.commit()
+    print(f"[WARN] payment operation #{op.id} {op.provider}/{op.kind} failed: {error[:200]}")
+    try:
+        where = f"booking #{op.booking_id}" if op.booking_id else f"operation #{op.id}"
+        notify_admins(
+            db,
+            "Payment operation failed",
+            f"{LABELS.get((op.provider, op.kind), op.kind)} for {where}: {error[:200]}",
+            "/admin/payment-ops?status=failed",
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
+def _process(op_id: int) -> None:
+    db = SessionLocal()
+    try:
+        op = db.get(PaymentOperation, op_id)
+        if not op or op.status != "running":
+            return
+        params = json.loads(op.params or "{}")
+        key = op.request_key or op.idempotency_key
+        runner = RUNNERS.get((op.provider, op.kind))
+        # Provider round-trip outside any transaction
+        db.commit()
+
+        try:
+            if runner is None:
+                raise PermanentError(f"no runner for {op.provider}/{op.kind}")
+            result = runner(params, key)
+        except PermanentError as e:
+            _fail(db, op, str(e))
+            return
+        except Exception as e:
+            if op.provider == "stripe" and _stripe_server_error(e):
+                # Same key would replay the cached 5xx; no response → keep the key
+                op.request_key = _next_request_key(op)
+            if (op.attempts or 0) >= PAYMENT_OPS_MAX_ATTEMPTS:
+                _fail(db, op, f"{e} (after {op.attempts} attempts)")
+                return
+            op.status = "pending"
+            op.last_error = str(e)[:1000]
+            op.next_attempt_at = datetime.utcnow() + _backoff(op.attempts or 1)
+            db.commit()
+            return
+
+        hook = AFTER_DONE.get((op.provider, op.kind))
+        if hook:
+            hook(db, op, params, result)
+        op.status = "done"
+        op.result = json.dumps(result, default=str)
+        op.last_error = None
+        op.completed_at = datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] payment_ops operation {op_id} failed: {e}")
+    finally:
+        db.close()
+
+
+def run_pending(limit: int = 100) -> int:
+    """Claim and run due operations in the calling thread (CLI / tests)."""
+    ids = _claim_due(limit)
+    for op_id in ids:
+        _process(op_id)
+    return len(ids)
+
+
+def _dispatch_loop() -> None:
+    while not _stop.is_set():
+        _wake.clear()
+        for op_id in _claim_due(PAYMENT_OPS_WORKERS * 4):
+            _executor.submit(_process, op_id)
+        _wake.wait(PAYMENT_OPS_POLL_SECONDS)
+
+
+def start_worker() -> bool:
+    global _executor, _dispatcher
+    if _dispatcher and _dispatcher.is_alive():
+        return True
+    _stop.clear()
+    _executor = ThreadPoolExecutor(max_workers=PAYMENT_OPS_WORKERS, thread_name_prefix="payment-ops")
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="payment-ops-dispatch", daemon=True)
+    _dispatcher.start()
+    return True
+
+
+def stop_worker() -> None:
+    _stop.set()
+    _wake.set()
+    if _executor:
+        _executor.shutdown(wait=False)
+
+
+# ================= Routes =================
+router = APIRouter(tags=["payments"])
+
+
+def _session_user(request: Request, db: Session) -> Optional[User]:
+    uid = (request.session.get("user") or {}).get("id")
+    return db.get(User, uid) if uid else None
+
+
+def _is_staff(u: Optional[User]) -> bool:
+    return bool(u and (u.role == "admin" or getattr(u, "is_deposit_manager", False)))
+
+
+@router.get("/bookings/{booking_id}/payment-ops")
+def booking_payment_ops(booking_id: int, request: Request, db: Session = Depends(get_db)):
+    """Polled by the booking flow page while an operation is pending."""
+    user = _session_user(request, db)
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    bk = db.get(Booking, booking_id)
+    if not bk:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if user.id not in (bk.renter_id, bk.owner_id) and not _is_staff(user):
+        raise HTTPException(status_code=403)
+    return {"booking_id": bk.id, "operations": for_booking(db, bk.id)}
+
+
+@router.get("/admin/payment-ops")
+def admin_payment_ops(request: Request, status: Optional[str] = None, limit: int = 100, db: Session = Depends(get_db)):
+    if not _is_staff(_session_user(request, db)):
+        raise HTTPException(status_code=403, detail="Admin only")
+    q = db.query(PaymentOperation)
+    if status:
+        q = q.filter(PaymentOperation.status == status)
+    rows = q.order_by(PaymentOperation.id.desc()).limit(max(1, min(limit, 500))).all()
+    return {"operations": [describe(r) for r in rows]}
+
+
+@router.post("/admin/payment-ops/{op_id}/retry")
+def admin_retry_payment_op(op_id: int, request: Request, db: Session = Depends(get_db)):
+    """Requeue a failed operation (same idempotency key)."""
+    if not _is_staff(_session_user(request, db)):
+        raise HTTPException(status_code=403, detail="Admin only")
+    n = db.query(PaymentOperation).filter(
+        PaymentOperation.id == op_id, PaymentOperation.status == "failed"
+    ).update(
+        {"status": "pending", "attempts": 0, "next_attempt_at": datetime.utcnow(), "completed_at": None},
+        synchronize_session=False,
+    )
+    db.commit()
+    if not n:
+        raise HTTPException(status_code=409, detail="Only failed operations can be retried")
+    kick()
+    return {"ok": True, "id": op_id}
@@ -1,7 +1,32 @@
 # app/paypal_client.py
+"""
+Shared PayPal REST client.
+
+- One long-lived pooled httpx.Client (sync handlers, robots) and one
+  httpx.AsyncClient (async handlers) with keep-alive, so calls reuse the TLS
+  connection instead of handshaking every time.
+- The OAuth token is cached until `expires_in` minus a safety margin. A
+  single fetch is in flight at a time (threading.Lock); async callers refresh
+  it through a worker thread so both sides share the same token. A 401 drops
+  the cached token and the call is retried once with a fresh one.
+- Latency / status counters per endpoint template
+  ("POST /v2/checkout/orders/{order_id}/capture"), shown at
+  GET /admin/paypal/metrics.
+
+PAYPAL_BASE_URL overrides the sandbox/live URL, e.g. to run against the local
+mock server:  python mock_paypal.py --port 8099
+              PAYPAL_BASE_URL=http://127.0.0.1:8099 ...
+"""
+from __future__ import annotations
+
+import asyncio
 import os
-import base64
+import threading
+import time
+from collections import deque
+
 import httpx
+from fastapi import APIRouter, HTTPException, Request
 
 PAYPAL_MODE = os.getenv("PAYPAL_MODE", "sandbox")
 
@@ -9,38 +34,318 @@ if PAYPAL_MODE == "live":
     BASE_URL = "https://api-m.paypal.com"
 else:
     BASE_URL = "https://api-m.sandbox.paypal.com"
+BASE_URL = (os.getenv("PAYPAL_BASE_URL") or BASE_URL).rstrip("/")
 
 CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
-SECRET = os.getenv("PAYPAL_SECRET")
+# pay_api.py historically read PAYPAL_CLIENT_SECRET, this module PAYPAL_SECRET
+SECRET = os.getenv("PAYPAL_SECRET") or os.getenv("PAYPAL_CLIENT_SECRET")
 
+PAYPAL_TIMEOUT_SECONDS = float(os.getenv("PAYPAL_TIMEOUT_SECONDS", "20"))
+PAYPAL_CONNECT_TIMEOUT_SECONDS = float(os.getenv("PAYPAL_CONNECT_TIMEOUT_SECONDS", "5"))
+PAYPAL_MAX_CONNECTIONS = int(os.getenv("PAYPAL_MAX_CONNECTIONS", "20"))
+PAYPAL_KEEPALIVE_CONNECTIONS = int(os.getenv("PAYPAL_KEEPALIVE_CONNECTIONS", "10"))
+PAYPAL_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("PAYPAL_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# Refresh the token this long before PayPal says it expires
+PAYPAL_TOKEN_MARGIN_SECONDS = float(os.getenv("PAYPAL_TOKEN_MARGIN_SECONDS", "120"))
+# Latency samples kept per endpoint for the percentiles
+PAYPAL_METRICS_WINDOW = int(os.getenv("PAYPAL_METRICS_WINDOW", "500"))
 
-class PayPalError(Exception):
-    pass
+TOKEN_ENDPOINT = "/v1/oauth2/token"
 
 
-async def _get_access_token():
-    auth = base64.b64encode(f"{CLIENT_ID}:{SECRET}".encode()).decode()
-    headers = {
-        "Authorization": f"Basic {auth}",
-        "Content-Type": "application/x-www-form-urlencoded",
+class PayPalError(RuntimeError):
+    def __init__(self, message, status_code: int | None = None, endpoint: str | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.endpoint = endpoint
+
+
+# =====================================================
+# HTTP clients (one per process, created lazily)
+# =====================================================
+
+def _client_kwargs() -> dict:
+    return {
+        "base_url": BASE_URL,
+        "timeout": httpx.Timeout(PAYPAL_TIMEOUT_SECONDS, connect=PAYPAL_CONNECT_TIMEOUT_SECONDS),
+        "limits": httpx.Limits(
+            max_connections=PAYPAL_MAX_CONNECTIONS,
+            max_keepalive_connections=PAYPAL_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=PAYPAL_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        "headers": {"Accept": "application/json"},
     }
 
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f"{BASE_URL}/v1/oauth2/token",
+
+_client_lock = threading.Lock()
+_sync_client: httpx.Client | None = None
+_async_client: httpx.AsyncClient | None = None
+_async_loop = None
+
+
+def get_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        with _client_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(**_client_kwargs())
+    return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    # An AsyncClient's connections belong to the loop that opened them; a new
+    # loop (tests, CLI scripts calling asyncio.run twice) gets its own client.
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_client = httpx.AsyncClient(**_client_kwargs())
+        _async_loop = loop
+    return _async_client
+
+
+def close() -> None:
+    """Close both clients (app shutdown)."""
+    global _sync_client, _async_client, _async_loop
+    with _client_lock:
+        client, _sync_client = _sync_client, None
+    if client is not None:
+        client.close()
+    aclient, loop = _async_client, _async_loop
+    _async_client = _async_loop = None
+    if aclient is not None and loop is not None and not loop.is_closed():
+        try:
+            if loop.is_running():
+                loop.create_task(aclient.aclose())
+            else:
+                loop.run_until_complete(aclient.aclose())
+        except Exception as e:
+            print(f"[WARN] paypal async client close failed: {e}")
+
+
+# =====================================================
+# Metrics
+# =====================================================
+
+_metrics_lock = threading.Lock()
+_metrics: dict[str, dict] = {}
+
+
+def _record(endpoint: str, ms: float, status: int | None) -> None:
+    with _metrics_lock:
+        st = _metrics.get(endpoint)
+        if st is None:
+            st = _metrics[endpoint] = {
+                "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "status": {}, "samples": deque(maxlen=PAYPAL_METRICS_WINDOW),
+            }
+        st["calls"] += 1
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+        st["samples"].append(ms)
+        key = str(status) if status is not None else "network_error"
+        st["status"][key] = st["status"].get(key, 0) + 1
+        if status is None or status >= 400:
+            st["errors"] += 1
+
+
+def _pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def metrics() -> list[dict]:
+    with _metrics_lock:
+        snap = [(k, dict(v), sorted(v["samples"])) for k, v in _metrics.items()]
+    rows = []
+    for endpoint, st, samples in snap:
+        rows.append({
+            "endpoint": endpoint,
+            "calls": st["calls"],
+            "errors": st["errors"],
+            "status": dict(st["status"]),
+            "avg_ms": round(st["total_ms"] / st["calls"], 1) if st["calls"] else 0,
+            "p50_ms": round(_pct(samples, 50), 1),
+            "p95_ms": round(_pct(samples, 95), 1),
+            "p99_ms": round(_pct(samples, 99), 1),
+            "max_ms": round(st["max_ms"], 1),
+        })
+    rows.sort(key=lambda r: r["calls"], reverse=True)
+    return rows
+
+
+# =====================================================
+# OAuth token cache
+# =====================================================
+
+class _TokenCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self.fetches = 0
+
+    def _fresh(self) -> str | None:
+        if self._token and time.monotonic() < self._expires_at:
+            return self._token
+        return None
+
+    def get(self) -> str:
+        token = self._fresh()
+        if token:
+            return token
+        with self._lock:
+            # Another thread may have refreshed it while we waited
+            token = self._fresh()
+            if token:
+                return token
+            data = _fetch_token()
+            expires_in = float(data.get("expires_in") or 0)
+            self._token = data["access_token"]
+            # Short-lived tokens keep at least half their TTL
+            margin = min(PAYPAL_TOKEN_MARGIN_SECONDS, expires_in / 2)
+            self._expires_at = time.monotonic() + max(0.0, expires_in - margin)
+            self.fetches += 1
+            return self._token
+
+    async def aget(self) -> str:
+        token = self._fresh()
+        if token:
+            return token
+        # Refresh in a worker thread so sync and async callers share one fetch
+        return await asyncio.to_thread(self.get)
+
+    def invalidate(self, token: str | None = None) -> None:
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def status(self) -> dict:
+        left = self._expires_at - time.monotonic() if self._token else 0
+        return {"cached": bool(self._fresh()), "seconds_left": round(max(0.0, left)), "fetches": self.fetches}
+
+
+def _fetch_token() -> dict:
+    if not CLIENT_ID or not SECRET:
+        raise PayPalError("PayPal credentials missing", endpoint=f"POST {TOKEN_ENDPOINT}")
+
+    endpoint = f"POST {TOKEN_ENDPOINT}"
+    t0 = time.perf_counter()
+    try:
+        r = get_client().post(
+            TOKEN_ENDPOINT,
             data={"grant_type": "client_credentials"},
-            headers=headers,
+            auth=(CLIENT_ID, SECRET),
         )
+    except httpx.HTTPError as e:
+        _record(endpoint, (time.perf_counter() - t0) * 1000, None)
+        raise PayPalError(f"PayPal token request failed: {e}", endpoint=endpoint) from e
+    _record(endpoint, (time.perf_counter() - t0) * 1000, r.status_code)
 
     if r.status_code != 200:
-        raise PayPalError(r.text)
+        raise PayPalError(r.text, status_code=r.status_code, endpoint=endpoint)
+    return r.json()
 
-    return r.json()["access_token"]
 
+token_cache = _TokenCache()
 
-async def create_paypal_order(amount, currency, return_url, cancel_url, reference_id, description, custom_id):
-    token = await _get_access_token()
 
+def get_access_token() -> str:
+    return token_cache.get()
+
+
+# =====================================================
+# Requests
+# =====================================================
+
+def _headers(token: str, extra: dict | None) -> dict:
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    if extra:
+        headers.update(extra)
+    return headers
+
+
+def _result(r: httpx.Response, endpoint: str) -> dict:
+    if r.status_code >= 400:
+        raise PayPalError(r.text, status_code=r.status_code, endpoint=endpoint)
+    return r.json() if r.content else {}
+
+
+def request(method: str, path: str, *, json=None, headers: dict | None = None, **path_params) -> dict:
+    """
+    Call PayPal with the cached token. `path` is the endpoint template
+    ("/v2/checkout/orders/{order_id}/capture"), filled from path_params;
+    metrics are keyed by the template.
+    """
+    endpoint = f"{method.upper()} {path}"
+    url = path.format(**path_params)
+    for attempt in (1, 2):
+        token = token_cache.get()
+        t0 = time.perf_counter()
+        try:
+            r = get_client().request(method, url, json=json, headers=_headers(token, headers))
+        except httpx.HTTPError as e:
+            _record(endpoint, (time.perf_counter() - t0) * 1000, None)
+            raise PayPalError(f"PayPal request failed: {e}", endpoint=endpoint) from e
+        _record(endpoint, (time.perf_counter() - t0) * 1000, r.status_code)
+        if r.status_code == 401 and attempt == 1:
+            # Revoked / expired early: drop it and retry once with a new token
+            token_cache.invalidate(token)
+            continue
+        return _result(r, endpoint)
+
+
+async def arequest(method: str, path: str, *, json=None, headers: dict | None = None, **path_params) -> dict:
+    """Async twin of request()."""
+    endpoint = f"{method.upper()} {path}"
+    url = path.format(**path_params)
+    for attempt in (1, 2):
+        token = await token_cache.aget()
+        t0 = time.perf_counter()
+        try:
+            r = await get_async_client().request(method, url, json=json, headers=_headers(token, headers))
+        except httpx.HTTPError as e:
+            _record(endpoint, (time.perf_counter() - t0) * 1000, None)
+            raise PayPalError(f"PayPal request failed: {e}", endpoint=endpoint) from e
+        _record(endpoint, (time.perf_counter() - t0) * 1000, r.status_code)
+        if r.status_code == 401 and attempt == 1:
+            token_cache.invalidate(token)
+            continue
+        return _result(r, endpoint)
+
+
+# =====================================================
+# Orders / captures
+# =====================================================
+
+def approval_link(order: dict) -> str:
+    for link in order.get("links", []):
+        if link.get("rel") == "approve":
+            return link["href"]
+    raise PayPalError("PayPal approval link not found")
+
+
+def create_order(payload: dict) -> dict:
+    return request("POST", "/v2/checkout/orders", json=payload)
+
+
+def capture_order(order_id: str) -> dict:
+    return request("POST", "/v2/checkout/orders/{order_id}/capture", order_id=order_id)
+
+
+def refund_capture(capture_id: str, payload: dict, request_id: str | None = None) -> dict:
+    # PayPal-Request-Id makes a retried refund return the first one
+    headers = {"PayPal-Request-Id": request_id} if request_id else None
+    return request("POST", "/v2/payments/captures/{capture_id}/refund", json=payload, headers=headers,
+                   capture_id=capture_id)
+
+
+async def _get_access_token():
+    return await token_cache.aget()
+
+
+async def create_paypal_order(amount, currency, return_url, cancel_url, reference_id, description, custom_id):
     payload = {
         "intent": "CAPTURE",
         "purchase_units": [{
@@ -58,44 +363,37 @@ async def create_paypal_order(amount, currency, return_url, cancel_url, referenc
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f"{BASE_URL}/v2/checkout/orders",
-            json=payload,
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-        )
-
-    if r.status_code not in (200, 201):
-        raise PayPalError(r.text)
-
-    data = r.json()
-    approve_url = next(l["href"] for l in data["links"] if l["rel"] == "approve")
+    data = await arequest("POST", "/v2/checkout/orders", json=payload)
 
     return {
         "order_id": data["id"],
-        "approval_url": approve_url
+        "approval_url": approval_link(data)
     }
 
 
 async def capture_paypal_order(order_id):
-    token = await _get_access_token()
-
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f"{BASE_URL}/v2/checkout/orders/{order_id}/capture",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-        )
-
-    if r.status_code not in (200, 201):
-        raise PayPalError(r.text)
-
-    data = r.json()
+    data = await arequest("POST", "/v2/checkout/orders/{order_id}/capture", order_id=order_id)
     capture_id = data["purchase_units"][0]["payments"]["captures"][0]["id"]
 
     return {"capture_id": capture_id}
+
+
+# ================= Admin =================
+router = APIRouter(prefix="/admin/paypal", tags=["admin"])
+
+
+@router.get("/metrics")
+def paypal_metrics(request: Request):
+    u = request.session.get("user") or {}
+    if u.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {
+        "base_url": BASE_URL,
+        "token": token_cache.status(),
+        "pool": {
+            "max_connections": PAYPAL_MAX_CONNECTIONS,
+            "keepalive_connections": PAYPAL_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry_seconds": PAYPAL_KEEPALIVE_EXPIRY_SECONDS,
+        },
+        "endpoints": metrics(),
+    }
@@ -1,15 +1,60 @@
 # app/platform_wallet.py
+"""
+Platform wallet (site balance).
+
+The balance is not a row that every payment updates: `platform_ledger` is
+append-only and the balance is derived from it,
+
+    balance = latest platform_balance_snapshots row
+              + effect of every ledger row with id > snapshot.last_ledger_id
+
+so money movements are plain INSERTs and concurrent payment / refund flows
+never wait on each other. A scheduler job folds the ledger tail into a new
+snapshot every few minutes (only rows older than SNAPSHOT_LAG_SECONDS, so a
+transaction that got its id earlier but committed later is not skipped), and
+`reconcile()` re-adds the ledger between snapshots to prove the chain.
+
+Only spend_available() (money leaving the platform) needs to see a settled
+balance for its sufficient-funds check; it serializes on a transaction-level
+advisory lock on Postgres, which inflows never take.
+
+The legacy single `platform_balance` row is read once, as the opening snapshot.
+
+CLI:
+    python -m app.platform_wallet balance
+    python -m app.platform_wallet snapshot
+    python -m app.platform_wallet reconcile     # exit code 1 on mismatch
+"""
 from __future__ import annotations
 
+import os
 from decimal import Decimal
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import case, func, insert, text
+from sqlalchemy.exc import IntegrityError
+
+from .database import _backend_name
+from .models import PlatformBalanceSnapshot, PlatformLedger
+
+# جدول: platform_ledger (سجل العمليات) — append-only
+# جدول: platform_balance_snapshots (لقطات الرصيد)
+
+SNAPSHOT_LAG_SECONDS = int(os.getenv("PLATFORM_WALLET_SNAPSHOT_LAG_SECONDS", "300"))
+# Any constant: key of the advisory lock taken by spend_available
+_SPEND_LOCK_KEY = 7_204_110
 
-# جدول: platform_balance (صف واحد فقط)
-# جدول: platform_ledger (سجل العمليات)
+# ledger type -> (effect on available, effect on hold) per unit of amount.
+# Types not listed move `available` by their direction (in: +, out: -).
+EFFECTS: dict[str, tuple[int, int]] = {
+    "deposit_hold_in": (0, 1),
+    "hold_to_available": (1, -1),
+    "platform_spend": (-1, 0),
+    "refund_revert": (1, 0),
+    "manual_topup": (1, 0),
+}
 
 
 def _dec(v) -> Decimal:
@@ -19,34 +64,121 @@ def _dec(v) -> Decimal:
         return Decimal("0")
 
 
-def get_balance_row_locked(db: Session) -> dict:
+def _money(v) -> Decimal:
+    return _dec(v).quantize(Decimal("0.01"))
+
+
+# ================= Derived balance =================
+def _deltas():
+    amt = PlatformLedger.amount
+    by_direction = case((PlatformLedger.direction == "out", -amt), else_=amt)
+    avail = case(*[(PlatformLedger.type == t, amt * a) for t, (a, _h) in EFFECTS.items()], else_=by_direction)
+    hold = case(*[(PlatformLedger.type == t, amt * h) for t, (_a, h) in EFFECTS.items()], else_=0)
+    return avail, hold
+
+
+def _sum_ledger(db: Session, after_id: int, upto_id: Optional[int] = None) -> tuple[Decimal, Decimal, int, int]:
+    """(available delta, hold delta, row count, max id) of ledger rows in (after_id, upto_id]."""
+    avail, hold = _deltas()
+    q = db.query(
+        func.coalesce(func.sum(avail), 0),
+        func.coalesce(func.sum(hold), 0),
+        func.count(PlatformLedger.id),
+        func.coalesce(func.max(PlatformLedger.id), after_id),
+    ).filter(PlatformLedger.id > after_id)
+    if upto_id is not None:
+        q = q.filter(PlatformLedger.id <= upto_id)
+    a, h, n, last = q.one()
+    return _dec(a), _dec(h), int(n or 0), int(last or after_id)
+
+
+def _latest_snapshot(db: Session) -> Optional[PlatformBalanceSnapshot]:
+    return db.query(PlatformBalanceSnapshot).order_by(PlatformBalanceSnapshot.last_ledger_id.desc()).first()
+
+
+def ensure_opening_snapshot(db: Session) -> PlatformBalanceSnapshot:
     """
-    يرجّع صف الرصيد مع قفل FOR UPDATE (مهم ضد التزامن).
+    First snapshot: the legacy platform_balance row, covering every ledger row
+    written so far (those were already applied to that row).
     """
-    row = db.execute(
-        text("""
-            SELECT id, available_amount, hold_amount
-            FROM platform_balance
-            ORDER BY id ASC
-            LIMIT 1
-            FOR UPDATE
-        """)
-    ).mappings().first()
+    snap = _latest_snapshot(db)
+    if snap is not None:
+        return snap
+    row = None
+    try:
+        row = db.execute(text(
+            "SELECT available_amount, hold_amount FROM platform_balance ORDER BY id ASC LIMIT 1"
+        )).first()
+    except Exception:
+        db.rollback()
+    last_id = db.query(func.coalesce(func.max(PlatformLedger.id), 0)).scalar() or 0
+    try:
+        db.add(PlatformBalanceSnapshot(
+            last_ledger_id=int(last_id),
+            available_amount=_money(row[0] if row else 0),
+            hold_amount=_money(row[1] if row else 0),
+            kind="opening",
+            created_at=datetime.utcnow(),
+        ))
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # another worker wrote it first
+    return _latest_snapshot(db)
 
-    if not row:
-        # لو ما فيه صف، ننشئ واحد
-        db.execute(text("INSERT INTO platform_balance (available_amount, hold_amount) VALUES (0,0)"))
-        row = db.execute(
-            text("""
-                SELECT id, available_amount, hold_amount
-                FROM platform_balance
-                ORDER BY id ASC
-                LIMIT 1
-                FOR UPDATE
-            """)
-        ).mappings().first()
 
-    return dict(row)
+def get_balance(db: Session) -> dict:
+    """
+    Current balance: latest snapshot + ledger tail. Includes this
+    transaction's own uncommitted ledger rows.
+    """
+    snap = _latest_snapshot(db)
+    if snap is None:
+        from .database import SessionLocal
+
+        own = SessionLocal()
+        try:
+            ensure_opening_snapshot(own)
+        finally:
+            own.close()
+        snap = _latest_snapshot(db)
+    base_avail = _dec(snap.available_amount) if snap else Decimal("0")
+    base_hold = _dec(snap.hold_amount) if snap else Decimal("0")
+    after_id = snap.last_ledger_id if snap else 0
+    a, h, n, last = _sum_ledger(db, after_id)
+    return {
+        "available_amount": _money(base_avail + a),
+        "hold_amount": _money(base_hold + h),
+        "snapshot_id": snap.id if snap else None,
+        "snapshot_at": snap.created_at if snap else None,
+        "tail_rows": n,
+        "as_of_ledger_id": last,
+    }
+
+
+# ================= Ledger writes =================
+_opening_ready = False
+
+
+def _ensure_opening_once() -> None:
+    """
+    The opening snapshot must exist before the first new-style ledger row,
+    otherwise that row would be counted as already included in the legacy
+    balance row. Checked once per process, in its own session.
+    """
+    global _opening_ready
+    if _opening_ready:
+        return
+    from .database import SessionLocal
+
+    own = SessionLocal()
+    try:
+        ensure_opening_snapshot(own)
+        _opening_ready = True
+    except Exception as e:
+        own.rollback()
+        print(f"[WARN] platform wallet opening snapshot failed: {e}")
+    finally:
+        own.close()
 
 
 def ledger_add(
@@ -58,19 +190,17 @@ def ledger_add(
     booking_id: Optional[int] = None,
     note: Optional[str] = None,
 ):
+    _ensure_opening_once()
     db.execute(
-        text("""
-            INSERT INTO platform_ledger (type, amount, direction, source, booking_id, note)
-            VALUES (:type, :amount, :direction, :source, :booking_id, :note)
-        """),
-        {
-            "type": type,
-            "amount": float(_dec(amount)),
-            "direction": direction,
-            "source": source,
-            "booking_id": booking_id,
-            "note": note,
-        },
+        insert(PlatformLedger.__table__).values(
+            type=type,
+            amount=_money(amount),
+            direction=direction,
+            source=source,
+            booking_id=booking_id,
+            note=note,
+            created_at=datetime.utcnow(),
+        )
     )
 
 
@@ -82,14 +212,6 @@ def add_hold(db: Session, amount, source="paypal", booking_id: Optional[int] = N
     amt = _dec(amount)
     if amt <= 0:
         return
-
-    bal = get_balance_row_locked(db)
-    new_hold = _dec(bal["hold_amount"]) + amt
-
-    db.execute(
-        text("UPDATE platform_balance SET hold_amount=:h, updated_at=NOW() WHERE id=:id"),
-        {"h": float(new_hold), "id": bal["id"]},
-    )
     ledger_add(db, "deposit_hold_in", amt, "in", source, booking_id, note)
 
 
@@ -103,28 +225,22 @@ def hold_to_available(db: Session, amount, source="paypal", booking_id: Optional
     if amt <= 0:
         return
 
-    bal = get_balance_row_locked(db)
-    hold = _dec(bal["hold_amount"])
-    avail = _dec(bal["available_amount"])
-
+    hold = get_balance(db)["hold_amount"]
     if hold < amt:
-        # ما نكسر السيستم، نخليها صفر ونكمل (لكن نسجل)
-        amt = hold
+        # ما نكسر السيستم، نخليها بقدر الـ hold ونكمل (لكن نسجل)
+        amt = max(hold, Decimal("0"))
+        if amt <= 0:
+            return
 
-    new_hold = hold - amt
-    new_avail = avail + amt
-
-    db.execute(
-        text("""
-            UPDATE platform_balance
-            SET hold_amount=:h, available_amount=:a, updated_at=NOW()
-            WHERE id=:id
-        """),
-        {"h": float(new_hold), "a": float(new_avail), "id": bal["id"]},
-    )
     ledger_add(db, "hold_to_available", amt, "in", source, booking_id, note)
 
 
+def _lock_spends(db: Session) -> None:
+    """Serialize outflows only (sufficient-funds check); SQLite already has one writer."""
+    if str(_backend_name()).startswith("postgres"):
+        db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _SPEND_LOCK_KEY})
+
+
 def spend_available(db: Session, amount, source="robot", booking_id: Optional[int] = None, note: str = ""):
     """
     عند خروج فلوس من رصيد المنصّة (Refund / payout etc)
@@ -134,16 +250,11 @@ def spend_available(db: Session, amount, source="robot", booking_id: Optional[in
     if amt <= 0:
         return
 
-    bal = get_balance_row_locked(db)
-    avail = _dec(bal["available_amount"])
+    _lock_spends(db)
+    avail = get_balance(db)["available_amount"]
     if avail < amt:
         raise ValueError(f"Not enough platform available balance. Have={avail}, need={amt}")
 
-    new_avail = avail - amt
-    db.execute(
-        text("UPDATE platform_balance SET available_amount=:a, updated_at=NOW() WHERE id=:id"),
-        {"a": float(new_avail), "id": bal["id"]},
-    )
     ledger_add(db, "platform_spend", amt, "out", source, booking_id, note)
 
 
@@ -154,13 +265,113 @@ def refund_revert(db: Session, amount, source="system", booking_id: Optional[int
     amt = _dec(amount)
     if amt <= 0:
         return
+    ledger_add(db, "refund_revert", amt, "in", source, booking_id, note)
 
-    bal = get_balance_row_locked(db)
-    avail = _dec(bal["available_amount"])
-    new_avail = avail + amt
 
-    db.execute(
-        text("UPDATE platform_balance SET available_amount=:a, updated_at=NOW() WHERE id=:id"),
-        {"a": float(new_avail), "id": bal["id"]},
+def manual_topup(db: Session, amount, source="admin", note: str = ""):
+    amt = _dec(amount)
+    if amt <= 0:
+        return
+    ledger_add(db, "manual_topup", amt, "in", source, None, note)
+
+
+# ================= Snapshots / reconciliation =================
+def take_snapshot(db: Session, *, lag_seconds: Optional[int] = None) -> Optional[dict]:
+    """
+    Fold ledger rows older than the lag into a new snapshot. Returns the
+    snapshot summary, or None when there is nothing new to fold.
+    """
+    lag = SNAPSHOT_LAG_SECONDS if lag_seconds is None else lag_seconds
+    prev = ensure_opening_snapshot(db)
+    cutoff = datetime.utcnow() - timedelta(seconds=lag)
+    upto = (
+        db.query(func.max(PlatformLedger.id))
+        .filter(PlatformLedger.id > prev.last_ledger_id, PlatformLedger.created_at <= cutoff)
+        .scalar()
     )
-    ledger_add(db, "refund_revert", amt, "in", source, booking_id, note)
+    if not upto:
+        return None
+    a, h, n, _last = _sum_ledger(db, prev.last_ledger_id, upto)
+    snap = PlatformBalanceSnapshot(
+        last_ledger_id=int(upto),
+        available_amount=_money(_dec(prev.available_amount) + a),
+        hold_amount=_money(_dec(prev.hold_amount) + h),
+        kind="periodic",
+        created_at=datetime.utcnow(),
+    )
+    try:
+        db.add(snap)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return {"snapshot_id": snap.id, "last_ledger_id": snap.last_ledger_id, "rows": n,
+            "available_amount": str(snap.available_amount), "hold_amount": str(snap.hold_amount)}
+
+
+def reconcile(db: Session) -> dict:
+    """
+    Verify the chain: every snapshot must equal the previous one plus the
+    ledger rows between them, and the reported balance must equal the opening
+    snapshot plus every ledger row after it. A mismatch means a ledger row
+    was edited/deleted, or committed after a later snapshot was taken.
+    """
+    snaps = db.query(PlatformBalanceSnapshot).order_by(PlatformBalanceSnapshot.last_ledger_id.asc()).all()
+    if not snaps:
+        return {"ok": True, "snapshots": 0, "mismatches": [], "note": "no snapshots yet"}
+
+    mismatches = []
+    for prev, cur in zip(snaps, snaps[1:]):
+        a, h, n, _ = _sum_ledger(db, prev.last_ledger_id, cur.last_ledger_id)
+        exp_a = _money(_dec(prev.available_amount) + a)
+        exp_h = _money(_dec(prev.hold_amount) + h)
+        if exp_a != _money(cur.available_amount) or exp_h != _money(cur.hold_amount):
+            mismatches.append({
+                "snapshot_id": cur.id,
+                "ledger_range": [prev.last_ledger_id + 1, cur.last_ledger_id],
+                "expected": {"available_amount": str(exp_a), "hold_amount": str(exp_h)},
+                "stored": {"available_amount": str(_money(cur.available_amount)),
+                           "hold_amount": str(_money(cur.hold_amount))},
+            })
+
+    opening = snaps[0]
+    a, h, n, last = _sum_ledger(db, opening.last_ledger_id)
+    full = {
+        "available_amount": _money(_dec(opening.available_amount) + a),
+        "hold_amount": _money(_dec(opening.hold_amount) + h),
+    }
+    reported = get_balance(db)
+    balance_ok = (full["available_amount"] == reported["available_amount"]
+                  and full["hold_amount"] == reported["hold_amount"])
+    return {
+        "ok": balance_ok and not mismatches,
+        "snapshots": len(snaps),
+        "ledger_rows_after_opening": n,
+        "as_of_ledger_id": last,
+        "reported": {k: str(reported[k]) for k in ("available_amount", "hold_amount")},
+        "recomputed": {k: str(v) for k, v in full.items()},
+        "negative_available": reported["available_amount"] < 0,
+        "mismatches": mismatches,
+    }
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    from .database import SessionLocal
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "reconcile"
+    _db = SessionLocal()
+    try:
+        if cmd == "balance":
+            out = get_balance(_db)
+        elif cmd == "snapshot":
+            out = take_snapshot(_db)
+        else:
+            out = reconcile(_db)
+        print(json.dumps(out, default=str, indent=2))
+        if cmd == "reconcile" and not out.get("ok"):
+            sys.exit(1)
+    finally:
+        _db.close()
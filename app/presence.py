@@ -0,0 +1,256 @@
+# app/presence.py
+"""
+Who is online: per-session / per-user presence with TTL expiry.
+
+Beacons (app/metrics_buffer.py record_visit / record_heartbeat) call touch().
+Each worker keeps its own window in memory — sessions ordered by last beat,
+entries older than PRESENCE_TTL_SECONDS dropped from the front — and a
+publisher thread writes a snapshot of it every PRESENCE_PUBLISH_SECONDS to
+PRESENCE_DIR (one small JSON file per worker, replaced atomically).
+
+Reads merge the local window with the other workers' files (files not
+refreshed within the TTL belong to dead workers and are ignored / removed),
+cached for PRESENCE_CACHE_SECONDS:
+
+  online_count()        sessions online across all workers on this host
+  is_online(user_id)    for a single badge
+  online_user_ids(ids)  batch lookup (messages inbox)
+  GET /api/presence?ids=1,2,3
+
+PRESENCE_DIR defaults to a directory under the system temp dir; point it at a
+shared mount to aggregate across hosts. If it is not writable, presence falls
+back to this worker's window only.
+
+online_sessions (DB) keeps the flushed session history for reporting; the
+online_sessions_purge scheduler job deletes rows idle for more than
+ONLINE_SESSIONS_RETENTION_HOURS so that table stays small.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from .models_metrics import OnlineSession
+
+# ================= Settings =================
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", os.getenv("ONLINE_WINDOW_SECONDS", "120")))
+PRESENCE_PUBLISH_SECONDS = float(os.getenv("PRESENCE_PUBLISH_SECONDS", "5"))
+PRESENCE_CACHE_SECONDS = float(os.getenv("PRESENCE_CACHE_SECONDS", "2"))
+PRESENCE_DIR = os.getenv("PRESENCE_DIR") or os.path.join(tempfile.gettempdir(), "sevor-presence")
+ONLINE_SESSIONS_RETENTION_HOURS = int(os.getenv("ONLINE_SESSIONS_RETENTION_HOURS", "24"))
+ONLINE_SESSIONS_PURGE_BATCH = int(os.getenv("ONLINE_SESSIONS_PURGE_BATCH", "5000"))
+
+WORKER_FILE = f"{socket.gethostname()}-{os.getpid()}.json"
+
+
+# ================= Local window =================
+_lock = threading.Lock()
+_sessions: "OrderedDict[str, tuple[float, Optional[int]]]" = OrderedDict()  # sid -> (last beat, user id), oldest first
+_users: dict[int, float] = {}                                              # user id -> last beat
+
+
+def touch(session_id: str, user_id: Optional[int] = None) -> None:
+    now = time.time()
+    with _lock:
+        prev = _sessions.get(session_id)
+        uid = user_id or (prev[1] if prev else None)
+        _sessions[session_id] = (now, uid)
+        _sessions.move_to_end(session_id)
+        if uid:
+            _users[uid] = now
+
+
+def _expire_local(now: float) -> None:
+    # caller holds _lock
+    cutoff = now - PRESENCE_TTL_SECONDS
+    while _sessions:
+        ts = next(iter(_sessions.values()))[0]
+        if ts >= cutoff:
+            break
+        _sessions.popitem(last=False)
+    if len(_users) > len(_sessions):
+        for uid in [u for u, ts in _users.items() if ts < cutoff]:
+            del _users[uid]
+
+
+def _local_snapshot() -> tuple[dict, dict]:
+    with _lock:
+        _expire_local(time.time())
+        return ({sid: ts for sid, (ts, _) in _sessions.items()}, dict(_users))
+
+
+# ================= Shared store (one file per worker) =================
+_store_ok = True
+
+
+def _store_path(name: str = WORKER_FILE) -> str:
+    return os.path.join(PRESENCE_DIR, name)
+
+
+def publish() -> bool:
+    """Write this worker's window to PRESENCE_DIR (atomic replace)."""
+    global _store_ok
+    sessions, users = _local_snapshot()
+    try:
+        os.makedirs(PRESENCE_DIR, exist_ok=True)
+        tmp = _store_path(WORKER_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"at": time.time(), "sessions": sessions, "users": users}, f, separators=(",", ":"))
+        os.replace(tmp, _store_path())
+        _store_ok = True
+        return True
+    except Exception as e:
+        if _store_ok:
+            print(f"[WARN] presence store {PRESENCE_DIR} unavailable, using this worker only: {e}")
+        _store_ok = False
+        return False
+
+
+def _read_peers(now: float) -> list[dict]:
+    if not _store_ok:
+        return []
+    peers = []
+    try:
+        names = os.listdir(PRESENCE_DIR)
+    except Exception:
+        return []
+    for name in names:
+        if not name.endswith(".json") or name == WORKER_FILE:
+            continue
+        path = _store_path(name)
+        try:
+            age = now - os.path.getmtime(path)
+            if age > PRESENCE_TTL_SECONDS:
+                if age > PRESENCE_TTL_SECONDS * 10:
+                    os.remove(path)  # worker gone for good
+                continue
+            with open(path) as f:
+                peers.append(json.load(f))
+        except Exception:
+            continue  # being replaced / removed right now
+    return peers
+
+
+_agg_lock = threading.Lock()
+_agg: dict = {"at": 0.0, "sessions": {}, "users": {}}
+
+
+def _aggregate() -> dict:
+    now = time.time()
+    if now - _agg["at"] < PRESENCE_CACHE_SECONDS:
+        return _agg
+    with _agg_lock:
+        if now - _agg["at"] < PRESENCE_CACHE_SECONDS:
+            return _agg
+        sessions, users = _local_snapshot()
+        for peer in _read_peers(now):
+            for sid, ts in (peer.get("sessions") or {}).items():
+                if ts > sessions.get(sid, 0):
+                    sessions[sid] = ts
+            for uid, ts in (peer.get("users") or {}).items():
+                uid = int(uid)
+                if ts > users.get(uid, 0):
+                    users[uid] = ts
+        cutoff = now - PRESENCE_TTL_SECONDS
+        _agg.update(
+            at=now,
+            sessions={s: ts for s, ts in sessions.items() if ts >= cutoff},
+            users={u: ts for u, ts in users.items() if ts >= cutoff},
+        )
+        return _agg
+
+
+# ================= Lookups =================
+def online_count() -> int:
+    return len(_aggregate()["sessions"])
+
+
+def is_online(user_id: Optional[int]) -> bool:
+    return bool(user_id) and user_id in _aggregate()["users"]
+
+
+def online_user_ids(user_ids: Iterable[Optional[int]]) -> set[int]:
+    users = _aggregate()["users"]
+    return {u for u in user_ids if u and u in users}
+
+
+def last_seen(user_id: int) -> Optional[datetime]:
+    ts = _aggregate()["users"].get(user_id)
+    return datetime.utcfromtimestamp(ts) if ts else None
+
+
+# ================= DB purge (scheduler) =================
+def purge_online_sessions(db: Session) -> dict:
+    """Delete online_sessions rows idle for more than ONLINE_SESSIONS_RETENTION_HOURS."""
+    cutoff = datetime.utcnow() - timedelta(hours=ONLINE_SESSIONS_RETENTION_HOURS)
+    deleted = 0
+    while True:
+        ids = (
+            select(OnlineSession.session_id)
+            .where(OnlineSession.last_seen < cutoff)
+            .limit(ONLINE_SESSIONS_PURGE_BATCH)
+            .scalar_subquery()
+        )
+        n = db.execute(delete(OnlineSession).where(OnlineSession.session_id.in_(ids))).rowcount or 0
+        db.commit()
+        deleted += n
+        if n < ONLINE_SESSIONS_PURGE_BATCH:
+            break
+    return {"deleted": deleted}
+
+
+# ================= Publisher thread =================
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _loop() -> None:
+    while not _stop.wait(PRESENCE_PUBLISH_SECONDS):
+        publish()
+
+
+def start() -> bool:
+    global _thread
+    if _thread and _thread.is_alive():
+        return True
+    _stop.clear()
+    publish()
+    _thread = threading.Thread(target=_loop, name="presence-publish", daemon=True)
+    _thread.start()
+    return True
+
+
+def stop() -> None:
+    _stop.set()
+    try:
+        os.remove(_store_path())
+    except Exception:
+        pass
+
+
+# ================= Routes =================
+router = APIRouter(tags=["presence"])
+
+
+@router.get("/api/presence")
+def presence_lookup(request: Request, ids: str = ""):
+    """Online badge lookup: ?ids=1,2,3 → {"online": [ids that are online]}."""
+    if not request.session.get("user"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    wanted = []
+    for part in ids.split(",")[:100]:
+        part = part.strip()
+        if part.isdigit():
+            wanted.append(int(part))
+    return {"online": sorted(online_user_ids(wanted)), "ttl_seconds": PRESENCE_TTL_SECONDS}
@@ -1,83 +1,59 @@
 # app/profiles.py
 from __future__ import annotations
 
-from fastapi import APIRouter, Request, Depends, UploadFile, File, Form
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Depends, UploadFile, File, Form, HTTPException
+from fastapi.responses import FileResponse, RedirectResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from datetime import datetime
-import os, secrets
+import os
 
-from .database import get_db
+from .database import get_db, get_read_db
 from .models import User, Item, Rating, Document
 from .utils_badges import get_user_badges
 
-# --- Cloudinary ---
-import cloudinary
-import cloudinary.uploader
+from . import media_queue
+from .media_queue import queue_derivatives, stage_file
+from .utils_images import strip_metadata_inplace
 
-CLOUD_NAME = os.environ.get("CLOUDINARY_CLOUD_NAME")
-API_KEY    = os.environ.get("CLOUDINARY_API_KEY")
-API_SECRET = os.environ.get("CLOUDINARY_API_SECRET")
+AVATAR_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+DOC_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".pdf")
 
-if CLOUD_NAME and API_KEY and API_SECRET:
-    cloudinary.config(
-        cloud_name=CLOUD_NAME,
-        api_key=API_KEY,
-        api_secret=API_SECRET,
-        secure=True,
-    )
-
-def _ensure_cloudinary_keys() -> None:
-    if not (CLOUD_NAME and API_KEY and API_SECRET):
-        raise RuntimeError("Cloudinary credentials missing on server")
 
-def _upload_avatar_cloudinary(fileobj: UploadFile, *, folder: str = "sevor/avatars") -> str:
+def _stage_avatar(fileobj: UploadFile) -> str:
+    """Save the avatar locally (EXIF stripped) and return its /uploads URL."""
     if not fileobj:
         raise ValueError("no file provided")
     ctype = (fileobj.content_type or "").lower()
     if not ctype.startswith("image/"):
         raise ValueError("invalid content type")
-    _ensure_cloudinary_keys()
-
-    public_id = f"{secrets.token_hex(12)}"
-    res = cloudinary.uploader.upload(
-        fileobj.file,
-        folder=folder,
-        public_id=public_id,
-        overwrite=True,
-        resource_type="image",
-        format="jpg",
-        transformation=[{"quality": "auto:good"}],
-        invalidate=True,
-    )
-    url = res.get("secure_url") or res.get("url")
-    if not url:
-        raise RuntimeError("cloudinary upload failed")
-    return url
-
-def _upload_doc_cloudinary(fileobj: UploadFile, *, folder: str = "sevor/ids") -> str:
+    res = stage_file(fileobj, "avatars", AVATAR_EXTS, transform=strip_metadata_inplace)
+    if not res:
+        raise ValueError("unsupported image type")
+    queue_derivatives(res[0])
+    return res[1]
+
+def _stage_doc(fileobj: UploadFile) -> str:
+    """Save an ID document (image or PDF) in private storage and return its /private URL."""
     if not fileobj:
         raise ValueError("no file provided")
     ctype = (fileobj.content_type or "").lower()
     if not (ctype.startswith("image/") or ctype == "application/pdf"):
         raise ValueError("invalid document type")
-    _ensure_cloudinary_keys()
-
-    public_id = f"{secrets.token_hex(12)}"
-    res = cloudinary.uploader.upload(
-        fileobj.file,
-        folder=folder,
-        public_id=public_id,
-        overwrite=True,
-        resource_type="auto",
-        invalidate=True,
-        transformation=[{"quality": "auto:good"}] if ctype.startswith("image/") else None,
-    )
-    url = res.get("secure_url") or res.get("url")
-    if not url:
-        raise RuntimeError("cloudinary upload failed")
-    return url
+    res = stage_file(fileobj, "ids", DOC_EXTS, private=True)
+    if not res:
+        raise ValueError("unsupported document type")
+    return res[1]
+
+def _queue_cloud(db: Session, folder: str, target_table: str, target_id: int, *urls: str | None) -> None:
+    """Push staged files to Cloudinary in the background (local URL served meanwhile)."""
+    try:
+        for url in urls:
+            media_queue.enqueue(db, url, folder=folder, target_table=target_table, target_id=target_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print("Cloudinary enqueue failed:", e)
 
 router = APIRouter()
 
@@ -152,7 +128,7 @@ def profile(request: Request, db: Session = Depends(get_db)):
 
 # ======================== Public User Page ========================
 @router.get("/u/{user_id}")
-def public_profile(user_id: int, request: Request, db: Session = Depends(get_db)):
+def public_profile(user_id: int, request: Request, db: Session = Depends(get_read_db)):
     user: User | None = db.get(User, user_id)
     if not user:
         return RedirectResponse(url="/", status_code=303)
@@ -248,9 +224,10 @@ def profile_docs_post(
         try:
             if not avatar:
                 raise ValueError("no file")
-            new_url = _upload_avatar_cloudinary(avatar, folder="sevor/avatars")
+            new_url = _stage_avatar(avatar)
             user.avatar_path = new_url
             db.commit()
+            _queue_cloud(db, "sevor/avatars", "users", user.id, new_url)
 
             # Update session immediately so the new avatar appears in the UI
             sess = request.session.get("user") or {}
@@ -274,11 +251,14 @@ def profile_docs_post(
             except Exception:
                 pass
 
+        staged_docs = []
         try:
             if doc_front:
-                doc.file_front_path = _upload_doc_cloudinary(doc_front, folder="sevor/ids")
+                doc.file_front_path = _stage_doc(doc_front)
+                staged_docs.append(doc.file_front_path)
             if doc_back:
-                doc.file_back_path = _upload_doc_cloudinary(doc_back, folder="sevor/ids")
+                doc.file_back_path = _stage_doc(doc_back)
+                staged_docs.append(doc.file_back_path)
         except Exception:
             pass
 
@@ -288,6 +268,7 @@ def profile_docs_post(
         if doc not in user.documents:
             db.add(doc)
         db.commit()
+        _queue_cloud(db, "sevor/ids", "documents", user.id, *staged_docs)
 
         message = "Documents saved and sent for review."
 
@@ -302,3 +283,27 @@ def profile_docs_post(
             "message": message,
         }
     )
+
+# ========================== Private documents ==========================
+@router.get("/private/{path:path}")
+def private_document(path: str, request: Request, db: Session = Depends(get_db)):
+    """ID documents staged in private storage: only their owner and admins/moderators."""
+    u = request.session.get("user")
+    if not u:
+        raise HTTPException(status_code=401, detail="Login required")
+    url = f"/private/{path}"
+    fpath = media_queue.private_path_for(url)
+    if not fpath or not os.path.isfile(fpath):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    viewer: User | None = db.get(User, u["id"])
+    staff = bool(viewer) and ((viewer.role or "") == "admin" or bool(getattr(viewer, "is_mod", False)))
+    if not staff:
+        owns = db.query(Document.id).filter(
+            Document.user_id == u["id"],
+            or_(Document.file_front_path == url, Document.file_back_path == url),
+        ).first()
+        if not owns:
+            raise HTTPException(status_code=404, detail="Not found")
+
+    return FileResponse(fpath, headers={"Cache-Control": "private, no-store"})
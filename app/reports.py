@@ -6,11 +6,13 @@ from datetime import datetime
 from typing import Any, Dict, Optional
 from fastapi.responses import RedirectResponse
 
-from fastapi import APIRouter, Depends, Request, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Request, Form, HTTPException
 from fastapi.responses import JSONResponse, RedirectResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .database import get_db, engine
+from .database import SessionLocal, get_async_db, get_db, engine
 from .models import User, Item
 
 # =========================
@@ -277,7 +279,8 @@ def _log_action(db: Session, report_id: int, actor_id: int, action: str, note: O
 @router.post("/reports")
 async def create_report(
     request: Request,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
 
     # Support both Form and JSON
     item_id: int = Form(None),
@@ -310,7 +313,7 @@ async def create_report(
         raise HTTPException(status_code=422, detail="missing-required-fields")
 
     # Verify item exists and get owner
-    owner_id = _get_item_owner_id(db, item_id)
+    owner_id = await db.scalar(select(Item.owner_id).where(Item.id == int(item_id)))
     if not owner_id:
         raise HTTPException(status_code=404, detail="item-not-found")
 
@@ -325,23 +328,32 @@ async def create_report(
             payload={"ip": request.client.host if request.client else None},
         )
         db.add(report)
-        db.commit()
-        db.refresh(report)
+        await db.commit()
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="failed-to-create-report") from e
 
-    # Log the initial action "submitted"
-    _log_action(db, getattr(report, "id", 0), int(u["id"]), "submitted", note)
+    # Initial "submitted" log: best effort (same as _log_action), never fails the report
+    if ReportActionLog is not None:
+        try:
+            db.add(ReportActionLog(
+                report_id=report.id,
+                actor_id=int(u["id"]),
+                action="submitted",
+                note=(note or "").strip() or None,
+                created_at=datetime.utcnow(),
+            ))
+            await db.commit()
+        except Exception:
+            await db.rollback()
 
-    # Notify owner + admins/mods
-    try:
-        reporter_name = f"{u.get('first_name','').strip()} {u.get('last_name','').strip()}".strip() or f"User#{u['id']}"
-        _notify_owner_and_moderators(db, owner_id, reporter_name, int(item_id), str(reason), image_index)
-    except Exception:
-        pass
+    # Notify owner + admins/mods after the response, with their own session
+    reporter_name = f"{u.get('first_name','').strip()} {u.get('last_name','').strip()}".strip() or f"User#{u['id']}"
+    background_tasks.add_task(
+        _notify_report_bg, owner_id, reporter_name, int(item_id), str(reason), image_index
+    )
 
     return JSONResponse(
         {
@@ -354,13 +366,24 @@ async def create_report(
     )
 
 
+def _notify_report_bg(owner_id: int, reporter_name: str, item_id: int, reason: str, image_index: Optional[int]):
+    db = SessionLocal()
+    try:
+        _notify_owner_and_moderators(db, owner_id, reporter_name, item_id, reason, image_index)
+    except Exception:
+        pass
+    finally:
+        db.close()
+
+
 # =========================
 # (Legacy compatibility) /reports/new → reuse the same logic
 # =========================
 @router.post("/reports/new")
 async def create_report_legacy(
     request: Request,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db),
     item_id: int = Form(None),
     reason: str = Form(None),
     note: str | None = Form(None),
@@ -368,6 +391,7 @@ async def create_report_legacy(
 ):
     return await create_report(
         request=request,
+        background_tasks=background_tasks,
         db=db,
         item_id=item_id,
         reason=reason,
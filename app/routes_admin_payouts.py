@@ -3,12 +3,15 @@
 # =====================================================
 from fastapi import APIRouter, Request, Depends, HTTPException, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import Numeric, and_, case, cast, func, literal, select
 from sqlalchemy.orm import Session, joinedload
 from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
 import csv
 import io
+import os
 
-from .database import get_db
+from .database import SessionLocal, get_db
 from .models import Booking, User, UserPayoutMethod
 from .notifications_api import push_notification
 
@@ -28,43 +31,158 @@ def require_admin(user: User | None):
     if not user or user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
 
- # =====================================================
+# =====================================================
+# Payout queue (one query per section)
+# =====================================================
+PAYOUTS_PAGE_SIZE = int(os.getenv("PAYOUTS_PAGE_SIZE", "50"))
+
+# PayPal fee taken from the original deposit: 2.9% + 0.30
+DEPOSIT_FEE_PCT = 0.029
+DEPOSIT_FEE_FIXED = 0.30
+CENTS = Decimal("0.01")
+
+# Deposit statuses where the MD decision is final ✅
+DEPOSIT_FINAL_STATUSES = ("partially_withheld", "no_deposit", "refunded")
+
+QUEUE_CURRENCY = func.coalesce(Booking.currency_display, Booking.currency)
+
+
+def _rent_pending():
+    return and_(Booking.payout_ready == True, Booking.payout_sent == False)
+
+
+def _deposit_pending():
+    return and_(
+        Booking.dm_decision_amount > 0,
+        Booking.deposit_comp_sent == False,
+        Booking.deposit_status.in_(DEPOSIT_FINAL_STATUSES),
+    )
+
+
+def _money(expr):
+    return cast(expr, Numeric(12, 2))
+
+
+def _deposit_net_sql():
+    """
+    MD decision − PayPal fee on the original deposit, never below 0 (same as _deposit_breakdown).
+    Computed in NUMERIC: Postgres has no round(double precision, integer), which is
+    what Integer * Python float would give.
+    """
+    pct = literal(Decimal(str(DEPOSIT_FEE_PCT)), Numeric(6, 4))
+    fixed = literal(Decimal(str(DEPOSIT_FEE_FIXED)), Numeric(6, 2))
+    fee = func.round(_money(func.coalesce(Booking.deposit_amount, 0)) * pct + fixed, 2)
+    net = _money(func.coalesce(Booking.dm_decision_amount, 0)) - fee
+    return case((net > 0, func.round(net, 2)), else_=literal(Decimal("0"), Numeric(12, 2)))
+
+
+def _deposit_breakdown(b: Booking) -> dict:
+    """
+    Same arithmetic as _deposit_net_sql (exact decimals, half-up cents), so the
+    card, the queue totals and the CSV agree: deposit 15, MD 10 → fee 0.74, net 9.26.
+    """
+    # deposit الأصلي الذي دفعه الزبون (مثال: 20)
+    deposit_gross = Decimal(str(getattr(b, "deposit_amount", 0) or 0))
+    # مثال: 20 => 20*0.029 + 0.30 = 0.88
+    paypal_fee = (deposit_gross * Decimal(str(DEPOSIT_FEE_PCT)) + Decimal(str(DEPOSIT_FEE_FIXED))).quantize(CENTS, ROUND_HALF_UP)
+    # قرار MD الاسمي (مثال: 10)
+    md_amount = Decimal(str(getattr(b, "dm_decision_amount", 0) or 0))
+    # ✅ المبلغ الحقيقي الذي يمكن إرساله للمالك
+    net_to_owner = max((md_amount - paypal_fee).quantize(CENTS, ROUND_HALF_UP), Decimal("0"))
+    return {
+        "amount": float(net_to_owner),
+        "md_amount": float(md_amount),
+        "paypal_fee": float(paypal_fee),
+        "deposit_gross": float(deposit_gross),
+    }
+
+
+def _first_active_method():
+    """user_id → id of the owner's first active payout method (one row per owner)."""
+    return (
+        select(
+            UserPayoutMethod.user_id.label("user_id"),
+            func.min(UserPayoutMethod.id).label("method_id"),
+        )
+        .where(UserPayoutMethod.is_active == True)
+        .group_by(UserPayoutMethod.user_id)
+        .subquery()
+    )
+
+
+def _active_methods(db: Session, owner_ids) -> dict:
+    """Batched IN load: owner_id → active UserPayoutMethod."""
+    ids = {i for i in owner_ids if i}
+    if not ids:
+        return {}
+    out = {}
+    for m in (
+        db.query(UserPayoutMethod)
+        .filter(UserPayoutMethod.user_id.in_(ids), UserPayoutMethod.is_active == True)
+        .order_by(UserPayoutMethod.id.asc())
+    ):
+        out.setdefault(m.user_id, m)
+    return out
+
+
+def _queue_page(db: Session, pending, page: int, per_page: int):
+    """(Booking, UserPayoutMethod | None) rows of one queue section, owner eager-loaded."""
+    first = _first_active_method()
+    return (
+        db.query(Booking, UserPayoutMethod)
+        .options(joinedload(Booking.owner))
+        .outerjoin(first, first.c.user_id == Booking.owner_id)
+        .outerjoin(UserPayoutMethod, UserPayoutMethod.id == first.c.method_id)
+        .filter(pending)
+        .order_by(Booking.created_at.asc(), Booking.id.asc())
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+        .all()
+    )
+
+
+def _queue_totals(db: Session, pending, amount) -> list[dict]:
+    rows = (
+        db.query(QUEUE_CURRENCY, func.count(Booking.id), func.coalesce(func.sum(amount), 0))
+        .filter(pending)
+        .group_by(QUEUE_CURRENCY)
+        .order_by(QUEUE_CURRENCY)
+        .all()
+    )
+    return [
+        {"currency": cur or "—", "count": int(n), "amount": float(Decimal(str(total or 0)).quantize(CENTS, ROUND_HALF_UP))}
+        for cur, n, total in rows
+    ]
+
+
+def _pager(totals: list[dict], page: int, per_page: int) -> dict:
+    count = sum(t["count"] for t in totals)
+    pages = max(1, -(-count // per_page))
+    return {"page": page, "pages": pages, "count": count, "has_prev": page > 1, "has_next": page < pages}
+
+
+# =====================================================
 # GET – Pending payouts (RENT + DEPOSIT)
 # =====================================================
 @router.get("/payouts", response_class=HTMLResponse)
 def admin_payouts(
     request: Request,
+    page: int = 1,
+    dpage: int = 1,
     db: Session = Depends(get_db),
 ):
     user = get_current_user(request, db)
     require_admin(user)
 
+    per_page = PAYOUTS_PAGE_SIZE
+    page, dpage = max(1, page), max(1, dpage)
     rows = []
 
     # ==========================
     # RENT PAYOUTS (PENDING)
     # ==========================
-    rent_bookings = (
-        db.query(Booking)
-        .options(joinedload(Booking.owner))
-        .filter(
-            Booking.payout_ready == True,
-            Booking.payout_sent == False,
-        )
-        .order_by(Booking.created_at.asc())
-        .all()
-    )
-
-    for b in rent_bookings:
-        payout = (
-            db.query(UserPayoutMethod)
-            .filter(
-                UserPayoutMethod.user_id == b.owner_id,
-                UserPayoutMethod.is_active == True,
-            )
-            .first()
-        )
-
+    rent_totals = _queue_totals(db, _rent_pending(), Booking.owner_amount)
+    for b, payout in _queue_page(db, _rent_pending(), page, per_page):
         rows.append({
             "type": "rent",
             "booking": b,
@@ -78,66 +196,13 @@ def admin_payouts(
     # DEPOSIT COMPENSATIONS
     # (FINAL DECISION ONLY ✅)
     # ==========================
-    deposit_bookings = (
-        db.query(Booking)
-        .options(joinedload(Booking.owner))
-        .filter(
-            Booking.dm_decision_amount > 0,
-            Booking.deposit_comp_sent == False,
-
-            # ✅ القرار نهائي فقط
-            Booking.deposit_status.in_([
-                "partially_withheld",
-                "no_deposit",
-                "refunded",
-            ]),
-        )
-        .order_by(Booking.created_at.asc())
-        .all()
-    )
-
-    for b in deposit_bookings:
-        payout = (
-            db.query(UserPayoutMethod)
-            .filter(
-                UserPayoutMethod.user_id == b.owner_id,
-                UserPayoutMethod.is_active == True,
-            )
-            .first()
-        )
-
-        # ==========================
-        # DISPLAY ONLY LOGIC (DEPOSIT)
-        # ==========================
-        # deposit الأصلي الذي دفعه الزبون (مثال: 20)
-        deposit_gross = float(getattr(b, "deposit_amount", 0) or 0)
-
-        # ✅ PayPal fee محسوب من deposit الأصلي: 2.9% + 0.30
-        # مثال: 20 => 20*0.029 + 0.30 = 0.88
-        paypal_fee = round((deposit_gross * 0.029) + 0.30, 2)
-
-        # قرار MD الاسمي (مثال: 10)
-        md_amount = float(getattr(b, "dm_decision_amount", 0) or 0)
-
-        # ✅ المبلغ الحقيقي الذي يمكن إرساله للمالك
-        # (قرار MD − عمولة PayPal المحسوبة من deposit الأصلي)
-        net_to_owner = round(md_amount - paypal_fee, 2)
-        if net_to_owner < 0:
-            net_to_owner = 0.0
-
+    deposit_totals = _queue_totals(db, _deposit_pending(), _deposit_net_sql())
+    for b, payout in _queue_page(db, _deposit_pending(), dpage, per_page):
         rows.append({
             "type": "deposit",
             "booking": b,
             "owner": b.owner,
-
-            # ✅ هذا هو الرقم الذي يظهر في بطاقة الأدمن
-            "amount": net_to_owner,
-
-            # معلومات إضافية (عرض فقط)
-            "md_amount": md_amount,
-            "paypal_fee": paypal_fee,
-            "deposit_gross": deposit_gross,
-
+            **_deposit_breakdown(b),
             "currency": b.currency_display or b.currency,
             "payout": payout,
         })
@@ -148,10 +213,88 @@ def admin_payouts(
             "request": request,
             "user": user,
             "rows": rows,
+            "rent_totals": rent_totals,
+            "deposit_totals": deposit_totals,
+            "rent_pager": _pager(rent_totals, page, per_page),
+            "deposit_pager": _pager(deposit_totals, dpage, per_page),
             "session_user": request.session.get("user"),
         }
     )
 
+
+# =====================================================
+# GET – Payout queue CSV (bulk payout runs)
+# =====================================================
+CSV_COLUMNS = [
+    "type", "booking_id", "created_at", "owner_id", "owner_name", "owner_email",
+    "amount", "currency", "method", "destination", "method_currency", "country",
+]
+
+
+def _csv_rows(kind: str):
+    first = _first_active_method()
+    sections = []
+    if kind in ("all", "rent"):
+        sections.append(("rent", _rent_pending(), Booking.owner_amount))
+    if kind in ("all", "deposit"):
+        sections.append(("deposit", _deposit_pending(), _deposit_net_sql()))
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_COLUMNS)
+    yield buf.getvalue()
+
+    # Own session: the response body is streamed after the request's get_db session is gone
+    db = SessionLocal()
+    try:
+        for label, pending, amount in sections:
+            q = (
+                db.query(
+                    Booking.id, Booking.created_at, Booking.owner_id,
+                    User.first_name, User.last_name, User.email,
+                    amount.label("amount"), QUEUE_CURRENCY.label("currency"),
+                    UserPayoutMethod.method, UserPayoutMethod.destination,
+                    UserPayoutMethod.currency, UserPayoutMethod.country,
+                )
+                .join(User, User.id == Booking.owner_id)
+                .outerjoin(first, first.c.user_id == Booking.owner_id)
+                .outerjoin(UserPayoutMethod, UserPayoutMethod.id == first.c.method_id)
+                .filter(pending)
+                .order_by(Booking.created_at.asc(), Booking.id.asc())
+                .yield_per(500)
+            )
+            for r in q:
+                buf.seek(0)
+                buf.truncate(0)
+                writer.writerow([
+                    label, r[0], r[1].isoformat() if r[1] else "", r[2],
+                    f"{r[3] or ''} {r[4] or ''}".strip(), r[5] or "",
+                    f"{float(r[6] or 0):.2f}", r[7] or "",
+                    r[8] or "", r[9] or "", r[10] or "", r[11] or "",
+                ])
+                yield buf.getvalue()
+    finally:
+        db.close()
+
+
+@router.get("/payouts/export.csv")
+def admin_payouts_export(
+    request: Request,
+    type: str = "all",
+    db: Session = Depends(get_db),
+):
+    user = get_current_user(request, db)
+    require_admin(user)
+    if type not in ("all", "rent", "deposit"):
+        raise HTTPException(status_code=400, detail="type must be all, rent or deposit")
+
+    fname = f"payout_queue_{type}_{datetime.utcnow():%Y%m%d_%H%M}.csv"
+    return StreamingResponse(
+        _csv_rows(type),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{fname}"'},
+    )
+
 # =====================================================
 # POST – Mark RENT payout as sent
 # =====================================================
@@ -249,21 +392,11 @@ def admin_payouts_paid(
         .all()
     )
 
-    rows = []
-    for b in bookings:
-        payout = (
-            db.query(UserPayoutMethod)
-            .filter(
-                UserPayoutMethod.user_id == b.owner_id,
-                UserPayoutMethod.is_active == True,
-            )
-            .first()
-        )
-        rows.append({
-            "booking": b,
-            "owner": b.owner,
-            "payout": payout,
-        })
+    methods = _active_methods(db, (b.owner_id for b in bookings))
+    rows = [
+        {"booking": b, "owner": b.owner, "payout": methods.get(b.owner_id)}
+        for b in bookings
+    ]
 
     return request.app.templates.TemplateResponse(
         "admin_payouts_paid.html",
@@ -387,23 +520,17 @@ def admin_deposit_payouts_paid(
         .all()
     )
 
-    rows = []
-    for b in bookings:
-        payout = (
-            db.query(UserPayoutMethod)
-            .filter(
-                UserPayoutMethod.user_id == b.owner_id,
-                UserPayoutMethod.is_active == True,
-            )
-            .first()
-        )
-        rows.append({
+    methods = _active_methods(db, (b.owner_id for b in bookings))
+    rows = [
+        {
             "booking": b,
             "owner": b.owner,
             "amount": b.dm_decision_amount,
             "currency": b.currency_display or b.currency,
-            "payout": payout,
-        })
+            "payout": methods.get(b.owner_id),
+        }
+        for b in bookings
+    ]
 
     return request.app.templates.TemplateResponse(
         "admin_deposit_payouts_paid.html",
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Request, Depends, HTTPException, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from sqlalchemy.orm import Session
 
 from .database import get_db
-from .models import PlatformBalance, PlatformLedger, User
+from .models import PlatformLedger, User
+from . import platform_wallet
 
 router = APIRouter(prefix="/admin/wallet", tags=["admin-wallet"])
 
@@ -32,7 +33,7 @@ def wallet_page(
     user = get_current_user(request, db)
     require_admin(user)
 
-    balance = db.query(PlatformBalance).first()
+    balance = platform_wallet.get_balance(db)
 
     ledger = (
         db.query(PlatformLedger)
@@ -69,18 +70,20 @@ def wallet_topup(
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Invalid amount")
 
-    balance = db.query(PlatformBalance).first()
-    balance.available_amount += amount
-
-    db.add(
-        PlatformLedger(
-            type="manual_topup",
-            amount=amount,
-            direction="in",
-            source="admin",
-            note=note,
-        )
-    )
-
+    platform_wallet.manual_topup(db, amount, source="admin", note=note)
     db.commit()
     return RedirectResponse("/admin/wallet", status_code=303)
+
+
+# =========================
+# GET – Reconciliation (snapshot chain + ledger tail == reported balance)
+# =========================
+@router.get("/reconcile")
+def wallet_reconcile(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request, db)
+    require_admin(user)
+    res = platform_wallet.reconcile(db)
+    return JSONResponse(
+        {k: (str(v) if not isinstance(v, (dict, list, bool, int, type(None))) else v) for k, v in res.items()},
+        status_code=200 if res.get("ok") else 409,
+    )
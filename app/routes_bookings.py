@@ -5,11 +5,13 @@ import os
 
 from fastapi import APIRouter, Depends, Request, HTTPException, Form, Query
 from fastapi.responses import RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.sql import func
 
-from .database import get_db
-from .models import User, Item, Booking, UserReview
+from .database import get_async_db, get_db
+from . import availability, payment_ops
+from .models import User, Item, Booking, UserReview, booking_list_load
 from .utils import category_label, display_currency, fx_convert
 from .notifications_api import push_notification, notify_admins
 from .pay_api import paypal_start, paypal_return, compute_grand_total_for_paypal
@@ -34,6 +36,11 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optiona
     uid = data.get("id")
     return db.get(User, uid) if uid else None
 
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)) -> Optional[User]:
+    data = request.session.get("user") or {}
+    uid = data.get("id")
+    return await db.get(User, uid) if uid else None
+
 def require_auth(user: Optional[User]):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -56,8 +63,8 @@ def redirect_to_flow(bk: Booking):
 async def create_booking(
     request: Request,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user: Optional[User] = Depends(get_current_user_async),
 ):
     require_auth(user)
 
@@ -84,10 +91,14 @@ async def create_booking(
     if end_date <= start_date:
         raise HTTPException(status_code=400, detail="Invalid dates")
 
-    item = db.get(Item, item_id)
+    item = await db.get(Item, item_id)
     if not item:
         raise HTTPException(status_code=400, detail="Invalid item")
 
+    # ✅ Dates already taken by a confirmed booking
+    if not await db.run_sync(availability.is_available, item.id, start_date, end_date):
+        raise HTTPException(status_code=409, detail="Item is not available for these dates")
+
     days = max(1, (end_date - start_date).days)
     total_amount = days * item.price_per_day
 
@@ -128,8 +139,7 @@ async def create_booking(
     )
 
     db.add(bk)
-    db.commit()
-    db.refresh(bk)
+    await db.commit()
 
     # ✅ كل شيء ثقيل بالخلفية (إشعار + إيميل)
     background_tasks.add_task(_after_booking_created_bg, bk.id)
@@ -263,6 +273,9 @@ def booking_flow(
 
         # ⏱️ PASS DEADLINE TO TEMPLATE
         "dispute_deadline_iso": dispute_deadline_iso,
+
+        # Queued Stripe/PayPal operations (app/payment_ops.py)
+        "payment_ops": payment_ops.for_booking(db, bk.id),
     }
 
     return request.app.templates.TemplateResponse("booking_flow.html", ctx)
@@ -314,6 +327,10 @@ def owner_decision_route(
     # =========================
     # ✅ ACCEPTED
     # =========================
+    availability.lock_item(db, bk.item_id)
+    if availability.conflicts(db, bk.item_id, bk.start_date, bk.end_date, exclude_booking_id=bk.id):
+        raise HTTPException(status_code=409, detail="These dates are already booked for this item")
+
     bk.status = "accepted"
     bk.accepted_at = datetime.utcnow()
     bk.security_amount = deposit_amount
@@ -418,10 +435,11 @@ def bookings_index(
 ):
     require_auth(user)
 
+    qset = db.query(Booking).options(booking_list_load(), selectinload(Booking.item))
     if view == "owner":
-        bookings = db.query(Booking).filter(Booking.owner_id == user.id).all()
+        bookings = qset.filter(Booking.owner_id == user.id).all()
     else:
-        bookings = db.query(Booking).filter(Booking.renter_id == user.id).all()
+        bookings = qset.filter(Booking.renter_id == user.id).all()
 
     return request.app.templates.TemplateResponse(
         "booking_index.html",
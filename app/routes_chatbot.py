@@ -8,12 +8,14 @@ import json
 from functools import lru_cache
 from typing import Optional
 from datetime import datetime
+from sqlalchemy import select, update
 
+from . import ticket_events
 from .utils import display_currency
 from .auth import get_current_user
 from .models import User, SupportTicket, SupportMessage
-from .database import get_db
-from .notifications_api import push_notification
+from .database import engine, get_db
+from .notifications_api import push_notifications
 
 router = APIRouter(tags=["chatbot"])
 
@@ -85,6 +87,7 @@ def chatbot_open_ticket(
         unread_for_user=False,
         channel="chatbot",
         created_at=datetime.utcnow(),
+        last_msg_at=datetime.utcnow(),
     )
     db.add(t)
     db.flush()
@@ -98,23 +101,39 @@ def chatbot_open_ticket(
         created_at=datetime.utcnow(),
     )
     db.add(msg)
+    ticket_events.record(db, t.id, "created", actor_id=user.id, queue=t.queue, status=t.status, channel="chatbot")
     db.commit()
 
     # notify CS agents
-    agents = db.query(User).filter(User.is_support == True).all()
-    for ag in agents:
-        push_notification(
-            db,
-            ag.id,
-            "🤖 Chatbot escalation",
-            f"User needs help (ticket #{t.id})",
-            url=f"/cs/chatbot/ticket/{t.id}",
-            kind="support",
-        )
+    agent_ids = [r[0] for r in db.query(User.id).filter(User.is_support == True).all()]
+    push_notifications(
+        db,
+        agent_ids,
+        "🤖 Chatbot escalation",
+        f"User needs help (ticket #{t.id})",
+        url=f"/cs/chatbot/ticket/{t.id}",
+        kind="support",
+    )
 
     return {"ok": True, "ticket_id": t.id}
 
 
+def _update_open_ticket(db, ticket_id: int, **values):
+    """
+    UPDATE support_tickets SET ... WHERE id = :id AND status != 'closed', in one
+    statement; returns the ticket's queue / status afterwards, None if nothing matched.
+    """
+    T = SupportTicket.__table__
+    values = {k: v for k, v in values.items() if k in T.c}
+    stmt = update(T).where(T.c.id == ticket_id, T.c.status != "closed").values(**values)
+    cols = [T.c[c] for c in ("id", "queue", "status") if c in T.c]
+    if engine.dialect.update_returning:
+        return db.execute(stmt.returning(*cols)).mappings().first()
+    if not db.execute(stmt).rowcount:
+        return None
+    return db.execute(select(*cols).where(T.c.id == ticket_id)).mappings().first()
+
+
 # ===========================================================
 # TRANSFER TICKET
 # ===========================================================
@@ -128,13 +147,6 @@ def chatbot_transfer_ticket(
     if not user or not user.is_support:
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    t = db.query(SupportTicket).filter_by(id=ticket_id).first()
-    if not t:
-        raise HTTPException(status_code=404, detail="Ticket not found")
-
-    if t.status == "closed":
-        raise HTTPException(status_code=400, detail="Ticket already closed")
-
     now = datetime.utcnow()
 
     transfer_map = {
@@ -146,6 +158,20 @@ def chatbot_transfer_ticket(
     if new_queue not in transfer_map:
         raise HTTPException(status_code=400, detail="Invalid queue")
 
+    # one conditional UPDATE: moves the ticket unless it is closed
+    row = _update_open_ticket(
+        db, ticket_id,
+        queue=new_queue,
+        last_from="system",
+        unread_for_user=True,
+        unread_for_agent=True,
+        updated_at=now,
+    )
+    if not row:
+        if not db.query(SupportTicket.id).filter_by(id=ticket_id).first():
+            raise HTTPException(status_code=404, detail="Ticket not found")
+        raise HTTPException(status_code=400, detail="Ticket already closed")
+
     db.add(SupportMessage(
         ticket_id=ticket_id,
         sender_id=user.id,
@@ -154,12 +180,9 @@ def chatbot_transfer_ticket(
         channel="chatbot",
         created_at=now,
     ))
-
-    t.queue = new_queue
-    t.last_from = "system"
-    t.unread_for_user = True
-    t.unread_for_agent = True
-    t.updated_at = now
+    ticket_events.record(db, ticket_id, "transferred", actor_id=user.id, queue=new_queue, status=row["status"],
+                         to=new_queue)
+    db.commit()
 
     # who receives the ticket?
     if new_queue == "cs_chatbot":
@@ -167,19 +190,16 @@ def chatbot_transfer_ticket(
     else:
         target_filter = User.is_mod == True
 
-    agents = db.query(User).filter(target_filter).all()
-
-    for ag in agents:
-        push_notification(
-            db,
-            ag.id,
-            "🤖 Ticket transferred",
-            f"Ticket #{ticket_id} moved to your team.",
-            url=f"/{new_queue.replace('_chatbot','')}/chatbot/ticket/{ticket_id}",
-            kind="support",
-        )
+    agent_ids = [r[0] for r in db.query(User.id).filter(target_filter).all()]
+    push_notifications(
+        db,
+        agent_ids,
+        "🤖 Ticket transferred",
+        f"Ticket #{ticket_id} moved to your team.",
+        url=f"/{new_queue.replace('_chatbot','')}/chatbot/ticket/{ticket_id}",
+        kind="support",
+    )
 
-    db.commit()
     return {"ok": True, "queue": new_queue}
 
 
@@ -199,14 +219,6 @@ def chatbot_close_ticket(
     if not (user.is_support or user.is_mod):
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    t = db.query(SupportTicket).filter_by(id=ticket_id).first()
-    if not t:
-        raise HTTPException(status_code=404, detail="Ticket not found")
-
-    # ✅ إذا كانت مغلقة مسبقاً
-    if t.status == "closed":
-        return {"ok": True, "status": "already_closed"}
-
     now = datetime.utcnow()
 
     closer_name = (
@@ -216,6 +228,23 @@ def chatbot_close_ticket(
         or "support agent"
     )
 
+    # ✅ Update ticket (only if not closed yet)
+    row = _update_open_ticket(
+        db, ticket_id,
+        status="closed",              # ✅ هنا التعديل الحاسم
+        closed_by=closer_name,
+        closed_at=now,
+        last_from="system",
+        unread_for_user=True,
+        unread_for_agent=False,
+        updated_at=now,
+    )
+    if not row:
+        if not db.query(SupportTicket.id).filter_by(id=ticket_id).first():
+            raise HTTPException(status_code=404, detail="Ticket not found")
+        # ✅ إذا كانت مغلقة مسبقاً
+        return {"ok": True, "status": "already_closed"}
+
     # SYSTEM message with closer name
     db.add(SupportMessage(
         ticket_id=ticket_id,
@@ -225,15 +254,7 @@ def chatbot_close_ticket(
         channel="chatbot",
         created_at=now,
     ))
-
-    # ✅ Update ticket
-    t.status = "closed"              # ✅ هنا التعديل الحاسم
-    t.closed_by = closer_name
-    t.closed_at = now
-    t.last_from = "system"
-    t.unread_for_user = True
-    t.unread_for_agent = False
-    t.updated_at = now
+    ticket_events.record(db, ticket_id, "resolved", actor_id=user.id, queue=row.get("queue"), status="closed")
 
     db.commit()
 
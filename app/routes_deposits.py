@@ -3,15 +3,14 @@ from __future__ import annotations
 from typing import Optional, Literal, List, Dict, Annotated
 from datetime import datetime, timedelta
 import os
-import shutil
 import stripe
 import mimetypes
+from pathlib import Path
 from fastapi import BackgroundTasks
 
 
-# --- NEW: Cloudinary ---
-import cloudinary
-import cloudinary.uploader
+# --- Cloudinary (background upload queue) ---
+from . import booking_deadlines, media_queue, payment_ops, staff_queues
 
 from fastapi import (
     APIRouter,
@@ -23,11 +22,22 @@ from fastapi import (
     File
 )
 from fastapi.responses import RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, and_, text
-
-from .database import get_db, engine as _engine
-from .models import Booking, Item, User
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import and_, insert as sa_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from .database import get_async_db, get_db, SessionLocal, engine as _engine
+from .utils_uploads import remove_files, save_upload_file
+from .routes_evidence import (
+    MAX_FILE_BYTES as EVIDENCE_MAX_FILE_BYTES,
+    MAX_FILES_PER_REQUEST as EVIDENCE_MAX_FILES,
+    MAX_REQUEST_BYTES as EVIDENCE_MAX_REQUEST_BYTES,
+    UploadTooLarge,
+    get_current_user_async,
+    stream_upload_file,
+)
+from .models import Booking, Item, User, booking_list_load
 from .notifications_api import push_notification, notify_admins
 
 
@@ -166,8 +176,7 @@ def _save_evidence_files(booking_id: int, files: List[UploadFile] | None) -> Lis
         _, ext = os.path.splitext(f.filename)
         safe_name = f"{ts}{ext.lower()}"
         dest = os.path.join(folder, safe_name)
-        with open(dest, "wb") as out:
-            shutil.copyfileobj(f.file, out)
+        save_upload_file(f.file, Path(dest))  # deduplicated via the blob store
         try:
             f.file.close()
         except Exception:
@@ -175,24 +184,33 @@ def _save_evidence_files(booking_id: int, files: List[UploadFile] | None) -> Lis
         saved.append(safe_name)
     return saved
 
-# >>> Local save + Cloudinary upload [(local_name, secure_url)]
-def _save_evidence_files_and_cloud(booking_id: int, files: List[UploadFile] | None) -> List[tuple[str, str]]:
+# >>> Local save + background Cloudinary upload [(local_name, local_url)]
+def _save_evidence_files_and_cloud(
+    booking_id: int,
+    files: List[UploadFile] | None,
+    db: Session | None = None,
+) -> List[tuple[str, str]]:
+    """
+    Save evidence files locally and return their /uploads URLs right away.
+    When `db` is given, a media_uploads job per file is added to that session so
+    the Cloudinary copy replaces file_path once uploaded (after the caller commits).
+    """
     saved_names = _save_evidence_files(booking_id, files)
     results: List[tuple[str, str]] = []
     folder = _booking_folder(booking_id)
     for name in saved_names:
         url = f"/uploads/deposits/{booking_id}/{name}"
-        try:
-            full_path = os.path.join(folder, name)
-            up = cloudinary.uploader.upload(
-                full_path,
-                folder=f"deposits/{booking_id}",
-                public_id=os.path.splitext(name)[0],
-                resource_type="auto"
-            )
-            url = up.get("secure_url") or url
-        except Exception:
-            pass
+        if db is not None:
+            try:
+                media_queue.enqueue(
+                    db, url,
+                    folder=f"deposits/{booking_id}",
+                    target_table="deposit_evidences",
+                    target_id=booking_id,
+                    local_path=os.path.join(folder, name),
+                )
+            except Exception:
+                pass
         results.append((name, url))
     return results
 # <<<
@@ -331,52 +349,27 @@ def dm_queue(
     user: Optional[User] = Depends(get_current_user),
     state: Literal["all", "new", "awaiting_renter", "awaiting_dm", "closed"] = "all",
     q: Optional[str] = None,
+    cursor: Optional[str] = None,
 ):
     require_auth(user)
     if not can_manage_deposits(user):
         raise HTTPException(status_code=403, detail="Access denied")
 
-    qset = db.query(Booking)
-
-    # =========================
-    # ✅ NEW (FIXED – ONLY HERE)
-    # =========================
-    if state == "new":
-        qset = qset.filter(
-            or_(
-                Booking.deposit_status == "in_dispute",
-                Booking.deposit_status.is_(None)
-            ),
-            Booking.renter_response_at.is_(None),
-            Booking.dm_decision_at.is_(None),
-        )
-
-    elif state == "awaiting_renter":
-        qset = qset.filter(
-            Booking.deposit_status == "awaiting_renter"
-        )
-
-    elif state == "awaiting_dm":
-        qset = qset.filter(
-            Booking.deposit_status == "in_dispute",
-            Booking.renter_response_at.isnot(None),
-            Booking.dm_decision_at.is_(None),
-        )
-
-    elif state == "closed":
-        qset = qset.filter(
-            or_(
-                Booking.status == "closed",
-                Booking.dm_decision_at.isnot(None),
-            )
-        )
-
-    if q:
-        q = q.strip()
-        if q.isdigit():
-            qset = qset.filter(Booking.id == int(q))
+    load = (
+        booking_list_load(),
+        selectinload(Booking.item),
+        selectinload(Booking.renter),
+        selectinload(Booking.owner),
+    )
+    queue = staff_queues.QUEUES["dm_deposits"]
 
-    cases = qset.order_by(Booking.updated_at.desc()).all()
+    next_cursor = None
+    q = (q or "").strip()
+    if q.isdigit():
+        cases = queue.query(db, state).options(*load).filter(Booking.id == int(q)).all()
+    else:
+        # Keyset-paged on (updated_at, id) — see app/staff_queues.py
+        cases, next_cursor = queue.page(db, state, cursor, options=load)
 
     return request.app.templates.TemplateResponse(
         "dm_queue.html",
@@ -385,6 +378,8 @@ def dm_queue(
             "cases": cases,
             "state": state,
             "q": q or "",
+            "counters": queue.counts(db),
+            "next_cursor": next_cursor,
             "session_user": request.session.get("user"),
         },
     )
@@ -466,9 +461,9 @@ def dm_decision(
         spend_available(
             db=db,
             amount=refund_amount,
-            reason=f"Deposit refund — booking #{bk.id}",
+            source="dm",
             booking_id=bk.id,
-            actor_id=user.id,
+            note=f"Deposit refund — booking #{bk.id} (by user #{user.id})",
         )
 
         bk.deposit_status = "refunded"
@@ -580,7 +575,7 @@ def report_deposit_issue(
             raise HTTPException(status_code=400, detail="No deposit hold found")
 
     # --- حفظ الصور ---
-    saved_pairs = _save_evidence_files_and_cloud(bk.id, files)
+    saved_pairs = _save_evidence_files_and_cloud(bk.id, files, db)
 
     try:
         from .models import DepositEvidence
@@ -716,41 +711,105 @@ def report_deposit_issue(
     )
 # ========================= Evidence for both parties =========================
 @router.post("/deposits/{booking_id}/evidence/upload")
-def evidence_upload(
+async def evidence_upload(
     booking_id: int,
+    background: BackgroundTasks,
     files: List[UploadFile] | None = File(None),
     comment: str = Form(""),
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_current_user),
+    description: str = Form(""),   # field name of the plain /deposits/{id}/evidence/form page
+    db: AsyncSession = Depends(get_async_db),
+    user: Optional[User] = Depends(get_current_user_async),
 ):
+    """
+    Evidence from either party. Files are streamed into the booking folder in
+    1 MB chunks, capped per file (EVIDENCE_MAX_FILE_MB) and per request
+    (EVIDENCE_MAX_REQUEST_MB) → 413 and no partial files. Runs on the async
+    session: rows, Cloudinary jobs and the booking update are one transaction
+    (run_sync, no threadpool hop); notifications and emails run after the
+    response.
+    """
     require_auth(user)
-    bk = require_booking(db, booking_id)
+    bk = await db.get(Booking, booking_id)
+    if not bk:
+        raise HTTPException(status_code=404, detail="Booking not found")
     if _is_closed(bk):
         raise HTTPException(status_code=400, detail="case already closed")
     if user.id not in (bk.owner_id, bk.renter_id):
         raise HTTPException(status_code=403, detail="Not participant in this booking")
 
-    saved_pairs = _save_evidence_files_and_cloud(bk.id, files)
+    files = [f for f in (files or []) if f is not None and _ext_ok(f.filename or "")]
+    if len(files) > EVIDENCE_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Max {EVIDENCE_MAX_FILES} files per request")
+    comment = (comment or description or "").strip()
+
+    folder = await run_in_threadpool(_booking_folder, bk.id)
+    budget = [EVIDENCE_MAX_REQUEST_BYTES]
+    written: List[Path] = []
+    saved_pairs: List[tuple[str, str]] = []
+    for up in files:
+        ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+        _, ext = os.path.splitext(up.filename)
+        name = f"{ts}{ext.lower()}"
+        dest = Path(folder) / name
+        try:
+            await stream_upload_file(dest, up, max_bytes=EVIDENCE_MAX_FILE_BYTES, budget=budget)
+        except UploadTooLarge:
+            await run_in_threadpool(remove_files, written)
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large (max {EVIDENCE_MAX_FILE_BYTES // (1024 * 1024)} MB per file, "
+                       f"{EVIDENCE_MAX_REQUEST_BYTES // (1024 * 1024)} MB per request)",
+            )
+        except Exception as e:
+            await run_in_threadpool(remove_files, written)
+            raise HTTPException(status_code=500, detail=f"Failed to store file: {e}")
+        written.append(dest)
+        saved_pairs.append((name, f"/uploads/deposits/{bk.id}/{name}"))
+
+    if not await db.run_sync(_record_evidence_upload, bk, user, comment, saved_pairs):
+        await run_in_threadpool(remove_files, written)
+        return RedirectResponse(url=f"/bookings/flow/{bk.id}?evidence_error=1", status_code=303)
+    background.add_task(_notify_evidence_upload, bk.id, user.id)
+
+    return RedirectResponse(url=f"/bookings/flow/{bk.id}?evidence=1", status_code=303)
 
-    try:
-        from .models import DepositEvidence
-        side_val = "owner" if user.id == bk.owner_id else "renter"
-        for name, url in saved_pairs:
-            db.add(DepositEvidence(
-                booking_id=bk.id,
-                uploader_id=user.id,
-                side=side_val,
-                kind="image",
-                file_path=url,
-                description=(comment or None),
-            ))
-        db.commit()
-    except Exception:
-        db.rollback()
-        pass
 
+def _record_evidence_upload(
+    db: Session, bk: Booking, user: User, comment: str, saved_pairs: List[tuple[str, str]]
+) -> bool:
+    """
+    Evidence rows (one INSERT), their Cloudinary jobs and the booking update, one commit.
+    Returns False (rolled back) when nothing was recorded.
+    """
     now = datetime.utcnow()
+    side_val = "owner" if user.id == bk.owner_id else "renter"
     try:
+        if saved_pairs and DepositEvidence is not None:
+            db.execute(sa_insert(DepositEvidence), [
+                {
+                    "booking_id": bk.id,
+                    "uploader_id": user.id,
+                    "side": side_val,
+                    "kind": "image",
+                    "file_path": url,
+                    "description": (comment or None),
+                    "created_at": now,
+                }
+                for _, url in saved_pairs
+            ])
+            folder = _booking_folder(bk.id)
+            for name, url in saved_pairs:
+                try:
+                    media_queue.enqueue(
+                        db, url,
+                        folder=f"deposits/{bk.id}",
+                        target_table="deposit_evidences",
+                        target_id=bk.id,
+                        local_path=os.path.join(folder, name),
+                    )
+                except Exception:
+                    pass
+
         setattr(bk, "updated_at", now)
         if getattr(bk, "status", "") in ("closed", "completed"):
             bk.status = "in_review"
@@ -758,48 +817,60 @@ def evidence_upload(
             bk.deposit_status = "in_dispute"
         if user.id == bk.renter_id:
             setattr(bk, "renter_response_at", now)
+        _audit(db, actor=user, bk=bk, action="evidence_upload",
+               details={"by": side_val.capitalize(), "files": [p[0] for p in saved_pairs], "comment": comment})
         db.commit()
-    except Exception:
+        return True
+    except Exception as e:
         db.rollback()
-        pass
+        print(f"[WARN] evidence upload for booking #{bk.id} not recorded: {e}")
+        return False
 
-    other_id = bk.renter_id if user.id == bk.owner_id else bk.owner_id
-    who = "Owner" if user.id == bk.owner_id else "Renter"
 
+def _notify_evidence_upload(booking_id: int, uploader_id: int) -> None:
+    """Background task: tell the other party and the DMs (in-app + email)."""
+    db = SessionLocal()
     try:
-        push_notification(db, other_id, "New Evidence in Case",
-                          f"{who} uploaded new evidence for booking #{bk.id}.",
-                          f"/bookings/flow/{bk.id}", "deposit")
-        notify_dms(db, "New Evidence — Case Updated",
-                   f"New evidence uploaded for booking #{bk.id}.", f"/dm/deposits/{bk.id}")
-        _audit(db, actor=user, bk=bk, action="evidence_upload",
-               details={"by": who, "files": [p[0] for p in saved_pairs], "comment": comment})
-    except Exception:
-        pass
+        bk = db.get(Booking, booking_id)
+        if not bk:
+            return
+        other_id = bk.renter_id if uploader_id == bk.owner_id else bk.owner_id
+        who = "Owner" if uploader_id == bk.owner_id else "Renter"
 
-    try:
-        other_email = _user_email(db, other_id)
-        dms_em      = _dm_emails_only(db)
-        case_url    = f"{BASE_URL}/dm/deposits/{bk.id}"
-        flow_url    = f"{BASE_URL}/bookings/flow/{bk.id}"
-        if other_email:
-            send_email(
-                other_email,
-                f"New Evidence Uploaded — #{bk.id}",
-                f"<p>{who} uploaded new evidence for the deposit case on booking #{bk.id}.</p>"
-                f'<p><a href="{flow_url}">View booking</a></p>'
-            )
-        for em in dms_em:
-            send_email(
-                em,
-                f"[DM] New Evidence — #{bk.id}",
-                f"<p>New evidence has been uploaded for the case for booking #{bk.id}.</p>"
-                f'<p><a href="{case_url}">Open case</a></p>'
-            )
-    except Exception:
-        pass
+        try:
+            push_notification(db, other_id, "New Evidence in Case",
+                              f"{who} uploaded new evidence for booking #{bk.id}.",
+                              f"/bookings/flow/{bk.id}", "deposit")
+            notify_dms(db, "New Evidence — Case Updated",
+                       f"New evidence uploaded for booking #{bk.id}.", f"/dm/deposits/{bk.id}")
+        except Exception:
+            pass
 
-    return RedirectResponse(url=f"/bookings/flow/{bk.id}?evidence=1", status_code=303)
+        try:
+            other_email = _user_email(db, other_id)
+            dms_em      = _dm_emails_only(db)
+            case_url    = f"{BASE_URL}/dm/deposits/{bk.id}"
+            flow_url    = f"{BASE_URL}/bookings/flow/{bk.id}"
+            if other_email:
+                send_email(
+                    other_email,
+                    f"New Evidence Uploaded — #{bk.id}",
+                    f"<p>{who} uploaded new evidence for the deposit case on booking #{bk.id}.</p>"
+                    f'<p><a href="{flow_url}">View booking</a></p>'
+                )
+            for em in dms_em:
+                send_email(
+                    em,
+                    f"[DM] New Evidence — #{bk.id}",
+                    f"<p>New evidence has been uploaded for the case for booking #{bk.id}.</p>"
+                    f'<p><a href="{case_url}">Open case</a></p>'
+                )
+        except Exception:
+            pass
+    except Exception as e:
+        print(f"[WARN] evidence notifications failed for booking #{booking_id}: {e}")
+    finally:
+        db.close()
 
 # ==== Renter reply ====
 @router.post("/deposits/{booking_id}/renter-response")
@@ -1107,16 +1178,17 @@ def _auto_capture_for_booking(db: Session, bk: Booking) -> bool:
 
     pi_id = _get_deposit_pi_id(bk)
     captured_ok = False
-    charge_id = None
+    op_id = None
 
     if pi_id:
-        try:
-            pi = stripe.PaymentIntent.capture(pi_id, amount_to_capture=amt * 100)
-            captured_ok = bool(pi and pi.get("status") in ("succeeded", "requires_capture") or True)
-            charge_id = (pi.get("latest_charge")
-                         or ((pi.get("charges") or {}).get("data") or [{}])[0].get("id"))
-        except Exception:
-            captured_ok = False
+        # Capture + owner transfer run in the payment_ops worker (retried with
+        # the same idempotency key); a permanent failure is escalated to admins there.
+        owner: User = db.get(User, bk.owner_id)
+        transfer_to = None
+        if owner and getattr(owner, "stripe_account_id", None) and getattr(owner, "payouts_enabled", False):
+            transfer_to = owner.stripe_account_id
+        op_id = payment_ops.stripe_capture(db, bk, pi_id, amt, transfer_to=transfer_to).id
+        captured_ok = True
 
     bk.deposit_status = "partially_withheld" if captured_ok else "no_deposit"
     bk.deposit_charged_amount = (bk.deposit_charged_amount or 0) + (amt if captured_ok else 0)
@@ -1128,7 +1200,7 @@ def _auto_capture_for_booking(db: Session, bk: Booking) -> bool:
     try:
         _audit(
             db, actor=None, bk=bk, action="auto_withhold_on_deadline",
-            details={"amount": amt, "pi": pi_id, "captured": captured_ok, "charge_id": charge_id}
+            details={"amount": amt, "pi": pi_id, "captured": captured_ok, "payment_op": op_id}
         )
     except Exception:
         pass
@@ -1153,17 +1225,6 @@ def _auto_capture_for_booking(db: Session, bk: Booking) -> bool:
     except Exception:
         pass
 
-    if captured_ok:
-        try:
-            owner: User = db.get(User, bk.owner_id)
-            if owner and getattr(owner, "stripe_account_id", None) and getattr(owner, "payouts_enabled", False):
-                stripe.Transfer.create(
-                    amount=amt * 100, currency="cad",
-                    destination=owner.stripe_account_id, source_transaction=charge_id
-                )
-        except Exception:
-            pass
-
     return captured_ok
 
 def cron_check_window(
@@ -1178,11 +1239,20 @@ def cron_check_window(
             if not (sess.get("role") == "admin" or bool(sess.get("is_admin"))):
                 raise HTTPException(status_code=403, detail="forbidden")
 
+    return check_window_tick(db)
+
+
+def check_window_tick(db: Session) -> dict:
+    """
+    Auto-capture every booking whose renter response deadline has passed.
+    Runs as the "dm_check_window" scheduler job; the endpoint below is the manual trigger.
+    """
     rows = _deadline_overdue_rows(db)
 
     count = 0
     done = 0
     skipped = 0
+    errors = 0
 
     for bk in rows:
         count += 1
@@ -1190,6 +1260,7 @@ def cron_check_window(
             ok = _auto_capture_for_booking(db, bk)
             if ok:
                 done += 1
+                booking_deadlines.mark_processed(db, bk.id, "renter_response", "captured")
             else:
                 skipped += 1
                 try:
@@ -1207,8 +1278,11 @@ def cron_check_window(
                     )
                 except Exception:
                     pass
-        except Exception:
+        except Exception as e:
+            db.rollback()
             skipped += 1
+            errors += 1
+            print(f"[WARN] dm_check_window: booking #{bk.id} failed: {e}")
             try:
                 notify_admins(
                     db,
@@ -1219,7 +1293,7 @@ def cron_check_window(
             except Exception:
                 pass
 
-    return {"checked": count, "captured": done, "needs_manual": skipped}
+    return {"checked": count, "captured": done, "needs_manual": skipped, "errors": errors}
 
 # public endpoint to run cron manually
 @router.get("/dm/deposits/check-window")
@@ -1231,16 +1305,9 @@ def run_check_window(
     return cron_check_window(request=request, db=db, token=token)
 
 def _deadline_overdue_rows(db: Session) -> List[Booking]:
-    now = datetime.utcnow()
-    q = (
-        db.query(Booking)
-        .filter(
-            text("deposit_status = 'awaiting_renter'"),
-            Booking.renter_response_deadline_at.isnot(None),
-            Booking.renter_response_deadline_at < now,
-        )
+    return booking_deadlines.scan_due(
+        db, "renter_response", eligible=lambda bk: (bk.deposit_status or "") == "awaiting_renter",
     )
-    return q.all()
 
 
 # ===== Simple nudge to renter to upload evidence =====
@@ -1399,7 +1466,7 @@ def renter_pickup_proof_upload(
     if (bk.status or "").lower() not in ("paid",):
         return RedirectResponse(url=f"/bookings/{bk.id}", status_code=303)
 
-    saved_pairs = _save_evidence_files_and_cloud(bk.id, files)
+    saved_pairs = _save_evidence_files_and_cloud(bk.id, files, db)
 
     try:
         if DepositEvidence:
@@ -1526,7 +1593,7 @@ def renter_return_proof_upload(
     if (bk.status or "").lower() not in ("picked_up",):
         return RedirectResponse(url=f"/bookings/{bk.id}", status_code=303)
 
-    saved_pairs = _save_evidence_files_and_cloud(bk.id, files)
+    saved_pairs = _save_evidence_files_and_cloud(bk.id, files, db)
 
     try:
         if DepositEvidence:
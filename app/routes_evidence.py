@@ -1,19 +1,20 @@
 # app/routes_evidence.py
 from __future__ import annotations
 
+import hashlib
 import os
-import uuid
 from pathlib import Path
 from typing import Optional, Literal, List, Dict, Any
 
-from datetime import datetime
-from fastapi import APIRouter, Depends, Request, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, Depends, Request, UploadFile, HTTPException
 from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from .database import get_db, engine as _engine
+from .database import get_async_db, get_db, engine as _engine, table_columns
 from .models import Booking, User
-from .notifications_api import push_notification, notify_admins
+from .utils_uploads import adopt_into_store, new_blob_tmp_path
 
 # ===== SMTP Email (fallback) =====
 # Will be replaced later by app/emailer.py; here we ensure execution doesn’t break if it doesn’t exist.
@@ -51,6 +52,9 @@ ALLOWED_DOC_EXTS   = {"pdf"}
 ALLOWED_ALL_EXTS = ALLOWED_IMAGE_EXTS | ALLOWED_VIDEO_EXTS | ALLOWED_DOC_EXTS
 
 MAX_FILES_PER_REQUEST = 10  # Simple protection
+MAX_FILE_BYTES = int(os.getenv("EVIDENCE_MAX_FILE_MB", "100")) * 1024 * 1024
+MAX_REQUEST_BYTES = int(os.getenv("EVIDENCE_MAX_REQUEST_MB", "300")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 # =========================
 # Helpers: user/booking identity
@@ -60,6 +64,11 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optiona
     uid = data.get("id")
     return db.get(User, uid) if uid else None
 
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)) -> Optional[User]:
+    data = request.session.get("user") or {}
+    uid = data.get("id")
+    return await db.get(User, uid) if uid else None
+
 def require_auth(user: Optional[User]):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -107,75 +116,58 @@ def save_upload_file(dst_path: Path, up: UploadFile) -> None:
                 break
             f.write(chunk)
 
+class UploadTooLarge(Exception):
+    pass
+
+async def stream_upload_file(dst_path: Path, up: UploadFile, *, max_bytes: int, budget: List[int]) -> int:
+    """
+    Stream an UploadFile to disk in chunks without blocking the event loop
+    (reads via UploadFile.read, writes in the threadpool).
+    Enforces a per-file cap and a shared per-request budget (budget[0] = bytes left).
+    The bytes are hashed while streaming and stored once in the blob store;
+    dst_path is a link to that blob (identical files share disk).
+    Returns the number of bytes written; removes the partial file on failure.
+    """
+    written = 0
+    h = hashlib.sha256()
+    tmp = new_blob_tmp_path()
+    f = await run_in_threadpool(tmp.open, "wb")
+    try:
+        while True:
+            chunk = await up.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            written += len(chunk)
+            budget[0] -= len(chunk)
+            if written > max_bytes or budget[0] < 0:
+                raise UploadTooLarge()
+            h.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        try:
+            tmp.unlink()
+        except Exception:
+            pass
+        raise
+    await run_in_threadpool(f.close)
+    await run_in_threadpool(adopt_into_store, tmp, dst_path, sha256=h.hexdigest())
+    return written
+
 # =========================
 # Helpers: compatibility layer with table (uploader_id/by_user_id, file_path/file)
 # =========================
 def _evidence_cols() -> Dict[str, bool]:
-    cols = {
-        "id": False, "booking_id": False, "uploader_id": False, "by_user_id": False,
-        "side": False, "kind": False, "file_path": False, "file": False,
-        "description": False, "created_at": False
-    }
-    try:
-        with _engine.begin() as conn:
-            rows = conn.exec_driver_sql("PRAGMA table_info('deposit_evidences')").all()
-        for _, name, *_ in rows:
-            if name in cols:
-                cols[name] = True
-    except Exception:
-        pass
-    return cols
-
-def _insert_evidence_row(values: Dict[str, Any]) -> int:
-    cols = _evidence_cols()
-    has_uploader = cols.get("uploader_id", False)
-    has_by_user  = cols.get("by_user_id",  False)
-    has_filepath = cols.get("file_path",   False)
-    has_file     = cols.get("file",        False)
-
-    insert_cols = ["booking_id", "side", "kind", "description", "created_at"]
-    params = {
-        "booking_id": values["booking_id"],
-        "side": values["side"],
-        "kind": values["kind"],
-        "description": values.get("description"),
-        "created_at": values.get("created_at") or datetime.utcnow(),
-    }
-
-    if has_uploader and has_by_user:
-        insert_cols += ["uploader_id", "by_user_id"]
-        params["uploader_id"] = values["uploader_id"]
-        params["by_user_id"]  = values["uploader_id"]
-    elif has_uploader:
-        insert_cols.append("uploader_id")
-        params["uploader_id"] = values["uploader_id"]
-    elif has_by_user:
-        insert_cols.append("by_user_id")
-        params["by_user_id"]  = values["uploader_id"]
-
-    fp = values.get("file_path")
-    if has_filepath and has_file:
-        insert_cols += ["file_path", "file"]
-        params["file_path"] = fp
-        params["file"]      = fp
-    elif has_filepath:
-        insert_cols.append("file_path")
-        params["file_path"] = fp
-    elif has_file:
-        insert_cols.append("file")
-        params["file"] = fp
-
-    placeholders = ", ".join([f":{c}" for c in insert_cols])
-    columns_sql  = ", ".join(insert_cols)
-    sql = f"INSERT INTO deposit_evidences ({columns_sql}) VALUES ({placeholders})"
-
-    with _engine.begin() as conn:
-        res = conn.exec_driver_sql(sql, params)
-        try:
-            new_id = int(res.lastrowid or 0)
-        except Exception:
-            new_id = 0
-    return new_id
+    """
+    Which optional columns deposit_evidences has (uploader_id/by_user_id, file_path/file).
+    Backed by database.table_columns(): one inspector call per process, on SQLite and Postgres.
+    """
+    present = table_columns("deposit_evidences")
+    return {name: (name in present) for name in (
+        "id", "booking_id", "uploader_id", "by_user_id",
+        "side", "kind", "file_path", "file",
+        "description", "created_at",
+    )}
 
 def _select_evidence_rows(booking_id: int) -> List[Dict[str, Any]]:
     cols = _evidence_cols()
@@ -204,255 +196,8 @@ def _select_evidence_rows(booking_id: int) -> List[Dict[str, Any]]:
         rows = conn.exec_driver_sql(sql, {"bid": booking_id}).mappings().all()
         return [dict(r) for r in rows]
 
-# =========================
-# API: upload evidence (images/videos/docs + note)
-# =========================
-@router.post("/deposits/{booking_id}/evidence/upload")
-async def upload_deposit_evidence(
-    booking_id: int,
-    request: Request,
-    description: str = Form(""),
-    files: Optional[List[UploadFile]] = File(None),
-    db: Session = Depends(get_db),
-    user: Optional[User] = Depends(get_current_user),
-):
-    """
-    Uploads evidence from both sides (owner/renter) or the manager.
-    - Saves files under: /uploads/deposits/{booking_id}/{side}/<uuid>.<ext>
-    - Inserts rows into deposit_evidences with support for (uploader_id/by_user_id) and (file_path/file)
-    - If no files are sent and a note is sent -> records note-type evidence (no file)
-    - Sends notifications
-    """
-    require_auth(user)
-    bk = require_booking(db, booking_id)
-    side = user_side_for_booking(user, bk)
-
-    files = files or []
-    if len(files) > MAX_FILES_PER_REQUEST:
-        raise HTTPException(status_code=400, detail=f"Max {MAX_FILES_PER_REQUEST} files per request")
-
-    saved_any = False
-    saved_ids: List[int] = []
-    saved_files: List[str] = []
-    has_real_file = False
-    comment = (description or "").strip()
-
-    evidence_dir = DEPOSITS_DIR / str(bk.id) / side
-    ensure_dirs(evidence_dir)
-
-    # 1) Note only
-    if not files and comment:
-        ev_id = _insert_evidence_row({
-            "booking_id": bk.id,
-            "uploader_id": user.id,
-            "side": side,
-            "kind": "note",
-            "file_path": None,
-            "description": comment,
-            "created_at": datetime.utcnow(),
-        })
-        if ev_id:
-            saved_any = True
-            saved_ids.append(ev_id)
-
-    # 2) Files
-    for up in files:
-        filename = up.filename or ""
-        ext = safe_ext(filename)
-        if ext not in ALLOWED_ALL_EXTS:
-            raise HTTPException(status_code=400, detail=f"Extension .{ext} not allowed")
-
-        uid = uuid.uuid4().hex
-        stored_name = f"{uid}.{ext}"
-        full_path = evidence_dir / stored_name
-
-        try:
-            save_upload_file(full_path, up)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to store file: {e}")
-
-        # ✅ Stable public path to preview images/videos immediately
-        rel_path = f"/uploads/deposits/{bk.id}/{side}/{stored_name}"
-
-        kind = classify_kind(ext)
-        ev_id = _insert_evidence_row({
-            "booking_id": bk.id,
-            "uploader_id": user.id,
-            "side": side,
-            "kind": kind,
-            "file_path": rel_path,
-            "description": (comment or None),
-            "created_at": datetime.utcnow(),
-        })
-        if ev_id:
-            saved_any = True
-            saved_ids.append(ev_id)
-            saved_files.append(rel_path)
-            has_real_file = True
-
-
-    if not saved_any:
-        raise HTTPException(status_code=400, detail="No files nor description provided")
-
-    now = datetime.utcnow()
-    try:
-        setattr(bk, "updated_at", now)
-        db.commit()
-    except Exception:
-        pass
-
-    # ===== Phase: if deposit_status is awaiting_renter and the renter replied → switch to dispute and notify DMs =====
-    try:
-        current_status = (getattr(bk, "deposit_status", None) or "").lower()
-        if side == "renter" and current_status == "awaiting_renter" and has_real_file:
-
-            try:
-                bk.deposit_status = "in_dispute"   # ← makes the UI show review buttons
-                bk.status = "in_review"
-            except Exception:
-                pass
-            try:
-                setattr(bk, "renter_response_at", now)
-            except Exception:
-                pass
-            try:
-                setattr(bk, "renter_response_deadline_at", None)
-            except Exception:
-                pass
-            try:
-                old_note = (getattr(bk, "renter_response_text", "") or "").strip()
-                new_note = (old_note + ("\n" if old_note and comment else "") + (comment or "")).strip()
-                setattr(bk, "renter_response_text", new_note or None)
-            except Exception:
-                pass
-            try:
-                from .routes_deposits import _audit
-                _audit(
-                    db,
-                    actor=user,
-                    bk=bk,
-                    action="renter_uploaded_evidence",
-                    details={"files": saved_files, "comment": comment},
-                )
-            except Exception:
-                pass
-            try:
-                db.commit()
-            except Exception:
-                pass
-
-            # 🔔 Notifications — note links go to DM page for review
-            try:
-                push_notification(
-                    db, bk.owner_id, "Renter reply to deduction decision",
-                    f"The renter uploaded evidence/note for booking #{bk.id}.",
-                    f"/dm/deposits/{bk.id}", "deposit"
-                )
-                notify_admins(
-                    db, "New renter reply regarding deduction decision",
-                    f"Evidence received from renter for booking #{bk.id}.",
-                    f"/dm/deposits/{bk.id}"
-                )
-            except Exception:
-                pass
-
-            # ✉️ Email: notify authorized roles
-            try:
-                owner_email = _user_email(db, bk.owner_id)
-                admins_em = _admin_emails(db)
-                case_url = f"{BASE_URL}/dm/deposits/{bk.id}"
-                if owner_email:
-                    send_email(
-                        owner_email,
-                        f"Renter reply on deposit #{bk.id}",
-                        f"<p>The renter uploaded evidence/note. Status now: open dispute.</p>"
-                        f'<p><a href="{case_url}">Open case</a></p>'
-                    )
-                for em in admins_em:
-                    send_email(
-                        em,
-                        f"[DM] Renter responded — #{bk.id}",
-                        f"<p>The renter added evidence — case became in_dispute.</p>"
-                        f'<p><a href="{case_url}">Open case</a></p>'
-                    )
-            except Exception:
-                pass
-
-            accept = (request.headers.get("accept") or "").lower()
-            if "application/json" in accept:
-                return JSONResponse({"ok": True, "saved_ids": saved_ids})
-            return RedirectResponse(url=f"/bookings/flow/{bk.id}", status_code=303)
-    except Exception:
-        pass
-
-    # Default notifications by side (links to normal flow page for the other party)
-    try:
-        if side == "owner":
-            push_notification(
-                db, bk.renter_id, "New evidence from owner",
-                f"New evidence was uploaded on the deposit case for booking #{bk.id}.",
-                f"/bookings/flow/{bk.id}", "deposit"
-            )
-        elif side == "renter":
-            push_notification(
-                db, bk.owner_id, "Renter reply and evidence",
-                f"The renter added evidence/note on the deposit case for booking #{bk.id}.",
-                f"/bookings/flow/{bk.id}", "deposit"
-            )
-        else:
-            push_notification(
-                db, bk.owner_id, "Case updated",
-                f"The deposit manager uploaded/attached evidence for case #{bk.id}.",
-                f"/bookings/flow/{bk.id}", "deposit"
-            )
-            push_notification(
-                db, bk.renter_id, "Case updated",
-                f"The deposit manager uploaded/attached evidence for case #{bk.id}.",
-                f"/bookings/flow/{bk.id}", "deposit"
-            )
-        # Administrative notification (if you want to open the DM page directly you can also change the link here)
-        notify_admins(db, "Evidence uploaded", f"Booking #{bk.id} — side={side}", f"/bookings/flow/{bk.id}")
-    except Exception:
-        pass
-
-    # ✉️ Email: notify the other party + appropriate links
-    try:
-        case_url = f"{BASE_URL}/bookings/flow/{bk.id}"
-        if side == "owner":
-            em = _user_email(db, bk.renter_id)
-            if em:
-                send_email(
-                    em,
-                    f"New evidence from owner — #{bk.id}",
-                    f"<p>The owner added evidence/note for the deposit case.</p>"
-                    f'<p><a href="{case_url}">Booking details</a></p>'
-                )
-        elif side == "renter":
-            em = _user_email(db, bk.owner_id)
-            if em:
-                send_email(
-                    em,
-                    f"Evidence from renter — #{bk.id}",
-                    f"<p>The renter added evidence/note for the deposit case.</p>"
-                    f'<p><a href="{case_url}">Booking details</a></p>'
-                )
-        else:
-            for em in (_user_email(db, bk.owner_id), _user_email(db, bk.renter_id)):
-                if em:
-                    send_email(
-                        em,
-                        f"Update from deposit manager — #{bk.id}",
-                        f"<p>The deposit manager added attachments/note.</p>"
-                        f'<p><a href="{case_url}">Booking details</a></p>'
-                    )
-    except Exception:
-        pass
-
-    accept = (request.headers.get("accept") or "").lower()
-    if "application/json" in accept:
-        return JSONResponse({"ok": True, "saved_ids": saved_ids})
-
-    return RedirectResponse(url=f"/bookings/flow/{bk.id}", status_code=303)
+# POST /deposits/{booking_id}/evidence/upload is served by routes_deposits.evidence_upload
+# (streamed with the caps above); the forms below post there.
 
 # =========================
 # API: fetch evidence as JSON
@@ -7,7 +7,7 @@ from pathlib import Path
 from urllib.parse import quote
 import random
 
-from .database import get_db
+from .database import get_read_db
 from .models import Item, FxRate, ItemReview, Category
 from sqlalchemy.sql import func
 from .utils import category_label as _category_label
@@ -157,7 +157,7 @@ def home_page(
     lng: float | None = Query(None),
     lon: float | None = Query(None),
     radius_km: float | None = Query(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
 
     # Fix lon->lng
@@ -0,0 +1,38 @@
+# app/routes_media.py
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response
+
+from .utils_images import DERIVATIVE_SIZES, ensure_derivative, is_image_path, resolve_upload
+
+router = APIRouter(tags=["media"])
+
+# Derivatives are immutable for a given original (new uploads get new names)
+CACHE_CONTROL = "public, max-age=2592000"
+
+
+@router.get("/media/{size}/{rel_path:path}", include_in_schema=False)
+def media_derivative(size: str, rel_path: str, request: Request):
+    """
+    Serve a resized copy of a local upload, generated on first request.
+    WebP when the browser accepts it, JPEG otherwise.
+    """
+    if size not in DERIVATIVE_SIZES or not is_image_path(rel_path):
+        return Response(status_code=404)
+
+    src = resolve_upload(rel_path)
+    if not src:
+        return Response(status_code=404)
+
+    accept = (request.headers.get("accept") or "").lower()
+    fmt = "webp" if "image/webp" in accept else "jpg"
+
+    out = ensure_derivative(src, size, fmt)
+    if not out:
+        # Unreadable by Pillow → serve the original as-is
+        return RedirectResponse(url=f"/uploads/{rel_path.lstrip('/')}", status_code=307)
+
+    return FileResponse(
+        out,
+        media_type="image/webp" if fmt == "webp" else "image/jpeg",
+        headers={"Cache-Control": CACHE_CONTROL, "Vary": "Accept"},
+    )
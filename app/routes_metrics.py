@@ -1,14 +1,13 @@
 # app/routes_metrics.py
-from datetime import datetime, timedelta, date
+from typing import Optional
 from fastapi import APIRouter, Depends, Request, Body, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func, distinct
+from . import metrics_buffer, metrics_rollup, presence
 from .database import get_db
-from .models_metrics import Visit, OnlineSession
 
 router = APIRouter()
 
-ONLINE_WINDOW_SECONDS = 120  # Consider "online now" if there was activity in the last two minutes
+ONLINE_WINDOW_SECONDS = presence.PRESENCE_TTL_SECONDS  # "online now" = activity in the last two minutes
 
 def _client_ip(request: Request) -> str:
     xff = request.headers.get("x-forwarded-for")
@@ -16,83 +15,50 @@ def _client_ip(request: Request) -> str:
         return xff.split(",")[0].strip()
     return request.client.host if request.client else "0.0.0.0"
 
-@router.post("/api/metrics/track")
-async def track_visit(request: Request, payload: dict = Body(...), db: Session = Depends(get_db)):
-    session_id = (payload.get("session_id") or "").strip()
+def _beacon(request: Request, payload: dict) -> tuple[str, Optional[int], str, str]:
+    session_id = (payload.get("session_id") or "").strip()[:64]
     if not session_id:
         raise HTTPException(400, "session_id required")
-    user_id = payload.get("user_id")
-    ip = _client_ip(request)
+    # Who is online comes from the login session; a user_id in the payload is ignored
+    # (any visitor could otherwise mark another user as online in messaging)
+    try:
+        user_id = int((request.session.get("user") or {}).get("id") or 0) or None
+    except (TypeError, ValueError):
+        user_id = None
+    ip = _client_ip(request)[:64]
     ua = (request.headers.get("user-agent") or "")[:255]
+    return session_id, user_id, ip, ua
 
-    db.add(Visit(session_id=session_id, user_id=user_id, ip=ip, user_agent=ua))
-
-    now = datetime.utcnow()
-    osess = db.get(OnlineSession, session_id)
-    if osess:
-        osess.last_seen = now
-        osess.ip = ip
-        osess.user_agent = ua
-        if user_id:
-            osess.user_id = user_id
-    else:
-        db.add(OnlineSession(session_id=session_id, user_id=user_id, ip=ip, user_agent=ua,
-                             first_seen=now, last_seen=now))
-    db.commit()
+# Beacons only touch the in-memory buffer; app/metrics_buffer.py writes them in bulk
+@router.post("/api/metrics/track")
+async def track_visit(request: Request, payload: dict = Body(...)):
+    metrics_buffer.record_visit(*_beacon(request, payload))
     return {"ok": True}
 
 @router.post("/api/metrics/heartbeat")
-async def heartbeat(request: Request, payload: dict = Body(...), db: Session = Depends(get_db)):
-    session_id = (payload.get("session_id") or "").strip()
-    if not session_id:
-        raise HTTPException(400, "session_id required")
-    user_id = payload.get("user_id")
-    ip = _client_ip(request)
-    ua = (request.headers.get("user-agent") or "")[:255]
-    now = datetime.utcnow()
-
-    osess = db.get(OnlineSession, session_id)
-    if osess:
-        osess.last_seen = now
-        osess.ip = ip
-        osess.user_agent = ua
-        if user_id:
-            osess.user_id = user_id
-    else:
-        db.add(OnlineSession(session_id=session_id, user_id=user_id, ip=ip, user_agent=ua,
-                             first_seen=now, last_seen=now))
-    db.commit()
-
-    online_now = db.query(OnlineSession).filter(OnlineSession.last_seen >= now - timedelta(seconds=ONLINE_WINDOW_SECONDS)).count()
-    return {"ok": True, "online_now": online_now}
+async def heartbeat(request: Request, payload: dict = Body(...)):
+    metrics_buffer.record_heartbeat(*_beacon(request, payload))
+    return {"ok": True, "online_now": presence.online_count()}
 
 @router.get("/api/admin/metrics/summary")
 def metrics_summary(db: Session = Depends(get_db)):
-    now = datetime.utcnow()
-    today = date.today()
-
-    today_count = db.query(func.count(distinct(Visit.session_id))).filter(Visit.day == today).scalar() or 0
-    month_count = db.query(func.count(distinct(Visit.session_id))).filter(Visit.year == today.year, Visit.month == today.month).scalar() or 0
-    year_count  = db.query(func.count(distinct(Visit.session_id))).filter(Visit.year == today.year).scalar() or 0
-
-    online_now = db.query(OnlineSession).filter(OnlineSession.last_seen >= now - timedelta(seconds=ONLINE_WINDOW_SECONDS)).count()
+    # Rollup rows (app/metrics_rollup.py), not COUNT(DISTINCT) over raw visits
+    counts = metrics_rollup.summary(db)
 
     return {
-        "today": today_count,
-        "month": month_count,
-        "year": year_count,
-        "online_now": online_now,
+        **counts,
+        "online_now": presence.online_count(),  # all workers, from memory
         "online_window_seconds": ONLINE_WINDOW_SECONDS,
     }
 
 @router.get("/api/admin/metrics/daily_chart")
 def daily_chart(db: Session = Depends(get_db)):
-    start_day = date.today() - timedelta(days=29)
-    rows = (
-        db.query(Visit.day.label("d"), func.count(distinct(Visit.session_id)).label("u"))
-        .filter(Visit.day >= start_day)
-        .group_by(Visit.day)
-        .order_by(Visit.day)
-        .all()
-    )
-    return {"labels": [r.d.isoformat() for r in rows], "values": [int(r.u) for r in rows]}
+    return metrics_rollup.daily_chart(db, days=30)
+
+@router.get("/api/admin/metrics/ingest")
+def metrics_ingest(request: Request):
+    """Buffer counters (beacons received, flushes, rows written, dropped)."""
+    u = request.session.get("user") or {}
+    if (u.get("role") or "").lower() != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return metrics_buffer.stats()
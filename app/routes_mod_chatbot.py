@@ -1,12 +1,13 @@
 # app/routes_mod_chatbot.py
 
 from datetime import datetime
+from typing import Optional
 from fastapi import APIRouter, Request, Depends, Form
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
 
+from . import staff_queues, ticket_events
 from .database import get_db
 from .models import SupportTicket, SupportMessage, User
 from .utils import display_currency
@@ -48,7 +49,12 @@ def _ensure_mod_session(db: Session, request: Request):
 # ------------------------------------------------
 
 @router.get("/inbox")
-def mod_chatbot_inbox(request: Request, db: Session = Depends(get_db)):
+def mod_chatbot_inbox(
+    request: Request,
+    db: Session = Depends(get_db),
+    tab: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
     u = _require_login(request)
     if not u:
         return RedirectResponse("/login", 303)
@@ -57,49 +63,8 @@ def mod_chatbot_inbox(request: Request, db: Session = Depends(get_db)):
     if not u_mod:
         return RedirectResponse("/support/my", 303)
 
-    base = db.query(SupportTicket).filter(
-        SupportTicket.channel == "chatbot",
-        SupportTicket.queue == "mod_chatbot"
-    )
-
-    # -----------------------------
-    # 🆕 NEW
-    # -----------------------------
-    new_q = base.filter(
-        SupportTicket.assigned_to_id.is_(None),
-        SupportTicket.status.in_(("new", "open")),
-        SupportTicket.last_from == "user",
-    ).order_by(
-        desc(SupportTicket.last_msg_at),
-        desc(SupportTicket.created_at)
-    )
-
-    # -----------------------------
-    # 📂 IN REVIEW
-    # -----------------------------
-    in_review_q = base.filter(
-        SupportTicket.assigned_to_id.isnot(None),
-        SupportTicket.status == "open",
-    ).order_by(
-        desc(SupportTicket.updated_at),
-        desc(SupportTicket.last_msg_at)
-    )
-
-    # -----------------------------
-    # ✅ RESOLVED
-    # -----------------------------
-    resolved_q = base.filter(
-            SupportTicket.status.in_(("resolved", "closed"))
-    ).order_by(
-        desc(SupportTicket.resolved_at),
-        desc(SupportTicket.updated_at)
-    )
-
-    data = {
-        "new": new_q.all(),
-        "in_review": in_review_q.all(),
-        "resolved": resolved_q.all(),
-    }
+    # Paged per tab (keyset) with cached counts — see app/staff_queues.py
+    inbox = staff_queues.inbox(db, "mod_chatbot", tab, cursor)
 
     return templates.TemplateResponse(
         "mod_chatbot_inbox.html",
@@ -107,7 +72,7 @@ def mod_chatbot_inbox(request: Request, db: Session = Depends(get_db)):
             "request": request,
             "session_user": u_mod,
             "title": "MOD Chatbot Inbox",
-            "data": data,
+            **inbox,
             "display_currency": display_currency,
         },
     )
@@ -209,6 +174,7 @@ def mod_chatbot_reply(
     t.status = "open"
     t.unread_for_user = True
     t.unread_for_agent = False
+    ticket_events.record(db, t.id, "message", actor_id=u_mod["id"], queue=t.queue, status="open", author="agent")
 
     db.commit()
 
@@ -253,6 +219,7 @@ def mod_chatbot_resolve(ticket_id: int, request: Request, db: Session = Depends(
     db.add(close_msg)
 
     t.unread_for_user = True
+    ticket_events.record(db, t.id, "resolved", actor_id=u_mod["id"], queue=t.queue, status="resolved")
 
     db.commit()
 
@@ -4,8 +4,9 @@ from fastapi import APIRouter, Depends, Request, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, func
 
-from .database import get_db
+from .database import get_db, get_read_db
 from .models import User, Item
+from . import availability
 
 router = APIRouter()
 
@@ -131,7 +132,9 @@ def search_page(
     lng: str | None = Query(None),
     lon: str | None = Query(None),
     radius_km: str | None = Query(None),
-    db: Session = Depends(get_db)
+    available_from: str | None = Query(None),
+    available_to: str | None = Query(None),
+    db: Session = Depends(get_read_db)
 ):
     if (lng is None or str(lng).strip() == "") and lon not in (None, ""):
         lng = lon
@@ -164,6 +167,7 @@ def search_page(
     lat_f = _to_float(lat)
     lng_f = _to_float(lng)
     radius_f = _to_float(radius_km, default=25.0)
+    date_range = availability.parse_range(available_from, available_to)
 
     if len(q) >= 2:
         pattern = f"%{q}%"
@@ -201,6 +205,8 @@ def search_page(
         )
 
         items_q = _apply_city_or_gps_filter(items_q, city, lat_f, lng_f, radius_f)
+        if date_range:
+            items_q = items_q.filter(availability.available_between(*date_range))
         items_rows = items_q.limit(24).all()
 
         items = [
@@ -226,6 +232,8 @@ def search_page(
             "selected_city": city or "",
             "lat": lat_f,
             "lng": lng_f,
-            "radius_km": radius_f
+            "radius_km": radius_f,
+            "available_from": date_range[0].isoformat() if date_range else "",
+            "available_to": date_range[1].isoformat() if date_range else "",
         },
     )
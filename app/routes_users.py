@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends, Request, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from .database import get_db
+from .database import get_read_db
 from .models import User, Item, UserReview   # ← استخدام UserReview
 
 # ===== [Optional: unified email sender] =====
@@ -45,7 +45,7 @@ def _is_new(created_at: datetime | None, days: int = 60) -> bool:
 
 
 @router.get("/users/{user_id}")
-def user_profile(user_id: int, request: Request, db: Session = Depends(get_db)):
+def user_profile(user_id: int, request: Request, db: Session = Depends(get_read_db)):
     # 1) the user
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -0,0 +1,387 @@
+# app/scheduler.py
+"""
+In-process scheduler for the periodic maintenance jobs
+(deposit auto-release, DM response window, refund/silence robots, ...).
+
+Every web worker runs the same loop, but each job is guarded by a lease row in
+`scheduler_locks`: a worker must win a conditional UPDATE (lease expired and
+next_run_at reached) before running it, so one run happens per interval across
+all processes. The row also carries the shared schedule and the consecutive
+failure count used for exponential backoff. Each run is recorded in
+`scheduler_runs` (status, duration, result/error).
+
+Jobs are plain callables that open their own session and return something
+JSON-serialisable (stored as the run result). A job fails by raising; a job
+that keeps going past per-booking errors returns {"errors": n, ...} and an
+n > 0 marks the run as failed too.
+
+The scheduler is on by default (SCHEDULER_ENABLED=0 turns it off, e.g. when
+a single dedicated process runs it): auto-release, the deposit robots, the
+wallet snapshot, metrics rollup / visit retention, the online_sessions purge
+and the ticket-event prune all run only from here.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, get_db
+from .models import SchedulerLock, SchedulerRun
+
+# ================= Settings =================
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").lower() in ("1", "true", "yes")
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "20"))
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "2"))
+# Upper bound for failure backoff
+SCHEDULER_MAX_BACKOFF_SECONDS = int(os.getenv("SCHEDULER_MAX_BACKOFF_SECONDS", "3600"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        interval: int,
+        *,
+        jitter: float = 0.1,
+        lease: Optional[int] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.interval = int(interval)
+        self.jitter = jitter                               # fraction of interval added at random
+        self.lease = int(lease or max(self.interval, 600))  # how long a crashed holder blocks others
+
+        # in-process metrics (this worker only; history lives in scheduler_runs)
+        self.runs = 0
+        self.failures = 0
+        self.last_duration_ms: Optional[int] = None
+        self.total_duration_ms = 0
+        self.last_status: Optional[str] = None
+
+    def next_delay(self, failures: int) -> float:
+        if failures > 0:
+            base = min(self.interval * (2 ** min(failures, 10)), max(SCHEDULER_MAX_BACKOFF_SECONDS, self.interval))
+        else:
+            base = self.interval
+        return base + random.uniform(0, base * self.jitter)
+
+
+_jobs: dict[str, Job] = {}
+_running: set[str] = set()
+_running_guard = threading.Lock()
+
+
+def register_job(name: str, func: Callable[[], Any], interval: int, **kw) -> Optional[Job]:
+    """
+    Register a periodic job. The interval can be overridden per job with
+    SCHEDULER_<NAME>_SECONDS; 0 disables it.
+    """
+    interval = int(os.getenv(f"SCHEDULER_{name.upper()}_SECONDS", str(interval)))
+    if interval <= 0:
+        _jobs.pop(name, None)
+        return None
+    job = _jobs[name] = Job(name, func, interval, **kw)
+    return job
+
+
+def jobs() -> list[Job]:
+    return list(_jobs.values())
+
+
+# ================= Leases =================
+def _acquire(db: Session, job: Job, *, force: bool = False) -> bool:
+    """Try to take the job's lease. `force` ignores next_run_at (manual runs)."""
+    now = datetime.utcnow()
+    conds = [
+        SchedulerLock.job_name == job.name,
+        or_(
+            SchedulerLock.locked_until.is_(None),
+            SchedulerLock.locked_until < now,
+            SchedulerLock.owner == WORKER_ID,
+        ),
+    ]
+    if not force:
+        conds.append(or_(SchedulerLock.next_run_at.is_(None), SchedulerLock.next_run_at <= now))
+    n = db.query(SchedulerLock).filter(*conds).update(
+        {"owner": WORKER_ID, "locked_until": now + timedelta(seconds=job.lease), "updated_at": now},
+        synchronize_session=False,
+    )
+    if n:
+        db.commit()
+        return True
+    db.rollback()
+
+    if db.get(SchedulerLock, job.name) is not None:
+        return False
+    # First run ever: whoever inserts the row owns it
+    try:
+        db.add(SchedulerLock(
+            job_name=job.name,
+            owner=WORKER_ID,
+            locked_until=now + timedelta(seconds=job.lease),
+            next_run_at=now,
+            failures=0,
+        ))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+
+def _release(db: Session, job: Job, ok: bool) -> None:
+    lock = db.get(SchedulerLock, job.name)
+    if not lock or lock.owner != WORKER_ID:
+        return
+    lock.failures = 0 if ok else (lock.failures or 0) + 1
+    lock.next_run_at = datetime.utcnow() + timedelta(seconds=job.next_delay(lock.failures))
+    lock.locked_until = None
+    db.commit()
+
+
+# ================= Running =================
+def _to_text(result: Any) -> Optional[str]:
+    if result is None:
+        return None
+    try:
+        return json.dumps(result, default=str)[:4000]
+    except Exception:
+        return str(result)[:4000]
+
+
+def _run(job: Job, trigger: str) -> dict:
+    db = SessionLocal()
+    run = SchedulerRun(job_name=job.name, worker=WORKER_ID, trigger=trigger, status="running",
+                       started_at=datetime.utcnow())
+    db.add(run)
+    db.commit()
+
+    t0 = time.monotonic()
+    ok = True
+    result = None
+    error = None
+    try:
+        result = job.func()
+        n_errors = result.get("errors") if isinstance(result, dict) else None
+        if n_errors:
+            ok = False
+            error = f"{n_errors} item(s) failed"
+            print(f"[WARN] scheduler job {job.name}: {error}")
+    except Exception as e:
+        ok = False
+        error = f"{type(e).__name__}: {e}"[:2000]
+        print(f"[WARN] scheduler job {job.name} failed: {str(e).splitlines()[0][:300] if str(e) else type(e).__name__}")
+    elapsed = int((time.monotonic() - t0) * 1000)
+
+    job.runs += 1
+    job.last_duration_ms = elapsed
+    job.total_duration_ms += elapsed
+    job.last_status = "ok" if ok else "error"
+    if not ok:
+        job.failures += 1
+
+    try:
+        db.rollback()
+        run = db.get(SchedulerRun, run.id)
+        run.status = job.last_status
+        run.finished_at = datetime.utcnow()
+        run.duration_ms = elapsed
+        run.result = _to_text(result)
+        run.error = error
+        db.commit()
+        _release(db, job, ok)
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] scheduler bookkeeping failed for {job.name}: {e}")
+    finally:
+        db.close()
+    return {"job": job.name, "status": job.last_status, "duration_ms": elapsed, "result": result}
+
+
+def run_job(name: str, *, force: bool = False, trigger: str = "schedule") -> Optional[dict]:
+    """
+    Run one job if this worker can take its lease. Returns the run summary,
+    or None when the job is not due / held elsewhere / already running here.
+    """
+    job = _jobs.get(name)
+    if not job:
+        raise KeyError(name)
+    with _running_guard:
+        if name in _running:
+            return None
+        _running.add(name)
+    try:
+        db = SessionLocal()
+        try:
+            if not _acquire(db, job, force=force):
+                return None
+        except Exception as e:
+            db.rollback()
+            print(f"[WARN] scheduler lease failed for {name}: {e}")
+            return None
+        finally:
+            db.close()
+        return _run(job, trigger)
+    finally:
+        with _running_guard:
+            _running.discard(name)
+
+
+# ================= Loop =================
+_executor: Optional[ThreadPoolExecutor] = None
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _loop() -> None:
+    # Spread workers that booted together
+    _stop.wait(random.uniform(0, SCHEDULER_TICK_SECONDS))
+    while not _stop.is_set():
+        for job in jobs():
+            with _running_guard:
+                busy = job.name in _running
+            if not busy:
+                _executor.submit(run_job, job.name)
+        _stop.wait(SCHEDULER_TICK_SECONDS * random.uniform(0.8, 1.2))
+
+
+def register_default_jobs() -> None:
+    """The periodic jobs that used to be triggered by external cron hits."""
+    from . import cron_auto_release, routes_deposits
+    from . import deposit_owner_silence_robot, deposit_refund_robot, deposit_renter_silence_robot
+    from . import metrics_rollup, platform_wallet, presence, ticket_events
+
+    def _with_db(fn):
+        def _job():
+            db = SessionLocal()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+        return _job
+
+    register_job("auto_release", _with_db(lambda db: cron_auto_release.auto_release_tick(db, dry=False)), 900)
+    register_job("dm_check_window", _with_db(routes_deposits.check_window_tick), 900)
+    register_job("deposit_refund_robot", deposit_refund_robot.run_once, 1800)
+    register_job("owner_silence_robot", deposit_owner_silence_robot.run_once, 1800)
+    register_job("renter_silence_robot", deposit_renter_silence_robot.run_once, 1800)
+    register_job("platform_wallet_snapshot", _with_db(platform_wallet.take_snapshot), 600)
+    register_job("metrics_rollup", _with_db(metrics_rollup.rollup_tick), 300)
+    register_job("visits_retention", _with_db(metrics_rollup.prune_tick), 86400)
+    register_job("online_sessions_purge", _with_db(presence.purge_online_sessions), 3600)
+    register_job("ticket_events_prune", _with_db(ticket_events.prune), 86400)
+
+
+def start() -> bool:
+    """Start the scheduler loop (unless SCHEDULER_ENABLED=0)."""
+    global _executor, _thread
+    if not SCHEDULER_ENABLED:
+        print(
+            "[WARN] scheduler disabled (SCHEDULER_ENABLED=0): auto-release, deposit robots, wallet snapshots, "
+            "metrics rollup/retention and the presence/ticket-event purges will not run in this process"
+        )
+        return False
+    if _thread and _thread.is_alive():
+        return True
+    if not _jobs:
+        register_default_jobs()
+    _stop.clear()
+    _executor = ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS, thread_name_prefix="scheduler-job")
+    _thread = threading.Thread(target=_loop, name="scheduler", daemon=True)
+    _thread.start()
+    return True
+
+
+def stop() -> None:
+    _stop.set()
+    if _executor:
+        _executor.shutdown(wait=False)
+
+
+# ================= Admin =================
+router = APIRouter(prefix="/admin/scheduler", tags=["admin"])
+
+
+def _require_admin(request: Request) -> None:
+    u = request.session.get("user") or {}
+    if u.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+
+@router.get("")
+def scheduler_status(request: Request, db: Session = Depends(get_db), limit: int = 20):
+    """Jobs, their shared schedule/lease, and the latest runs (any worker)."""
+    _require_admin(request)
+    if not _jobs:
+        register_default_jobs()
+    locks = {l.job_name: l for l in db.query(SchedulerLock).all()}
+    out = []
+    for job in jobs():
+        lock = locks.get(job.name)
+        recent = (
+            db.query(SchedulerRun)
+            .filter(SchedulerRun.job_name == job.name)
+            .order_by(SchedulerRun.id.desc())
+            .limit(max(1, min(limit, 200)))
+            .all()
+        )
+        durations = [r.duration_ms for r in recent if r.duration_ms is not None]
+        out.append({
+            "name": job.name,
+            "interval_seconds": job.interval,
+            "owner": lock.owner if lock else None,
+            "locked_until": lock.locked_until.isoformat() if lock and lock.locked_until else None,
+            "next_run_at": lock.next_run_at.isoformat() if lock and lock.next_run_at else None,
+            "consecutive_failures": lock.failures if lock else 0,
+            "avg_duration_ms": (sum(durations) // len(durations)) if durations else None,
+            "max_duration_ms": max(durations) if durations else None,
+            "this_worker": {
+                "runs": job.runs,
+                "failures": job.failures,
+                "last_status": job.last_status,
+                "last_duration_ms": job.last_duration_ms,
+            },
+            "runs": [
+                {
+                    "id": r.id,
+                    "worker": r.worker,
+                    "trigger": r.trigger,
+                    "status": r.status,
+                    "started_at": r.started_at.isoformat() if r.started_at else None,
+                    "duration_ms": r.duration_ms,
+                    "result": r.result,
+                    "error": r.error,
+                }
+                for r in recent
+            ],
+        })
+    return {"enabled": SCHEDULER_ENABLED, "worker": WORKER_ID, "jobs": out}
+
+
+@router.post("/{name}/run")
+def scheduler_run_now(name: str, request: Request):
+    """Run a job immediately (still takes the lease, so it never overlaps a scheduled run)."""
+    _require_admin(request)
+    if not _jobs:
+        register_default_jobs()
+    if name not in _jobs:
+        raise HTTPException(status_code=404, detail="unknown job")
+    res = run_job(name, force=True, trigger="manual")
+    if res is None:
+        raise HTTPException(status_code=409, detail="job is running on another worker")
+    return res
@@ -0,0 +1,318 @@
+# app/staff_queues.py
+"""
+Shared query layer for the staff inboxes: CS (/cs/inbox), MD and MOD chatbot
+inboxes, the DM deposit queue (/dm/deposits) and the deposit-manager tabs.
+
+Each inbox is a StaffQueue: a base filter plus named tabs, every tab being
+(filter, sort key). Pages use keyset pagination on (sort key, id) descending
+with an opaque cursor, so the "resolved" tabs cost the same at page 50 as at
+page 1 and nothing loads the whole history. Per-tab counts come from one
+conditional-aggregate query per queue, cached for STAFF_QUEUE_COUNTS_TTL_SECONDS
+and dropped whenever a flush touches the queue's model.
+
+Other pages can register() their own StaffQueue (the /admin user directory,
+app/user_directory.py) and pass extra filter clauses to page()/counts().
+
+Startup (main.py) runs normalize() — legacy NULL / mis-filed support_tickets
+queue values and NULL last_msg_at — and ensure_indexes():
+  support_tickets (queue, status, assigned_to_id, last_msg_at)
+  bookings        (deposit_status, updated_at)
+"""
+from __future__ import annotations
+
+import base64
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, case, event, func, or_, select, text
+from sqlalchemy.orm import Session
+
+from .database import engine, table_columns
+from .models import Booking, SupportTicket
+
+STAFF_QUEUE_PAGE_SIZE = int(os.getenv("STAFF_QUEUE_PAGE_SIZE", "50"))
+STAFF_QUEUE_COUNTS_TTL_SECONDS = float(os.getenv("STAFF_QUEUE_COUNTS_TTL_SECONDS", "30"))
+
+
+# ================= Cursor =================
+def encode_cursor(key: datetime, row_id: int) -> str:
+    raw = f"{key.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple[datetime, int]]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        key, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(key), int(row_id)
+    except Exception:
+        return None  # stale / hand-edited cursor: start from the top
+
+
+def keyset_page(query, key, id_col, cursor: Optional[str], limit: int):
+    """
+    Rows of `query` ordered by (key DESC, id DESC), starting after `cursor`.
+    Returns (rows, next_cursor or None). `key` must be non-null for every row.
+    """
+    after = decode_cursor(cursor)
+    if after:
+        k, i = after
+        query = query.filter(or_(key < k, and_(key == k, id_col < i)))
+    rows = query.order_by(key.desc(), id_col.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(_key_value(last, key), last.id)
+
+
+def _key_value(row, key) -> datetime:
+    # Plain column → attribute; coalesce(...) → first non-null of its columns
+    cols = getattr(key, "clauses", None)
+    for col in (cols if cols is not None else [key]):
+        v = getattr(row, getattr(col, "key", ""), None)
+        if v is not None:
+            return v
+    # NULL sort key (row written before normalize()): sorts last on SQLite
+    return getattr(row, "created_at", None) or datetime.min
+
+
+# ================= Queues =================
+class StaffQueue:
+    def __init__(self, name: str, model, base, tabs: dict):
+        self.name = name
+        self.model = model
+        self.base = base      # callable → filter clause (or None)
+        self.tabs = tabs      # tab → (callable → filter clause or None, sort key)
+
+    def _where(self, extra=()) -> list:
+        base = self.base() if self.base else None
+        return ([base] if base is not None else []) + list(extra)
+
+    def query(self, db: Session, tab: str, extra=()):
+        """`extra`: additional filter clauses (e.g. search filters) applied to every tab."""
+        cond, _ = self.tabs[tab]
+        q = db.query(self.model)
+        for w in self._where(extra):
+            q = q.filter(w)
+        c = cond() if cond else None
+        if c is not None:
+            q = q.filter(c)
+        return q
+
+    def page(self, db: Session, tab: str, cursor: Optional[str] = None, limit: Optional[int] = None,
+             options=(), extra=()):
+        q = self.query(db, tab, extra)
+        if options:
+            q = q.options(*options)
+        return keyset_page(q, self.tabs[tab][1], self.model.id, cursor, limit or STAFF_QUEUE_PAGE_SIZE)
+
+    def counts(self, db: Session, extra=(), cache_key: str = "") -> dict:
+        """Per-tab counts; with `extra`, pass a `cache_key` identifying those filters."""
+        return _cached_counts(self, db, extra, cache_key)
+
+    def _count_now(self, db: Session, extra=()) -> dict:
+        cols = []
+        for tab, (cond, _) in self.tabs.items():
+            c = cond() if cond else None
+            cols.append(func.count(self.model.id) if c is None else func.coalesce(func.sum(case((c, 1), else_=0)), 0))
+        q = select(*cols).select_from(self.model)
+        for w in self._where(extra):
+            q = q.where(w)
+        row = db.execute(q).one()
+        return {tab: int(v or 0) for tab, v in zip(self.tabs, row)}
+
+
+_COUNTS_MAX_KEYS = 512  # filtered counts (searches) are cached too; bound the dict
+
+_counts_lock = threading.Lock()
+_counts: dict[tuple[str, str], tuple[float, dict]] = {}
+
+
+def _cached_counts(queue: StaffQueue, db: Session, extra=(), cache_key: str = "") -> dict:
+    now = time.monotonic()
+    key = (queue.name, cache_key)
+    hit = _counts.get(key)
+    if hit and now - hit[0] < STAFF_QUEUE_COUNTS_TTL_SECONDS:
+        return hit[1]
+    counts = queue._count_now(db, extra)
+    with _counts_lock:
+        if len(_counts) >= _COUNTS_MAX_KEYS:
+            _counts.clear()
+        _counts[key] = (now, counts)
+    return counts
+
+
+def invalidate_counts(model=None) -> None:
+    with _counts_lock:
+        for key in list(_counts):
+            if model is None or QUEUES[key[0]].model is model:
+                _counts.pop(key, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _drop_counts_on_change(session, _ctx):
+    touched = {type(o) for o in (*session.new, *session.dirty, *session.deleted)}
+    for model in {q.model for q in QUEUES.values()} & touched:
+        invalidate_counts(model)
+
+
+# ---------- support tickets ----------
+def _ticket_queue(queue: str, channel: Optional[str] = None):
+    def base():
+        c = SupportTicket.queue == queue
+        return and_(SupportTicket.channel == channel, c) if channel else c
+    return base
+
+
+_T_LAST = SupportTicket.last_msg_at
+_T_UPDATED = func.coalesce(SupportTicket.updated_at, SupportTicket.created_at)
+_T_RESOLVED = func.coalesce(SupportTicket.resolved_at, SupportTicket.updated_at, SupportTicket.created_at)
+
+
+def _ticket_tabs(*, new_unread_only: bool, in_review_key, resolved_statuses):
+    def new():
+        c = and_(
+            SupportTicket.status.in_(("new", "open")),
+            SupportTicket.assigned_to_id.is_(None),
+            SupportTicket.last_from == "user",
+        )
+        return and_(c, SupportTicket.unread_for_agent.is_(True)) if new_unread_only else c
+
+    return {
+        "new": (new, _T_LAST),
+        "in_review": (lambda: and_(SupportTicket.status == "open", SupportTicket.assigned_to_id.isnot(None)),
+                      in_review_key),
+        "resolved": (lambda: SupportTicket.status.in_(resolved_statuses), _T_RESOLVED),
+    }
+
+
+# ---------- bookings ----------
+_B_UPDATED = Booking.updated_at
+
+DM_TABS = {
+    "all": (None, _B_UPDATED),
+    "new": (lambda: and_(
+        or_(Booking.deposit_status == "in_dispute", Booking.deposit_status.is_(None)),
+        Booking.renter_response_at.is_(None),
+        Booking.dm_decision_at.is_(None),
+    ), _B_UPDATED),
+    "awaiting_renter": (lambda: Booking.deposit_status == "awaiting_renter", _B_UPDATED),
+    "awaiting_dm": (lambda: and_(
+        Booking.deposit_status == "in_dispute",
+        Booking.renter_response_at.isnot(None),
+        Booking.dm_decision_at.is_(None),
+    ), _B_UPDATED),
+    "closed": (lambda: or_(Booking.status == "closed", Booking.dm_decision_at.isnot(None)), _B_UPDATED),
+}
+
+DEPOSIT_MANAGER_TABS = {
+    "pending": (lambda: and_(
+        Booking.status.in_(["returned", "in_review"]),
+        Booking.deposit_status.in_(["in_dispute", "held"]),
+    ), _B_UPDATED),
+    "in_review": (lambda: Booking.status == "in_review", _B_UPDATED),
+    "resolved": (lambda: Booking.status.in_(["closed", "completed"]), _B_UPDATED),
+}
+
+
+QUEUES: dict[str, StaffQueue] = {
+    q.name: q for q in (
+        StaffQueue("cs", SupportTicket, _ticket_queue("cs"),
+                   _ticket_tabs(new_unread_only=True, in_review_key=_T_LAST, resolved_statuses=("resolved",))),
+        StaffQueue("md_chatbot", SupportTicket, _ticket_queue("md_chatbot", "chatbot"),
+                   _ticket_tabs(new_unread_only=False, in_review_key=_T_UPDATED,
+                                resolved_statuses=("resolved", "closed"))),
+        StaffQueue("mod_chatbot", SupportTicket, _ticket_queue("mod_chatbot", "chatbot"),
+                   _ticket_tabs(new_unread_only=False, in_review_key=_T_UPDATED,
+                                resolved_statuses=("resolved", "closed"))),
+        StaffQueue("dm_deposits", Booking, None, DM_TABS),
+        StaffQueue("deposit_manager", Booking, None, DEPOSIT_MANAGER_TABS),
+    )
+}
+
+
+def register(queue: StaffQueue) -> StaffQueue:
+    """Add a queue defined elsewhere (e.g. the admin user directory) to QUEUES."""
+    QUEUES[queue.name] = queue
+    return queue
+
+
+def inbox(db: Session, name: str, tab: Optional[str] = None, cursor: Optional[str] = None, options=()) -> dict:
+    """
+    Template data for a tabbed inbox: first page of every tab, or the page
+    after `cursor` for `tab`, plus cached per-tab counts and next cursors.
+    """
+    queue = QUEUES[name]
+    data, next_cursors = {}, {}
+    for t in queue.tabs:
+        rows, nxt = queue.page(db, t, cursor if t == tab else None, options=options)
+        data[t] = rows
+        next_cursors[t] = nxt
+    return {"data": data, "counts": queue.counts(db), "next_cursor": next_cursors}
+
+
+# ================= Normalization / indexes (startup) =================
+INDEXES = (
+    ("support_tickets", "ix_support_tickets_queue_status_assignee_last",
+     ("queue", "status", "assigned_to_id", "last_msg_at")),
+    ("bookings", "ix_bookings_deposit_status_updated", ("deposit_status", "updated_at")),
+)
+
+
+def normalize(db: Session) -> dict:
+    """
+    One-time data fixes the queues rely on (idempotent, touches only bad rows):
+      - support_tickets.queue NULL → 'cs' (what COALESCE(queue,'cs') meant)
+      - web-form tickets that got the 'cs_chatbot' column default → 'cs'
+      - support_tickets.last_msg_at NULL → created_at (keyset sort key)
+      - bookings.updated_at NULL → created_at (keyset sort key)
+    """
+    out = {}
+    tcols = table_columns("support_tickets")
+    if "queue" in tcols:
+        out["queue_null"] = db.execute(text("UPDATE support_tickets SET queue = 'cs' WHERE queue IS NULL")).rowcount
+        if "channel" in tcols:
+            out["queue_misfiled"] = db.execute(text(
+                "UPDATE support_tickets SET queue = 'cs' "
+                "WHERE queue = 'cs_chatbot' AND COALESCE(channel, 'legacy') <> 'chatbot'"
+            )).rowcount
+    if tcols:
+        out["ticket_last_msg"] = db.execute(text(
+            "UPDATE support_tickets SET last_msg_at = COALESCE(updated_at, created_at) WHERE last_msg_at IS NULL"
+        )).rowcount
+    if "updated_at" in table_columns("bookings"):
+        out["booking_updated"] = db.execute(text(
+            "UPDATE bookings SET updated_at = created_at WHERE updated_at IS NULL AND created_at IS NOT NULL"
+        )).rowcount
+    db.commit()
+    invalidate_counts()
+    return {k: v for k, v in out.items() if v}
+
+
+def create_index(table: str, name: str, columns_sql: str, needs) -> bool:
+    """
+    CREATE INDEX IF NOT EXISTS (CONCURRENTLY on Postgres) when `table` has all
+    columns in `needs`. create_all() never adds indexes to existing tables.
+    """
+    if not set(needs) <= table_columns(table):
+        return False
+    pg = engine.dialect.name == "postgresql"
+    sql = f"CREATE INDEX {'CONCURRENTLY ' if pg else ''}IF NOT EXISTS {name} ON {table} ({columns_sql})"
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(sql))
+        return True
+    except Exception as e:
+        print(f"[WARN] index {name} failed: {e}")
+        return False
+
+
+def ensure_indexes() -> list[str]:
+    """Create the queue indexes (see INDEXES)."""
+    return [name for table, name, cols in INDEXES if create_index(table, name, ", ".join(cols), cols)]
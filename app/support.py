@@ -3,13 +3,15 @@ from datetime import datetime
 
 from fastapi import APIRouter, Request, Depends, Form
 from fastapi.responses import RedirectResponse, HTMLResponse
+from sqlalchemy import case, func, or_, select, update
 from sqlalchemy.orm import Session
 
-from .database import get_db
+from . import ticket_events
+from .database import engine, get_db
 from .models import SupportTicket, SupportMessage, User
 
 # ✅ import internal notifications function
-from .notifications_api import push_notification
+from .notifications_api import push_notifications
 
 router = APIRouter()
 
@@ -21,35 +23,72 @@ def _require_login(request: Request):
         return None
     return u
 
-def bump_ticket_on_message(db, ticket_id, author_user, is_cs_author: bool):
-    t = db.get(SupportTicket, ticket_id)
-    if not t:
-        return
-    t.last_msg_at = datetime.utcnow()
-    t.updated_at = datetime.utcnow()
+_TICKET_STATE_COLS = ("id", "user_id", "subject", "queue", "status", "assigned_to_id")
+
+
+def bump_ticket_on_message(db, ticket_id, author_user, is_cs_author: bool, owner_id=None, commit: bool = True):
+    """
+    Ticket state after a new message, as one conditional UPDATE (no SELECT of
+    the ticket and its joined users first). `owner_id` restricts it to that
+    customer's ticket. Records a "message" event and returns the ticket's
+    id / user_id / subject / queue / status / assigned_to_id after the change,
+    or None if no ticket matched.
+    """
+    T = SupportTicket.__table__
+    author_id = author_user.get("id") if isinstance(author_user, dict) else getattr(author_user, "id", None)
+    now = datetime.utcnow()
 
     if is_cs_author:
-        # last message from support
-        t.last_from = "agent"
-        # confirm assignment + keep it open
-        if not t.assigned_to_id:
-            t.assigned_to_id = author_user.id
-        if t.status in (None, "new", "resolved"):
-            t.status = "open"
-        # read by agent now
-        t.unread_for_agent = False
-        # mark as unread for user so they will see the reply
-        t.unread_for_user = True
+        values = {
+            # last message from support
+            "last_from": "agent",
+            # confirm assignment + keep it open
+            "assigned_to_id": func.coalesce(T.c.assigned_to_id, author_id),
+            "status": case(
+                (or_(T.c.status.is_(None), T.c.status.in_(("new", "resolved"))), "open"),
+                else_=T.c.status,
+            ),
+            # read by agent now, unread for the user so they will see the reply
+            "unread_for_agent": False,
+            "unread_for_user": True,
+        }
+    else:
+        values = {
+            # last message from the customer
+            "last_from": "user",
+            # if closed, reopen it
+            "status": case((T.c.status == "resolved", "open"), else_=T.c.status),
+            # became unread for agent
+            "unread_for_agent": True,
+            "unread_for_user": False,
+        }
+
+    stmt = update(T).where(T.c.id == ticket_id).values(last_msg_at=now, updated_at=now, **values)
+    if owner_id is not None:
+        stmt = stmt.where(T.c.user_id == owner_id)
+    cols = [T.c[c] for c in _TICKET_STATE_COLS if c in T.c]
+
+    if engine.dialect.update_returning:
+        row = db.execute(stmt.returning(*cols)).mappings().first()
     else:
-        # last message from the customer
-        t.last_from = "user"
-        # if closed, reopen it
-        if t.status == "resolved":
-            t.status = "open"
-        # became unread for agent
-        t.unread_for_agent = True
+        row = None
+        if db.execute(stmt).rowcount:
+            row = db.execute(select(*cols).where(T.c.id == ticket_id)).mappings().first()
+    if not row:
+        return None
 
-    db.commit()
+    ticket_events.record(
+        db, row["id"], "message", actor_id=author_id,
+        queue=row.get("queue"), status=row["status"], author="agent" if is_cs_author else "user",
+    )
+    if commit:
+        db.commit()
+    return row
+
+
+def _support_agent_ids(db: Session) -> list[int]:
+    rows = db.query(User.id).filter(User.is_support == True, User.status == "approved").all()
+    return [r[0] for r in rows]
 
 
 def _ensure_cs_session(db: Session, request: Request):
@@ -82,29 +121,17 @@ def _ensure_cs_session(db: Session, request: Request):
 
 # ✅ function to notify all CS agents when a new ticket is opened
 def _notify_support_agents_on_new_ticket(db: Session, ticket: SupportTicket):
-    agents = (
-        db.query(User)
-        .filter(User.is_support == True, User.status == "approved")
-        .all()
-    )
     # you can keep the direct ticket link or make it /cs/inbox per team preference
     url = f"/cs/ticket/{ticket.id}"
     title = "🎫 New support ticket"
     body = f"#{ticket.id} — {ticket.subject or ''}".strip()
 
-    for ag in agents:
-        try:
-            push_notification(
-                db,
-                ag.id,
-                title,
-                body,
-                url,
-                "support",  # notification kind
-            )
-        except Exception:
-            # do not block ticket creation if one notification fails
-            pass
+    try:
+        push_notifications(db, _support_agent_ids(db), title, body, url, "support")
+    except Exception as e:
+        # do not block ticket creation if the notifications fail
+        db.rollback()
+        print(f"[WARN] support ticket #{ticket.id} agent notifications failed: {e}")
 
 
 # ========== Customer UI ==========
@@ -143,12 +170,15 @@ def support_new_post(request: Request, db: Session = Depends(get_db)):
         subject = "No subject"
 
     # create ticket + first message
+    now = datetime.utcnow()
     t = SupportTicket(
         user_id=u["id"],
         subject=subject,
+        queue="cs",           # web form → CS inbox (the column default is the chatbot queue)
         status="new",
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow(),
+        created_at=now,
+        updated_at=now,
+        last_msg_at=now,
         last_from="user",
         unread_for_agent=True,
         unread_for_user=False,
@@ -164,6 +194,7 @@ def support_new_post(request: Request, db: Session = Depends(get_db)):
         created_at=datetime.utcnow(),
     )
     db.add(m)
+    ticket_events.record(db, t.id, "created", actor_id=u["id"], queue=t.queue, status=t.status)
     db.commit()
 
     # ✅ after successful creation: notify CS agents
@@ -240,50 +271,31 @@ def support_ticket_reply(tid: int, request: Request, db: Session = Depends(get_d
     if not u:
         return RedirectResponse("/login", status_code=303)
 
-    t = db.get(SupportTicket, tid)
-    if not t or t.user_id != u["id"]:
+    # update ticket state and flags (only if it is this user's ticket)
+    t = bump_ticket_on_message(db, tid, u, is_cs_author=False, owner_id=u["id"], commit=False)
+    if not t:
         return RedirectResponse("/support/my", status_code=303)
 
     # create a customer message
     m = SupportMessage(
-        ticket_id=t.id,
+        ticket_id=tid,
         sender_id=u["id"],
         sender_role="user",
         body=(body or "").strip() or "(no text)",
         created_at=datetime.utcnow(),
     )
     db.add(m)
-
-    # update ticket state and flags
-    t.last_msg_at = datetime.utcnow()
-    t.updated_at = datetime.utcnow()
-    t.last_from = "user"
-    if t.status == "resolved":
-        t.status = "open"
-    t.unread_for_agent = True
-    t.unread_for_user = False
     db.commit()
 
     # notify the assigned agent if any, otherwise all approved CS staff
-    if t.assigned_to_id:
-        push_notification(
-            db,
-            t.assigned_to_id,
-            "💬 New customer reply",
-            f"#{t.id} — {t.subject or ''}",
-            url=f"/cs/ticket/{t.id}",
-            kind="support",
-        )
-    else:
-        agents = db.query(User).filter(User.is_support==True, User.status=="approved").all()
-        for ag in agents:
-            push_notification(
-                db,
-                ag.id,
-                "💬 New customer reply",
-                f"#{t.id} — {t.subject or ''}",
-                url=f"/cs/ticket/{t.id}",
-                kind="support",
-            )
-
-    return RedirectResponse(f"/support/ticket/{t.id}", status_code=303)
+    recipients = [t["assigned_to_id"]] if t["assigned_to_id"] else _support_agent_ids(db)
+    push_notifications(
+        db,
+        recipients,
+        "💬 New customer reply",
+        f"#{tid} — {t['subject'] or ''}",
+        url=f"/cs/ticket/{tid}",
+        kind="support",
+    )
+
+    return RedirectResponse(f"/support/ticket/{tid}", status_code=303)
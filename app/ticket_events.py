@@ -0,0 +1,158 @@
+# app/ticket_events.py
+"""
+Support ticket event log (support_ticket_events) and the tail endpoint staff
+consoles poll instead of reloading whole inboxes.
+
+Every ticket state change records one row in the same transaction as the
+change itself (record()):
+
+  created       ticket opened (web form / chatbot escalation)
+  message       user or agent message (support.bump_ticket_on_message)
+  assigned      agent took the ticket
+  resolved      ticket resolved / closed
+  transferred   moved to another queue (data: {"from": ..., "to": ...})
+
+GET /api/support/events?queue=cs,cs_chatbot&after=<id>
+    → {"events": [...], "last_id": N}; without `after` only last_id is
+      returned, so a console starts at the head and then asks for what
+      happened since. Staff only.
+
+Rows are small and append-only; the ticket_events_prune scheduler job deletes
+rows older than TICKET_EVENTS_RETENTION_DAYS in batches.
+"""
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import Session
+
+from . import staff_queues
+from .database import get_db
+from .models import SupportTicket, SupportTicketEvent, User
+
+# ================= Settings =================
+TICKET_EVENTS_RETENTION_DAYS = int(os.getenv("TICKET_EVENTS_RETENTION_DAYS", "30"))
+TICKET_EVENTS_PRUNE_BATCH = int(os.getenv("TICKET_EVENTS_PRUNE_BATCH", "5000"))
+TICKET_EVENTS_PAGE = int(os.getenv("TICKET_EVENTS_PAGE", "200"))
+
+
+# ================= Write =================
+def record(
+    db: Session,
+    ticket_id: int,
+    kind: str,
+    actor_id: Optional[int] = None,
+    queue: Optional[str] = None,
+    status: Optional[str] = None,
+    **data,
+) -> None:
+    """Add an event row to the current transaction (the caller commits)."""
+    db.add(SupportTicketEvent(
+        ticket_id=ticket_id,
+        kind=kind,
+        actor_id=actor_id,
+        queue=queue,
+        status=status,
+        data=json.dumps(data, default=str) if data else None,
+        created_at=datetime.utcnow(),
+    ))
+
+
+@event.listens_for(Session, "after_flush")
+def _drop_counts_on_event(session, _ctx):
+    # Ticket transitions are single UPDATE statements the ORM never sees as
+    # dirty rows; their event row is what tells the inbox counts to refresh.
+    if any(isinstance(o, SupportTicketEvent) for o in session.new):
+        staff_queues.invalidate_counts(SupportTicket)
+
+
+# ================= Read =================
+def _as_dict(e: SupportTicketEvent) -> dict:
+    try:
+        data = json.loads(e.data) if e.data else {}
+    except Exception:
+        data = {}
+    return {
+        "id": e.id,
+        "ticket_id": e.ticket_id,
+        "kind": e.kind,
+        "actor_id": e.actor_id,
+        "queue": e.queue,
+        "status": e.status,
+        "data": data,
+        "created_at": e.created_at.isoformat() if e.created_at else None,
+    }
+
+
+def last_id(db: Session) -> int:
+    return int(db.execute(select(func.max(SupportTicketEvent.id))).scalar() or 0)
+
+
+def tail(db: Session, after: int, queues: Optional[list[str]] = None, limit: int = TICKET_EVENTS_PAGE) -> list[dict]:
+    q = select(SupportTicketEvent).where(SupportTicketEvent.id > after)
+    if queues:
+        q = q.where(SupportTicketEvent.queue.in_(queues))
+    q = q.order_by(SupportTicketEvent.id).limit(max(1, min(limit, TICKET_EVENTS_PAGE)))
+    return [_as_dict(e) for e in db.execute(q).scalars()]
+
+
+# ================= Retention (scheduler) =================
+def prune(db: Session) -> dict:
+    """Delete events older than TICKET_EVENTS_RETENTION_DAYS."""
+    cutoff = datetime.utcnow() - timedelta(days=TICKET_EVENTS_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        ids = (
+            select(SupportTicketEvent.id)
+            .where(SupportTicketEvent.created_at < cutoff)
+            .limit(TICKET_EVENTS_PRUNE_BATCH)
+            .scalar_subquery()
+        )
+        n = db.execute(delete(SupportTicketEvent).where(SupportTicketEvent.id.in_(ids))).rowcount or 0
+        db.commit()
+        deleted += n
+        if n < TICKET_EVENTS_PRUNE_BATCH:
+            break
+    return {"deleted": deleted}
+
+
+# ================= Routes =================
+router = APIRouter(tags=["support"])
+
+_STAFF_SESSION_FLAGS = ("is_support", "is_md", "is_mod")
+
+
+def _is_staff(db: Session, request: Request) -> bool:
+    sess = request.session.get("user") or {}
+    if not sess.get("id"):
+        return False
+    if (sess.get("role") or "") == "admin" or any(sess.get(f) for f in _STAFF_SESSION_FLAGS):
+        return True
+    u = db.get(User, sess["id"])
+    return bool(u) and (
+        (getattr(u, "role", "") or "") == "admin"
+        or any(getattr(u, f, False) for f in ("is_support", "is_mod", "is_deposit_manager", "badge_admin"))
+    )
+
+
+@router.get("/api/support/events")
+def support_events(
+    request: Request,
+    db: Session = Depends(get_db),
+    queue: str = "",
+    after: Optional[int] = None,
+    limit: int = TICKET_EVENTS_PAGE,
+):
+    """Ticket events after `after` (optionally for some queues), oldest first."""
+    if not _is_staff(db, request):
+        raise HTTPException(status_code=403, detail="Staff only")
+    queues = [q.strip() for q in queue.split(",") if q.strip()][:10]
+    if after is None:
+        return {"events": [], "last_id": last_id(db)}
+    events = tail(db, after, queues, limit)
+    return {"events": events, "last_id": events[-1]["id"] if events else after}
@@ -0,0 +1,172 @@
+# app/user_directory.py
+"""
+Admin user directory (/admin): the four user sections of admin_dashboard.html
+(pending individuals / pending companies / all individuals / all companies)
+as a StaffQueue, so each section is keyset-paged on (created_at, id) and its
+count comes from one cached conditional-aggregate query (app/staff_queues.py).
+
+Filters (query string, applied to every section):
+  q             "#123" / "123" → user id; "a@b" → email prefix;
+                "jo" → first name, last name or email prefix;
+                "jo sm" → first name "jo…" and last name "sm…"
+  status        pending | approved | rejected | …
+  role          user | admin
+  verified      1 | 0
+  created_from  YYYY-MM-DD (inclusive)
+  created_to    YYYY-MM-DD (inclusive)
+
+Indexes (startup, ensure_indexes): users (status, created_at), (role, created_at),
+(created_at) and, on Postgres, prefix-search indexes on email / lower(names).
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlencode
+
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import Session, selectinload
+
+from . import staff_queues
+from .database import engine, table_columns
+from .models import User
+
+FILTER_KEYS = ("q", "status", "role", "verified", "created_from", "created_to")
+
+
+# ================= Sections =================
+def _is_company():
+    return func.coalesce(User.account_type, "individual") == "company"
+
+
+def _is_individual():
+    return func.coalesce(User.account_type, "individual") != "company"
+
+
+_U_CREATED = User.created_at
+
+SECTIONS = {
+    "pending_individuals": (lambda: and_(User.status == "pending", _is_individual()), _U_CREATED),
+    "pending_companies": (lambda: and_(User.status == "pending", _is_company()), _U_CREATED),
+    "individuals": (_is_individual, _U_CREATED),
+    "companies": (_is_company, _U_CREATED),
+}
+
+QUEUE = staff_queues.register(staff_queues.StaffQueue("admin_users", User, None, SECTIONS))
+
+
+# ================= Filters =================
+def _like_prefix(col, value: str):
+    v = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return col.like(v + "%", escape="\\")
+
+
+def _parse_day(value: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d")
+    except Exception:
+        return None
+
+
+def filters_from(params) -> dict:
+    """Clean filter values from a query-string mapping (unknown / empty keys dropped)."""
+    out = {}
+    for k in FILTER_KEYS:
+        v = (params.get(k) or "").strip()
+        if not v:
+            continue
+        if k in ("created_from", "created_to") and not _parse_day(v):
+            continue
+        if k == "verified" and v not in ("0", "1"):
+            continue
+        out[k] = v[:100] if k == "q" else v.lower()
+    return out
+
+
+def _clauses(filters: dict) -> list:
+    where = []
+    if filters.get("status"):
+        where.append(User.status == filters["status"])
+    if filters.get("role"):
+        where.append(func.coalesce(User.role, "user") == filters["role"])
+    if filters.get("verified") == "1":
+        where.append(User.is_verified.is_(True))
+    elif filters.get("verified") == "0":
+        where.append(or_(User.is_verified.is_(False), User.is_verified.is_(None)))
+    if filters.get("created_from"):
+        where.append(User.created_at >= _parse_day(filters["created_from"]))
+    if filters.get("created_to"):
+        where.append(User.created_at < _parse_day(filters["created_to"]) + timedelta(days=1))
+
+    q = (filters.get("q") or "").strip().lower()
+    if q:
+        digits = q.lstrip("#")
+        first = func.lower(User.first_name)
+        last = func.lower(User.last_name)
+        if digits.isdigit():
+            where.append(User.id == int(digits))
+        elif "@" in q:
+            where.append(_like_prefix(User.email, q))
+        elif " " in q:
+            a, b = q.split(None, 1)
+            where.append(and_(_like_prefix(first, a), _like_prefix(last, b.strip())))
+        else:
+            where.append(or_(_like_prefix(first, q), _like_prefix(last, q), _like_prefix(User.email, q)))
+    return where
+
+
+# ================= Page data =================
+def directory(db: Session, params, section: Optional[str] = None, cursor: Optional[str] = None) -> dict:
+    """
+    Template data for admin_dashboard.html: first page of each section (or the
+    page after `cursor` for `section`), filtered counts and next cursors.
+    """
+    filters = filters_from(params)
+    where = _clauses(filters)
+    filter_qs = urlencode(filters)
+    users, next_cursor = {}, {}
+    for s in SECTIONS:
+        rows, nxt = QUEUE.page(
+            db, s, cursor if s == section else None,
+            options=(selectinload(User.documents),), extra=where,
+        )
+        users[s] = rows
+        next_cursor[s] = nxt
+    return {
+        "users": users,
+        "counts": QUEUE.counts(db, extra=where, cache_key=filter_qs),
+        "next_cursor": next_cursor,
+        "filters": filters,
+        "filter_qs": filter_qs,
+    }
+
+
+# ================= Normalization / indexes (startup) =================
+def normalize(db: Session) -> int:
+    """users.created_at NULL → updated_at (keyset sort key); returns rows fixed."""
+    if "updated_at" not in table_columns("users"):
+        return 0
+    n = db.execute(text(
+        "UPDATE users SET created_at = updated_at WHERE created_at IS NULL AND updated_at IS NOT NULL"
+    )).rowcount
+    db.commit()
+    return n or 0
+
+
+INDEXES = (
+    ("ix_users_status_created", "status, created_at", ("status", "created_at")),
+    ("ix_users_role_created", "role, created_at", ("role", "created_at")),
+    ("ix_users_created", "created_at", ("created_at",)),
+)
+
+# LIKE 'x%' can only use a btree on Postgres with pattern ops (non-C collations)
+PG_PREFIX_INDEXES = (
+    ("ix_users_email_prefix", "email varchar_pattern_ops", ("email",)),
+    ("ix_users_first_name_prefix", "lower(first_name) text_pattern_ops", ("first_name",)),
+    ("ix_users_last_name_prefix", "lower(last_name) text_pattern_ops", ("last_name",)),
+)
+
+
+def ensure_indexes() -> list[str]:
+    wanted = INDEXES + (PG_PREFIX_INDEXES if engine.dialect.name == "postgresql" else ())
+    return [name for name, cols_sql, needs in wanted if staff_queues.create_index("users", name, cols_sql, needs)]
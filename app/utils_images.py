@@ -0,0 +1,212 @@
+# app/utils_images.py
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Literal, Optional
+
+from PIL import Image, ImageOps
+
+from .utils_uploads import UPLOADS_DIR, ALLOWED_IMAGE_EXTS, ensure_dirs, split_name_ext
+
+# Responsive derivatives for item photos and avatars.
+#
+# Each local image under /uploads gets fixed-width copies in WebP (served to
+# browsers that accept it) and JPEG (fallback), stored under:
+#   uploads/_derived/{size}/{relative/path/of/original}.{webp|jpg}
+# They are generated at upload time, or lazily on the first /media request.
+# Cloudinary URLs are resized by Cloudinary itself (URL transformations).
+
+DERIVATIVE_SIZES = {
+    "thumb": 320,
+    "card": 640,
+    "detail": 1280,
+}
+DERIVATIVE_FORMATS = ("webp", "jpg")
+DERIVED_DIR = UPLOADS_DIR / "_derived"
+
+WEBP_QUALITY = int(os.getenv("IMG_WEBP_QUALITY", "78"))
+JPEG_QUALITY = int(os.getenv("IMG_JPEG_QUALITY", "82"))
+
+_CLOUDINARY_MARK = "/image/upload/"
+
+# One lock per target file so two concurrent first hits don't both encode it
+_locks_guard = threading.Lock()
+_locks: dict[str, threading.Lock] = {}
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _locks_guard:
+        lk = _locks.get(key)
+        if lk is None:
+            lk = _locks[key] = threading.Lock()
+        return lk
+
+
+def is_image_path(name: str) -> bool:
+    _, ext = split_name_ext(name or "")
+    return ext in ALLOWED_IMAGE_EXTS and ext != "gif"
+
+
+def resolve_upload(rel_path: str) -> Optional[Path]:
+    """
+    Resolve a path relative to /uploads to an absolute file path.
+    Returns None for traversal attempts, derived files or missing files.
+    """
+    rel = (rel_path or "").replace("\\", "/").lstrip("/")
+    if rel.startswith("uploads/"):
+        rel = rel[len("uploads/"):]
+    if not rel or rel.startswith(("_derived/", "_blobs/")):
+        return None
+    root = UPLOADS_DIR.resolve()
+    try:
+        full = (root / rel).resolve()
+        full.relative_to(root)
+    except Exception:
+        return None
+    return full if full.is_file() else None
+
+
+def derivative_path(src: Path, size: str, fmt: Literal["webp", "jpg"]) -> Path:
+    rel = src.resolve().relative_to(UPLOADS_DIR.resolve())
+    return DERIVED_DIR / size / rel.parent / f"{rel.name}.{fmt}"
+
+
+def _load_clean(src: Path) -> Image.Image:
+    """Open an image, apply EXIF orientation, and drop all metadata."""
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode in ("RGBA", "LA", "P"):
+            im = im.convert("RGBA")
+            bg = Image.new("RGB", im.size, (255, 255, 255))
+            bg.paste(im, mask=im.split()[-1])
+            im = bg
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        # Rebuilding from raw pixels guarantees no EXIF/ICC/XMP survives
+        clean = Image.new("RGB", im.size)
+        clean.paste(im)
+        return clean
+
+
+def _encode(im: Image.Image, width: int, fmt: str, dest: Path) -> None:
+    out = im
+    if im.width > width:
+        height = max(1, round(im.height * width / im.width))
+        out = im.resize((width, height), Image.LANCZOS)
+    ensure_dirs(dest.parent)
+    tmp = dest.with_name(dest.name + f".{os.getpid()}.tmp")
+    if fmt == "webp":
+        out.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        out.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp, dest)
+
+
+def ensure_derivative(src: Path, size: str, fmt: Literal["webp", "jpg"]) -> Optional[Path]:
+    """
+    Return the cached derivative for (src, size, fmt), encoding it first if it
+    is missing or older than the original. Returns None if Pillow can't read it.
+    """
+    if size not in DERIVATIVE_SIZES or fmt not in DERIVATIVE_FORMATS:
+        return None
+    dest = derivative_path(src, size, fmt)
+    try:
+        if dest.exists() and dest.stat().st_mtime >= src.stat().st_mtime:
+            return dest
+    except OSError:
+        pass
+    with _lock_for(str(dest)):
+        if dest.exists() and dest.stat().st_mtime >= src.stat().st_mtime:
+            return dest
+        try:
+            im = _load_clean(src)
+            _encode(im, DERIVATIVE_SIZES[size], fmt, dest)
+        except Exception as e:
+            print(f"[WARN] image derivative failed for {src}: {e}")
+            return None
+    return dest
+
+
+def generate_derivatives(src: Path | str) -> int:
+    """
+    Encode every size/format for one original (used right after upload).
+    Returns the number of derivatives written or already present.
+    """
+    src = Path(src)
+    if not src.is_file() or not is_image_path(src.name):
+        return 0
+    try:
+        im = _load_clean(src)
+    except Exception as e:
+        print(f"[WARN] image derivatives skipped for {src}: {e}")
+        return 0
+    done = 0
+    for size, width in DERIVATIVE_SIZES.items():
+        for fmt in DERIVATIVE_FORMATS:
+            dest = derivative_path(src, size, fmt)
+            try:
+                with _lock_for(str(dest)):
+                    _encode(im, width, fmt, dest)
+                done += 1
+            except Exception as e:
+                print(f"[WARN] image derivative {size}/{fmt} failed for {src}: {e}")
+    return done
+
+
+def strip_metadata_inplace(src: Path | str) -> None:
+    """Rewrite a freshly uploaded local JPEG/PNG/WebP without EXIF (GPS, camera, ...)."""
+    src = Path(src)
+    _, ext = split_name_ext(src.name)
+    fmt = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}.get(ext)
+    if not fmt:
+        return
+    try:
+        im = _load_clean(src)
+        tmp = src.with_name(src.name + ".tmp")
+        if fmt == "JPEG":
+            im.save(tmp, fmt, quality=92, optimize=True)
+        else:
+            im.save(tmp, fmt)
+        os.replace(tmp, src)
+    except Exception as e:
+        print(f"[WARN] strip metadata failed for {src}: {e}")
+
+
+# ---------------- URL helpers (used by Jinja filters) ----------------
+def sized_url(path: str | None, size: str, *, fill: bool = False) -> str:
+    """
+    URL of a `size` derivative:
+      - Cloudinary: inject an f_auto/q_auto/w_* transformation
+        (fill=True: square w_*,h_*,c_fill crop, for fixed-ratio cards)
+      - local /uploads image: /media/{size}/{relative path} (format negotiated;
+        the card's object-fit does the crop)
+      - anything else: returned unchanged
+    """
+    if not path:
+        return ""
+    p = str(path).strip()
+    width = DERIVATIVE_SIZES.get(size)
+    if not width:
+        return p
+    if p.startswith("http://") or p.startswith("https://"):
+        if "res.cloudinary.com" in p and _CLOUDINARY_MARK in p:
+            head, tail = p.split(_CLOUDINARY_MARK, 1)
+            crop = f"w_{width},h_{width},c_fill" if fill else f"w_{width},c_limit"
+            return f"{head}{_CLOUDINARY_MARK}f_auto,q_auto,{crop}/{tail}"
+        return p
+    rel = p.lstrip("/")
+    if rel.startswith("uploads/") and is_image_path(rel):
+        return f"/media/{size}/{rel[len('uploads/'):]}"
+    return p if p.startswith("/") else "/" + p
+
+
+def srcset(path: str | None, *, fill: bool = False) -> str:
+    """`srcset` attribute value covering every derivative width."""
+    if not path:
+        return ""
+    urls = [(sized_url(path, s, fill=fill), w) for s, w in DERIVATIVE_SIZES.items()]
+    if len({u for u, _ in urls}) == 1:
+        return ""
+    return ", ".join(f"{u} {w}w" for u, w in urls)
@@ -1,10 +1,14 @@
 # app/utils_uploads.py
 from __future__ import annotations
 
+import hashlib
+import os
 import re
+import shutil
+import time
 import uuid
 from pathlib import Path
-from typing import Literal, Optional, Tuple
+from typing import BinaryIO, Callable, Literal, Optional, Tuple
 
 # Note: your project mounts uploads in app/main.py at:
 #   UPLOADS_DIR = <root>/uploads
@@ -131,3 +135,226 @@ def map_kind_from_filename(name: str) -> Literal["image", "video", "doc"]:
     """Shortcut: infer kind from filename only."""
     _, ext = split_name_ext(name)
     return classify_kind(ext)
+
+
+# =========================================================
+# Content-addressed blob store (dedup for uploads/evidence)
+# =========================================================
+# Every saved upload is stored once under:
+#   uploads/_blobs/<sha[:2]>/<sha[2:4]>/<sha256>.<ext>
+# and the per-booking / per-item path the app serves (uploads/deposits/...,
+# uploads/items/...) is a hard link to that blob. The same photo uploaded as
+# pickup proof, return proof and dispute evidence therefore uses disk once.
+#
+# Reference count = the blob's link count minus one (st_nlink - 1): deleting a
+# view drops a reference, and gc_blobs() removes blobs nobody links to anymore.
+# If hard links are not supported (e.g. different filesystems) the view is a
+# plain copy and the blob is left for GC.
+
+BLOBS_DIR = UPLOADS_DIR / "_blobs"
+BLOBS_TMP_DIR = BLOBS_DIR / "tmp"
+_HASH_CHUNK = 1024 * 1024
+
+
+def blob_path(sha256: str, ext: str = "") -> Path:
+    """Sharded location of a blob: _blobs/ab/cd/abcd....ext"""
+    ext = (ext or "").lower().strip(".")
+    name = f"{sha256}.{ext}" if ext else sha256
+    return BLOBS_DIR / sha256[:2] / sha256[2:4] / name
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def new_blob_tmp_path(ext: str = "") -> Path:
+    """
+    Temp file path inside the blob store (same filesystem → atomic rename).
+    Keeps the extension so format-aware transforms can run on it.
+    """
+    ensure_dirs(BLOBS_TMP_DIR)
+    ext = (ext or "part").lower().strip(".")
+    return BLOBS_TMP_DIR / f"{uuid.uuid4().hex}.{ext}"
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    ensure_dirs(dest.parent)
+    if dest.exists():
+        dest.unlink()
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def adopt_into_store(tmp_path: Path, dest_path: Path, *, sha256: Optional[str] = None) -> Tuple[str, bool]:
+    """
+    Move a fully written temp file into the blob store and expose it at dest_path.
+    If an identical blob already exists, the temp file is discarded.
+    Returns (sha256, deduplicated).
+    """
+    tmp_path = Path(tmp_path)
+    dest_path = Path(dest_path)
+    sha = sha256 or file_sha256(tmp_path)
+    _, ext = split_name_ext(dest_path.name)
+    blob = blob_path(sha, ext)
+    ensure_dirs(blob.parent)
+
+    deduped = blob.exists()
+    if deduped:
+        try:
+            tmp_path.unlink()
+        except Exception:
+            pass
+    else:
+        os.replace(tmp_path, blob)
+
+    _link_or_copy(blob, dest_path)
+    return sha, deduped
+
+
+def save_upload_file(
+    src: BinaryIO,
+    dest_path: Path,
+    *,
+    transform: Optional[Callable[[Path], None]] = None,
+) -> Tuple[str, bool]:
+    """
+    Stream a file object into the blob store and link it at dest_path.
+    `transform` (e.g. EXIF stripping) runs on the temp file before hashing.
+    Returns (sha256, deduplicated).
+    """
+    tmp = new_blob_tmp_path(split_name_ext(Path(dest_path).name)[1])
+    h = hashlib.sha256()
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in iter(lambda: src.read(_HASH_CHUNK), b""):
+                h.update(chunk)
+                out.write(chunk)
+        sha = h.hexdigest()
+        if transform:
+            transform(tmp)
+            sha = file_sha256(tmp)
+        return adopt_into_store(tmp, Path(dest_path), sha256=sha)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except Exception:
+            pass
+        raise
+
+
+def remove_files(paths) -> None:
+    """Best-effort unlink of files written for a request that did not go through."""
+    for p in paths:
+        try:
+            Path(p).unlink()
+        except Exception:
+            pass
+
+
+class UploadBodyLimit:
+    """
+    ASGI middleware: cap the request body of upload endpoints *before* the
+    multipart form is parsed (Starlette would otherwise spool it all to disk).
+    A declared Content-Length over the cap is refused up front; chunked or
+    understated bodies are counted while streaming and cut off at the cap.
+    """
+
+    def __init__(self, app, *, path_pattern: str, max_bytes: int) -> None:
+        self.app = app
+        self.path_re = re.compile(path_pattern)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope.get("type") != "http"
+            or scope.get("method") != "POST"
+            or not self.path_re.match(scope.get("path") or "")
+        ):
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope.get("headers") or []).get(b"content-length")
+        if declared is not None:
+            try:
+                too_large = int(declared) > self.max_bytes
+            except ValueError:
+                too_large = False
+            if too_large:
+                return await self._reject(scope, receive, send)
+
+        from fastapi import HTTPException  # FastAPI re-raises it from body parsing as-is
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message.get("type") == "http.request":
+                received += len(message.get("body") or b"")
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        return await self.app(scope, limited_receive, send)
+
+    def _detail(self) -> str:
+        return f"Request too large (max {self.max_bytes // (1024 * 1024)} MB)"
+
+    async def _reject(self, scope, receive, send) -> None:
+        from starlette.responses import JSONResponse
+
+        response = JSONResponse({"detail": self._detail()}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+
+def blob_refcount(blob: Path) -> int:
+    """How many served paths still point at this blob."""
+    try:
+        return max(0, os.stat(blob).st_nlink - 1)
+    except FileNotFoundError:
+        return 0
+
+
+def gc_blobs(*, grace_seconds: int = 3600, dry_run: bool = False) -> Tuple[int, int]:
+    """
+    Delete blobs with no remaining references (and stale temp files) older
+    than grace_seconds. Returns (files_removed, bytes_freed).
+    """
+    removed = 0
+    freed = 0
+    if not BLOBS_DIR.exists():
+        return removed, freed
+    cutoff = time.time() - grace_seconds
+    for root, _dirs, names in os.walk(BLOBS_DIR):
+        for name in names:
+            p = Path(root) / name
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_mtime > cutoff:
+                continue
+            is_tmp = p.parent == BLOBS_TMP_DIR
+            if is_tmp or st.st_nlink <= 1:
+                removed += 1
+                freed += st.st_size
+                if not dry_run:
+                    try:
+                        p.unlink()
+                    except Exception:
+                        removed -= 1
+                        freed -= st.st_size
+    return removed, freed
+
+
+if __name__ == "__main__":
+    import sys
+
+    dry = "--dry-run" in sys.argv
+    n, size = gc_blobs(dry_run=dry)
+    print(f"[blobs] {'would remove' if dry else 'removed'} {n} files, {size / 1024 / 1024:.1f} MB")
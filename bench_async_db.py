@@ -0,0 +1,201 @@
+# bench_async_db.py
+"""
+Concurrency benchmark: sync Session inside async handlers vs AsyncSession.
+
+Runs the real POST /bookings handler (now on get_async_db) against a copy of
+its previous body (async def + blocking sync Session), under a mixed load of
+booking writes and item reads issued by C concurrent clients through the ASGI
+app in-process (httpx.ASGITransport, no network). Prints p50/p95/p99 per
+request kind for both modes.
+
+The blocking variant stalls the event loop for every query, so reads queue
+behind writes; with AsyncSession the loop keeps serving while the driver works.
+Keep --concurrency below the sync pool size (5 + 10 overflow): past it the
+blocking variant waits for a pooled connection *on the event loop*, while the
+holders can't resume, and every request ends in the 30 s pool timeout.
+
+Usage:
+    python bench_async_db.py [--requests 2000] [--concurrency 12] [--write-ratio 0.3]
+    DATABASE_URL=postgresql://... python bench_async_db.py   # against a scratch Postgres
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--requests", type=int, default=2000)
+parser.add_argument("--concurrency", type=int, default=12)
+parser.add_argument("--write-ratio", type=float, default=0.3)
+parser.add_argument("--keep", action="store_true", help="keep the generated SQLite file")
+args = parser.parse_args()
+
+tmp_dir = None
+if not os.getenv("DATABASE_URL"):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_async_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Map every optional column as real (the benchmark DB is created from the model)
+import app.database as database  # noqa: E402
+
+database._has_column = lambda table, col: True
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI, HTTPException, Request  # noqa: E402
+from fastapi.responses import RedirectResponse  # noqa: E402
+from sqlalchemy import ARRAY, insert, select  # noqa: E402
+from sqlalchemy.ext.compiler import compiles  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import availability, routes_bookings  # noqa: E402
+from app.database import Base, SessionLocal, engine, get_async_db, get_db  # noqa: E402
+from app.models import Booking, Item, ItemReservation, User  # noqa: E402
+
+USERS = 200
+
+
+# items.image_urls is a Postgres ARRAY; store it as TEXT on SQLite
+@compiles(ARRAY, "sqlite")
+def _array_as_text(_type, _compiler, **kw):
+    return "TEXT"
+
+
+# Notifications/emails are not what we measure
+routes_bookings._after_booking_created_bg = lambda booking_id: None
+
+
+def setup_db() -> None:
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {"id": i, "first_name": "U", "last_name": str(i), "email": f"u{i}@bench.local",
+             "phone": "0", "password_hash": "x", "status": "approved"}
+            for i in range(1, USERS + 1)
+        ])
+        conn.execute(insert(Item.__table__), [
+            {"id": i, "owner_id": i, "title": f"Item {i}", "category": "tools",
+             "price_per_day": 10, "is_active": "yes", "status": "approved", "image_urls": None}
+            for i in range(1, USERS + 1)
+        ])
+
+
+# ---------- previous handler body: async def + blocking sync Session ----------
+async def create_booking_blocking(request: Request, db: Session = Depends(get_db)):
+    uid = request.session["user"]["id"]
+    user = db.get(User, uid)
+    form = await request.form()
+    item = db.get(Item, int(form["item_id"]))
+    if not item:
+        raise HTTPException(status_code=400, detail="Invalid item")
+    start = date.fromisoformat(form["start_date"])
+    end = date.fromisoformat(form["end_date"])
+    if not availability.is_available(db, item.id, start, end):
+        raise HTTPException(status_code=409, detail="Item is not available for these dates")
+    days = max(1, (end - start).days)
+    bk = Booking(item_id=item.id, renter_id=user.id, owner_id=item.owner_id, start_date=start, end_date=end,
+                 days=days, price_per_day_snapshot=item.price_per_day, total_amount=days * item.price_per_day,
+                 status="requested")
+    db.add(bk)
+    db.commit()
+    db.refresh(bk)
+    return RedirectResponse(url=f"/bookings/flow/{bk.id}", status_code=303)
+
+
+async def read_item_blocking(item_id: int, db: Session = Depends(get_db)):
+    it = db.get(Item, item_id)
+    return {"id": it.id, "title": it.title}
+
+
+async def read_item_async(item_id: int, db: AsyncSession = Depends(get_async_db)):
+    it = (await db.execute(select(Item.id, Item.title).where(Item.id == item_id))).one()
+    return {"id": it.id, "title": it.title}
+
+
+def build_app(mode: str) -> FastAPI:
+    app = FastAPI()
+    if mode == "async":
+        app.include_router(routes_bookings.router)
+        app.add_api_route("/bench/items/{item_id}", read_item_async, methods=["GET"])
+    else:
+        app.add_api_route("/bookings", create_booking_blocking, methods=["POST"])
+        app.add_api_route("/bench/items/{item_id}", read_item_blocking, methods=["GET"])
+
+    # Logged-in user taken from a header instead of the signed cookie
+    async def with_session(scope, receive, send):
+        if scope["type"] == "http":
+            uid = dict(scope["headers"]).get(b"x-bench-user", b"1").decode()
+            scope["session"] = {"user": {"id": int(uid)}}
+        await app_inner(scope, receive, send)
+
+    app_inner = app
+    return with_session
+
+
+async def run(mode: str) -> dict:
+    asgi = build_app(mode)
+    lat: dict[str, list[float]] = {"write": [], "read": []}
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=asgi)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i: int) -> None:
+            nonlocal errors
+            uid = random.randint(1, USERS)
+            async with sem:
+                t0 = time.perf_counter()
+                if random.random() < args.write_ratio:
+                    kind = "write"
+                    start = date(2030, 1, 1) + timedelta(days=random.randint(0, 3000))
+                    r = await client.post("/bookings", headers={"x-bench-user": str(uid)}, data={
+                        "item_id": str(random.randint(1, USERS)),
+                        "start_date": start.isoformat(),
+                        "end_date": (start + timedelta(days=2)).isoformat(),
+                    })
+                    ok = r.status_code in (303, 409)
+                else:
+                    kind = "read"
+                    r = await client.get(f"/bench/items/{random.randint(1, USERS)}")
+                    ok = r.status_code == 200
+                lat[kind].append((time.perf_counter() - t0) * 1000)
+                if not ok:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        wall = time.perf_counter() - t0
+    return {"lat": lat, "errors": errors, "wall": wall}
+
+
+def pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+if __name__ == "__main__":
+    setup_db()
+    print(f"{engine.dialect.name}: {args.requests} requests, concurrency {args.concurrency}, "
+          f"{int(args.write_ratio * 100)}% writes")
+    for mode in ("blocking", "async"):
+        res = asyncio.run(run(mode))
+        print(f"{mode}: {args.requests / res['wall']:.0f} req/s, errors={res['errors']}")
+        for kind, vals in res["lat"].items():
+            print(f"  {kind:<5} n={len(vals):>5}  p50 {pct(vals, 50):7.1f} ms  p95 {pct(vals, 95):7.1f} ms  "
+                  f"p99 {pct(vals, 99):7.1f} ms  mean {statistics.fmean(vals) if vals else 0:7.1f} ms")
+        with SessionLocal() as db:
+            db.query(ItemReservation).delete()
+            db.query(Booking).delete()
+            db.commit()
+
+    if tmp_dir and not args.keep:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
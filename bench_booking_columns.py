@@ -0,0 +1,110 @@
+# bench_booking_columns.py
+"""
+Memory/latency benchmark for Booking column loading.
+
+Builds a throw-away SQLite database with N synthetic bookings (every
+optional column present, ~2 KB of photo JSON per row) and compares:
+  full      every column (what db.query(Booking) loaded before the cold groups)
+  deferred  db.query(Booking) now: photos / case_text / tax groups deferred
+  list      booking_list_load(): only the columns list pages render
+
+Usage:
+    python bench_booking_columns.py [--rows 100000] [--keep]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rows", type=int, default=100_000)
+parser.add_argument("--keep", action="store_true", help="keep the generated database file")
+args = parser.parse_args()
+
+db_file = os.path.join(tempfile.mkdtemp(prefix="bench_bookings_"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Map every optional column as real (the benchmark DB is created from the model)
+import app.database as database  # noqa: E402
+
+database._has_column = lambda table, col: True
+
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import undefer_group  # noqa: E402
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.models import Booking, User, booking_list_load  # noqa: E402
+
+# items.image_urls is a Postgres ARRAY; bookings don't need the items table here
+Base.metadata.create_all(bind=engine, tables=[User.__table__, Booking.__table__])
+
+
+def seed(n: int) -> None:
+    owners = 2000
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {"id": i, "first_name": "U", "last_name": str(i), "email": f"u{i}@bench.local",
+             "phone": "0", "password_hash": "x"}
+            for i in range(1, owners + 1)
+        ])
+        photos = "[" + ",".join(f'"/uploads/bookings/{"x" * 40}_{k}.jpg"' for k in range(30)) + "]"
+        note = "Scratches on the left side, see photos. " * 8
+        today = date.today()
+        batch = []
+        for i in range(1, n + 1):
+            owner = random.randint(1, owners)
+            batch.append({
+                "id": i, "item_id": owner, "owner_id": owner, "renter_id": random.randint(1, owners),
+                "start_date": today, "end_date": today + timedelta(days=2), "days": 2,
+                "price_per_day_snapshot": 10, "total_amount": 20, "status": "completed",
+                "deposit_status": "refunded", "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+                "pickup_photos_json": photos, "return_photos_json": photos,
+                "owner_return_note": note, "owner_report_reason": note,
+                "renter_response_text": note, "dm_decision_note": note, "tax_details_json": '{"gst": 5}',
+            })
+            if len(batch) == 5000:
+                conn.execute(insert(Booking.__table__), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Booking.__table__), batch)
+
+
+def measure(label: str, build) -> None:
+    db = SessionLocal()
+    try:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        rows = build(db).all()
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {label:<9} rows={len(rows):>7}  {elapsed * 1000:8.1f} ms  peak {peak / 1_048_576:7.1f} MiB")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    seed(args.rows)
+    print(f"seeded {args.rows} bookings in {time.perf_counter() - t0:.1f}s → {db_file}")
+
+    full = (undefer_group("photos"), undefer_group("case_text"), undefer_group("tax"))
+
+    print("scan all bookings (robot-style):")
+    measure("full", lambda db: db.query(Booking).options(*full))
+    measure("deferred", lambda db: db.query(Booking))
+    measure("list", lambda db: db.query(Booking).options(booking_list_load()))
+
+    print("one owner's bookings (/bookings?view=owner):")
+    measure("full", lambda db: db.query(Booking).options(*full).filter(Booking.owner_id == 7))
+    measure("deferred", lambda db: db.query(Booking).filter(Booking.owner_id == 7))
+    measure("list", lambda db: db.query(Booking).options(booking_list_load()).filter(Booking.owner_id == 7))
+
+    if not args.keep:
+        shutil.rmtree(os.path.dirname(db_file), ignore_errors=True)
@@ -0,0 +1,139 @@
+# bench_sqlite_profile.py
+"""
+SQLite concurrency benchmark: default connection settings vs the SQLite
+profile in app/database.py (WAL, synchronous=NORMAL, busy_timeout, mmap,
+cache_size, per-process writer queue).
+
+Each mode runs in its own subprocess (SQLITE_PROFILE=0 / 1) on a fresh
+database file. T threads (like the FastAPI threadpool) share the app's
+engine/SessionLocal and run a mix of:
+  write  insert an event row + bump a counter row, commit
+  read   a point lookup + a small range scan
+Prints throughput, p50/p95/p99 per kind and "database is locked" errors.
+
+Usage:
+    python bench_sqlite_profile.py [--threads 16] [--ops 4000] [--write-ratio 0.3]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--threads", type=int, default=16)
+parser.add_argument("--ops", type=int, default=4000, help="operations per mode (all threads)")
+parser.add_argument("--write-ratio", type=float, default=0.3)
+parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def child() -> None:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from sqlalchemy import text
+
+    from app.database import SessionLocal, engine
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE bench_events (id INTEGER PRIMARY KEY, user_id INTEGER, kind VARCHAR(20), "
+            "payload TEXT, created_at REAL)"
+        )
+        conn.exec_driver_sql("CREATE INDEX ix_bench_events_user ON bench_events(user_id, id)")
+        conn.exec_driver_sql("CREATE TABLE bench_counters (user_id INTEGER PRIMARY KEY, n INTEGER)")
+        conn.exec_driver_sql(
+            "INSERT INTO bench_counters (user_id, n) "
+            "WITH RECURSIVE s(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM s WHERE i < 1000) SELECT i, 0 FROM s"
+        )
+
+    lat = {"write": [], "read": []}
+    errors = {"locked": 0, "other": 0}
+    guard = threading.Lock()
+    per_thread = max(1, args.ops // args.threads)
+    payload = "x" * 400
+
+    def worker(seed: int) -> None:
+        rnd = random.Random(seed)
+        for _ in range(per_thread):
+            uid = rnd.randint(1, 1000)
+            kind = "write" if rnd.random() < args.write_ratio else "read"
+            t0 = time.perf_counter()
+            db = SessionLocal()
+            try:
+                if kind == "write":
+                    db.execute(
+                        text("INSERT INTO bench_events (user_id, kind, payload, created_at) VALUES (:u, 'visit', :p, :t)"),
+                        {"u": uid, "p": payload, "t": time.time()},
+                    )
+                    db.execute(text("UPDATE bench_counters SET n = n + 1 WHERE user_id = :u"), {"u": uid})
+                    db.commit()
+                else:
+                    db.execute(text("SELECT n FROM bench_counters WHERE user_id = :u"), {"u": uid}).fetchone()
+                    db.execute(
+                        text("SELECT id, kind FROM bench_events WHERE user_id = :u ORDER BY id DESC LIMIT 20"),
+                        {"u": uid},
+                    ).fetchall()
+                    db.commit()
+                ms = (time.perf_counter() - t0) * 1000
+                with guard:
+                    lat[kind].append(ms)
+            except Exception as e:
+                db.rollback()
+                with guard:
+                    errors["locked" if "locked" in str(e) else "other"] += 1
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    with engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    print(json.dumps({"lat": lat, "errors": errors, "wall": wall, "journal": mode}))
+
+
+def main() -> None:
+    for profile in ("0", "1"):
+        tmp = tempfile.mkdtemp(prefix="bench_sqlite_")
+        env = dict(os.environ, SQLITE_PROFILE=profile, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        try:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 "--threads", str(args.threads), "--ops", str(args.ops), "--write-ratio", str(args.write_ratio)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        res = json.loads(out.strip().splitlines()[-1])
+        done = sum(len(v) for v in res["lat"].values())
+        label = "profile" if profile == "1" else "default"
+        print(f"{label} (journal={res['journal']}): {done / res['wall']:.0f} ops/s, "
+              f"locked={res['errors']['locked']} other_errors={res['errors']['other']}")
+        for kind, vals in res["lat"].items():
+            print(f"  {kind:<5} n={len(vals):>5}  p50 {pct(vals, 50):7.1f} ms  p95 {pct(vals, 95):7.1f} ms  "
+                  f"p99 {pct(vals, 99):7.1f} ms")
+
+
+if __name__ == "__main__":
+    if args.child:
+        child()
+    else:
+        print(f"{args.threads} threads, {args.ops} ops per mode, {int(args.write_ratio * 100)}% writes")
+        main()
@@ -0,0 +1,130 @@
+# mock_paypal.py
+"""
+Local mock of the PayPal REST endpoints used by app/paypal_client.py, for
+trying the client without sandbox credentials or network:
+
+  POST /v1/oauth2/token                      Basic auth, returns expires_in
+  POST /v2/checkout/orders                   -> CREATED order + approve link
+  POST /v2/checkout/orders/{id}/capture      -> COMPLETED + capture id
+  POST /v2/payments/captures/{id}/refund     -> COMPLETED refund id
+  GET  /_mock/stats                          tokens issued, calls, rejected
+
+Bearer tokens expire after --expires-in seconds (401 afterwards, like PayPal);
+--latency-ms adds a fixed delay to every call.
+
+Usage:
+    python mock_paypal.py [--port 8099] [--expires-in 32400] [--latency-ms 0]
+    PAYPAL_BASE_URL=http://127.0.0.1:8099 PAYPAL_CLIENT_ID=mock PAYPAL_SECRET=mock \\
+        python -m uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import base64
+import secrets
+import time
+from collections import Counter
+
+from fastapi import FastAPI, Header, HTTPException, Request
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8099)
+parser.add_argument("--client-id", default="mock")
+parser.add_argument("--secret", default="mock")
+parser.add_argument("--expires-in", type=int, default=32400, help="token lifetime in seconds (PayPal: ~9h)")
+parser.add_argument("--latency-ms", type=float, default=0.0)
+args, _ = parser.parse_known_args()
+
+app = FastAPI(title="mock paypal")
+
+tokens: dict[str, float] = {}  # token -> expires at (monotonic)
+orders: dict[str, dict] = {}
+stats = Counter()
+
+
+async def _delay():
+    if args.latency_ms:
+        await asyncio.sleep(args.latency_ms / 1000)
+
+
+def _check_bearer(authorization: str | None) -> None:
+    token = (authorization or "").removeprefix("Bearer ").strip()
+    exp = tokens.get(token)
+    if exp is None or time.monotonic() >= exp:
+        stats["rejected"] += 1
+        raise HTTPException(status_code=401, detail={"error": "invalid_token"})
+
+
+@app.post("/v1/oauth2/token")
+async def oauth_token(request: Request, authorization: str | None = Header(None)):
+    await _delay()
+    stats["token"] += 1
+    expected = base64.b64encode(f"{args.client_id}:{args.secret}".encode()).decode()
+    form = await request.form()
+    if authorization != f"Basic {expected}" or form.get("grant_type") != "client_credentials":
+        raise HTTPException(status_code=401, detail={"error": "invalid_client"})
+    token = "A21AA" + secrets.token_urlsafe(24)
+    tokens[token] = time.monotonic() + args.expires_in
+    return {"access_token": token, "token_type": "Bearer", "expires_in": args.expires_in, "app_id": "APP-MOCK"}
+
+
+@app.post("/v2/checkout/orders", status_code=201)
+async def create_order(request: Request, authorization: str | None = Header(None)):
+    await _delay()
+    stats["create_order"] += 1
+    _check_bearer(authorization)
+    body = await request.json()
+    order_id = secrets.token_hex(8).upper()
+    unit = (body.get("purchase_units") or [{}])[0]
+    orders[order_id] = {"amount": unit.get("amount") or {}, "status": "CREATED"}
+    base = str(request.base_url).rstrip("/")
+    return {
+        "id": order_id,
+        "status": "CREATED",
+        "links": [
+            {"rel": "self", "href": f"{base}/v2/checkout/orders/{order_id}", "method": "GET"},
+            {"rel": "approve", "href": f"{base}/checkoutnow?token={order_id}", "method": "GET"},
+            {"rel": "capture", "href": f"{base}/v2/checkout/orders/{order_id}/capture", "method": "POST"},
+        ],
+    }
+
+
+@app.post("/v2/checkout/orders/{order_id}/capture", status_code=201)
+async def capture_order(order_id: str, authorization: str | None = Header(None)):
+    await _delay()
+    stats["capture"] += 1
+    _check_bearer(authorization)
+    order = orders.get(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail={"name": "RESOURCE_NOT_FOUND"})
+    if order["status"] == "COMPLETED":
+        raise HTTPException(status_code=422, detail={"name": "UNPROCESSABLE_ENTITY", "issue": "ORDER_ALREADY_CAPTURED"})
+    order["status"] = "COMPLETED"
+    capture_id = secrets.token_hex(8).upper()
+    return {
+        "id": order_id,
+        "status": "COMPLETED",
+        "purchase_units": [{"payments": {"captures": [
+            {"id": capture_id, "status": "COMPLETED", "amount": order["amount"]}
+        ]}}],
+    }
+
+
+@app.post("/v2/payments/captures/{capture_id}/refund", status_code=201)
+async def refund_capture(capture_id: str, request: Request, authorization: str | None = Header(None)):
+    await _delay()
+    stats["refund"] += 1
+    _check_bearer(authorization)
+    body = await request.json() if await request.body() else {}
+    return {"id": secrets.token_hex(8).upper(), "status": "COMPLETED", "amount": body.get("amount")}
+
+
+@app.get("/_mock/stats")
+def mock_stats():
+    return dict(stats)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,103 @@
+# test_booking_deadlines.py
+"""
+booking_deadlines.scan_due: timers that are blocked ahead of an eligible one
+must not starve it, and timers that can never fire are retired.
+
+    python -m pytest -q test_booking_deadlines.py
+"""
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+# The models decide their optional columns from the schema at import time:
+# point them at a throwaway copy of the dev database, never at app.db itself.
+_tmp = tempfile.mkdtemp()
+shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.db"), os.path.join(_tmp, "app.db"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/app.db"
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import booking_deadlines
+from app.models import Booking, BookingDeadline
+
+
+@pytest.fixture()
+def db():
+    engine = create_engine("sqlite://")
+    Booking.__table__.create(engine)
+    BookingDeadline.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _add(db, booking_id, due_at, kind="auto_release", **cols):
+    row = {
+        "id": booking_id, "item_id": 1, "renter_id": 1, "owner_id": 2,
+        "start_date": due_at.date(), "end_date": due_at.date(),
+        "status": "in_review", "deposit_amount": 100,
+    }
+    row.update(cols)
+    db.execute(insert(Booking.__table__), [{k: v for k, v in row.items() if k in Booking.__table__.c}])
+    db.execute(insert(BookingDeadline.__table__), [{"booking_id": booking_id, "kind": kind, "due_at": due_at}])
+
+
+def _pending(db, booking_id):
+    return db.execute(
+        select(BookingDeadline.processed_at, BookingDeadline.outcome).where(BookingDeadline.booking_id == booking_id)
+    ).one()
+
+
+def test_blocked_timers_do_not_starve_later_ones(db):
+    start = datetime.utcnow() - timedelta(days=10)
+    limit = 5
+    # 3 * limit blocked (but still reachable) timers, all due before the eligible one
+    for i in range(1, 3 * limit + 1):
+        _add(db, i, start + timedelta(minutes=i), kind="renter_response", status="in_review")
+    # same due_at as the last blocked row: the keyset must still reach it
+    _add(db, 100, start + timedelta(minutes=3 * limit), kind="renter_response", status="returned")
+    db.commit()
+
+    picked = booking_deadlines.scan_due(
+        db, "renter_response", eligible=lambda bk: bk.status == "returned", limit=limit,
+    )
+
+    assert [bk.id for bk in picked] == [100]
+    # blocked rows are not retired: they may still qualify later
+    assert all(_pending(db, i).processed_at is None for i in range(1, 3 * limit + 1))
+
+
+def test_unreachable_timers_are_retired(db):
+    start = datetime.utcnow() - timedelta(days=3)
+    _add(db, 1, start, status="closed")
+    _add(db, 2, start + timedelta(minutes=1), status="returned")
+    _add(db, 3, start + timedelta(minutes=2), status="returned")
+    _add(db, 4, start + timedelta(minutes=3), kind="owner_silence", status="returned", deposit_amount=0)
+    db.commit()
+
+    # booking 2 has no deposit hold: it cannot pass the job's own check either
+    picked = booking_deadlines.scan_due(db, "auto_release", eligible=lambda bk: bk.id == 3)
+    assert [bk.id for bk in picked] == [3]
+    assert _pending(db, 1).outcome == "skipped:settled"
+    assert _pending(db, 2).outcome == "skipped:no_hold"
+    assert _pending(db, 3).processed_at is None
+
+    assert booking_deadlines.scan_due(db, "owner_silence", filters=(Booking.deposit_amount > 0,)) == []
+    assert _pending(db, 4).outcome == "skipped:no_deposit"
+
+
+def test_retire_false_leaves_rows_alone(db):
+    _add(db, 1, datetime.utcnow() - timedelta(hours=1), status="closed")
+    db.commit()
+    assert booking_deadlines.scan_due(db, "auto_release", eligible=lambda bk: False, retire=False) == []
+    assert _pending(db, 1).processed_at is None
+
+
+def test_future_timers_are_not_due(db):
+    _add(db, 1, datetime.utcnow() + timedelta(hours=1), status="returned")
+    db.commit()
+    assert booking_deadlines.scan_due(db, "auto_release") == []